@@ -0,0 +1,221 @@
+"""
+Admission control for expensive ECOSPEED requests
+Heavy endpoints (route computations, navigation updates, station queries,
+bulk exports) ask for admission with an estimated cost before working, in
+abstract cost units (one unit ~ 1000 elementary route points of physics):
+
+- Capacity: at most `capacity` units run at the same time per process. A
+  request costing more than the capacity is clamped to it (it runs alone).
+- Priority lanes: waiting requests are granted lane by lane, navigation
+  updates first, then new plans, then bulk exports, FIFO within a lane.
+  The head of a lane is never overtaken by a smaller request of a lower
+  lane, so large requests are not starved.
+- Load shedding: each lane has a latency SLO. The queue latency a new
+  request would see is projected from the work ahead of it (cost of the
+  running and queued requests times the measured seconds per unit of
+  their lane). Beyond the SLO the request is rejected right away with
+  AdmissionRejected (429 + Retry-After for the API) instead of piling up;
+  an admitted request still waiting after its SLO is rejected too.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Cost model: route points per road km (OpenRouteService geometry with elevation),
+# and station query area served per unit
+ROUTE_POINTS_PER_KM = 12
+ROAD_DETOUR_FACTOR = 1.3
+STATION_AREA_KM2_PER_UNIT = 10000
+EWMA_ALPHA = 0.2
+WAIT_SAMPLES = 512
+
+
+class AdmissionRejected(Exception):
+    """A request shed by admission control (projected or actual queue latency above the lane SLO)."""
+
+    def __init__(self, lane: str, reason: str, retry_after_s: float):
+        super().__init__(f"Server busy ({lane}): {reason}")
+        self.lane = lane
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+
+
+@dataclass
+class Lane:
+    name: str
+    priority: int  # Lower is served first
+    slo_s: float  # Maximum queue latency accepted
+    unit_s: float = 0.05  # Seconds per cost unit, updated from completed requests
+    max_queued: int = 1000
+
+
+class Ticket:
+    """Admission of one request: capacity held from grant to release()."""
+
+    def __init__(self, controller: "AdmissionController", lane: Lane, cost: float):
+        self.controller = controller
+        self.lane = lane
+        self.cost = cost
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.granted: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    @property
+    def expected_s(self) -> float:
+        return self.cost * self.lane.unit_s
+
+    def release(self) -> None:
+        """Give the capacity back (idempotent) and learn the lane's seconds per unit."""
+        if self.started_at is None:
+            return
+        elapsed = time.monotonic() - self.started_at
+        self.started_at = None
+        self.controller._release(self, elapsed)
+
+
+def route_cost(straight_line_km: float) -> float:
+    """Cost of a route computation from the straight-line distance between its geocoded stops."""
+    return points_cost(straight_line_km * ROAD_DETOUR_FACTOR * ROUTE_POINTS_PER_KM)
+
+
+def points_cost(points: float) -> float:
+    """Cost of a physics pass over `points` elementary route points."""
+    return 1 + points / 1000
+
+
+def area_cost(area_km2: float) -> float:
+    """Cost of a charging-station query covering `area_km2`."""
+    return 1 + area_km2 / STATION_AREA_KM2_PER_UNIT
+
+
+class AdmissionController:
+    """Cost-weighted capacity with priority lanes and SLO-based load shedding (per process)."""
+
+    def __init__(self, capacity: float, lanes: List[Lane]):
+        self.capacity = capacity
+        self.lanes = {lane.name: lane for lane in lanes}
+        self._ordered = sorted(lanes, key=lambda lane: lane.priority)
+        self._queues: Dict[str, Deque[Ticket]] = {lane.name: deque() for lane in lanes}
+        self._running: List[Ticket] = []
+        self.in_use = 0.0
+        self.counters = {lane.name: {"admitted": 0, "rejected": 0, "timed_out": 0} for lane in lanes}
+        self._waits: Dict[str, Deque[float]] = {lane.name: deque(maxlen=WAIT_SAMPLES) for lane in lanes}
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def projected_wait_s(self, lane: Lane, cost: float) -> float:
+        """Queue latency of a new request of `lane` costing `cost` units if it were queued now."""
+        ahead = [ticket for other in self._ordered if other.priority <= lane.priority for ticket in self._queues[other.name]]
+        if not ahead and self.in_use + cost <= self.capacity:
+            return 0.0
+        now = time.monotonic()
+        # Unit-seconds of work left before this request can start, spread over the capacity
+        work = sum(ticket.cost * max(ticket.expected_s - (now - ticket.started_at), 0.0) for ticket in self._running)
+        work += sum(ticket.cost * ticket.expected_s for ticket in ahead)
+        return work / self.capacity
+
+    async def acquire(self, lane_name: str, cost: float) -> Ticket:
+        """
+        Wait for admission; raises AdmissionRejected if the projected wait
+        exceeds the lane SLO, the lane queue is full or the SLO passes while waiting.
+        """
+        lane = self.lanes[lane_name]
+        ticket = Ticket(self, lane, min(max(cost, 0.001), self.capacity))
+        if not self.enabled:
+            ticket.started_at = time.monotonic()
+            return ticket
+        projected = self.projected_wait_s(lane, ticket.cost)
+        if projected > lane.slo_s or len(self._queues[lane.name]) >= lane.max_queued:
+            self.counters[lane.name]["rejected"] += 1
+            raise AdmissionRejected(lane.name, f"projected queue latency {projected:.1f}s above {lane.slo_s:g}s", projected)
+        self._queues[lane.name].append(ticket)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.granted), lane.slo_s)
+        except asyncio.TimeoutError:
+            self._abandon(ticket)
+            self.counters[lane.name]["timed_out"] += 1
+            raise AdmissionRejected(lane.name, f"queued longer than {lane.slo_s:g}s", self.projected_wait_s(lane, ticket.cost))
+        except asyncio.CancelledError:
+            # Client gone while queued (or right after the grant)
+            self._abandon(ticket)
+            raise
+        self.counters[lane.name]["admitted"] += 1
+        self._waits[lane.name].append(ticket.started_at - ticket.enqueued_at)
+        return ticket
+
+    @asynccontextmanager
+    async def admit(self, lane_name: str, cost: float) -> AsyncIterator[Ticket]:
+        ticket = await self.acquire(lane_name, cost)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def _abandon(self, ticket: Ticket) -> None:
+        if ticket.granted.done():
+            ticket.release()
+        else:
+            ticket.granted.cancel()
+            self._queues[ticket.lane.name].remove(ticket)
+
+    def _dispatch(self) -> None:
+        """Grant queued tickets in lane priority order while capacity allows (head-of-line within the order)."""
+        for lane in self._ordered:
+            queue = self._queues[lane.name]
+            while queue:
+                ticket = queue[0]
+                if self.in_use + ticket.cost > self.capacity:
+                    return
+                queue.popleft()
+                self.in_use += ticket.cost
+                ticket.started_at = time.monotonic()
+                self._running.append(ticket)
+                ticket.granted.set_result(None)
+
+    def _release(self, ticket: Ticket, elapsed_s: float) -> None:
+        if not self.enabled:
+            return
+        self._running.remove(ticket)
+        self.in_use = max(self.in_use - ticket.cost, 0.0)
+        lane = ticket.lane
+        lane.unit_s += EWMA_ALPHA * (elapsed_s / ticket.cost - lane.unit_s)
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        lanes = {}
+        for lane in self._ordered:
+            waits = sorted(self._waits[lane.name])
+            queue = self._queues[lane.name]
+            lanes[lane.name] = {
+                **self.counters[lane.name],
+                "queued": len(queue),
+                "queued_cost": round(sum(ticket.cost for ticket in queue), 2),
+                "running": sum(1 for ticket in self._running if ticket.lane is lane),
+                "slo_s": lane.slo_s,
+                "unit_ms": round(lane.unit_s * 1000, 3),
+                "projected_wait_ms": round(self.projected_wait_s(lane, 1.0) * 1000, 1),
+                "wait_ms_p50": round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0,
+                "wait_ms_p95": round(waits[min(len(waits) - 1, math.ceil(len(waits) * 0.95) - 1)] * 1000, 1) if waits else 0.0,
+            }
+        return {"enabled": self.enabled, "capacity": self.capacity, "in_use": round(self.in_use, 2), "lanes": lanes}
+
+
+admission = AdmissionController(
+    capacity=float(os.environ.get('ADMISSION_CAPACITY', '400')),
+    lanes=[
+        Lane("navigation", 0, slo_s=float(os.environ.get('ADMISSION_NAVIGATION_SLO_S', '1'))),
+        Lane("planning", 1, slo_s=float(os.environ.get('ADMISSION_PLANNING_SLO_S', '10'))),
+        Lane("bulk", 2, slo_s=float(os.environ.get('ADMISSION_BULK_SLO_S', '30'))),
+    ],
+)
@@ -0,0 +1,112 @@
+"""
+Benchmark of the physics executor under mixed short / long route load.
+
+Simulates concurrent /api/route requests (upstream latency + route physics)
+where most routes are short and a few are very long, and compares inline
+physics with process-pool offload: overall throughput and latency of the
+short requests, which suffer most when long routes block the event loop.
+
+Usage (from the backend directory):
+    python benchmarks/bench_physics_executor.py --short 200 --long 10 --workers 2
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from physics_executor import PhysicsExecutor  # noqa: E402
+
+VEHICLE = SimpleNamespace(
+    empty_mass=1850.0, extra_load=150.0, drag_coefficient=0.58, rolling_resistance=0.008,
+    motor_efficiency=0.95, regen_efficiency=0.85, aux_power_kw=2.0,
+)
+
+
+def make_route(point_count: int, seed: int):
+    rng = np.random.default_rng(seed)
+    lat = 48.0 + np.cumsum(np.full(point_count, 1e-4))
+    lon = 2.0 + np.cumsum(rng.normal(0, 1e-4, point_count))
+    elevation = 100 + np.cumsum(rng.normal(0, 1.0, point_count))
+    speed_limit = rng.choice([50.0, 90.0, 130.0], point_count - 1)
+    real_speed = speed_limit * 0.92
+    return lat, lon, elevation, speed_limit, real_speed
+
+
+async def simulated_request(executor: PhysicsExecutor, route, upstream_latency_s: float) -> float:
+    t0 = time.perf_counter()
+    await asyncio.sleep(upstream_latency_s)  # Geocoding + directions round-trip
+    arrays = await executor.route_arrays(*route, VEHICLE, total_mass_kg=1925.0, aux_power_kw=2.0)
+    # Stand-in for grouping / serialization work proportional to the route size
+    float(arrays["eco_energy"].sum())
+    return time.perf_counter() - t0
+
+
+async def run_load(executor: PhysicsExecutor, args) -> dict:
+    short_routes = [make_route(args.short_points, i) for i in range(8)]
+    long_routes = [make_route(args.long_points, 100 + i) for i in range(2)]
+    kinds = ["short"] * args.short + ["long"] * args.long
+    random.Random(0).shuffle(kinds)
+
+    latencies = {"short": [], "long": []}
+
+    async def one(kind: str, i: int, delay: float):
+        await asyncio.sleep(delay)
+        route = short_routes[i % len(short_routes)] if kind == "short" else long_routes[i % len(long_routes)]
+        latencies[kind].append(await simulated_request(executor, route, args.upstream_ms / 1000))
+
+    t0 = time.perf_counter()
+    # Open-loop arrivals spread over the requested duration
+    await asyncio.gather(*(
+        one(kind, i, i * args.duration_s / len(kinds)) for i, kind in enumerate(kinds)
+    ))
+    elapsed = time.perf_counter() - t0
+
+    def pct(values, q):
+        return statistics.quantiles(values, n=100)[q - 1] * 1000 if len(values) >= 2 else float("nan")
+
+    return {
+        "throughput_rps": len(kinds) / elapsed,
+        "short_p50_ms": pct(latencies["short"], 50),
+        "short_p95_ms": pct(latencies["short"], 95),
+        "short_p99_ms": pct(latencies["short"], 99),
+        "long_p50_ms": pct(latencies["long"], 50),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--short", type=int, default=200, help="number of short route requests")
+    parser.add_argument("--long", type=int, default=10, help="number of long route requests")
+    parser.add_argument("--short-points", type=int, default=2000)
+    parser.add_argument("--long-points", type=int, default=100000)
+    parser.add_argument("--upstream-ms", type=float, default=50.0, help="simulated upstream latency per request")
+    parser.add_argument("--duration-s", type=float, default=2.0, help="time over which requests arrive")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--offload-min-points", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{args.short} short ({args.short_points} pts) + {args.long} long ({args.long_points} pts) requests, "
+          f"{args.workers} worker(s), offload threshold {args.offload_min_points} pts")
+    for mode in ("inline", "process"):
+        executor = PhysicsExecutor(mode=mode, workers=args.workers, offload_min_points=args.offload_min_points)
+        executor.start()
+        try:
+            result = asyncio.run(run_load(executor, args))
+            stats = executor.stats()
+        finally:
+            executor.shutdown()
+        print(f"{mode:>8}: {result['throughput_rps']:7.1f} req/s | short p50 {result['short_p50_ms']:7.1f} ms"
+              f" p95 {result['short_p95_ms']:7.1f} ms p99 {result['short_p99_ms']:7.1f} ms"
+              f" | long p50 {result['long_p50_ms']:7.1f} ms | {stats}")
+
+
+if __name__ == "__main__":
+    main()
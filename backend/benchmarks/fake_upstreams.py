@@ -0,0 +1,285 @@
+"""
+Local stand-ins for the upstream APIs of ECOSPEED, for load tests.
+
+One HTTP server answers, in the formats the backend parses:
+
+- OpenRouteService: POST /v2/directions/driving-car (geometry interpolated
+  between the stops every ~80 m, encoded polyline with elevation, waytype
+  and waycategory extras, way_points), POST /elevation/line and POST /v2/matrix/driving-car
+- Nominatim: GET /search (a set of French cities; any other address gets a
+  stable pseudo-random position in France, so every query resolves)
+- Open Charge Map: GET /v3/poi (the MockOcm of mock_ocm.py)
+
+Each upstream has its own injected faults: a latency (mean + uniform jitter,
+slept in the handler thread) and an error rate (503 responses, with
+Retry-After for a quarter of them).
+
+Usage (from the backend directory):
+    python benchmarks/fake_upstreams.py --port 8090 --ors-latency-ms 300 --ors-error-rate 0.01
+    ORS_BASE_URL=http://127.0.0.1:8090 ORS_API_KEY=fake \\
+    NOMINATIM_DOMAIN=127.0.0.1:8090 NOMINATIM_SCHEME=http \\
+    OCM_BASE_URL=http://127.0.0.1:8090/v3 uvicorn server:app
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from mock_ocm import MockOcm  # noqa: E402
+
+CITIES = {
+    "paris": (48.8566, 2.3522), "lyon": (45.7640, 4.8357), "marseille": (43.2965, 5.3698),
+    "toulouse": (43.6047, 1.4442), "nice": (43.7102, 7.2620), "nantes": (47.2184, -1.5536),
+    "strasbourg": (48.5734, 7.7521), "montpellier": (43.6108, 3.8767), "bordeaux": (44.8378, -0.5792),
+    "lille": (50.6292, 3.0573), "rennes": (48.1173, -1.6778), "reims": (49.2583, 4.0317),
+    "dijon": (47.3220, 5.0415), "grenoble": (45.1885, 5.7245), "angers": (47.4784, -0.5632),
+    "orleans": (47.9030, 1.9093), "tours": (47.3941, 0.6848), "clermont-ferrand": (45.7772, 3.0870),
+    "limoges": (45.8336, 1.2611), "rouen": (49.4432, 1.0999), "caen": (49.1829, -0.3707),
+    "metz": (49.1193, 6.1757), "brest": (48.3904, -4.4861), "le mans": (48.0061, 0.1996),
+    "amiens": (49.8941, 2.2958), "besancon": (47.2378, 6.0241), "perpignan": (42.6887, 2.8948),
+    "poitiers": (46.5802, 0.3404), "pau": (43.2951, -0.3708), "avignon": (43.9493, 4.8055),
+}
+POINT_SPACING_M = 80.0
+WAYTYPES = (1, 1, 2, 2, 3)  # ORS State Road, Road, Street
+
+
+@dataclass
+class Fault:
+    """Latency and error injection of one upstream."""
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+
+    def delay(self, rng: random.Random) -> None:
+        delay_ms = self.latency_ms + rng.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+
+def geocode(query: str) -> tuple:
+    """Position of a query: a known city, or a stable pseudo-random point in France."""
+    key = " ".join(query.lower().replace(",", " ").split())
+    for name, position in CITIES.items():
+        if key == name or key.startswith(name + " ") or key.endswith(" " + name):
+            return position
+    digest = hashlib.sha256(key.encode("utf-8")).digest()
+    return 43.0 + digest[0] / 255 * 7.5, -1.5 + digest[1] / 255 * 8.5
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(a))
+
+
+def _encode_value(value: int) -> str:
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return "".join(chunks)
+
+
+def encode_polyline(points: List[tuple]) -> str:
+    """Polyline (precision 5) with elevation (precision 2), as returned by ORS with elevation=true."""
+    encoded = []
+    previous = (0, 0, 0)
+    for lat, lon, elevation in points:
+        current = (round(lat * 1e5), round(lon * 1e5), round(elevation * 100))
+        encoded.extend(_encode_value(c - p) for c, p in zip(current, previous))
+        previous = current
+    return "".join(encoded)
+
+
+def directions(body: Dict, rng: random.Random) -> Dict:
+    """ORS directions response (routes format) following the great circle between the stops."""
+    stops = body["coordinates"]
+    points: List[tuple] = []
+    way_points = [0]
+    segments = []
+    for (lon1, lat1), (lon2, lat2) in zip(stops[:-1], stops[1:]):
+        distance = haversine_m(lat1, lon1, lat2, lon2) * 1.25
+        count = max(2, int(distance / POINT_SPACING_M))
+        phase = rng.uniform(0, math.pi)
+        for k in range(1 if points else 0, count + 1):
+            t = k / count
+            # Slight detour and rolling terrain
+            lat = lat1 + (lat2 - lat1) * t + 0.02 * math.sin(math.pi * t)
+            lon = lon1 + (lon2 - lon1) * t
+            elevation = 150 + 120 * math.sin(phase + 12 * math.pi * t) + 30 * math.sin(97 * t)
+            points.append((lat, lon, elevation))
+        way_points.append(len(points) - 1)
+        segments.append({"distance": distance, "duration": distance / 22.0, "steps": []})
+    # Road types by blocks of ~40 points, half of the state roads being motorways
+    waytypes, waycategories = [], []
+    for start in range(0, len(points) - 1, 40):
+        block = [start, min(start + 40, len(points) - 1)]
+        waytype = rng.choice(WAYTYPES)
+        waytypes.append(block + [waytype])
+        waycategories.append(block + [1 if waytype == 1 and rng.random() < 0.5 else 0])
+    total = sum(segment["distance"] for segment in segments)
+    return {
+        "routes": [{
+            "geometry": encode_polyline(points),
+            "segments": segments,
+            "way_points": way_points,
+            "extras": {"waytype": {"values": waytypes}, "waycategory": {"values": waycategories}},
+            "summary": {"distance": total, "duration": total / 22.0},
+        }]
+    }
+
+
+def elevation_line(body: Dict) -> Dict:
+    coordinates = body["geometry"]["coordinates"]
+    return {"geometry": {"type": "LineString", "coordinates": [
+        [lon, lat, 150 + 100 * math.sin(lat * 50) * math.cos(lon * 50)] for lon, lat, *_ in coordinates
+    ]}}
+
+
+def matrix(body: Dict) -> Dict:
+    locations = body["locations"]
+    sources = body.get("sources") or list(range(len(locations)))
+    distances = [[haversine_m(locations[i][1], locations[i][0], lat, lon) * 1.25 for lon, lat in locations] for i in sources]
+    return {"distances": distances, "durations": [[d / 22.0 for d in row] for row in distances]}
+
+
+class FakeUpstreams:
+    """Request counters and faults of the three upstreams."""
+
+    def __init__(self, faults: Dict[str, Fault], stations: int = 20000, seed: int = 0):
+        self.faults = faults
+        self.ocm = MockOcm(stations, seed)
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.counters = {name: {"requests": 0, "errors": 0} for name in faults}
+
+    def inject(self, upstream: str, rng: random.Random) -> bool:
+        """Apply the latency; True if this request must fail."""
+        fault = self.faults[upstream]
+        fault.delay(rng)
+        failed = rng.random() < fault.error_rate
+        with self.lock:
+            self.counters[upstream]["requests"] += 1
+            self.counters[upstream]["errors"] += failed
+        return failed
+
+
+def make_handler(upstreams: FakeUpstreams):
+    local = threading.local()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _rng(self) -> random.Random:
+            if not hasattr(local, "rng"):
+                local.rng = random.Random(f"{upstreams.seed}-{threading.get_ident()}")
+            return local.rng
+
+        def _reply(self, status: int, payload: Optional[object] = None, headers: Optional[Dict[str, str]] = None):
+            body = json.dumps(payload if payload is not None else {"error": "injected failure"}).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _fail_or(self, upstream: str, build):
+            rng = self._rng()
+            if upstreams.inject(upstream, rng):
+                headers = {"Retry-After": "1"} if rng.random() < 0.25 else None
+                self._reply(503, headers=headers)
+            else:
+                self._reply(200, build(rng))
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if url.path.rstrip("/") == "/search":
+                def search(rng):
+                    lat, lon = geocode(params.get("q", ""))
+                    return [{"lat": str(lat), "lon": str(lon), "display_name": params.get("q", ""), "place_id": 1}]
+                self._fail_or("nominatim", search)
+            elif url.path.rstrip("/") == "/v3/poi":
+                self._fail_or("ocm", lambda rng: upstreams.ocm.query(params))
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            path = url.path.rstrip("/")
+            if path.startswith("/v2/directions/"):
+                self._fail_or("ors", lambda rng: directions(body, rng))
+            elif path == "/elevation/line":
+                self._fail_or("ors", lambda rng: elevation_line(body))
+            elif path.startswith("/v2/matrix/"):
+                self._fail_or("ors", lambda rng: matrix(body))
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(port: int, faults: Dict[str, Fault], stations: int = 20000, seed: int = 0) -> ThreadingHTTPServer:
+    """Start the stand-ins in background threads and return the server (call .shutdown() to stop)."""
+    upstreams = FakeUpstreams(faults, stations, seed)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(upstreams))
+    server.daemon_threads = True
+    server.upstreams = upstreams
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_fault_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = {"ors": 250.0, "nominatim": 80.0, "ocm": 150.0}
+    for upstream, latency in defaults.items():
+        parser.add_argument(f"--{upstream}-latency-ms", type=float, default=latency)
+        parser.add_argument(f"--{upstream}-jitter-ms", type=float, default=latency / 2)
+        parser.add_argument(f"--{upstream}-error-rate", type=float, default=0.0)
+
+
+def faults_from_arguments(args: argparse.Namespace) -> Dict[str, Fault]:
+    return {
+        upstream: Fault(
+            getattr(args, f"{upstream}_latency_ms"), getattr(args, f"{upstream}_jitter_ms"), getattr(args, f"{upstream}_error_rate")
+        )
+        for upstream in ("ors", "nominatim", "ocm")
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--stations", type=int, default=20000)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+    serve(args.port, faults_from_arguments(args), args.stations)
+    print(f"Fake upstreams on http://127.0.0.1:{args.port} (ORS, Nominatim /search, Open Charge Map /v3)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
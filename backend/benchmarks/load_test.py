@@ -0,0 +1,409 @@
+"""
+Load test of the ECOSPEED API against local upstream stand-ins.
+
+Starts the fake OpenRouteService / Nominatim / Open Charge Map servers of
+fake_upstreams.py (latency and error injection per upstream), starts the
+backend pointed at them (uvicorn, or gunicorn with --workers) unless
+--target is given, then drives a mix of /api/route, /api/charging-stations
+and /api/vehicle-profiles requests:
+
+- open loop: Poisson arrivals at the stage rate, whatever the response
+  times, and latencies measured from the scheduled arrival time, so a slow
+  server cannot slow the load down and hide its own queueing
+- one stage per --rates value (e.g. 10,20,40,80) to find the knee
+- per stage: throughput, status codes (429 = shed by admission control),
+  p50 / p95 / p99 / max latency per endpoint, event-loop lag of the backend
+  (difference of the /api/metrics lag histograms before and after the
+  stage) and of the driver itself (its results are not trustworthy if the
+  driver lags)
+
+Route requests use known cities (caches warm up: geocodes, ORS geometries)
+and, for --unique-route-fraction of them, addresses never seen before (full
+geocode + ORS + physics pipeline).
+
+Usage (from the backend directory, MongoDB optional: writes are queued and retried):
+    python benchmarks/load_test.py --rates 5,10,20,40 --stage-s 30
+    python benchmarks/load_test.py --workers 4 --rates 20,40,80 --ors-latency-ms 400 --ors-error-rate 0.02
+    python benchmarks/load_test.py --target http://127.0.0.1:8001 --rates 10 --json before.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlparse
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fake_upstreams import CITIES, add_fault_arguments, faults_from_arguments, serve  # noqa: E402
+from loop_monitor import LAG_BUCKETS_MS, LoopLagMonitor  # noqa: E402
+
+VEHICLE = {
+    "name": "Load Test EV", "empty_mass": 1850, "extra_load": 150, "drag_coefficient": 0.58,
+    "frontal_area": 2.2, "rolling_resistance": 0.008, "motor_efficiency": 0.95,
+    "regen_efficiency": 0.85, "aux_power_kw": 2.0, "battery_kwh": 75, "usable_battery_kwh": 72,
+}
+ENDPOINTS = ("route", "stations", "vehicles")
+
+
+# ============================================================================
+# HTTP
+# ============================================================================
+
+async def http_request(host: str, port: int, method: str, path: str, body: Optional[bytes] = None) -> Tuple[int, int]:
+    """One HTTP/1.1 request on a fresh connection (Connection: close). Returns (status, body bytes)."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        head = f"{method} {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\nAccept: application/json\r\n"
+        if body is not None:
+            head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        writer.write(head.encode("latin-1") + b"\r\n" + (body or b""))
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    status_line, _, rest = response.partition(b"\r\n")
+    _, _, payload = rest.partition(b"\r\n\r\n")
+    return int(status_line.split()[1]), len(payload)
+
+
+async def get_json(host: str, port: int, path: str) -> Any:
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n\r\n".encode("latin-1"))
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    if b"chunked" in head.lower():
+        payload = _dechunk(payload)
+    return json.loads(payload)
+
+
+def _dechunk(data: bytes) -> bytes:
+    out = []
+    while data:
+        size_line, _, data = data.partition(b"\r\n")
+        size = int(size_line.split(b";")[0], 16)
+        if size == 0:
+            break
+        out.append(data[:size])
+        data = data[size + 2:]
+    return b"".join(out)
+
+
+# ============================================================================
+# WORKLOAD
+# ============================================================================
+
+class Workload:
+    """Random requests of the mix (seeded)."""
+
+    def __init__(self, mix: Dict[str, float], unique_route_fraction: float, nationwide_fraction: float, seed: int):
+        self.rng = random.Random(seed)
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.unique_route_fraction = unique_route_fraction
+        self.nationwide_fraction = nationwide_fraction
+        self.cities = list(CITIES)
+        self._unique = 0
+
+    def next(self) -> Tuple[str, str, str, Optional[bytes]]:
+        """(endpoint, method, path, body)"""
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        if kind == "route":
+            start, end = self.rng.sample(self.cities, 2)
+            if self.rng.random() < self.unique_route_fraction:
+                self._unique += 1
+                end = f"Lieu-dit {self._unique}-{self.rng.randrange(10 ** 9)}"
+            body = {"start": start, "end": end, "vehicle_profile": VEHICLE, "num_passengers": self.rng.randint(1, 4)}
+            return kind, "POST", "/api/route", json.dumps(body).encode("utf-8")
+        if kind == "stations":
+            if self.rng.random() < self.nationwide_fraction:
+                return kind, "GET", "/api/charging-stations", None
+            query = {
+                "latitude": round(self.rng.uniform(43.0, 50.5), 4),
+                "longitude": round(self.rng.uniform(-1.5, 7.0), 4),
+                "distance": self.rng.choice([10, 25, 50]),
+            }
+            return kind, "GET", f"/api/charging-stations?{urlencode(query)}", None
+        query = {"q": self.rng.choice(["tesla", "renault", "peugeot", "model"])} if self.rng.random() < 0.3 else {}
+        return kind, "GET", "/api/vehicle-profiles" + (f"?{urlencode(query)}" if query else ""), None
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of sorted values (NaN if empty)."""
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))]
+
+
+def histogram_percentiles(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, float]:
+    """Lag percentiles (bucket upper bounds, ms) of the samples taken between two /api/metrics snapshots."""
+    counts = [b - a for a, b in zip(before["histogram"], after["histogram"])]
+    total = sum(counts)
+    samples = after["samples"] - before["samples"]
+    result = {
+        "samples": samples,
+        "mean_ms": round((after["mean_ms"] * after["samples"] - before["mean_ms"] * before["samples"]) / samples, 2) if samples else 0.0,
+    }
+    bounds = list(LAG_BUCKETS_MS) + [float("inf")]
+    for name, q in (("p50_ms", 0.5), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+        cumulative = 0
+        result[name] = float("nan")
+        for bound, count in zip(bounds, counts):
+            cumulative += count
+            if total and cumulative >= q * total:
+                result[name] = bound
+                break
+    return result
+
+
+# ============================================================================
+# DRIVER
+# ============================================================================
+
+async def run_stage(host: str, port: int, workload: Workload, rate: float, duration_s: float,
+                    timeout_s: float, max_in_flight: int, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    latencies: Dict[str, List[float]] = {kind: [] for kind in ENDPOINTS}
+    statuses: Dict[str, Counter] = {kind: Counter() for kind in ENDPOINTS}
+    received_bytes = 0
+    in_flight = 0
+    dropped = 0
+    tasks = set()
+    driver_lag = LoopLagMonitor(0.01)
+    driver_lag.start()
+
+    try:
+        metrics_before = await get_json(host, port, "/api/metrics")
+    except Exception:
+        metrics_before = None
+
+    async def one(kind: str, method: str, path: str, body: Optional[bytes], scheduled: float):
+        nonlocal in_flight, received_bytes
+        in_flight += 1
+        try:
+            status, size = await asyncio.wait_for(http_request(host, port, method, path, body), timeout_s)
+            statuses[kind][status] += 1
+            received_bytes += size
+        except asyncio.TimeoutError:
+            statuses[kind]["timeout"] += 1
+        except OSError as e:
+            statuses[kind][f"error:{type(e).__name__}"] += 1
+        finally:
+            in_flight -= 1
+        # From the scheduled arrival: lateness of the driver or of the server both count
+        latencies[kind].append(time.perf_counter() - scheduled)
+
+    started = time.perf_counter()
+    next_at = started
+    while True:
+        next_at += rng.expovariate(rate)
+        if next_at - started >= duration_s:
+            break
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        kind, method, path, body = workload.next()
+        if in_flight >= max_in_flight:
+            dropped += 1
+            continue
+        task = asyncio.create_task(one(kind, method, path, body, next_at))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    sent_elapsed = time.perf_counter() - started
+    if tasks:
+        await asyncio.wait(set(tasks))
+    elapsed = time.perf_counter() - started
+    await driver_lag.stop()
+
+    try:
+        metrics_after = await get_json(host, port, "/api/metrics")
+    except Exception:
+        metrics_after = None
+
+    result: Dict[str, Any] = {
+        "target_rate": rate,
+        "sent": sum(len(values) for values in latencies.values()),
+        "dropped_by_driver": dropped,
+        "send_duration_s": round(sent_elapsed, 2),
+        "duration_s": round(elapsed, 2),
+        "received_mb": round(received_bytes / 1e6, 2),
+        "endpoints": {},
+        "driver_loop_lag_max_ms": round(driver_lag.max_ms, 1),
+    }
+    ok_total = 0
+    for kind in ENDPOINTS:
+        values = sorted(latencies[kind])
+        if not values:
+            continue
+        ok = sum(count for status, count in statuses[kind].items() if isinstance(status, int) and status < 400)
+        ok_total += ok
+        result["endpoints"][kind] = {
+            "requests": len(values),
+            "ok": ok,
+            "statuses": {str(status): count for status, count in sorted(statuses[kind].items(), key=lambda item: str(item[0]))},
+            "p50_ms": round(percentile(values, 0.50) * 1000, 1),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+            "max_ms": round(values[-1] * 1000, 1),
+        }
+    result["throughput_rps"] = round(result["sent"] / elapsed, 2)
+    result["goodput_rps"] = round(ok_total / elapsed, 2)
+    if metrics_before and metrics_after and "event_loop" in metrics_after:
+        result["backend_loop_lag"] = histogram_percentiles(metrics_before["event_loop"], metrics_after["event_loop"])
+        result["backend_loop_lag"]["max_ms_since_start"] = metrics_after["event_loop"]["max_ms"]
+        if "admission" in metrics_after:
+            result["admission"] = {
+                lane: {key: stats[key] for key in ("admitted", "rejected", "timed_out", "wait_ms_p95")}
+                for lane, stats in metrics_after["admission"]["lanes"].items()
+            }
+    return result
+
+
+def print_stage(result: Dict[str, Any]) -> None:
+    print(f"\n=== {result['target_rate']:g} req/s: sent {result['sent']} in {result['duration_s']} s "
+          f"-> throughput {result['throughput_rps']} req/s, goodput {result['goodput_rps']} req/s"
+          f" (dropped by driver: {result['dropped_by_driver']}, driver lag max {result['driver_loop_lag_max_ms']} ms)")
+    print(f"{'endpoint':<10} {'requests':>8} {'ok':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}  statuses")
+    for kind, stats in result["endpoints"].items():
+        print(f"{kind:<10} {stats['requests']:>8} {stats['ok']:>6} {stats['p50_ms']:>9} {stats['p95_ms']:>9}"
+              f" {stats['p99_ms']:>9} {stats['max_ms']:>9}  {stats['statuses']}")
+    lag = result.get("backend_loop_lag")
+    if lag:
+        print(f"backend event-loop lag: mean {lag['mean_ms']} ms, p50 <= {lag['p50_ms']} ms, p95 <= {lag['p95_ms']} ms,"
+              f" p99 <= {lag['p99_ms']} ms ({lag['samples']} samples)")
+    if result.get("admission"):
+        print(f"admission: {result['admission']}")
+
+
+# ============================================================================
+# BACKEND PROCESS
+# ============================================================================
+
+def backend_environment(args, upstream_port: int) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "ORS_BASE_URL": f"http://127.0.0.1:{upstream_port}",
+        "ORS_API_KEY": "load-test",
+        "NOMINATIM_DOMAIN": f"127.0.0.1:{upstream_port}",
+        "NOMINATIM_SCHEME": "http",
+        "OCM_BASE_URL": f"http://127.0.0.1:{upstream_port}/v3",
+        "MONGO_URL": os.environ.get("MONGO_URL", "mongodb://127.0.0.1:27017"),
+        "DB_NAME": os.environ.get("DB_NAME", "ecospeed_loadtest"),
+        # Cold shared cache for every run
+        "SHARED_CACHE_DIR": tempfile.mkdtemp(prefix="ecospeed-load-"),
+    })
+    if not args.keep_rate_limits:
+        # Upstream quotas of the real providers would be the bottleneck, not the backend
+        env.update({"NOMINATIM_RATE_PER_S": "10000", "ORS_RATE_PER_MIN": "600000", "ORS_BURST": "1000",
+                    "OCM_RATE_PER_S": "10000", "OCM_BURST": "1000"})
+    if args.workers:
+        env.update({"WEB_CONCURRENCY": str(args.workers), "PORT": str(args.port)})
+    return env
+
+
+def start_backend(args, upstream_port: int) -> subprocess.Popen:
+    if args.workers:
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "server:app"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(args.port),
+                   "--log-level", "warning"]
+    log_path = os.path.join(tempfile.gettempdir(), "ecospeed-load-backend.log")
+    print(f"Backend: {' '.join(command)} (log: {log_path})")
+    with open(log_path, "w") as log:
+        return subprocess.Popen(command, cwd=BACKEND_DIR, env=backend_environment(args, upstream_port),
+                                stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_ready(host: str, port: int, process: Optional[subprocess.Popen], timeout_s: float = 90) -> None:
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Backend exited with code {process.returncode}")
+        try:
+            status, _ = await http_request(host, port, "GET", "/api/")
+            if status == 200:
+                return
+        except OSError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("Backend not ready")
+
+
+async def run(args) -> List[Dict[str, Any]]:
+    target = urlparse(args.target or f"http://127.0.0.1:{args.port}")
+    host, port = target.hostname, target.port or 80
+    mix = {kind: float(weight) for kind, weight in (item.split("=") for item in args.mix.split(","))}
+    workload = Workload(mix, args.unique_route_fraction, args.nationwide_fraction, args.seed)
+
+    upstreams = None
+    process = None
+    if not args.target:
+        upstreams = serve(args.upstream_port, faults_from_arguments(args), args.stations, args.seed)
+        process = start_backend(args, args.upstream_port)
+    try:
+        await wait_ready(host, port, process)
+        if args.warmup_s > 0:
+            print(f"Warm-up: {args.warmup_s:g} s at {args.warmup_rate:g} req/s")
+            await run_stage(host, port, workload, args.warmup_rate, args.warmup_s, args.timeout_s, args.max_in_flight, args.seed)
+        results = []
+        for k, rate in enumerate(float(rate) for rate in args.rates.split(",")):
+            result = await run_stage(host, port, workload, rate, args.stage_s, args.timeout_s, args.max_in_flight, args.seed + k + 1)
+            if upstreams is not None:
+                result["upstreams"] = json.loads(json.dumps(upstreams.upstreams.counters))
+            print_stage(result)
+            results.append(result)
+        return results
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if upstreams is not None:
+            upstreams.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", help="URL of a running backend (default: start one against the fake upstreams)")
+    parser.add_argument("--port", type=int, default=8011, help="port of the started backend")
+    parser.add_argument("--workers", type=int, default=0, help="gunicorn workers (0: a single uvicorn process)")
+    parser.add_argument("--upstream-port", type=int, default=8090)
+    parser.add_argument("--rates", default="5,10,20", help="open-loop arrival rate of each stage (req/s)")
+    parser.add_argument("--stage-s", type=float, default=30.0)
+    parser.add_argument("--warmup-s", type=float, default=5.0)
+    parser.add_argument("--warmup-rate", type=float, default=2.0)
+    parser.add_argument("--mix", default="route=0.2,stations=0.5,vehicles=0.3")
+    parser.add_argument("--unique-route-fraction", type=float, default=0.2, help="route requests with never-seen addresses")
+    parser.add_argument("--nationwide-fraction", type=float, default=0.02, help="station requests without coordinates")
+    parser.add_argument("--timeout-s", type=float, default=60.0)
+    parser.add_argument("--max-in-flight", type=int, default=2000, help="beyond, arrivals are dropped by the driver")
+    parser.add_argument("--stations", type=int, default=20000, help="POIs of the fake Open Charge Map")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="keep the real providers' outbound rate limits")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results (and arguments) to this file")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"arguments": vars(args), "stages": results}, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
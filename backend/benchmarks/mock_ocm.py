@@ -0,0 +1,144 @@
+"""
+Local mock of the Open Charge Map API (GET /v3/poi/) for sync tests and benchmarks.
+
+Serves a deterministic set of French POIs in the Open Charge Map JSON format
+and supports the parameters used by ECOSPEED: latitude / longitude /
+distance (km), maxresults and modifiedsince. Every --change-interval-s a
+fraction of the POIs changes status or power and gets a new
+DateLastStatusUpdate, so incremental syncs have something to pick up.
+
+Usage (from the backend directory):
+    python benchmarks/mock_ocm.py --port 8090 --stations 20000
+    OCM_BASE_URL=http://127.0.0.1:8090/v3 uvicorn server:app
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class MockOcm:
+    def __init__(self, station_count: int, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        now = time.time()
+        self.pois = [self._poi(i, now - self.rng.uniform(0, 365 * 86400)) for i in range(station_count)]
+
+    def _poi(self, poi_id: int, updated: float) -> dict:
+        lat, lon = self.rng.uniform(42.5, 51.0), self.rng.uniform(-4.5, 7.8)
+        return {
+            "ID": poi_id,
+            "AddressInfo": {
+                "Title": f"Borne {poi_id}", "AddressLine1": f"{poi_id} rue de la Recharge",
+                "Town": "Ville", "Latitude": round(lat, 6), "Longitude": round(lon, 6),
+            },
+            "Connections": [{"PowerKW": self.rng.choice([7.4, 22, 50, 150, 350])}],
+            "StatusType": {"ID": 50},
+            "OperatorInfo": {"Title": self.rng.choice(["Ionity", "Tesla", "Electra", "TotalEnergies"])},
+            "UsageType": {"IsPayAtLocation": self.rng.random() < 0.5},
+            "DateLastStatusUpdate": datetime.fromtimestamp(updated, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "_updated": updated,
+        }
+
+    def mutate(self, fraction: float) -> int:
+        with self.lock:
+            changed = self.rng.sample(range(len(self.pois)), max(1, int(len(self.pois) * fraction)))
+            now = time.time()
+            for i in changed:
+                poi = self.pois[i]
+                poi["StatusType"] = {"ID": self.rng.choice([50, 50, 75])}
+                poi["Connections"] = [{"PowerKW": self.rng.choice([7.4, 22, 50, 150, 350])}]
+                poi["_updated"] = now
+                poi["DateLastStatusUpdate"] = datetime.fromtimestamp(now, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return len(changed)
+
+    def query(self, params: dict) -> list:
+        lat = float(params.get("latitude", 46.6))
+        lon = float(params.get("longitude", 1.9))
+        distance = float(params.get("distance", 50))
+        max_results = int(params.get("maxresults", 100))
+        since = None
+        if "modifiedsince" in params:
+            since = datetime.fromisoformat(params["modifiedsince"]).replace(tzinfo=timezone.utc).timestamp()
+        results = []
+        with self.lock:
+            for poi in self.pois:
+                if since is not None and poi["_updated"] <= since:
+                    continue
+                info = poi["AddressInfo"]
+                dlat = math.radians(info["Latitude"] - lat)
+                dlon = math.radians(info["Longitude"] - lon)
+                a = (math.sin(dlat / 2) ** 2
+                     + math.cos(math.radians(lat)) * math.cos(math.radians(info["Latitude"])) * math.sin(dlon / 2) ** 2)
+                if 2 * 6371 * math.asin(math.sqrt(a)) <= distance:
+                    results.append({k: v for k, v in poi.items() if not k.startswith("_")})
+                    if len(results) >= max_results:
+                        break
+        return results
+
+
+def make_handler(mock: MockOcm, latency_s: float):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path.rstrip("/") != "/v3/poi":
+                self.send_error(404)
+                return
+            if latency_s:
+                time.sleep(latency_s)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            body = json.dumps(mock.query(params)).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(port: int = 8090, stations: int = 20000, change_fraction: float = 0.01,
+          change_interval_s: float = 60.0, latency_s: float = 0.0, seed: int = 0) -> ThreadingHTTPServer:
+    """Start the mock in background threads and return the server (call .shutdown() to stop)."""
+    mock = MockOcm(stations, seed)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(mock, latency_s))
+    server.mock = mock
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def mutate_forever():
+        while True:
+            time.sleep(change_interval_s)
+            mock.mutate(change_fraction)
+
+    if change_interval_s > 0:
+        threading.Thread(target=mutate_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--stations", type=int, default=20000)
+    parser.add_argument("--change-fraction", type=float, default=0.01, help="fraction of POIs changed per interval")
+    parser.add_argument("--change-interval-s", type=float, default=60.0)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added latency per request")
+    args = parser.parse_args()
+    serve(args.port, args.stations, args.change_fraction, args.change_interval_s, args.latency_ms / 1000)
+    print(f"Mock Open Charge Map on http://127.0.0.1:{args.port}/v3 ({args.stations} POIs)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
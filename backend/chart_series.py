@@ -0,0 +1,91 @@
+"""
+Chart series for ECOSPEED routes
+Speed, cumulative energy and cumulative time along the route, downsampled
+on the server to a target number of points so that long routes stay cheap
+to ship and to draw.
+
+All series share one set of retained segments, chosen on the speed
+profile (the only non-monotonic series):
+
+- "lttb": Largest-Triangle-Three-Buckets on the eco speed, one point per
+  bucket, the one forming the largest triangle with its neighbours
+- "minmax": per bucket, the segments holding the minimum and maximum of
+  every speed series, so that no peak or dip disappears
+
+Cumulative energies and times are prefix sums over every segment, read at
+the retained segments: they stay exact (the last point equals the route
+totals) whatever the resolution.
+"""
+from typing import Any, Dict, List
+
+import numpy as np
+
+CHART_METHODS = ("lttb", "minmax")
+MIN_CHART_POINTS = 10
+MAX_CHART_POINTS = 5000
+
+SPEED_SERIES = ("speed_limit", "eco_speed", "real_speed")
+CUMULATIVE_SERIES = ("limit_energy", "eco_energy", "real_energy", "limit_time", "eco_time", "real_time")
+
+
+def chart_base(segments: List[Any]) -> Dict[str, np.ndarray]:
+    """Full-resolution columns of the chart: distance and speeds at each segment end, prefix sums."""
+    def column(name):
+        return np.fromiter((getattr(s, name) for s in segments), dtype=np.float64, count=len(segments))
+
+    base = {"distance_km": np.cumsum(column("distance")) / 1000}
+    for name in SPEED_SERIES:
+        base[name] = column(name)
+    for name in CUMULATIVE_SERIES:
+        base[name] = np.cumsum(column(name))
+    return base
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """Indices kept by Largest-Triangle-Three-Buckets (first and last always kept)."""
+    size = len(x)
+    if points >= size or points < 3:
+        return np.arange(size)
+    # points - 2 buckets between the first and the last point
+    edges = np.linspace(1, size - 1, points - 1).astype(np.int64)
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, size - 1
+    a = 0
+    for k in range(points - 2):
+        start, end = edges[k], edges[k + 1]
+        if k + 2 < len(edges):
+            next_x, next_y = x[end:edges[k + 2]].mean(), y[end:edges[k + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[k + 1] = a
+    return selected
+
+
+def minmax_indices(series: List[np.ndarray], points: int) -> np.ndarray:
+    """Indices of the minimum and maximum of every series in each bucket (first and last always kept)."""
+    size = len(series[0])
+    if points >= size:
+        return np.arange(size)
+    buckets = max(1, (points - 2) // (2 * len(series)))
+    edges = np.linspace(0, size, buckets + 1).astype(np.int64)
+    selected = {0, size - 1}
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end <= start:
+            continue
+        for values in series:
+            selected.add(start + int(np.argmin(values[start:end])))
+            selected.add(start + int(np.argmax(values[start:end])))
+    return np.array(sorted(selected), dtype=np.int64)
+
+
+def chart_series(base: Dict[str, np.ndarray], points: int, method: str = "lttb") -> Dict[str, Any]:
+    """Downsampled series (lists) of a chart base, with the retained segment indices."""
+    if method == "minmax":
+        indices = minmax_indices([base[name] for name in SPEED_SERIES], points)
+    else:
+        indices = lttb_indices(base["distance_km"], base["eco_speed"], points)
+    series = {name: values[indices].tolist() for name, values in base.items()}
+    series["segment_index"] = indices.tolist()
+    return series
@@ -0,0 +1,59 @@
+"""
+Request coalescing (single-flight) for ECOSPEED
+Concurrent identical requests (same trip, same station area) share one
+upstream fetch and computation instead of each doing its own geocoding and
+API calls.
+
+The first caller for a key (the leader) starts the work in a task; callers
+arriving while it runs (followers) await the same task. The key is forgotten
+as soon as the task finishes, so results are never served stale from here:
+a response cache, if any, should be checked before calling do() and filled
+by the coalesced function. The result is shared as-is: callers that need a
+private copy (e.g. mutable per-client state) use run() to know whether they
+got another caller's result.
+"""
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+def request_key(namespace: str, payload: Any) -> str:
+    """Stable key for a JSON-serializable payload (dict keys sorted)."""
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return f"{namespace}:{hashlib.sha256(encoded.encode('utf-8')).hexdigest()}"
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls sharing the same key."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.leaders = 0  # Calls that actually ran the work
+        self.followers = 0  # Calls that awaited another caller's work
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        result, _ = await self.run(key, fn)
+        return result
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Like do(), also telling whether this caller ran the work (True) or shared another caller's result."""
+        task = self._in_flight.get(key)
+        leader = task is None
+        if leader:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.followers += 1
+        # shield: a disconnecting client must not cancel the work shared by the others
+        return await asyncio.shield(task), leader
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "in_flight": len(self._in_flight),
+        }
@@ -0,0 +1,42 @@
+"""
+Production configuration of the ECOSPEED backend (gunicorn -c gunicorn.conf.py server:app)
+Several uvicorn workers pre-forked by one master process:
+
+- the application is imported once in the master (preload_app) and the
+  charging-station index is loaded there before the fork, so every worker
+  starts with it (shared copy-on-write pages) instead of rebuilding it
+- geocodes, OpenRouteService geometries, computed routes and station
+  snapshots are shared through shared_cache (SQLite on /dev/shm)
+- vehicle physics tables are memory-mapped .npy files in PHYSICS_TABLE_DIR,
+  mapped once by the kernel for all the workers
+
+WEB_CONCURRENCY sets the number of workers (default: min(4, CPUs)).
+"""
+import gc
+import os
+
+from shared_cache import SHARED_CACHE_DIR
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8001')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', str(min(4, os.cpu_count() or 1))))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+# Read when server.py is imported (preload): set before the application
+# Upstream rate limits are split between the workers (outbound.py)
+os.environ['WEB_CONCURRENCY'] = str(workers)
+if SHARED_CACHE_DIR:
+    os.environ.setdefault('PHYSICS_TABLE_DIR', os.path.join(SHARED_CACHE_DIR, "physics_tables"))
+# Each worker has its own physics process pool: split the CPUs between them
+os.environ.setdefault('PHYSICS_WORKERS', str(max(1, (os.cpu_count() or 2) // workers)))
+
+
+def when_ready(arbiter):
+    import server as app_module
+
+    app_module.preload_shared_state()
+    # Objects loaded so far are never freed: keep their pages shared after the fork
+    gc.freeze()
@@ -0,0 +1,100 @@
+"""
+HTTP caching for ECOSPEED read endpoints
+ASGI middleware adding validators and cache lifetimes to GET responses, so
+that browsers, the nginx frontend or a CDN can reuse them:
+
+- Cache-Control from the first matching policy (path regex), unless the
+  endpoint set its own
+- a strong ETag: the endpoint's own (e.g. a data version) or a SHA-256 of
+  the body
+- 304 Not Modified, without body, when If-None-Match matches
+
+Only successful GET responses on paths with a policy are buffered; other
+requests (POST, uploads, errors) go through untouched.
+"""
+import hashlib
+import re
+from typing import List, Optional, Pattern, Tuple
+
+
+def etag_for(body: bytes) -> str:
+    """Strong ETag from the content hash of a response body."""
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match comparison (weak comparison, as required for GET revalidation)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+class HttpCachingMiddleware:
+    """Conditional GET handling and Cache-Control policies for an ASGI app."""
+
+    def __init__(self, app, policies: List[Tuple[str, str]]):
+        self.app = app
+        self.policies: List[Tuple[Pattern, str]] = [(re.compile(path), value) for path, value in policies]
+
+    def _policy(self, path: str) -> Optional[str]:
+        for pattern, value in self.policies:
+            if pattern.fullmatch(path):
+                return value
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+        cache_control = self._policy(scope["path"])
+        if cache_control is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        chunks = []
+
+        async def buffered_send(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    await self._finish(scope, send, start, b"".join(chunks), cache_control)
+                return
+            await send(message)
+
+        await self.app(scope, receive, buffered_send)
+
+    async def _finish(self, scope, send, start, body: bytes, cache_control: str) -> None:
+        if start["status"] != 200:
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        headers = [(name, value) for name, value in start.get("headers", [])]
+        names = {name.lower() for name, _ in headers}
+        etag = next((value.decode("latin-1") for name, value in headers if name.lower() == b"etag"), None)
+        if etag is None:
+            etag = etag_for(body)
+            headers.append((b"etag", etag.encode("latin-1")))
+        if b"cache-control" not in names:
+            headers.append((b"cache-control", cache_control.encode("latin-1")))
+
+        if_none_match = next(
+            (value.decode("latin-1") for name, value in scope["headers"] if name == b"if-none-match"), None
+        )
+        if etag_matches(if_none_match, etag):
+            # 304: validators and caching headers only, no body nor content headers
+            kept = [(name, value) for name, value in headers
+                    if name.lower() not in (b"content-length", b"content-type")]
+            await send({"type": "http.response.start", "status": 304, "headers": kept})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
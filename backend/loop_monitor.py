@@ -0,0 +1,72 @@
+"""
+Event-loop lag monitor for ECOSPEED
+A background task sleeps `interval_s` in a loop and records how late it
+wakes up: the time the event loop was busy with something else (blocking
+code, long synchronous steps). The lag is kept in a cumulative histogram
+with fixed buckets, so that two snapshots of /api/metrics can be
+subtracted to get the lag distribution of a time window (load tests), and
+in a window of recent samples for a quick look.
+"""
+import asyncio
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+# Upper bounds of the histogram buckets (milliseconds), plus an overflow bucket
+LAG_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+RECENT_SAMPLES = 600
+
+
+class LoopLagMonitor:
+    def __init__(self, interval_s: float = 0.1):
+        self.interval_s = interval_s
+        self.histogram = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.samples = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._recent: Deque[float] = deque(maxlen=RECENT_SAMPLES)
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, lag_ms: float) -> None:
+        self.histogram[bisect_left(LAG_BUCKETS_MS, lag_ms)] += 1
+        self.samples += 1
+        self.total_ms += lag_ms
+        self.max_ms = max(self.max_ms, lag_ms)
+        self._recent.append(lag_ms)
+
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval_s)
+            self.record(max(0.0, (time.perf_counter() - started - self.interval_s) * 1000))
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        recent = sorted(self._recent)
+
+        def percentile(q: float) -> float:
+            return round(recent[min(len(recent) - 1, int(q * len(recent)))], 2) if recent else 0.0
+
+        return {
+            "interval_ms": self.interval_s * 1000,
+            "samples": self.samples,
+            "mean_ms": round(self.total_ms / self.samples, 3) if self.samples else 0.0,
+            "max_ms": round(self.max_ms, 2),
+            "recent_p50_ms": percentile(0.5),
+            "recent_p99_ms": percentile(0.99),
+            "buckets_ms": list(LAG_BUCKETS_MS),
+            "histogram": list(self.histogram),
+        }
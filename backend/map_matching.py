@@ -0,0 +1,353 @@
+"""
+GPS trace map-matching for ECOSPEED
+Matches recorded GPS fixes (GPX or CSV) to the geometry of a stored route with
+an HMM / Viterbi matcher (Newson & Krumm style) over a grid spatial index, and
+derives the time at which each route point was passed.
+
+Traces are read and matched in chunks: only the current chunk of fixes and one
+array per route point are kept in memory, so traces with hundreds of thousands
+of fixes are processed with bounded memory.
+"""
+import csv
+import io
+import math
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000
+
+# Matcher parameters
+SEARCH_RADIUS_M = 50.0  # Candidate segments must be within this distance of the fix
+GPS_SIGMA_M = 10.0  # Standard deviation of the GPS noise (emission probability)
+TRANSITION_BETA_M = 30.0  # Tolerance between route distance and straight-line distance
+MAX_BACKTRACK_M = 20.0  # The driver may not move backwards along the route more than this
+MIN_FIX_SPACING_M = 3.0  # Fixes closer than this to the previous one are skipped
+GRID_CELL_M = 100.0
+SPEED_WINDOW_M = 200.0  # Distance over which segment speeds are measured
+
+Fix = Tuple[float, float, float]  # (lat, lon, unix timestamp in seconds)
+
+
+# ============================================================================
+# TRACE PARSING
+# ============================================================================
+
+def _parse_time(value: str) -> float:
+    """Parse an ISO 8601 date or a unix timestamp (seconds) to a unix timestamp."""
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def parse_gpx(fileobj) -> Iterator[Fix]:
+    """
+    Stream (lat, lon, timestamp) fixes from a GPX file.
+    Elements are cleared as soon as they are read so memory does not grow with the file.
+    """
+    for _, elem in ET.iterparse(fileobj, events=("end",)):
+        tag = elem.tag.rsplit("}", 1)[-1]
+        if tag in ("trkpt", "rtept", "wpt"):
+            time_value = None
+            for child in elem:
+                if child.tag.rsplit("}", 1)[-1] == "time" and child.text:
+                    time_value = child.text
+                    break
+            if time_value is not None:
+                try:
+                    yield float(elem.get("lat")), float(elem.get("lon")), _parse_time(time_value)
+                except (TypeError, ValueError):
+                    pass
+            elem.clear()
+
+
+def parse_csv(fileobj) -> Iterator[Fix]:
+    """
+    Stream (lat, lon, timestamp) fixes from a CSV file with a header row.
+    Accepted columns: lat/latitude, lon/lng/longitude, time/timestamp (ISO 8601 or unix seconds).
+    """
+    text = io.TextIOWrapper(fileobj, encoding="utf-8", newline="") if isinstance(fileobj.read(0), bytes) else fileobj
+    reader = csv.DictReader(text)
+    fields = {name.strip().lower(): name for name in (reader.fieldnames or [])}
+
+    def column(*names: str) -> Optional[str]:
+        for name in names:
+            if name in fields:
+                return fields[name]
+        return None
+
+    lat_col = column("lat", "latitude")
+    lon_col = column("lon", "lng", "longitude")
+    time_col = column("time", "timestamp", "datetime")
+    if not lat_col or not lon_col or not time_col:
+        raise ValueError("CSV trace must have lat, lon and time columns")
+
+    for row in reader:
+        try:
+            yield float(row[lat_col]), float(row[lon_col]), _parse_time(row[time_col])
+        except (TypeError, ValueError):
+            continue
+
+
+def iter_chunks(fixes: Iterable[Fix], size: int) -> Iterator[List[Fix]]:
+    """Group an iterator of fixes into lists of at most `size` fixes."""
+    chunk = []
+    for fix in fixes:
+        chunk.append(fix)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ============================================================================
+# SPATIAL INDEX OVER THE ROUTE GEOMETRY
+# ============================================================================
+
+class RouteGeometryIndex:
+    """
+    Grid index over the elementary segments of a route.
+    Points are projected to a local equirectangular plane (meters) centered
+    on the route, which is accurate enough for matching distances.
+    """
+
+    def __init__(self, lat: np.ndarray, lon: np.ndarray, cell_m: float = GRID_CELL_M):
+        self.lat0 = math.radians(float(np.mean(lat)))
+        self.lon0 = math.radians(float(np.mean(lon)))
+        self.cos_lat0 = math.cos(self.lat0)
+        self.cell_m = cell_m
+
+        self.x, self.y = self.project(lat, lon)
+        self.dx = np.diff(self.x)
+        self.dy = np.diff(self.y)
+        self.length = np.hypot(self.dx, self.dy)
+        # Cumulative distance of each route point along the route
+        self.cumulative = np.concatenate(([0.0], np.cumsum(self.length)))
+
+        # Rasterize the bounding box of every segment into grid cells, stored
+        # as a CSR structure (sorted cell keys -> ranges of segment indices)
+        cx0 = np.floor(np.minimum(self.x[:-1], self.x[1:]) / cell_m).astype(np.int64)
+        cx1 = np.floor(np.maximum(self.x[:-1], self.x[1:]) / cell_m).astype(np.int64)
+        cy0 = np.floor(np.minimum(self.y[:-1], self.y[1:]) / cell_m).astype(np.int64)
+        cy1 = np.floor(np.maximum(self.y[:-1], self.y[1:]) / cell_m).astype(np.int64)
+        width = cx1 - cx0 + 1
+        counts = width * (cy1 - cy0 + 1)
+        segs = np.repeat(np.arange(len(self.length)), counts)
+        rank = np.arange(len(segs)) - np.repeat(np.cumsum(counts) - counts, counts)
+        keys = self._key(cx0[segs] + rank % width[segs], cy0[segs] + rank // width[segs])
+
+        order = np.argsort(keys, kind="stable")
+        keys, self.cell_segs = keys[order], segs[order]
+        self.cell_keys, self.cell_starts = np.unique(keys, return_index=True)
+        self.cell_ends = np.append(self.cell_starts[1:], len(keys))
+
+    @staticmethod
+    def _key(cx, cy):
+        return cx * 4_000_000 + cy
+
+    def project(self, lat, lon) -> Tuple[np.ndarray, np.ndarray]:
+        lat_rad = np.radians(np.asarray(lat, dtype=np.float64))
+        lon_rad = np.radians(np.asarray(lon, dtype=np.float64))
+        x = (lon_rad - self.lon0) * self.cos_lat0 * EARTH_RADIUS_M
+        y = (lat_rad - self.lat0) * EARTH_RADIUS_M
+        return x, y
+
+    def candidates(self, xs: np.ndarray, ys: np.ndarray, radius: float = SEARCH_RADIUS_M):
+        """
+        Candidate positions for a batch of fixes.
+        Returns (offsets, distances, positions): the candidates of fix i are
+        distances[offsets[i]:offsets[i + 1]] (distance to the route in meters)
+        and positions[offsets[i]:offsets[i + 1]] (position along the route in meters).
+        """
+        reach = int(math.ceil(radius / self.cell_m))
+        cx = np.floor(xs / self.cell_m).astype(np.int64)
+        cy = np.floor(ys / self.cell_m).astype(np.int64)
+        shifts = np.arange(-reach, reach + 1)
+        neighbor_keys = self._key(
+            (cx[:, None, None] + shifts[None, :, None]),
+            (cy[:, None, None] + shifts[None, None, :])
+        ).reshape(len(xs), -1)
+
+        # Cells of each fix -> ranges of segments
+        slot = np.searchsorted(self.cell_keys, neighbor_keys).clip(max=len(self.cell_keys) - 1)
+        hit = self.cell_keys[slot] == neighbor_keys
+        fix_of_cell = np.broadcast_to(np.arange(len(xs))[:, None], neighbor_keys.shape)[hit]
+        starts, ends = self.cell_starts[slot[hit]], self.cell_ends[slot[hit]]
+        counts = ends - starts
+        fix = np.repeat(fix_of_cell, counts)
+        rank = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        segs = self.cell_segs[np.repeat(starts, counts) + rank]
+
+        # A segment can be found in several neighboring cells
+        pair = np.unique(fix * len(self.length) + segs)
+        fix, segs = pair // len(self.length), pair % len(self.length)
+
+        # Projection of each fix on each candidate segment
+        px0, py0 = xs[fix] - self.x[segs], ys[fix] - self.y[segs]
+        length_sq = np.maximum(self.length[segs] ** 2, 1e-9)
+        t = np.clip((px0 * self.dx[segs] + py0 * self.dy[segs]) / length_sq, 0.0, 1.0)
+        dist = np.hypot(px0 - t * self.dx[segs], py0 - t * self.dy[segs])
+
+        keep = dist <= radius
+        fix, segs, t, dist = fix[keep], segs[keep], t[keep], dist[keep]
+        offsets = np.searchsorted(fix, np.arange(len(xs) + 1))
+        return offsets, dist, self.cumulative[segs] + t * self.length[segs]
+
+
+# ============================================================================
+# HMM / VITERBI MATCHER
+# ============================================================================
+
+class TraceMatcher:
+    """
+    Online Viterbi matcher of GPS fixes to a route.
+
+    Hidden states are candidate positions along the route near each fix.
+    Emission: Gaussian on the distance between the fix and the route.
+    Transition: exponential on the difference between the distance travelled
+    along the route and the straight-line distance between fixes.
+
+    Chunks are decoded one at a time (the best path of each chunk is committed
+    before the next one is read), and the time at which each route point was
+    passed is accumulated in `point_times`.
+    """
+
+    def __init__(self, index: RouteGeometryIndex):
+        self.index = index
+        self.point_times = np.full(len(index.cumulative), np.nan)
+        self.fixes_total = 0
+        self.fixes_matched = 0
+        # Last committed state (x, y, position along route, time)
+        self._last: Optional[Tuple[float, float, float, float]] = None
+
+    def feed(self, chunk: List[Fix]) -> None:
+        """Match a chunk of fixes and commit its best path."""
+        self.fixes_total += len(chunk)
+        if not chunk:
+            return
+        fixes = np.asarray(chunk, dtype=np.float64)
+        fixes = fixes[np.argsort(fixes[:, 2], kind="stable")]
+        xs, ys = self.index.project(fixes[:, 0], fixes[:, 1])
+
+        positions: List[np.ndarray] = []  # Candidate positions per kept fix
+        backpointers: List[np.ndarray] = []
+        kept: List[int] = []
+        scores = None
+        prev_x = prev_y = None
+        if self._last is not None:
+            prev_x, prev_y = self._last[0], self._last[1]
+            positions.append(np.array([self._last[2]]))
+            backpointers.append(np.zeros(1, dtype=np.int64))
+            kept.append(-1)
+            scores = np.zeros(1)
+
+        offsets, all_dist, all_pos = self.index.candidates(xs, ys)
+        for i in range(len(fixes)):
+            lo, hi = offsets[i], offsets[i + 1]
+            if lo == hi:
+                continue
+            x, y = float(xs[i]), float(ys[i])
+            if prev_x is not None and math.hypot(x - prev_x, y - prev_y) < MIN_FIX_SPACING_M:
+                continue
+            dist, pos = all_dist[lo:hi], all_pos[lo:hi]
+            emission = -0.5 * (dist / GPS_SIGMA_M) ** 2
+
+            if scores is None:
+                scores = emission
+                pointer = np.zeros(len(pos), dtype=np.int64)
+            else:
+                straight = math.hypot(x - prev_x, y - prev_y)
+                moved = pos[None, :] - positions[-1][:, None]
+                transition = -np.abs(moved - straight) / TRANSITION_BETA_M
+                transition[moved < -MAX_BACKTRACK_M] = -np.inf
+                total = scores[:, None] + transition
+                pointer = np.argmax(total, axis=0)
+                best = total[pointer, np.arange(len(pos))]
+                if not np.isfinite(best).any():
+                    # HMM break (e.g. the driver left the route): decode what we have and restart
+                    self._commit(fixes, kept, positions, backpointers, scores)
+                    positions, backpointers, kept = [], [], []
+                    scores = emission
+                    pointer = np.zeros(len(pos), dtype=np.int64)
+                else:
+                    scores = best + emission
+                    # Keep log-probabilities close to 0 on long chains
+                    scores -= scores[np.isfinite(scores)].max()
+
+            positions.append(pos)
+            backpointers.append(pointer)
+            kept.append(i)
+            prev_x, prev_y = x, y
+
+        if scores is not None:
+            self._commit(fixes, kept, positions, backpointers, scores)
+
+    def _commit(self, fixes, kept, positions, backpointers, scores) -> None:
+        """Backtrack the best path of the current chain and record point passing times."""
+        if not kept:
+            return
+        state = int(np.argmax(scores))
+        path_pos = np.empty(len(kept))
+        for k in range(len(kept) - 1, -1, -1):
+            path_pos[k] = positions[k][state]
+            state = int(backpointers[k][state])
+
+        real = np.array([k >= 0 for k in kept])
+        times = np.array([fixes[k, 2] if k >= 0 else self._last[3] for k in kept])
+        xs, ys = self.index.project(
+            [fixes[k, 0] for k in kept if k >= 0], [fixes[k, 1] for k in kept if k >= 0]
+        )
+        self.fixes_matched += int(real.sum())
+
+        # Positions along the route must not decrease
+        path_pos = np.maximum.accumulate(path_pos)
+        if len(path_pos) >= 2:
+            inside = (self.index.cumulative >= path_pos[0]) & (self.index.cumulative <= path_pos[-1])
+            self.point_times[inside] = np.interp(self.index.cumulative[inside], path_pos, times)
+        if len(xs):
+            self._last = (float(xs[-1]), float(ys[-1]), float(path_pos[-1]), float(times[-1]))
+
+    def segment_speeds(self, window_m: float = SPEED_WINDOW_M) -> np.ndarray:
+        """
+        Actual speed in km/h of each elementary segment of the route, NaN for
+        segments not covered by the trace.
+
+        GPS noise makes the passing time of individual points jittery, so the
+        speed of a segment is measured over a window of `window_m` meters
+        centered on it (distance / elapsed time, which avoids the upward bias
+        of averaging noisy per-segment speeds).
+        """
+        cumulative = self.index.cumulative
+        middle = (cumulative[:-1] + cumulative[1:]) / 2
+        lo = np.searchsorted(cumulative, middle - window_m / 2, side="right") - 1
+        hi = np.searchsorted(cumulative, middle + window_m / 2, side="left")
+        lo = np.clip(lo, 0, len(cumulative) - 1)
+        hi = np.clip(hi, 0, len(cumulative) - 1)
+
+        # Shrink the window where it runs out of the covered part of the route
+        covered = ~np.isnan(self.point_times)
+        segment_covered = covered[:-1] & covered[1:]
+        last_covered = np.maximum.accumulate(np.where(covered, np.arange(len(covered)), -1))
+        next_covered = np.minimum.accumulate(np.where(covered, np.arange(len(covered)), len(covered))[::-1])[::-1]
+        seg = np.arange(len(middle))
+        lo = np.maximum(lo, np.minimum(next_covered[lo], seg))
+        hi = np.minimum(hi, np.maximum(last_covered[hi], seg + 1))
+
+        elapsed = self.point_times[hi] - self.point_times[lo]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            speeds = (cumulative[hi] - cumulative[lo]) / elapsed * 3.6
+        speeds = np.where(segment_covered & (elapsed > 0), speeds, np.nan)
+        return np.clip(speeds, 1.0, 250.0)
+
+
+def match_trace(lat: np.ndarray, lon: np.ndarray, fixes: Iterable[Fix], chunk_size: int = 5000) -> TraceMatcher:
+    """Match a stream of fixes to the route (lat, lon) chunk by chunk."""
+    matcher = TraceMatcher(RouteGeometryIndex(lat, lon))
+    for chunk in iter_chunks(fixes, chunk_size):
+        matcher.feed(chunk)
+    return matcher
@@ -0,0 +1,295 @@
+"""
+Outbound request scheduler for ECOSPEED
+Every call to an upstream provider (Nominatim, OpenRouteService, Open Charge
+Map) goes through its Provider, which applies in order:
+
+1. Circuit breaker: after `failure_threshold` consecutive upstream failures
+   the provider is "open" and calls fail fast for `reset_timeout_s`, then a
+   single trial call decides between closing it again or re-opening it (a
+   trial whose caller is cancelled leaves its place to the next call).
+2. Token bucket: `rate_per_s` with a `burst`, enforced by reservation, so
+   waiting callers are served in order with asyncio.sleep (no blocking
+   sleeps, no thread held). A caller that would wait more than `max_wait_s`
+   is rejected right away.
+3. Retries of transient failures (network errors, timeouts, 429 and 5xx)
+   with full-jitter exponential backoff, honouring Retry-After, limited per
+   call (`max_retries`) and globally by a retry budget: each call earns
+   `retry_ratio` retry tokens, each retry spends one, so a failing upstream
+   never sees more than ~(1 + retry_ratio) times the normal traffic.
+
+Provider rate limits apply to the whole host: with WEB_CONCURRENCY worker
+processes (gunicorn.conf.py), each one gets an equal share of the rate and
+burst. Blocking client calls (requests, geopy) run in worker threads. Failures that
+should not be hidden raise UpstreamUnavailable, mapped to 503 by the API.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, Callable, Dict, Optional
+
+import requests
+from geopy import exc as geopy_exc
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamUnavailable(Exception):
+    """A provider cannot serve the call now (circuit open, rate-limit queue full, retries exhausted)."""
+
+    def __init__(self, provider: str, reason: str, retry_after_s: Optional[float] = None):
+        super().__init__(f"{provider} unavailable: {reason}")
+        self.provider = provider
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def is_transient(error: BaseException) -> bool:
+    """Errors worth retrying and counted as upstream failures by the circuit breaker."""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, geopy_exc.GeocoderTimedOut,
+                          geopy_exc.GeocoderUnavailable, geopy_exc.GeocoderRateLimited)):
+        return True
+    if isinstance(error, geopy_exc.GeocoderServiceError) and not isinstance(
+            error, (geopy_exc.GeocoderQueryError, geopy_exc.GeocoderAuthenticationFailure,
+                    geopy_exc.GeocoderInsufficientPrivileges)):
+        return True
+    status = _status_code(error)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Retry-After of a rate-limited response, in seconds (None if absent)."""
+    if isinstance(error, geopy_exc.GeocoderRateLimited) and error.retry_after:
+        return float(error.retry_after)
+    response = getattr(error, "response", None)
+    value = response.headers.get("Retry-After") if response is not None and hasattr(response, "headers") else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    """Reservation-based token bucket (FIFO waiting with asyncio.sleep)."""
+
+    def __init__(self, rate_per_s: float, burst: float):
+        self.rate = rate_per_s
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.waiting = 0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Take a token, possibly borrowed from the future; returns the wait in seconds."""
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def cancel(self) -> None:
+        self.tokens += 1
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker (closed -> open -> half-open)."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout_s: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_timeout_s else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def retry_in(self) -> float:
+        return max(0.0, self.reset_timeout_s - (time.monotonic() - self.opened_at)) if self.opened_at else 0.0
+
+    def release_trial(self) -> None:
+        """End the trial call without an outcome (rate-limited or cancelled caller)."""
+        self.trial_in_flight = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.trial_in_flight or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self.trial_in_flight:
+                logger.warning(f"Circuit opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+
+
+class RetryBudget:
+    """Retries allowed as a fraction of calls (token bucket fed by calls)."""
+
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class Provider:
+    """Rate limit, retries and circuit breaker of one upstream provider."""
+
+    def __init__(
+        self,
+        name: str,
+        rate_per_s: float,
+        burst: float = 1,
+        max_wait_s: float = 30.0,
+        max_retries: int = 2,
+        base_delay_s: float = 0.5,
+        max_delay_s: float = 8.0,
+        retry_ratio: float = 0.2,
+        failure_threshold: int = 5,
+        reset_timeout_s: float = 30.0,
+    ):
+        self.name = name
+        self.bucket = TokenBucket(rate_per_s, burst)
+        self.max_wait_s = max_wait_s
+        self.max_retries = max_retries
+        self.base_delay_s = base_delay_s
+        self.max_delay_s = max_delay_s
+        self.budget = RetryBudget(retry_ratio)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout_s)
+        self.counters = {
+            "calls": 0, "successes": 0, "failures": 0, "retries": 0,
+            "rate_limited": 0, "short_circuited": 0, "budget_exhausted": 0,
+        }
+
+    async def _acquire(self) -> None:
+        wait = self.bucket.reserve()
+        if wait > self.max_wait_s:
+            self.bucket.cancel()
+            self.counters["rate_limited"] += 1
+            raise UpstreamUnavailable(self.name, f"rate limit queue too long ({wait:.1f} s)", wait)
+        if wait > 0:
+            self.bucket.waiting += 1
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                # The reserved slot is given back to the callers behind
+                self.bucket.cancel()
+                raise
+            finally:
+                self.bucket.waiting -= 1
+
+    async def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run the blocking fn(*args, **kwargs) in a thread under this provider's policies."""
+        self.counters["calls"] += 1
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            trial = self.breaker.state == "half-open"
+            if not self.breaker.allow():
+                self.counters["short_circuited"] += 1
+                raise UpstreamUnavailable(self.name, "circuit open", self.breaker.retry_in())
+            try:
+                await self._acquire()
+            except (UpstreamUnavailable, asyncio.CancelledError):
+                if trial:
+                    self.breaker.release_trial()
+                raise
+            try:
+                result = await asyncio.to_thread(fn, *args, **kwargs)
+            except asyncio.CancelledError:
+                # Caller gone before the outcome: the next call runs the trial
+                if trial:
+                    self.breaker.release_trial()
+                raise
+            except Exception as e:
+                if not is_transient(e):
+                    # The provider answered (bad request, not found...): not an outage
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                self.counters["failures"] += 1
+                if attempt >= self.max_retries or self.breaker.state != "closed":
+                    raise UpstreamUnavailable(self.name, str(e), self.breaker.retry_in() or None) from e
+                if not self.budget.withdraw():
+                    self.counters["budget_exhausted"] += 1
+                    raise UpstreamUnavailable(self.name, f"retry budget exhausted ({e})") from e
+                delay = random.uniform(0, min(self.max_delay_s, self.base_delay_s * 2 ** attempt))
+                delay = max(delay, retry_after(e) or 0.0)
+                attempt += 1
+                self.counters["retries"] += 1
+                logger.warning(f"{self.name} call failed ({e}), retry {attempt}/{self.max_retries} in {delay:.2f} s")
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            self.counters["successes"] += 1
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "queue_depth": self.bucket.waiting,
+            "rate_per_s": round(self.bucket.rate, 4),
+            "circuit": self.breaker.state,
+            "retry_budget": round(self.budget.tokens, 2),
+        }
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+# Worker processes sharing the upstream quotas (set by gunicorn.conf.py)
+WORKER_COUNT = max(1, int(os.environ.get('WEB_CONCURRENCY', '1')))
+
+
+def _worker_share(rate_per_s: float, burst: float) -> Dict[str, float]:
+    return {"rate_per_s": rate_per_s / WORKER_COUNT, "burst": max(1.0, burst / WORKER_COUNT)}
+
+
+# Nominatim usage policy: at most 1 request per second.
+# OpenRouteService free plan: 40 directions requests per minute.
+providers: Dict[str, Provider] = {
+    "nominatim": Provider("nominatim", **_worker_share(_env_float('NOMINATIM_RATE_PER_S', 1.0), 1)),
+    "ors": Provider("ors", **_worker_share(_env_float('ORS_RATE_PER_MIN', 40) / 60, _env_float('ORS_BURST', 5))),
+    "ocm": Provider("ocm", **_worker_share(_env_float('OCM_RATE_PER_S', 2.0), _env_float('OCM_BURST', 2)),
+                    max_wait_s=600.0),
+}
+
+
+async def call(provider: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    return await providers[provider].call(fn, *args, **kwargs)
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    return {name: provider.stats() for name, provider in providers.items()}
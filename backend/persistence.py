@@ -0,0 +1,244 @@
+"""
+Write-behind MongoDB persistence for ECOSPEED
+Computed routes, geocoding results and charging-station snapshots are
+queued in memory by a non-blocking put() and written by a background task,
+so a request never waits on MongoDB.
+
+- Batching: pending documents are written every `flush_interval_s`, or as
+  soon as a collection has `batch_size` of them, with one insert_many
+  (append-only collections) or one unordered bulk of upserts on the
+  collection key per batch.
+- Coalescing: a document put again before it is written (same key)
+  replaces the pending one, so a burst of updates costs one write.
+- Backpressure: at most `max_pending` documents wait in memory. Beyond,
+  the oldest pending documents of the lowest-priority collection are
+  dropped (and counted), never the request. When a write fails or exceeds
+  `write_timeout_s`, its batch is put back and the writer backs off
+  exponentially (up to `max_backoff_s`) instead of piling up requests on a
+  slow server.
+- Indexes (including TTL indexes on `expires_at`) are created by the writer
+  when it starts. Writes are idempotent (upserts, or unique-key inserts
+  whose duplicates are ignored), so a retried batch never duplicates data.
+"""
+import asyncio
+import itertools
+import logging
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Hashable, List, Optional
+
+from pymongo import ASCENDING, IndexModel, ReplaceOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+@dataclass
+class CollectionSpec:
+    """How the documents of one collection are written."""
+    name: str
+    key: Optional[str] = None  # Upsert key field (None: append-only, insert_many)
+    indexes: List[IndexModel] = field(default_factory=list)
+    # Documents carry an `expires_at` datetime removed by MongoDB once passed
+    ttl: bool = False
+    # Lowest priority pending documents are dropped first under backpressure
+    priority: int = 0
+
+    def all_indexes(self) -> List[IndexModel]:
+        indexes = list(self.indexes)
+        if self.ttl:
+            indexes.append(IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0))
+        return indexes
+
+
+class WriteBehind:
+    """Bounded in-memory write queue flushed to MongoDB by a background task."""
+
+    def __init__(
+        self,
+        db: Any,
+        specs: List[CollectionSpec],
+        max_pending: int = 10000,
+        batch_size: int = 500,
+        flush_interval_s: float = 1.0,
+        write_timeout_s: float = 10.0,
+        max_backoff_s: float = 60.0,
+    ):
+        self.db = db
+        self.specs = {spec.name: spec for spec in specs}
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.write_timeout_s = write_timeout_s
+        self.max_backoff_s = max_backoff_s
+        # Per collection: key -> document (dict, or a callable building it in the writer)
+        self._pending: Dict[str, "OrderedDict[Hashable, Any]"] = {name: OrderedDict() for name in self.specs}
+        self._sequence = itertools.count()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.consecutive_failures = 0
+        self.last_flush_ms = 0.0
+        self.counters = {name: {"queued": 0, "coalesced": 0, "written": 0, "dropped": 0} for name in self.specs}
+        self.failed_batches = 0
+        self._last_shed_log = -math.inf
+
+    @property
+    def pending(self) -> int:
+        return sum(len(pending) for pending in self._pending.values())
+
+    def put(self, collection: str, document: Any, key: Optional[Hashable] = None) -> bool:
+        """
+        Queue a document (or a zero-argument callable returning it, built in a
+        worker thread at flush time). Never blocks; returns False if the
+        document was dropped right away by the backpressure policy.
+        """
+        spec = self.specs[collection]
+        if key is None:
+            key = document[spec.key] if spec.key else next(self._sequence)
+        pending = self._pending[collection]
+        counters = self.counters[collection]
+        if pending.pop(key, None) is not None:
+            counters["coalesced"] += 1
+        pending[key] = document
+        counters["queued"] += 1
+        if self.pending > self.max_pending:
+            self._shed()
+        if len(pending) >= self.batch_size:
+            self._wake.set()
+        return key in pending
+
+    def _shed(self) -> None:
+        """Drop the oldest pending documents of the lowest-priority collections down to max_pending."""
+        excess = self.pending - self.max_pending
+        for spec in sorted(self.specs.values(), key=lambda s: s.priority):
+            pending = self._pending[spec.name]
+            dropped = min(excess, len(pending))
+            for _ in range(dropped):
+                pending.popitem(last=False)
+            self.counters[spec.name]["dropped"] += dropped
+            excess -= dropped
+            if excess <= 0:
+                break
+        if time.monotonic() - self._last_shed_log > 10:
+            self._last_shed_log = time.monotonic()
+            logger.warning(f"Write-behind queue full ({self.max_pending} documents), oldest low-priority writes dropped")
+
+    def _requeue(self, collection: str, batch: List[tuple]) -> None:
+        """Put a failed batch back in front, unless a newer version of a document was queued meanwhile."""
+        pending = self._pending[collection]
+        for key, document in reversed(batch):
+            if key not in pending:
+                pending[key] = document
+                pending.move_to_end(key, last=False)
+        if self.pending > self.max_pending:
+            self._shed()
+
+    async def _write(self, spec: CollectionSpec, documents: List[Dict[str, Any]]) -> List[int]:
+        """Write one batch; returns the positions of the documents MongoDB rejected."""
+        collection = self.db[spec.name]
+        try:
+            if spec.key is None:
+                await collection.insert_many(documents, ordered=False)
+            else:
+                await collection.bulk_write(
+                    [ReplaceOne({spec.key: document[spec.key]}, document, upsert=True) for document in documents],
+                    ordered=False
+                )
+        except BulkWriteError as e:
+            # Duplicates = documents already written by a previous (timed out) attempt
+            errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != DUPLICATE_KEY]
+            if errors:
+                logger.warning(f"Write-behind: {len(errors)} {spec.name} documents rejected: {errors[0].get('errmsg')}")
+            return [error["index"] for error in errors]
+        return []
+
+    async def _flush_collection(self, spec: CollectionSpec) -> bool:
+        """Write every pending document of a collection, batch by batch. False on failure."""
+        pending = self._pending[spec.name]
+        while pending:
+            batch = [pending.popitem(last=False) for _ in range(min(self.batch_size, len(pending)))]
+            if any(callable(document) for _, document in batch):
+                batch = await asyncio.to_thread(
+                    lambda: [(key, document() if callable(document) else document) for key, document in batch]
+                )
+            try:
+                rejected = await asyncio.wait_for(self._write(spec, [document for _, document in batch]), self.write_timeout_s)
+            except Exception as e:
+                self.failed_batches += 1
+                self._requeue(spec.name, batch)
+                logger.warning(f"Write-behind: writing {len(batch)} {spec.name} documents failed ({e!r}), retrying later")
+                return False
+            self.counters[spec.name]["written"] += len(batch) - len(rejected)
+            # Rejected documents (invalid for this collection) would fail again: not retried
+            self.counters[spec.name]["dropped"] += len(rejected)
+        return True
+
+    async def flush(self) -> bool:
+        """Write everything pending, highest priority first. False if a write failed."""
+        started = time.perf_counter()
+        ok = True
+        for spec in sorted(self.specs.values(), key=lambda s: -s.priority):
+            if not await self._flush_collection(spec):
+                ok = False
+                break
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+        self.consecutive_failures = 0 if ok else self.consecutive_failures + 1
+        return ok
+
+    async def ensure_indexes(self) -> None:
+        for spec in self.specs.values():
+            indexes = spec.all_indexes()
+            if indexes:
+                await self.db[spec.name].create_indexes(indexes)
+
+    async def _run(self) -> None:
+        try:
+            await asyncio.wait_for(self.ensure_indexes(), self.write_timeout_s)
+        except Exception as e:
+            logger.warning(f"Write-behind: index creation failed: {e!r}")
+        while True:
+            if self.consecutive_failures:
+                # MongoDB slow or down: back off, documents keep accumulating (bounded)
+                await asyncio.sleep(min(self.flush_interval_s * 2 ** self.consecutive_failures, self.max_backoff_s))
+            else:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.flush_interval_s)
+                except asyncio.TimeoutError:
+                    pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush failed: {e!r}")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout_s: float = 5.0) -> None:
+        """Stop the writer and make a last attempt to write what is pending."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.pending:
+            try:
+                await asyncio.wait_for(self.flush(), timeout_s)
+            except Exception as e:
+                logger.warning(f"Write-behind: {self.pending} documents not persisted at shutdown ({e!r})")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": {name: len(pending) for name, pending in self._pending.items()},
+            "collections": self.counters,
+            "failed_batches": self.failed_batches,
+            "consecutive_failures": self.consecutive_failures,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+        }
@@ -0,0 +1,221 @@
+"""
+Physics executor for ECOSPEED
+Runs the per-segment route physics (route_physics.route_arrays) either inline
+in the request handler or, for routes with many points, in a pool of
+pre-warmed worker processes so that long routes do not block the event loop.
+
+Offloaded routes are passed to the workers as shared-memory arrays: the
+parent writes the input geometry into one block and the worker writes the
+result columns into another, only block names and scalars are pickled.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+import profiling
+import route_physics
+
+logger = logging.getLogger(__name__)
+
+# Rows of the shared input block (length = number of points, per-segment rows padded by one)
+INPUT_ROWS = ("lat", "lon", "elevation", "speed_limit", "real_speed")
+# Rows of the shared output block (length = number of elementary segments)
+OUTPUT_ROWS = (
+    "distance", "eco_speed", "real_speed",
+    "limit_energy", "eco_energy", "real_energy",
+    "limit_time", "eco_time", "real_time",
+)
+
+
+def _init_worker() -> None:
+    """Worker initializer: import NumPy and run the physics once so the first request is warm."""
+    vehicle = SimpleNamespace(
+        empty_mass=1800.0, extra_load=150.0, drag_coefficient=0.6, rolling_resistance=0.008,
+        motor_efficiency=0.9, regen_efficiency=0.8, aux_power_kw=2.0,
+    )
+    route_physics.route_arrays(
+        [48.0, 48.001, 48.002], [2.0, 2.0, 2.0], [100.0, 101.0, 100.0], [90.0, 90.0], [85.0, 85.0], vehicle
+    )
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _physics_worker(
+    input_name: str,
+    output_name: str,
+    point_count: int,
+    vehicle: Dict[str, Any],
+    total_mass_kg: float,
+    aux_power_kw: float,
+    rho_air: float,
+) -> None:
+    """Compute route_arrays on shared-memory input and write the result columns to shared memory."""
+    input_shm = shared_memory.SharedMemory(name=input_name)
+    output_shm = shared_memory.SharedMemory(name=output_name)
+    try:
+        inputs = np.ndarray((len(INPUT_ROWS), point_count), dtype=np.float64, buffer=input_shm.buf)
+        outputs = np.ndarray((len(OUTPUT_ROWS), point_count - 1), dtype=np.float64, buffer=output_shm.buf)
+        arrays = route_physics.route_arrays(
+            inputs[0], inputs[1], inputs[2], inputs[3, :-1], inputs[4, :-1],
+            SimpleNamespace(**vehicle),
+            total_mass_kg=total_mass_kg,
+            aux_power_kw=aux_power_kw,
+            rho_air=rho_air,
+        )
+        for row, name in enumerate(OUTPUT_ROWS):
+            outputs[row] = arrays[name]
+        del inputs, outputs
+    finally:
+        input_shm.close()
+        output_shm.close()
+
+
+class PhysicsExecutor:
+    """
+    Dispatches route physics inline or to a process pool depending on the
+    number of route points.
+
+    mode: "inline" (never offload) or "process" (offload routes with at
+    least `offload_min_points` points to `workers` worker processes).
+    """
+
+    def __init__(self, mode: str = "process", workers: int = 2, offload_min_points: int = 20000):
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.offload_min_points = offload_min_points
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.inline_count = 0
+        self.offloaded_count = 0
+        self.restart_count = 0
+
+    def start(self) -> None:
+        """Create the process pool and pre-warm every worker."""
+        if self.mode != "process" or self._pool is not None:
+            return
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+        # One task per worker forces all processes to start (and run the initializer) now
+        pids = {future.result() for future in [self._pool.submit(_ping) for _ in range(self.workers)]}
+        logger.info(f"Physics executor started with {len(pids)} pre-warmed worker process(es)")
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def _restart(self, broken: ProcessPoolExecutor) -> None:
+        """Replace a broken pool (a worker died, e.g. out of memory); routes run inline meanwhile."""
+        if self._pool is not broken:
+            # Already replaced by a concurrent request
+            return
+        self._pool = None
+        self.restart_count += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+        try:
+            await asyncio.to_thread(self.start)
+        except Exception as e:
+            logger.error(f"Physics executor restart failed, computing inline: {e!r}")
+            self._pool = None
+
+    def should_offload(self, point_count: int) -> bool:
+        return self._pool is not None and point_count >= self.offload_min_points
+
+    async def route_arrays(
+        self,
+        lat,
+        lon,
+        elevation,
+        speed_limit,
+        real_speed,
+        vehicle,
+        total_mass_kg: float = None,
+        aux_power_kw: float = None,
+        rho_air: float = 1.225,
+    ) -> Dict[str, np.ndarray]:
+        """Same result as route_physics.route_arrays, possibly computed in a worker process."""
+        point_count = len(lat)
+        if self.should_offload(point_count) and profiling.current() is not None:
+            # Profiled request: in a thread of this process, where the profiler samples it
+            return await asyncio.to_thread(
+                route_physics.route_arrays, lat, lon, elevation, speed_limit, real_speed, vehicle,
+                total_mass_kg=total_mass_kg, aux_power_kw=aux_power_kw, rho_air=rho_air,
+            )
+        if not self.should_offload(point_count):
+            self.inline_count += 1
+            return route_physics.route_arrays(
+                lat, lon, elevation, speed_limit, real_speed, vehicle,
+                total_mass_kg=total_mass_kg, aux_power_kw=aux_power_kw, rho_air=rho_air,
+            )
+
+        self.offloaded_count += 1
+        pool = self._pool
+        itemsize = np.dtype(np.float64).itemsize
+        input_shm = shared_memory.SharedMemory(create=True, size=len(INPUT_ROWS) * point_count * itemsize)
+        output_shm = shared_memory.SharedMemory(create=True, size=len(OUTPUT_ROWS) * (point_count - 1) * itemsize)
+        try:
+            inputs = np.ndarray((len(INPUT_ROWS), point_count), dtype=np.float64, buffer=input_shm.buf)
+            inputs[0], inputs[1], inputs[2] = lat, lon, elevation
+            inputs[3, :-1], inputs[4, :-1] = speed_limit, real_speed
+            inputs[3:, -1] = 0.0
+            del inputs
+
+            vehicle_params = {
+                name: getattr(vehicle, name) for name in (
+                    "empty_mass", "extra_load", "drag_coefficient", "rolling_resistance",
+                    "motor_efficiency", "regen_efficiency", "aux_power_kw",
+                )
+            }
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(
+                    pool, _physics_worker,
+                    input_shm.name, output_shm.name, point_count,
+                    vehicle_params, total_mass_kg, aux_power_kw, rho_air,
+                )
+            except BrokenProcessPool:
+                logger.error("Physics worker process died: restarting the pool, computing this route in-process")
+                await self._restart(pool)
+                return await asyncio.to_thread(
+                    route_physics.route_arrays, lat, lon, elevation, speed_limit, real_speed, vehicle,
+                    total_mass_kg=total_mass_kg, aux_power_kw=aux_power_kw, rho_air=rho_air,
+                )
+
+            outputs = np.ndarray((len(OUTPUT_ROWS), point_count - 1), dtype=np.float64, buffer=output_shm.buf)
+            arrays = {name: outputs[row].copy() for row, name in enumerate(OUTPUT_ROWS)}
+            del outputs
+            return arrays
+        finally:
+            input_shm.close()
+            input_shm.unlink()
+            output_shm.close()
+            output_shm.unlink()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode if self._pool is not None else "inline",
+            "workers": self.workers if self._pool is not None else 0,
+            "offload_min_points": self.offload_min_points,
+            "inline_count": self.inline_count,
+            "offloaded_count": self.offloaded_count,
+            "restart_count": self.restart_count,
+        }
+
+
+physics_executor = PhysicsExecutor(
+    mode=os.environ.get('PHYSICS_EXECUTOR', 'process'),
+    workers=int(os.environ.get('PHYSICS_WORKERS', str(max(1, (os.cpu_count() or 2) - 1)))),
+    offload_min_points=int(os.environ.get('PHYSICS_OFFLOAD_MIN_POINTS', '20000')),
+)
@@ -0,0 +1,369 @@
+"""
+On-demand profiling of single ECOSPEED requests
+A request sent with the header `X-Profile: <PROFILE_TOKEN>` runs under a
+wall-clock sampling profiler; every other request is untouched (the
+middleware is only installed when PROFILE_TOKEN is set).
+
+- A sampler thread reads the stacks of all threads every `interval_s` and
+  keeps those working for the profiled request: the event-loop thread
+  while it runs one of the request's task steps, and the worker threads
+  running its asyncio.to_thread calls (geocoding, OpenRouteService,
+  physics, encoding). Samples are attributed through the contextvars
+  Context of the asyncio handle / thread work item on the stack, so
+  concurrent requests never pollute the profile. Blocked threads are
+  sampled too: network waits show up where they happen. When no thread
+  works for the request, the await chain of its innermost pending task
+  is sampled instead ("awaiting": rate-limit queues, process pool,
+  admission), so the samples add up to the wall-clock time of the
+  request. Tasks it creates (single-flight, gather) are tracked by a task
+  factory installed on the loop only while a request is profiled.
+- The profile covers the whole ASGI call, response serialization included,
+  and is stored (in process and in the shared cache) under a profile id
+  returned in the `X-Profile-Id` header and under the route_id of the
+  request (path or response body), as speedscope JSON or collapsed stacks
+  (flamegraph.pl, inferno), fetched with GET /api/profiles/{id}. Physics
+  that would run in the worker processes runs in a thread for a profiled
+  request, so that it is sampled.
+- Guard: one profiled request at a time per process, at most
+  `max_per_minute`, each sampled for at most `max_duration_s`; beyond,
+  the request runs unprofiled (`X-Profile-Id: rate-limited`).
+
+Attribution relies on the pure-Python handles of the standard asyncio
+event loop (uvicorn's default without uvloop).
+"""
+import asyncio
+import concurrent.futures.thread
+import contextvars
+import hmac
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from shared_cache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_INTERVAL_MS = max(1.0, float(os.environ.get('PROFILE_INTERVAL_MS', '2')))
+PROFILE_MAX_PER_MINUTE = int(os.environ.get('PROFILE_MAX_PER_MINUTE', '6'))
+PROFILE_MAX_DURATION_S = float(os.environ.get('PROFILE_MAX_DURATION_S', '30'))
+PROFILE_TTL_S = 86400
+PROFILE_FORMATS = ("speedscope", "collapsed", "summary")
+MAX_STORED_PROFILES = 32
+MAX_STACK_DEPTH = 128
+
+# Functions whose samples are summed per phase in the profile summary
+PHASES = {
+    "geocode": ("_geocode",),
+    "ors": ("_post_json",),
+    "physics": ("route_arrays",),
+    "serialization": ("serialize_response", "jsonable_encoder", "render"),
+}
+
+_ROUTE_PATH = re.compile(r"/api/route/([^/]+)")
+_HANDLE_RUN = asyncio.events.Handle._run.__code__
+_WORK_ITEM_RUN = concurrent.futures.thread._WorkItem.run.__code__
+
+_active: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar("active_profile", default=None)
+
+
+def current() -> Optional["RequestProfile"]:
+    """Profile of the request being handled, if it is profiled."""
+    return _active.get()
+
+
+def _frame_context(frame) -> Optional[contextvars.Context]:
+    """Context of the asyncio handle or to_thread work item being run on a thread stack."""
+    depth = 0
+    while frame is not None and depth < MAX_STACK_DEPTH:
+        code = frame.f_code
+        if code is _HANDLE_RUN:
+            return getattr(frame.f_locals.get("self"), "_context", None)
+        if code is _WORK_ITEM_RUN:
+            fn = getattr(frame.f_locals.get("self"), "fn", None)
+            # asyncio.to_thread submits functools.partial(context.run, func, ...)
+            run = getattr(fn, "func", None)
+            owner = getattr(run, "__self__", None)
+            return owner if isinstance(owner, contextvars.Context) else None
+        frame = frame.f_back
+        depth += 1
+    return None
+
+
+def _task_factory(loop, coro, context=None):
+    """Loop task factory while a request is profiled: records the tasks created on its behalf."""
+    task = asyncio.Task(coro, loop=loop, context=context)
+    profile = (context if context is not None else contextvars.copy_context()).get(_active)
+    if profile is not None:
+        profile.tasks.append(task)
+    return task
+
+
+def _await_stack(coro) -> Tuple[Tuple[str, str, int], ...]:
+    """Frames of a suspended coroutine chain, outermost first, ending with the awaited object."""
+    frames = []
+    while coro is not None and len(frames) < MAX_STACK_DEPTH:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            frames.append((f"<{type(coro).__name__}>", "", 0))
+            break
+        code = frame.f_code
+        frames.append((code.co_qualname, code.co_filename, code.co_firstlineno))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return tuple(frames)
+
+
+def _stack(frame) -> Tuple[Tuple[str, str, int], ...]:
+    """(function, file, first line) of every frame, root first."""
+    frames = []
+    while frame is not None and len(frames) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        frames.append((code.co_qualname, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    frames.reverse()
+    return tuple(frames)
+
+
+class RequestProfile:
+    """Stack samples of one request, taken by a sampler thread."""
+
+    def __init__(self, method: str, path: str, interval_s: float, max_duration_s: float):
+        self.profile_id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.interval_s = interval_s
+        self.max_duration_s = max_duration_s
+        self.route_id: Optional[str] = None
+        self.status: Optional[int] = None
+        self.samples: Counter = Counter()
+        self.tasks: List[asyncio.Task] = []
+        self.started_at = time.time()
+        self.duration_s = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, task: asyncio.Task) -> None:
+        self.tasks.append(task)
+        self._loop_thread = threading.get_ident()
+        self._thread = threading.Thread(target=self._sample, name=f"profiler-{self.profile_id}", daemon=True)
+        self._started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration_s = time.perf_counter() - self._started
+
+    def _sample(self) -> None:
+        me = threading.get_ident()
+        deadline = time.perf_counter() + self.max_duration_s
+        while not self._stop.wait(self.interval_s) and time.perf_counter() < deadline:
+            working = False
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                context = _frame_context(frame)
+                if context is None or context.get(_active) is not self:
+                    continue
+                root = "event loop" if thread_id == self._loop_thread else "worker thread"
+                self.samples[(root, _stack(frame))] += 1
+                working = True
+            if not working and not self.tasks[0].done():
+                # Root task, then the most recent of its pending sub-tasks
+                stack = _await_stack(self.tasks[0].get_coro())
+                inner = next((task for task in reversed(self.tasks[1:]) if not task.done()), None)
+                if inner is not None:
+                    stack += _await_stack(inner.get_coro())
+                self.samples[("awaiting", stack)] += 1
+
+    def phases_ms(self) -> Dict[str, float]:
+        totals = dict.fromkeys(PHASES, 0)
+        for (_, stack), count in self.samples.items():
+            # Qualified names: "_geocode.<locals>.lookup" counts for _geocode
+            names = {part for name, _, _ in stack for part in name.split(".")}
+            for phase, functions in PHASES.items():
+                if names.intersection(functions):
+                    totals[phase] += count
+        return {phase: round(count * self.interval_s * 1000, 1) for phase, count in totals.items()}
+
+    def collapsed(self) -> str:
+        """Collapsed stacks: `root;frame;frame count` per line (flamegraph.pl / inferno / speedscope)."""
+        lines = []
+        for (root, stack), count in self.samples.most_common():
+            names = [f"{name} ({os.path.basename(filename)}:{line})" for name, filename, line in stack]
+            lines.append(";".join([root, *names]) + f" {count}")
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self) -> Dict[str, Any]:
+        """speedscope file format: one sampled profile per thread kind, weights in milliseconds."""
+        frames: List[Dict[str, Any]] = []
+        frame_index: Dict[Tuple[str, str, int], int] = {}
+        profiles: Dict[str, Dict[str, Any]] = {}
+        for (root, stack), count in self.samples.items():
+            indices = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                indices.append(frame_index[frame])
+            profile = profiles.setdefault(root, {
+                "type": "sampled", "name": f"{self.method} {self.path} ({root})", "unit": "milliseconds",
+                "startValue": 0, "endValue": round(self.duration_s * 1000, 3), "samples": [], "weights": [],
+            })
+            profile["samples"].append(indices)
+            profile["weights"].append(round(count * self.interval_s * 1000, 3))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.method} {self.path}",
+            "exporter": "ecospeed",
+            "shared": {"frames": frames},
+            "profiles": list(profiles.values()),
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "profile_id": self.profile_id,
+            "route_id": self.route_id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_s * 1000, 1),
+            "interval_ms": self.interval_s * 1000,
+            "samples": sum(self.samples.values()),
+            "phases_ms": self.phases_ms(),
+        }
+
+    def export(self) -> Dict[str, Any]:
+        """Stored form: summary and both renderings."""
+        return {**self.summary(), "speedscope": self.speedscope(), "collapsed": self.collapsed()}
+
+
+class ProfileGuard:
+    """At most one profiled request at a time and `max_per_minute` per process."""
+
+    def __init__(self, max_per_minute: int):
+        self.max_per_minute = max_per_minute
+        self._starts: Deque[float] = deque()
+        self.running = False
+        self.counters = {"profiled": 0, "rate_limited": 0}
+
+    def try_start(self) -> bool:
+        now = time.monotonic()
+        while self._starts and now - self._starts[0] > 60:
+            self._starts.popleft()
+        if self.running or len(self._starts) >= self.max_per_minute:
+            self.counters["rate_limited"] += 1
+            return False
+        self._starts.append(now)
+        self.running = True
+        self.counters["profiled"] += 1
+        return True
+
+    def done(self) -> None:
+        self.running = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": bool(PROFILE_TOKEN), "running": self.running, **self.counters}
+
+
+class ProfileStore:
+    """Recent profiles by profile id and route_id, in process and in the shared cache (other workers)."""
+
+    def __init__(self, max_entries: int = MAX_STORED_PROFILES):
+        self.max_entries = max_entries
+        self._profiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def put(self, profile: Dict[str, Any]) -> None:
+        keys = [profile["profile_id"]] + ([profile["route_id"]] if profile["route_id"] else [])
+        for key in keys:
+            self._profiles[key] = profile
+            self._profiles.move_to_end(key)
+            shared_cache.set("profile", key, profile, PROFILE_TTL_S)
+        while len(self._profiles) > self.max_entries:
+            self._profiles.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        profile = self._profiles.get(key)
+        return profile if profile is not None else shared_cache.get("profile", key)
+
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(PROFILE_TOKEN) and token is not None and hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling the requests carrying a valid X-Profile token."""
+
+    def __init__(self, app, store: ProfileStore, guard: ProfileGuard):
+        self.app = app
+        self.store = store
+        self.guard = guard
+
+    async def __call__(self, scope, receive, send):
+        # Fetching a stored profile (same header) is never profiled itself
+        if scope["type"] != "http" or scope["path"].startswith("/api/profiles/"):
+            return await self.app(scope, receive, send)
+        token = next((value.decode("latin-1") for name, value in scope["headers"] if name == b"x-profile"), None)
+        if token is None or not is_admin(token):
+            return await self.app(scope, receive, send)
+        if not self.guard.try_start():
+            return await self.app(scope, receive, self._with_header(send, "rate-limited"))
+
+        profile = RequestProfile(scope["method"], scope["path"], PROFILE_INTERVAL_MS / 1000, PROFILE_MAX_DURATION_S)
+        match = _ROUTE_PATH.match(scope["path"])
+        profile.route_id = match.group(1) if match else None
+        body: List[bytes] = []
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+            elif message["type"] == "http.response.body" and profile.route_id is None:
+                body.append(message.get("body", b""))
+            await send(message)
+
+        loop = asyncio.get_running_loop()
+        previous_factory = loop.get_task_factory()
+        if previous_factory is None:
+            loop.set_task_factory(_task_factory)
+        token_var = _active.set(profile)
+        profile.start(asyncio.current_task())
+        try:
+            await self.app(scope, receive, self._with_header(send_wrapper, profile.profile_id))
+        finally:
+            profile.stop()
+            _active.reset(token_var)
+            if previous_factory is None:
+                loop.set_task_factory(None)
+            self.guard.done()
+            # After the response: the client is not kept waiting by the encoding
+            await asyncio.to_thread(self._store, profile, body)
+
+    def _store(self, profile: RequestProfile, body: List[bytes]) -> None:
+        if profile.route_id is None and body:
+            try:
+                profile.route_id = json.loads(b"".join(body)).get("route_id")
+            except (ValueError, AttributeError):
+                pass
+        self.store.put(profile.export())
+        logger.info(f"Profiled {profile.method} {profile.path}: {profile.summary()}")
+
+    @staticmethod
+    def _with_header(send, profile_id: str):
+        async def wrapped(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]}
+            await send(message)
+        return wrapped
+
+
+profile_store = ProfileStore()
+profile_guard = ProfileGuard(PROFILE_MAX_PER_MINUTE)
@@ -0,0 +1,493 @@
+"""
+Energy reachability for ECOSPEED
+"Where can I get from here with 40% battery?" answered by one energy-bounded
+one-to-many search (Dijkstra on energy) instead of one route per destination.
+
+The search runs on a compact road graph whose nodes are grid cells of
+GRAPH_CELL_DEG degrees (~2 km): an edge links two cells connected by a road,
+with its length and speed limit (OSM maxspeed or road-type default). The
+graph is built offline from a local OSM extract, like the speed-limit table,
+stored as CSR arrays (.npy) and memory-mapped:
+    python reachability.py build france-latest.osm.bz2 data/road_graph
+(ROAD_GRAPH_PATH, default data/road_graph). Without it, a regular lattice of
+LATTICE_CELL_DEG cells around the origin with a road detour factor is used.
+
+Edge energies are evaluated for a vehicle with the vectorized physics of
+route_physics (eco speed on flat ground, OSM extracts have no elevation) and
+clamped at zero, so the search never counts on regeneration. Results are
+cached per (origin cell, vehicle class, state-of-charge bucket).
+"""
+import heapq
+import logging
+import math
+import os
+import sys
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from route_physics import EARTH_RADIUS_M, VehiclePhysicsContext
+from speed_limits import ROAD_CLASSES, default_limits, open_osm, parse_maxspeed
+from urban_zones import classify_urban
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROAD_GRAPH_PATH = Path(__file__).parent / "data" / "road_graph"
+GRAPH_CELL_DEG = 0.02  # OSM graph cells (~2.2 km in latitude)
+LATTICE_CELL_DEG = 0.05  # Fallback lattice cells (~5.5 km in latitude)
+LATTICE_DETOUR_FACTOR = 1.3  # Road distance / straight-line distance
+LATTICE_SPEED_KMH = 80.0
+MAX_RADIUS_KM = 500.0
+MAX_SNAP_KM = 10.0  # Maximum distance between the origin and the graph
+SOC_BUCKET_PCT = 5.0  # Battery levels are rounded down to buckets of this size
+POLYGON_SECTORS = 72
+
+
+def _cell_indices(lat, lon, cell_deg: float) -> Tuple[np.ndarray, np.ndarray]:
+    lat_q = np.floor((np.asarray(lat, dtype=np.float64) + 90.0) / cell_deg).astype(np.int64)
+    lon_q = np.floor((np.asarray(lon, dtype=np.float64) + 180.0) / cell_deg).astype(np.int64)
+    return lat_q, lon_q
+
+
+def grid_keys(lat, lon, cell_deg: float) -> np.ndarray:
+    """int64 keys of the grid cells containing the points."""
+    lat_q, lon_q = _cell_indices(lat, lon, cell_deg)
+    return (lat_q << 32) | lon_q
+
+
+def _haversine(lat1, lon1, lat2, lon2) -> np.ndarray:
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+# ============================================================================
+# CELL ROAD GRAPH
+# ============================================================================
+
+class RoadGraph:
+    """Directed graph of grid cells in CSR form (edges of node i: indptr[i]:indptr[i + 1])."""
+
+    def __init__(self, keys, indptr, targets, distance, speed_limit, cell_deg: float, source: str = "osm"):
+        self.keys = keys  # (N,) sorted cell keys
+        self.indptr = indptr  # (N + 1,) int64
+        self.targets = targets  # (E,) int32 target node of each edge
+        self.distance = distance  # (E,) float32 meters
+        self.speed_limit = speed_limit  # (E,) uint8 km/h
+        self.cell_deg = cell_deg
+        self.source = source
+        lat_q, lon_q = np.asarray(keys) >> 32, np.asarray(keys) & 0xFFFFFFFF
+        self.lat = (lat_q + 0.5) * cell_deg - 90.0
+        self.lon = (lon_q + 0.5) * cell_deg - 180.0
+        self._adjacency: Optional[Tuple[List[int], List[int]]] = None
+        self._costs: "OrderedDict[Tuple, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path) -> "RoadGraph":
+        path = Path(path)
+        arrays = {name: np.load(path / f"{name}.npy", mmap_mode="r")
+                  for name in ("keys", "indptr", "targets", "distance", "speed_limit")}
+        return cls(**arrays, cell_deg=float(np.load(path / "cell_deg.npy")))
+
+    def save(self, path) -> None:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in ("keys", "indptr", "targets", "distance", "speed_limit"):
+            np.save(path / f"{name}.npy", np.ascontiguousarray(getattr(self, name)))
+        np.save(path / "cell_deg.npy", np.array(self.cell_deg))
+
+    @classmethod
+    def from_edges(cls, source_keys, target_keys, distance, speed_limit, cell_deg: float, source: str = "osm") -> "RoadGraph":
+        """Graph from edge arrays; parallel edges with the same limit keep the shortest one."""
+        order = np.lexsort((distance, speed_limit, target_keys, source_keys))
+        source_keys, target_keys = source_keys[order], target_keys[order]
+        distance, speed_limit = distance[order], speed_limit[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = ((source_keys[1:] != source_keys[:-1]) | (target_keys[1:] != target_keys[:-1])
+                     | (speed_limit[1:] != speed_limit[:-1]))
+        source_keys, target_keys = source_keys[first], target_keys[first]
+        distance, speed_limit = distance[first], speed_limit[first]
+
+        keys = np.unique(np.concatenate([source_keys, target_keys]))
+        sources = np.searchsorted(keys, source_keys)
+        indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(keys)), out=indptr[1:])
+        return cls(
+            keys,
+            indptr,
+            np.searchsorted(keys, target_keys).astype(np.int32),
+            distance.astype(np.float32),
+            np.clip(np.round(speed_limit), 1, 250).astype(np.uint8),
+            cell_deg,
+            source,
+        )
+
+    @classmethod
+    def lattice(cls, lat: float, lon: float, radius_km: float, cell_deg: float = LATTICE_CELL_DEG) -> "RoadGraph":
+        """Regular 8-connected lattice of the cells within radius_km of a point (no road data)."""
+        lat_q0, lon_q0 = (int(v) for v in _cell_indices(lat, lon, cell_deg))
+        span_lat = int(math.ceil(radius_km / 111.32 / cell_deg)) + 1
+        span_lon = int(math.ceil(radius_km / (111.32 * max(math.cos(math.radians(lat)), 0.1)) / cell_deg)) + 1
+        lat_q, lon_q = np.meshgrid(np.arange(lat_q0 - span_lat, lat_q0 + span_lat + 1),
+                                   np.arange(lon_q0 - span_lon, lon_q0 + span_lon + 1), indexing="ij")
+        lat_q, lon_q = lat_q.ravel(), lon_q.ravel()
+        center_lat = (lat_q + 0.5) * cell_deg - 90.0
+        center_lon = (lon_q + 0.5) * cell_deg - 180.0
+        inside = _haversine(lat, lon, center_lat, center_lon) <= radius_km * 1000
+        lat_q, lon_q = lat_q[inside], lon_q[inside]
+        keys = (lat_q << 32) | lon_q
+
+        sources, targets = [], []
+        for d_lat in (-1, 0, 1):
+            for d_lon in (-1, 0, 1):
+                if d_lat or d_lon:
+                    neighbour = ((lat_q + d_lat) << 32) | (lon_q + d_lon)
+                    exists = np.isin(neighbour, keys)
+                    sources.append(keys[exists])
+                    targets.append(neighbour[exists])
+        source_keys, target_keys = np.concatenate(sources), np.concatenate(targets)
+        to_lat = lambda k: ((k >> 32) + 0.5) * cell_deg - 90.0  # noqa: E731
+        to_lon = lambda k: ((k & 0xFFFFFFFF) + 0.5) * cell_deg - 180.0  # noqa: E731
+        distance = _haversine(to_lat(source_keys), to_lon(source_keys), to_lat(target_keys), to_lon(target_keys))
+        return cls.from_edges(
+            source_keys, target_keys, distance * LATTICE_DETOUR_FACTOR,
+            np.full(len(source_keys), LATTICE_SPEED_KMH), cell_deg, source="lattice"
+        )
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def adjacency(self) -> Tuple[List[int], List[int]]:
+        """CSR arrays as Python lists (fast scalar access in the search loop), built once."""
+        if self._adjacency is None:
+            self._adjacency = (np.asarray(self.indptr).tolist(), np.asarray(self.targets).tolist())
+        return self._adjacency
+
+    def edge_costs(self, context: VehiclePhysicsContext, user_max_speed: float) -> List[float]:
+        """Energy (kWh, >= 0) of every edge at the eco speed, cached for the last few vehicle classes."""
+        key = (vehicle_class(context), user_max_speed)
+        with self._lock:
+            if key in self._costs:
+                self._costs.move_to_end(key)
+                return self._costs[key]
+        limit = np.minimum(np.asarray(self.speed_limit, dtype=np.float64), user_max_speed)
+        slope = np.zeros(len(limit))
+        energy = context.energy(context.eco_speeds(limit, slope), np.asarray(self.distance, dtype=np.float64), slope)
+        costs = np.maximum(energy, 0.0).tolist()
+        with self._lock:
+            self._costs[key] = costs
+            while len(self._costs) > 8:
+                self._costs.popitem(last=False)
+        return costs
+
+    def nearest_node(self, lat: float, lon: float) -> Optional[int]:
+        """Node of the cell containing the point, else the closest node within MAX_SNAP_KM."""
+        key = int(grid_keys(lat, lon, self.cell_deg))
+        slot = int(np.searchsorted(self.keys, key))
+        if slot < len(self.keys) and self.keys[slot] == key:
+            return slot
+        if not len(self.keys):
+            return None
+        distance = _haversine(lat, lon, self.lat, self.lon)
+        nearest = int(np.argmin(distance))
+        return nearest if distance[nearest] <= MAX_SNAP_KM * 1000 else None
+
+
+def energy_search(graph: RoadGraph, costs: List[float], origin: int, budget_kwh: float) -> Dict[int, float]:
+    """Minimum energy (kWh) from origin to every node reachable within budget_kwh (Dijkstra)."""
+    indptr, targets = graph.adjacency()
+    best = {origin: 0.0}
+    heap = [(0.0, origin)]
+    while heap:
+        energy, node = heapq.heappop(heap)
+        if energy > best[node]:
+            continue
+        for edge in range(indptr[node], indptr[node + 1]):
+            candidate = energy + costs[edge]
+            target = targets[edge]
+            if candidate <= budget_kwh and candidate < best.get(target, math.inf):
+                best[target] = candidate
+                heapq.heappush(heap, (candidate, target))
+    return best
+
+
+# ============================================================================
+# REACHABLE AREA
+# ============================================================================
+
+def vehicle_class(context: VehiclePhysicsContext) -> Tuple[float, ...]:
+    """Rounded physics parameters: vehicles (and loads) within ~0.5% share cached results."""
+    return tuple(float(f"{value:.3g}") for value in (
+        context.gravity_force, context.rolling_force, context.aero_coefficient,
+        context.inv_motor_efficiency, context.aux_power_w,
+    ))
+
+
+def soc_bucket(battery_pct: float) -> float:
+    """Battery level rounded down to SOC_BUCKET_PCT (never overstates the range)."""
+    return math.floor(battery_pct / SOC_BUCKET_PCT) * SOC_BUCKET_PCT
+
+
+@dataclass(frozen=True)
+class ReachableArea:
+    """Cells reachable from an origin with the remaining energy at each of them."""
+    source: str  # "osm" or "lattice"
+    cell_deg: float
+    origin_lat: float
+    origin_lon: float
+    usable_kwh: float
+    battery_pct: float  # Battery bucket the area was computed for
+    budget_kwh: float
+    keys: np.ndarray  # (M,) sorted cell keys
+    lat: np.ndarray  # (M,) cell centers
+    lon: np.ndarray
+    energy: np.ndarray  # (M,) kWh used to reach each cell
+
+    def battery_at(self, energy_kwh) -> np.ndarray:
+        return self.battery_pct - np.asarray(energy_kwh) / self.usable_kwh * 100
+
+    def locate(self, lat, lon) -> np.ndarray:
+        """Energy needed to reach each point's cell, NaN where it is out of reach."""
+        keys = grid_keys(lat, lon, self.cell_deg)
+        result = np.full(len(keys), np.nan)
+        if not len(self.keys):
+            return result
+        slot = np.searchsorted(self.keys, keys).clip(max=len(self.keys) - 1)
+        found = self.keys[slot] == keys
+        result[found] = self.energy[slot[found]]
+        return result
+
+    def polygon(self, sectors: int = POLYGON_SECTORS) -> List[List[float]]:
+        """
+        Star-shaped outline: in each angular sector around the origin, the
+        farthest reachable cell (plus half a cell). Closed [lat, lon] ring.
+        """
+        cos_lat = math.cos(math.radians(self.origin_lat))
+        north_km = (self.lat - self.origin_lat) * 111.32
+        east_km = (self.lon - self.origin_lon) * 111.32 * cos_lat
+        sector = ((np.arctan2(east_km, north_km) % (2 * math.pi)) / (2 * math.pi) * sectors).astype(np.int64) % sectors
+        reach_km = np.zeros(sectors)
+        np.maximum.at(reach_km, sector, np.hypot(north_km, east_km))
+        reach_km += self.cell_deg * 111.32 / 2
+        bearings = (np.arange(sectors) + 0.5) * 2 * math.pi / sectors
+        ring = [[round(self.origin_lat + r * math.cos(b) / 111.32, 5),
+                 round(self.origin_lon + r * math.sin(b) / (111.32 * cos_lat), 5)]
+                for r, b in zip(reach_km.tolist(), bearings.tolist())]
+        return ring + ring[:1]
+
+
+def reachable_area(
+    context: VehiclePhysicsContext,
+    usable_kwh: float,
+    lat: float,
+    lon: float,
+    battery_pct: float,
+    reserve_pct: float = 0.0,
+    user_max_speed: float = 130,
+    graph: Optional[RoadGraph] = None,
+) -> ReachableArea:
+    """
+    Cells reachable from (lat, lon) before the battery drops to reserve_pct,
+    on the OSM graph (graph or get_road_graph()) or a lattice around the origin.
+    ValueError if the origin is too far from the graph.
+    """
+    bucket = soc_bucket(battery_pct)
+    budget_kwh = max(bucket - reserve_pct, 0.0) / 100 * usable_kwh
+    graph = graph or get_road_graph()
+    if graph is None:
+        # Lattice as large as the budget allows on flat ground at the lattice speed
+        slope = np.zeros(1)
+        per_km = float(context.energy(context.eco_speeds(np.array([LATTICE_SPEED_KMH]), slope), np.array([1000.0]), slope)[0])
+        radius_km = min(budget_kwh / max(per_km, 1e-6) / LATTICE_DETOUR_FACTOR, MAX_RADIUS_KM) + LATTICE_CELL_DEG * 111.32
+        graph = RoadGraph.lattice(lat, lon, radius_km)
+    origin = graph.nearest_node(lat, lon)
+    if origin is None:
+        raise ValueError(f"No road within {MAX_SNAP_KM:g} km of ({lat}, {lon})")
+
+    best = energy_search(graph, graph.edge_costs(context, user_max_speed), origin, budget_kwh)
+    nodes = np.fromiter(best.keys(), dtype=np.int64, count=len(best))
+    energy = np.fromiter(best.values(), dtype=np.float64, count=len(best))
+    order = np.argsort(nodes)  # Node order = key order
+    nodes, energy = nodes[order], energy[order]
+    return ReachableArea(
+        source=graph.source,
+        cell_deg=graph.cell_deg,
+        origin_lat=lat,
+        origin_lon=lon,
+        usable_kwh=usable_kwh,
+        battery_pct=bucket,
+        budget_kwh=budget_kwh,
+        keys=np.asarray(graph.keys)[nodes],
+        lat=graph.lat[nodes],
+        lon=graph.lon[nodes],
+        energy=energy,
+    )
+
+
+class ReachabilityCache:
+    """LRU cache of ReachableArea by (origin cell, vehicle class, SoC bucket, ...) key."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._areas: "OrderedDict[Tuple, ReachableArea]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(context: VehiclePhysicsContext, usable_kwh: float, lat: float, lon: float, battery_pct: float,
+            reserve_pct: float, user_max_speed: float) -> Tuple:
+        graph = get_road_graph()
+        cell_deg = graph.cell_deg if graph is not None else LATTICE_CELL_DEG
+        return (int(grid_keys(lat, lon, cell_deg)), vehicle_class(context), round(usable_kwh, 1),
+                soc_bucket(battery_pct), reserve_pct, user_max_speed)
+
+    def get(self, key: Tuple) -> Optional[ReachableArea]:
+        with self._lock:
+            area = self._areas.get(key)
+            if area is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._areas.move_to_end(key)
+            return area
+
+    def put(self, key: Tuple, area: ReachableArea) -> None:
+        with self._lock:
+            self._areas[key] = area
+            self._areas.move_to_end(key)
+            while len(self._areas) > self.max_entries:
+                self._areas.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._areas), "hits": self.hits, "misses": self.misses}
+
+
+reachability_cache = ReachabilityCache(int(os.environ.get('REACHABILITY_CACHE_SIZE', '256')))
+
+
+# ============================================================================
+# GRAPH BUILD (OFFLINE)
+# ============================================================================
+
+def build_graph(osm_path, cell_deg: float = GRAPH_CELL_DEG) -> RoadGraph:
+    """
+    Build the cell graph from an OSM XML extract in two streaming passes
+    (ways with a highway tag, then the coordinates of their nodes). Along
+    every way, each change of cell adds an edge whose length is the road
+    length since the way entered the previous cell; one-way roads only get
+    the forward (or reverse, oneway=-1) edge.
+    """
+    ways: List[Tuple[List[int], int, Optional[int], int]] = []
+    needed = set()
+    with open_osm(osm_path) as f:
+        for _, elem in ET.iterparse(f, events=("end",)):
+            if elem.tag == "way":
+                tags = {tag.get("k"): tag.get("v") for tag in elem.iter("tag")}
+                road_class = ROAD_CLASSES.get(tags.get("highway", ""))
+                if road_class:
+                    oneway = tags.get("oneway", "")
+                    if oneway in ("yes", "true", "1") or (
+                            oneway != "no" and (tags.get("highway") == "motorway" or tags.get("junction") == "roundabout")):
+                        direction = 1
+                    else:
+                        direction = -1 if oneway == "-1" else 0
+                    limit = parse_maxspeed(tags["maxspeed"]) if "maxspeed" in tags else None
+                    refs = [int(nd.get("ref")) for nd in elem.iter("nd")]
+                    ways.append((refs, road_class, limit, direction))
+                    needed.update(refs)
+            if elem.tag in ("node", "way", "relation"):
+                elem.clear()
+    logger.info(f"{len(ways)} road ways, {len(needed)} nodes")
+
+    coords: Dict[int, Tuple[float, float]] = {}
+    with open_osm(osm_path) as f:
+        for _, elem in ET.iterparse(f, events=("end",)):
+            if elem.tag == "node":
+                node_id = int(elem.get("id"))
+                if node_id in needed:
+                    coords[node_id] = (float(elem.get("lat")), float(elem.get("lon")))
+            if elem.tag in ("node", "way", "relation"):
+                elem.clear()
+
+    # Way segments as arrays
+    lat1, lon1, lat2, lon2, way_ids, classes, limits, directions = [], [], [], [], [], [], [], []
+    for way_id, (refs, road_class, limit, direction) in enumerate(ways):
+        points = [coords[ref] for ref in refs if ref in coords]
+        for (a_lat, a_lon), (b_lat, b_lon) in zip(points[:-1], points[1:]):
+            lat1.append(a_lat)
+            lon1.append(a_lon)
+            lat2.append(b_lat)
+            lon2.append(b_lon)
+            way_ids.append(way_id)
+            classes.append(road_class)
+            limits.append(limit if limit else np.nan)
+            directions.append(direction)
+    lat1, lon1, lat2, lon2 = map(np.asarray, (lat1, lon1, lat2, lon2))
+    way_ids, classes = np.asarray(way_ids, dtype=np.int64), np.asarray(classes, dtype=np.int64)
+    limits, directions = np.asarray(limits, dtype=np.float64), np.asarray(directions, dtype=np.int64)
+    if not len(lat1):
+        raise ValueError("No road segments in the extract")
+
+    # Missing maxspeed: road-type defaults, urban where the urban dataset says so
+    is_urban = classify_urban((lat1 + lat2) / 2, (lon1 + lon2) / 2)
+    defaults = default_limits(classes, is_urban if is_urban is not None else np.zeros(len(classes), dtype=bool))
+    limits = np.where(np.isnan(limits), defaults, limits)
+
+    # Cell changes; the edge length is the way length since the previous change (or the way start)
+    length = _haversine(lat1, lon1, lat2, lon2)
+    cumulative = np.cumsum(length)
+    cell_a, cell_b = grid_keys(lat1, lon1, cell_deg), grid_keys(lat2, lon2, cell_deg)
+    index = np.arange(len(length))
+    changed = cell_a != cell_b
+    way_start = np.concatenate(([True], way_ids[1:] != way_ids[:-1]))
+    # First segment of the current cell run: way start or segment after a cell change
+    run_start = way_start | np.concatenate(([False], changed[:-1]))
+    run_start = np.maximum.accumulate(np.where(run_start, index, 0))
+    changes = np.flatnonzero(changed)
+    first = run_start[changes]
+    edge_length = cumulative[changes] - (cumulative[first] - length[first])
+
+    forward = directions[changes] >= 0
+    backward = directions[changes] <= 0
+    return RoadGraph.from_edges(
+        np.concatenate([cell_a[changes][forward], cell_b[changes][backward]]),
+        np.concatenate([cell_b[changes][forward], cell_a[changes][backward]]),
+        np.concatenate([edge_length[forward], edge_length[backward]]),
+        np.concatenate([limits[changes][forward], limits[changes][backward]]),
+        cell_deg,
+    )
+
+
+_graph: Optional[RoadGraph] = None
+_graph_loaded = False
+
+
+def get_road_graph() -> Optional[RoadGraph]:
+    """Memory-map the OSM cell graph once (None if it has not been built)."""
+    global _graph, _graph_loaded
+    if not _graph_loaded:
+        _graph_loaded = True
+        path = os.environ.get('ROAD_GRAPH_PATH') or DEFAULT_ROAD_GRAPH_PATH
+        try:
+            _graph = RoadGraph.load(path)
+            logger.info(f"Loaded road graph with {len(_graph)} cells from {path}")
+        except (OSError, ValueError) as e:
+            logger.info(f"No road graph at {path} ({e}), reachability uses a lattice")
+    return _graph
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "build":
+        print("Usage: python reachability.py build <extract.osm[.gz|.bz2]> <output_dir>")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO)
+    graph = build_graph(sys.argv[2])
+    graph.save(sys.argv[3])
+    print(f"Saved {len(graph)} cells, {len(graph.targets)} edges to {sys.argv[3]}")
@@ -0,0 +1,216 @@
+"""
+Columnar export of persisted routes for ECOSPEED analytics
+Streams the elementary segments of the routes persisted in MongoDB (the
+`routes` collection of the write-behind queue) as one flat table, one row
+per merged segment with its route id, date and vehicle:
+
+- Arrow IPC stream or Parquet (one record batch / row group per chunk),
+  when the optional pyarrow package is installed (pip install pyarrow)
+- CSV otherwise, or on request
+
+Memory stays bounded whatever the number of routes: documents are read
+from a MongoDB cursor in small batches, converted to NumPy columns and
+encoded every `chunk_rows` rows, and each encoded chunk is sent before the
+next one is built.
+"""
+import asyncio
+import io
+import logging
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:  # Optional: CSV export only
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("arrow", "parquet", "csv")
+MEDIA_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+    "csv": "text/csv; charset=utf-8",
+}
+EXTENSIONS = {"arrow": "arrows", "parquet": "parquet", "csv": "csv"}
+DEFAULT_CHUNK_ROWS = 65536
+CURSOR_BATCH_SIZE = 50  # Route documents per MongoDB batch (~100 kB each)
+
+# Segment fields (RouteResponse.segments), all exported as float64 except the index
+SEGMENT_FIELDS = (
+    "distance", "elevation_start", "elevation_end",
+    "speed_limit", "eco_speed", "real_speed",
+    "limit_energy", "eco_energy", "real_energy",
+    "limit_time", "eco_time", "real_time",
+    "lat_start", "lon_start", "lat_end", "lon_end",
+)
+COLUMNS = ("route_id", "created_at", "vehicle", "segment_index") + SEGMENT_FIELDS
+
+EXPORT_PROJECTION = {
+    "_id": 0,
+    "route_id": 1,
+    "created_at": 1,
+    "request.vehicle_profile.name": 1,
+    "response.segments": 1,
+}
+
+
+def arrow_available() -> bool:
+    return pa is not None
+
+
+def export_query(
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    vehicle: Optional[str] = None,
+    min_distance_km: Optional[float] = None,
+    max_distance_km: Optional[float] = None,
+) -> Dict[str, Any]:
+    """MongoDB filter of the routes to export (dates on created_at, distance on total_distance)."""
+    query: Dict[str, Any] = {}
+    if start_date is not None or end_date is not None:
+        query["created_at"] = {}
+        if start_date is not None:
+            query["created_at"]["$gte"] = start_date
+        if end_date is not None:
+            query["created_at"]["$lt"] = end_date
+    if vehicle:
+        query["request.vehicle_profile.name"] = vehicle
+    if min_distance_km is not None or max_distance_km is not None:
+        query["total_distance"] = {}
+        if min_distance_km is not None:
+            query["total_distance"]["$gte"] = min_distance_km
+        if max_distance_km is not None:
+            query["total_distance"]["$lte"] = max_distance_km
+    return query
+
+
+def route_columns(document: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    """Columns of the segments of one persisted route."""
+    segments = (document.get("response") or {}).get("segments") or []
+    n = len(segments)
+    vehicle = ((document.get("request") or {}).get("vehicle_profile") or {}).get("name", "")
+    created_at = document.get("created_at")
+    columns = {
+        "route_id": np.full(n, document.get("route_id", ""), dtype=object),
+        "created_at": np.full(n, np.datetime64(created_at.replace(tzinfo=None), "ms") if created_at else np.datetime64("NaT", "ms")),
+        "vehicle": np.full(n, vehicle, dtype=object),
+        "segment_index": np.fromiter((s.get("index", k) for k, s in enumerate(segments)), dtype=np.int32, count=n),
+    }
+    for name in SEGMENT_FIELDS:
+        columns[name] = np.fromiter((s.get(name, np.nan) for s in segments), dtype=np.float64, count=n)
+    return columns
+
+
+async def column_chunks(cursor: Any, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> AsyncIterator[Dict[str, np.ndarray]]:
+    """Concatenated columns of the cursor's routes, every time at least chunk_rows rows are buffered."""
+    buffered: List[Dict[str, np.ndarray]] = []
+    rows = 0
+    async for document in cursor:
+        columns = route_columns(document)
+        if not len(columns["route_id"]):
+            continue
+        buffered.append(columns)
+        rows += len(columns["route_id"])
+        if rows >= chunk_rows:
+            yield {name: np.concatenate([part[name] for part in buffered]) for name in COLUMNS}
+            buffered, rows = [], 0
+    if buffered:
+        yield {name: np.concatenate([part[name] for part in buffered]) for name in COLUMNS}
+
+
+class _DrainableSink(io.RawIOBase):
+    """Write-only stream whose content is taken out chunk by chunk (tell() keeps counting for Parquet offsets)."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def _csv_field(value: str) -> str:
+    if any(char in value for char in ',"\n\r'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+class CsvEncoder:
+    """CSV rows formatted with one %-format per row (about 3x faster than csv.writer on floats)."""
+
+    ROW_FORMAT = "%s,%s,%s,%d," + ",".join(["%.10g"] * len(SEGMENT_FIELDS))
+
+    def __init__(self):
+        self._header = True
+
+    def encode(self, columns: Dict[str, np.ndarray]) -> bytes:
+        values = [columns[name].tolist() for name in COLUMNS]
+        values[1] = np.datetime_as_string(columns["created_at"], unit="ms", timezone="UTC").tolist()
+        for position in (0, 2):  # Text columns: few distinct values, escaped once each
+            escaped = {value: _csv_field(value) for value in set(values[position])}
+            values[position] = [escaped[value] for value in values[position]]
+        lines = [self.ROW_FORMAT % row for row in zip(*values)]
+        if self._header:
+            lines.insert(0, ",".join(COLUMNS))
+            self._header = False
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    def finish(self) -> bytes:
+        return b"" if not self._header else (",".join(COLUMNS) + "\n").encode("utf-8")
+
+
+class ArrowEncoder:
+    """Arrow IPC stream (one record batch per chunk) or Parquet (one row group per chunk)."""
+
+    def __init__(self, fmt: str):
+        self.schema = pa.schema(
+            [("route_id", pa.string()), ("created_at", pa.timestamp("ms", tz="UTC")),
+             ("vehicle", pa.string()), ("segment_index", pa.int32())]
+            + [(name, pa.float64()) for name in SEGMENT_FIELDS]
+        )
+        self._sink = _DrainableSink()
+        if fmt == "parquet":
+            self._writer = pq.ParquetWriter(self._sink, self.schema)
+        else:
+            self._writer = pa.ipc.new_stream(self._sink, self.schema)
+
+    def encode(self, columns: Dict[str, np.ndarray]) -> bytes:
+        self._writer.write_table(pa.Table.from_pydict({name: columns[name] for name in COLUMNS}, schema=self.schema))
+        return self._sink.drain()
+
+    def finish(self) -> bytes:
+        self._writer.close()
+        return self._sink.drain()
+
+
+def make_encoder(fmt: str):
+    return CsvEncoder() if fmt == "csv" else ArrowEncoder(fmt)
+
+
+async def stream_export(cursor: Any, fmt: str, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> AsyncIterator[bytes]:
+    """Encoded export, chunk by chunk (encoding runs in a worker thread)."""
+    encoder = make_encoder(fmt)
+    rows = 0
+    async for columns in column_chunks(cursor, chunk_rows):
+        rows += len(columns["route_id"])
+        yield await asyncio.to_thread(encoder.encode, columns)
+    yield await asyncio.to_thread(encoder.finish)
+    logger.info(f"Exported {rows} segments as {fmt}")
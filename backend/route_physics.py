@@ -0,0 +1,384 @@
+"""
+Vectorized route physics for ECOSPEED
+Per-segment calculations of a route (distances, eco speeds, energy
+consumption and the grouping of segments by speed limit), evaluated with
+NumPy on whole arrays of elementary segments at once instead of one Python
+call per GPS point. This is the only implementation of the physics.
+"""
+import hashlib
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+GRAVITY = 9.81  # m/s²
+AIR_DENSITY = 1.225  # kg/m³
+EARTH_RADIUS_M = 6371000  # m
+
+# Reference values (typical EV) used by the eco-speed heuristic
+REF_ROLLING_RESISTANCE = 0.008
+REF_DRAG_COEFFICIENT = 0.6
+REF_EFFICIENCY = 0.90
+
+
+def haversine_distances(lat, lon):
+    """
+    Distance in meters between consecutive GPS points (Haversine formula).
+    Returns an array of len(lat) - 1 distances.
+    """
+    lat_rad = np.radians(np.asarray(lat, dtype=np.float64))
+    lon_rad = np.radians(np.asarray(lon, dtype=np.float64))
+    delta_lat = np.diff(lat_rad)
+    delta_lon = np.diff(lon_rad)
+
+    a = (np.sin(delta_lat / 2) ** 2 +
+         np.cos(lat_rad[:-1]) * np.cos(lat_rad[1:]) * np.sin(delta_lon / 2) ** 2)
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return EARTH_RADIUS_M * c
+
+
+def travel_times(distance_m, speed_kmh):
+    """Travel time in seconds for each segment (0 where speed is not positive)."""
+    speed_kmh = np.asarray(speed_kmh, dtype=np.float64)
+    distance_m = np.asarray(distance_m, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        times = np.where(speed_kmh > 0, distance_m / (speed_kmh / 3.6), 0.0)
+    return np.nan_to_num(np.maximum(times, 0.0), nan=0.0)
+
+
+def segment_slopes(distance_m, elevation_change_m):
+    """Slope of each segment (elevation change / distance), 0 for zero-length segments."""
+    distance_m = np.asarray(distance_m, dtype=np.float64)
+    elevation_change_m = np.asarray(elevation_change_m, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(distance_m > 0, elevation_change_m / np.where(distance_m > 0, distance_m, 1.0), 0.0)
+
+
+@dataclass(frozen=True)
+class VehiclePhysicsContext:
+    """
+    Per-request compiled physics of a vehicle.
+
+    Everything that only depends on the vehicle, its load, the HVAC power and
+    the air density is computed once here (forces per unit of slope / speed²,
+    inverse efficiencies, eco-speed factors), so evaluating a segment costs
+    a few multiply-adds.
+    """
+    gravity_force: float  # m·g (N per unit of slope)
+    rolling_force: float  # Crr·m·g (N on flat road)
+    aero_coefficient: float  # 0.5·ρ·CdA (N per (m/s)²)
+    inv_motor_efficiency: float  # 1 / η_drive
+    regen_efficiency: float  # η_regen
+    aux_power_w: float  # Auxiliary power (W)
+    uphill_factor: float  # Eco speed / limit on significant uphill (> 2%)
+    downhill_factor: float  # Eco speed / limit on significant downhill (< -2%)
+    flat_factor: float  # Eco speed / limit otherwise
+
+    @classmethod
+    def from_vehicle(
+        cls,
+        vehicle,
+        total_mass_kg: float = None,
+        aux_power_kw: float = None,
+        rho_air: float = 1.225,
+    ) -> "VehiclePhysicsContext":
+        total_mass = vehicle.empty_mass + vehicle.extra_load if total_mass_kg is None else total_mass_kg
+        aux_power = vehicle.aux_power_kw if aux_power_kw is None else aux_power_kw
+        air_density = rho_air if rho_air else AIR_DENSITY
+
+        # Eco-speed factors: heavier, draggier or less efficient vehicles slow down more
+        mass_ratio = total_mass / vehicle.empty_mass if vehicle.empty_mass > 0 else 1.0
+        rolling_factor = vehicle.rolling_resistance / REF_ROLLING_RESISTANCE
+        drag_factor = vehicle.drag_coefficient / REF_DRAG_COEFFICIENT
+        resistance_factor = 0.4 * rolling_factor + 0.6 * drag_factor
+        avg_efficiency = (vehicle.motor_efficiency + vehicle.regen_efficiency) / 2.0
+        efficiency_adjustment = 1.0 - (1.0 - avg_efficiency / REF_EFFICIENCY) * 0.1
+
+        return cls(
+            gravity_force=total_mass * GRAVITY,
+            rolling_force=vehicle.rolling_resistance * total_mass * GRAVITY,
+            aero_coefficient=0.5 * air_density * vehicle.drag_coefficient,
+            inv_motor_efficiency=1.0 / max(vehicle.motor_efficiency, 1e-6),
+            regen_efficiency=vehicle.regen_efficiency,
+            aux_power_w=aux_power * 1000,
+            uphill_factor=(
+                0.65
+                - min(0.10, (mass_ratio - 1.0) * 0.10)
+                - min(0.08, (resistance_factor - 1.0) * 0.08)
+                - (1.0 - efficiency_adjustment) * 0.05
+            ),
+            downhill_factor=(
+                0.85
+                + min(0.05, (mass_ratio - 1.0) * 0.05)
+                + min(0.03, (vehicle.regen_efficiency - 0.85) * 0.15)
+                - min(0.02, (resistance_factor - 1.0) * 0.02)
+            ),
+            flat_factor=(
+                0.88
+                - min(0.03, (mass_ratio - 1.0) * 0.03)
+                - min(0.05, (resistance_factor - 1.0) * 0.05)
+                - (1.0 - efficiency_adjustment) * 0.03
+            ),
+        )
+
+    @property
+    def table_key(self) -> Tuple[float, ...]:
+        """Parameters the traction energy table depends on (not aux power nor eco factors)."""
+        return (self.gravity_force, self.rolling_force, self.aero_coefficient,
+                self.inv_motor_efficiency, self.regen_efficiency)
+
+    def traction_energy_per_meter(self, speed_kmh, slope):
+        """
+        Electrical traction energy in kWh per meter at a constant speed on a
+        given slope (clamped to ±50%), without auxiliary power.
+        Uphill / flat: wheel energy divided by motor efficiency;
+        downhill: recovered energy multiplied by regen efficiency.
+        """
+        speed_ms = np.asarray(speed_kmh, dtype=np.float64) / 3.6
+        slope = np.clip(np.asarray(slope, dtype=np.float64), -0.5, 0.5)
+        # cos(atan(slope)) = 1 / sqrt(1 + slope²)
+        force = (self.gravity_force * slope
+                 + self.rolling_force / np.sqrt(1.0 + slope * slope)
+                 + self.aero_coefficient * speed_ms * speed_ms)
+        energy_j = np.where(force >= 0, force * self.inv_motor_efficiency, force * self.regen_efficiency)
+        return energy_j / 3.6e6
+
+    def energy(self, speed_kmh, distance_m, slope, table: "EnergyTable" = None):
+        """Energy in kWh of each segment (negative for regeneration), 0 where speed <= 0."""
+        speed_kmh = np.asarray(speed_kmh, dtype=np.float64)
+        distance_m = np.asarray(distance_m, dtype=np.float64)
+        if table is not None:
+            per_meter = table.interpolate(speed_kmh, slope)
+        else:
+            per_meter = self.traction_energy_per_meter(speed_kmh, slope)
+        moving = speed_kmh > 0
+        time_s = np.where(moving, distance_m / np.where(moving, speed_kmh / 3.6, 1.0), 0.0)
+        energy_kwh = per_meter * distance_m + self.aux_power_w * time_s / 3.6e6
+        return np.nan_to_num(np.where(moving, energy_kwh, 0.0), nan=0.0)
+
+    def eco_speeds(self, speed_limit_kmh, slope, min_speed_kmh: float = 30.0):
+        """Eco speed (km/h, rounded to 0.1) of each segment, never above its speed limit."""
+        speed_limit_kmh = np.asarray(speed_limit_kmh, dtype=np.float64)
+        slope = np.asarray(slope, dtype=np.float64)
+        uphill = np.maximum(min_speed_kmh, speed_limit_kmh * self.uphill_factor)
+        downhill = np.minimum(speed_limit_kmh * self.downhill_factor, speed_limit_kmh)
+        flat = speed_limit_kmh * self.flat_factor
+        eco = np.where(slope > 0.02, uphill, np.where(slope < -0.02, downhill, flat))
+        eco = np.maximum(min_speed_kmh, np.minimum(eco, speed_limit_kmh))
+        return np.round(eco, 1)
+
+
+# ============================================================================
+# PRECOMPUTED (SPEED, SLOPE) ENERGY TABLES
+# ============================================================================
+
+TABLE_SPEEDS = np.arange(0.0, 250.0 + 0.5, 0.5)  # km/h
+TABLE_SLOPES = np.arange(-0.5, 0.5 + 0.0025, 0.0025)
+
+
+class EnergyTable:
+    """
+    Traction energy per meter of a vehicle context sampled on a (speed, slope)
+    grid, evaluated by bilinear interpolation.
+    """
+
+    def __init__(self, values: np.ndarray):
+        self.values = values  # (len(TABLE_SPEEDS), len(TABLE_SLOPES)), possibly memory-mapped
+
+    @classmethod
+    def build(cls, context: VehiclePhysicsContext) -> "EnergyTable":
+        return cls(context.traction_energy_per_meter(TABLE_SPEEDS[:, None], TABLE_SLOPES[None, :]))
+
+    def interpolate(self, speed_kmh, slope):
+        speed_pos = np.clip(np.asarray(speed_kmh, dtype=np.float64) / 0.5, 0, len(TABLE_SPEEDS) - 1.000001)
+        slope_pos = np.clip((np.asarray(slope, dtype=np.float64) + 0.5) / 0.0025, 0, len(TABLE_SLOPES) - 1.000001)
+        i = speed_pos.astype(np.int64)
+        j = slope_pos.astype(np.int64)
+        di = speed_pos - i
+        dj = slope_pos - j
+        v = self.values
+        return ((v[i, j] * (1 - dj) + v[i, j + 1] * dj) * (1 - di)
+                + (v[i + 1, j] * (1 - dj) + v[i + 1, j + 1] * dj) * di)
+
+
+def _table_file(key: Tuple[float, ...]) -> Optional[Path]:
+    directory = os.environ.get('PHYSICS_TABLE_DIR')
+    if not directory:
+        return None
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+    return Path(directory) / f"energy_table_{digest}.npy"
+
+
+@lru_cache(maxsize=int(os.environ.get('PHYSICS_TABLE_CACHE_SIZE', '32')))
+def _cached_energy_table(key: Tuple[float, ...]) -> EnergyTable:
+    path = _table_file(key)
+    if path is not None and path.exists():
+        return EnergyTable(np.load(path, mmap_mode="r"))
+    table = EnergyTable.build(VehiclePhysicsContext(*key, aux_power_w=0.0, uphill_factor=0.0,
+                                                    downhill_factor=0.0, flat_factor=0.0))
+    if path is not None:
+        # Write then rename so other processes never map a partial file
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, table.values)
+        os.replace(tmp, path)
+        table = EnergyTable(np.load(path, mmap_mode="r"))
+    return table
+
+
+def energy_table(context: VehiclePhysicsContext) -> EnergyTable:
+    """
+    Energy table of a vehicle context, shared across requests through an LRU
+    cache (PHYSICS_TABLE_CACHE_SIZE entries) and, when PHYSICS_TABLE_DIR is
+    set, memory-mapped .npy files shared between processes.
+    """
+    return _cached_energy_table(context.table_key)
+
+
+def energy_consumption(
+    speed_kmh,
+    distance_m,
+    elevation_change_m,
+    vehicle,
+    total_mass_kg: float = None,
+    aux_power_kw: float = None,
+    rho_air: float = 1.225,
+):
+    """
+    Energy of elementary segments driven at speed_kmh (gravity, rolling
+    resistance and aerodynamic drag, plus auxiliary power).
+
+    Each element is an individual elementary segment with its own slope (never
+    averaged): uphill segments consume with motor efficiency losses and
+    downhill segments recover with regen efficiency losses.
+
+    Returns energy in kWh per segment (negative for regeneration).
+    """
+    context = VehiclePhysicsContext.from_vehicle(vehicle, total_mass_kg, aux_power_kw, rho_air)
+    return context.energy(speed_kmh, distance_m, segment_slopes(distance_m, elevation_change_m))
+
+
+def eco_speeds(
+    distance_m,
+    elevation_change_m,
+    speed_limit_kmh,
+    vehicle,
+    total_mass_kg: float = None,
+    min_speed_kmh: float = 30.0,
+):
+    """
+    Eco speed of elementary segments: reduced on uphill (> 2%), moderate on
+    downhill (< -2%) for regeneration, slightly below the limit on flat road.
+    The result never exceeds the speed limit of the segment. Returns km/h.
+    """
+    context = VehiclePhysicsContext.from_vehicle(vehicle, total_mass_kg)
+    return context.eco_speeds(speed_limit_kmh, segment_slopes(distance_m, elevation_change_m), min_speed_kmh)
+
+
+def group_starts(speed_limit, boundaries=None) -> np.ndarray:
+    """
+    First elementary segment of each merged group: 0, every change of speed
+    limit of at least 0.1 km/h and every index in `boundaries` (e.g. the first
+    segment of each leg of a multi-stop trip, never merged with the previous one).
+    """
+    speed_limit = np.asarray(speed_limit, dtype=np.float64)
+    new_group = np.zeros(len(speed_limit), dtype=bool)
+    if len(speed_limit):
+        new_group[0] = True
+        new_group[1:] = np.abs(np.diff(speed_limit)) >= 0.1
+    if boundaries is not None:
+        boundaries = np.asarray(boundaries, dtype=np.int64)
+        new_group[boundaries[(boundaries >= 0) & (boundaries < len(speed_limit))]] = True
+    return np.flatnonzero(new_group)
+
+
+def merge_by_speed_limit(speed_limit, distance_m, columns, speed_columns=None, boundaries=None):
+    """
+    Merged route segments, as returned by /api/route.
+
+    Consecutive elementary segments whose speed limit differs by less than
+    0.1 km/h are merged, except across `boundaries` (see group_starts).
+    Columns in `columns` are summed (energies keep their sign, regeneration
+    is never averaged away) and columns in `speed_columns` are
+    distance-weighted averages rounded to 0.1 km/h.
+
+    Returns (starts, ends, merged) where starts/ends are the first and last
+    elementary segment index of each group and merged maps column names to
+    per-group arrays.
+    """
+    speed_columns = speed_columns or {}
+    speed_limit = np.asarray(speed_limit, dtype=np.float64)
+    distance_m = np.asarray(distance_m, dtype=np.float64)
+    n = len(speed_limit)
+    if n == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, {name: np.zeros(0) for name in (*columns, *speed_columns, "distance")}
+
+    starts = group_starts(speed_limit, boundaries)
+    ends = np.concatenate((starts[1:] - 1, [n - 1]))
+
+    merged = {"distance": np.add.reduceat(distance_m, starts)}
+    for name, values in columns.items():
+        merged[name] = np.add.reduceat(np.asarray(values, dtype=np.float64), starts)
+
+    total_distance = merged["distance"]
+    for name, values in speed_columns.items():
+        values = np.asarray(values, dtype=np.float64)
+        weighted = np.add.reduceat(values * distance_m, starts)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            average = np.where(total_distance > 0, weighted / np.where(total_distance > 0, total_distance, 1.0), values[starts])
+        merged[name] = np.round(average, 1)
+
+    return starts, ends, merged
+
+
+def route_arrays(
+    lat,
+    lon,
+    elevation,
+    speed_limit,
+    real_speed,
+    vehicle,
+    total_mass_kg: float = None,
+    aux_power_kw: float = None,
+    rho_air: float = 1.225,
+    use_table: bool = None,
+):
+    """
+    Physics of every elementary segment of a route (point i -> point i + 1).
+
+    speed_limit and real_speed hold one value per elementary segment. The
+    vehicle is compiled once into a VehiclePhysicsContext; with use_table
+    (default: PHYSICS_LOOKUP_TABLES=1) energies are interpolated from the
+    cached (speed, slope) table of the vehicle instead of evaluated directly.
+
+    Returns a dict of arrays: distance, eco_speed, real_speed and the
+    limit / eco / real energies (kWh) and times (seconds).
+    """
+    if use_table is None:
+        use_table = os.environ.get('PHYSICS_LOOKUP_TABLES', '0') == '1'
+    context = VehiclePhysicsContext.from_vehicle(vehicle, total_mass_kg, aux_power_kw, rho_air)
+    table = energy_table(context) if use_table else None
+
+    distance_m = haversine_distances(lat, lon)
+    slope = segment_slopes(distance_m, np.diff(np.asarray(elevation, dtype=np.float64)))
+    speed_limit = np.asarray(speed_limit, dtype=np.float64)
+    real_speed = np.asarray(real_speed, dtype=np.float64)
+
+    eco_speed = context.eco_speeds(speed_limit, slope)
+    return {
+        "distance": distance_m,
+        "eco_speed": eco_speed,
+        "real_speed": real_speed,
+        "limit_time": travel_times(distance_m, speed_limit),
+        "eco_time": travel_times(distance_m, eco_speed),
+        "real_time": travel_times(distance_m, real_speed),
+        "limit_energy": context.energy(speed_limit, distance_m, slope, table),
+        "eco_energy": context.energy(eco_speed, distance_m, slope, table),
+        "real_energy": context.energy(real_speed, distance_m, slope, table),
+    }
@@ -0,0 +1,134 @@
+"""
+In-memory store of computed routes for ECOSPEED
+Keeps the decoded geometry of each route returned by /api/route (coordinates,
+elevations, speed limits and simulated real speeds as NumPy arrays) so that
+navigation updates can recompute the remaining part of the trip without a new
+geocoding / OpenRouteService round-trip.
+
+With several worker processes, computed routes are also published to the
+shared cache (shared_cache.py) so that any worker can serve the follow-up
+requests of a route, and the navigation progress is shared the same way.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from shared_cache import SharedCache, shared_cache
+
+
+@dataclass
+class StoredRoute:
+    """Geometry and request parameters of a computed route"""
+    route_id: str
+    request: Any  # RouteRequest used to compute the route
+    lat: np.ndarray  # (n,) point latitudes
+    lon: np.ndarray  # (n,) point longitudes
+    elevation: np.ndarray  # (n,) point elevations in meters
+    speed_limit: np.ndarray  # (n - 1,) speed limit of each elementary segment (km/h)
+    real_speed: np.ndarray  # (n - 1,) simulated real speed of each elementary segment (km/h)
+    start_location: str = ""
+    end_location: str = ""
+    created_at: float = field(default_factory=time.time)
+    # Index of the last point reached during navigation (the driver only moves forward)
+    progress_index: int = 0
+    # (n,) road class of each point (speed_limits.ROAD_CLASSES ids, 0 = unknown)
+    road_class: Optional[np.ndarray] = None
+    # Point index of every stop (start, waypoints..., end) of a multi-stop trip
+    stop_indices: Optional[np.ndarray] = None
+    # RouteResponse returned by /api/route (immutable once computed, served by GET /api/route/{route_id})
+    response: Any = None
+    # Chart series already computed: full-resolution base and downsampled series by (points, method)
+    chart_base: Optional[Dict[str, np.ndarray]] = None
+    charts: Dict[Tuple[int, str], Any] = field(default_factory=dict)
+
+    @property
+    def point_count(self) -> int:
+        return len(self.lat)
+
+
+class RouteStore:
+    """
+    Bounded LRU store of StoredRoute objects keyed by route_id.
+    Entries expire after `ttl_s` seconds; the least recently used entry is
+    evicted once `max_entries` is reached.
+    """
+
+    def __init__(self, max_entries: int = 500, ttl_s: float = 6 * 3600, shared: Optional[SharedCache] = None):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.shared = shared if shared is not None and shared.enabled else None
+        self._routes: "OrderedDict[str, StoredRoute]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, route: StoredRoute) -> None:
+        with self._lock:
+            self._routes[route.route_id] = route
+            self._routes.move_to_end(route.route_id)
+            while len(self._routes) > self.max_entries:
+                self._routes.popitem(last=False)
+
+    def _local(self, route_id: str) -> Optional[StoredRoute]:
+        with self._lock:
+            route = self._routes.get(route_id)
+            if route is not None and time.time() - route.created_at > self.ttl_s:
+                del self._routes[route_id]
+                return None
+            if route is not None:
+                self._routes.move_to_end(route_id)
+            return route
+
+    def _merge_shared(self, route: Optional[StoredRoute], shared_route: Optional[StoredRoute],
+                      progress: Optional[int]) -> Optional[StoredRoute]:
+        if route is None:
+            # Computed by another worker
+            if shared_route is None or time.time() - shared_route.created_at > self.ttl_s:
+                return None
+            route = shared_route
+            self.put(route)
+        if progress is not None and progress > route.progress_index:
+            route.progress_index = progress
+        return route
+
+    def get(self, route_id: str) -> Optional[StoredRoute]:
+        """Blocking lookup (shared cache reads included): for code outside the event loop."""
+        route = self._local(route_id)
+        if self.shared is None:
+            return route
+        shared_route = self.shared.get("route", route_id) if route is None else None
+        return self._merge_shared(route, shared_route, self.shared.get("route-progress", route_id))
+
+    async def aget(self, route_id: str) -> Optional[StoredRoute]:
+        """Lookup from the event loop: the shared cache is read in worker threads."""
+        route = self._local(route_id)
+        if self.shared is None:
+            return route
+        shared_route = await self.shared.aget("route", route_id) if route is None else None
+        if route is None and shared_route is None:
+            return None
+        return self._merge_shared(route, shared_route, await self.shared.aget("route-progress", route_id))
+
+    async def publish(self, route: StoredRoute) -> None:
+        """Make a computed route (with its response) available to the other workers."""
+        if self.shared is not None:
+            remaining_s = max(self.ttl_s - (time.time() - route.created_at), 1.0)
+            await self.shared.aset("route", route.route_id, route, remaining_s)
+
+    async def set_progress(self, route: StoredRoute, index: int) -> None:
+        route.progress_index = index
+        if self.shared is not None:
+            await self.shared.aset("route-progress", route.route_id, index, self.ttl_s)
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+
+route_store = RouteStore(
+    max_entries=int(os.environ.get('ROUTE_STORE_MAX_ENTRIES', '500')),
+    ttl_s=float(os.environ.get('ROUTE_STORE_TTL_HOURS', '6')) * 3600,
+    shared=shared_cache,
+)
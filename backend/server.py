@@ -1,19 +1,52 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Header, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel
 import os
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime, timezone
+import dataclasses
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 import math
-import random
 import requests
 import time
+import xml.etree.ElementTree as ET
+import numpy as np
 from geopy.geocoders import Nominatim
+from geopy.location import Location
+
+import chart_series
+import map_matching
+import outbound
+import profiling
+import route_export
+import route_physics
+from admission import AdmissionRejected, admission, area_cost, points_cost, route_cost
+from coalescing import SingleFlight, request_key
+from http_caching import HttpCachingMiddleware
+from loop_monitor import LoopLagMonitor
+from outbound import UpstreamUnavailable
+from persistence import CollectionSpec, WriteBehind
+from profiling import ProfilingMiddleware
+from physics_executor import physics_executor
+from reachability import ReachabilityCache, reachability_cache, reachable_area
+from route_store import StoredRoute, route_store
+from shared_cache import shared_cache, try_lock
+from speed_limits import ROAD_CLASSES, ors_road_classes, route_speed_limits
+from speed_model import DRIVER_PROFILES, route_seed, simulate_real_speeds
+from station_index import StationIndex, decode_cursor, encode_cursor
+from station_sync import FETCH_CONCURRENCY, REGION_CENTERS, StationSync, fan_out, fetch_pois, normalize_poi
+from stop_order import StopOrderOptimizer, energy_matrix, estimate_matrices
+from traffic_profiles import LOCAL_TZ, departure_count, departure_grid, evaluate_departures
+from urban_zones import classify_urban
+from vehicle_catalog import get_vehicle_catalog
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -23,17 +56,93 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# Persistance write-behind : les écritures MongoDB sont mises en file et faites
+# par lots en tâche de fond, jamais sur le chemin des requêtes
+ROUTE_PERSIST_TTL = timedelta(days=float(os.environ.get('ROUTE_PERSIST_TTL_DAYS', '30')))
+write_behind = WriteBehind(
+    db,
+    [
+        # Bornes : pas de TTL, la synchronisation incrémentale ne réécrit que les bornes modifiées
+        CollectionSpec(
+            "charging_stations",
+            key="id",
+            indexes=[IndexModel([("id", ASCENDING)], unique=True), IndexModel([("location", "2dsphere")])],
+            priority=2
+        ),
+        CollectionSpec(
+            "routes",
+            indexes=[
+                IndexModel([("route_id", ASCENDING)], unique=True),
+                IndexModel([("request_hash", ASCENDING), ("created_at", DESCENDING)]),
+                # Filtres de l'export analytique
+                IndexModel([("created_at", ASCENDING)]),
+                IndexModel([("request.vehicle_profile.name", ASCENDING), ("created_at", ASCENDING)])
+            ],
+            ttl=True,
+            priority=1
+        ),
+        CollectionSpec("geocodes", key="query", indexes=[IndexModel([("query", ASCENDING)], unique=True)], ttl=True),
+        # Date de la dernière synchronisation complète des bornes : écrite après les
+        # bornes (flush par priorité décroissante), et abandonnée la première si la file déborde
+        CollectionSpec("sync_state", key="name", priority=-1),
+    ],
+    max_pending=int(os.environ.get('PERSIST_MAX_PENDING', '10000')),
+    batch_size=int(os.environ.get('PERSIST_BATCH_SIZE', '500')),
+    flush_interval_s=float(os.environ.get('PERSIST_FLUSH_INTERVAL_S', '1')),
+    write_timeout_s=float(os.environ.get('PERSIST_WRITE_TIMEOUT_S', '10'))
+)
+
 # Create the main app without a prefix
 app = FastAPI()
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# ============================================================================
-# PHYSICS CONSTANTS
-# ============================================================================
-GRAVITY = 9.81  # m/s²
-AIR_DENSITY = 1.225  # kg/m³
+# Single-flight groups: identical concurrent requests share one upstream fetch
+route_flight = SingleFlight("route")
+station_flight = SingleFlight("charging-stations")
+geocode_flight = SingleFlight("geocode")
+stop_matrix_flight = SingleFlight("stop-matrix")
+reachability_flight = SingleFlight("reachability")
+
+# Retard de la boucle d'événements (code bloquant), exposé dans /api/metrics
+loop_monitor = LoopLagMonitor(float(os.environ.get('LOOP_LAG_INTERVAL_S', '0.1')))
+
+# Durées de cache HTTP (secondes) des endpoints de lecture, revalidation par ETag ensuite
+VEHICLE_PROFILES_MAX_AGE = int(os.environ.get('VEHICLE_PROFILES_MAX_AGE', '300'))
+CHARGING_STATIONS_MAX_AGE = int(os.environ.get('CHARGING_STATIONS_MAX_AGE', '600'))
+STORED_ROUTE_MAX_AGE = int(os.environ.get('STORED_ROUTE_MAX_AGE', '3600'))
+
+# Cache des géocodages (adresse normalisée -> (horodatage, résultat Nominatim))
+GEOCODE_CACHE_TTL_S = float(os.environ.get('GEOCODE_CACHE_TTL_S', '86400'))
+GEOCODE_CACHE_MAX_ENTRIES = 2048
+_geocode_cache: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+# Étapes maximales d'un trajet (OpenRouteService accepte 50 coordonnées)
+MAX_WAYPOINTS = 48
+# Matrices distance / durée / altitude entre arrêts (clé : coordonnées arrondies)
+MAX_ORDERED_STOPS = 100
+STOP_MATRIX_CACHE_MAX_ENTRIES = 128
+_stop_matrix_cache: "OrderedDict[tuple, tuple[np.ndarray, np.ndarray, np.ndarray, str]]" = OrderedDict()
+
+# Index des bornes pour les requêtes par emprise de carte
+STATION_INDEX_TTL_S = int(os.environ.get('STATION_INDEX_TTL_S', '3600'))
+# Plusieurs workers : un seul synchronise les bornes et publie un snapshot
+# dans le cache partagé, les autres le relisent toutes les STATION_SHARE_POLL_S secondes
+STATION_SHARE_POLL_S = float(os.environ.get('STATION_SHARE_POLL_S', '30'))
+STATION_SNAPSHOT_TTL_S = 7 * 86400
+# Profils de flotte : un enregistrement publie un tampon dans le cache partagé, les
+# autres workers rechargent les profils depuis MongoDB quand il change
+VEHICLE_CATALOG_POLL_S = float(os.environ.get('VEHICLE_CATALOG_POLL_S', '2'))
+# Géométries OpenRouteService partagées entre workers (mêmes coordonnées d'étapes)
+ORS_ROUTE_CACHE_TTL_S = float(os.environ.get('ORS_ROUTE_CACHE_TTL_S', '86400'))
+_station_index: Optional[StationIndex] = None
+_station_index_built_at = 0.0
+# Surface couverte par une requête de bornes sans coordonnées (France métropolitaine)
+FRANCE_AREA_KM2 = 550000
+# Coût d'admission d'une requête de bornes servie par la copie locale
+STATION_INDEX_COST = 1.0
+# Délai maximal par région pour le chargement national direct (résultats partiels au-delà)
+OCM_REGION_TIMEOUT_S = float(os.environ.get('OCM_REGION_TIMEOUT_S', '45'))
 
 # ============================================================================
 # MODELS
@@ -55,10 +164,12 @@ class VehicleProfile(BaseModel):
     nominal_voltage: float = 400.0  # V (battery pack nominal voltage)
     battery_age_years: float = 0.0  # Battery age in years (optional)
     max_charge_kw: float = 150.0  # kW (puissance de charge DC max véhicule)
+    source: Optional[str] = None  # Catalogue : "builtin" ou "custom" (profil de flotte)
 
 class RouteRequest(BaseModel):
     start: str
     end: str
+    waypoints: List[str] = []  # Intermediate stops between start and end, in driving order
     vehicle_profile: VehicleProfile
     user_max_speed: int = 130  # Maximum speed limit in km/h
     num_passengers: int = 1  # Number of passengers (driver included)
@@ -68,6 +179,10 @@ class RouteRequest(BaseModel):
     battery_start_pct: float = 100.0  # Battery percentage at departure
     battery_end_pct: float = 20.0  # Target battery percentage on arrival
     rho_air: float = 1.225  # Air density (kg/m³)
+    driver_profile: str = "average"  # Real-speed simulation: calm, average or aggressive
+    simulation_seed: Optional[int] = None  # Seed of the real-speed simulation (default: derived from start/end)
+    chart_points: Optional[int] = None  # Also return chart series downsampled to this many points
+    chart_method: str = "lttb"  # "lttb" or "minmax"
 
 class Segment(BaseModel):
     index: int
@@ -88,6 +203,40 @@ class Segment(BaseModel):
     lat_end: float
     lon_end: float
 
+class TripTotals(BaseModel):
+    distance: float  # km
+    limit_energy: float  # kWh
+    eco_energy: float  # kWh
+    real_energy: float  # kWh
+    limit_time: float  # minutes
+    eco_time: float  # minutes
+    real_time: float  # minutes
+
+class LegSummary(TripTotals):
+    """One leg of a multi-stop trip (stop index -> stop index + 1)"""
+    index: int
+    start_location: str
+    end_location: str
+    first_segment: int  # Index of the first Segment of the leg (segments never span two legs)
+    last_segment: int
+
+class ChartSeries(BaseModel):
+    """Chart-ready series at the retained segments (cumulative values are exact prefix sums)"""
+    method: str
+    points: int
+    source_segments: int  # Segments of the full-resolution route
+    segment_index: List[int]  # Retained segments (indices in RouteResponse.segments)
+    distance_km: List[float]  # Cumulative distance at the end of each retained segment
+    speed_limit: List[float]  # km/h
+    eco_speed: List[float]
+    real_speed: List[float]
+    limit_energy: List[float]  # Cumulative kWh
+    eco_energy: List[float]
+    real_energy: List[float]
+    limit_time: List[float]  # Cumulative seconds
+    eco_time: List[float]
+    real_time: List[float]
+
 class RouteResponse(BaseModel):
     route_id: str
     segments: List[Segment]
@@ -95,6 +244,9 @@ class RouteResponse(BaseModel):
     start_location: str
     end_location: str
     route_coordinates: List[List[float]] = []  # Full route coordinates [[lat, lon], ...] for map display
+    legs: List[LegSummary] = []  # Per-leg totals (a single leg without waypoints)
+    totals: Optional[TripTotals] = None  # Whole-trip totals
+    chart: Optional[ChartSeries] = None  # Only when chart points are requested
 
 class KPIResponse(BaseModel):
     eco_energy: float  # kWh
@@ -109,6 +261,103 @@ class KPIResponse(BaseModel):
     real_time: float  # minutes
     limit_time: float  # minutes
 
+class StopOrderRequest(BaseModel):
+    """Stops of a multi-stop round to put in the best order"""
+    start: str
+    stops: List[str]  # Stops to visit, in any order
+    end: Optional[str] = None  # Fixed last stop (default: open round, or the start with return_to_start)
+    return_to_start: bool = False
+    objective: str = "energy"  # "energy" or "time"
+    vehicle_profile: VehicleProfile
+    user_max_speed: int = 130
+    num_passengers: int = 1
+    avg_weight_kg: float = 75.0
+    use_climate: bool = False
+    climate_intensity: float = 50.0
+    battery_start_pct: float = 100.0
+    battery_end_pct: float = 20.0  # Minimum battery level at every stop
+    rho_air: float = 1.225
+
+class StopOrderResponse(BaseModel):
+    order: List[int]  # Indices in `stops`, in driving order
+    ordered_stops: List[str]  # Waypoints for POST /api/route, in driving order
+    end_location: str  # Last location of the round
+    energy_kwh: float  # Optimized order (matrix estimate)
+    time_min: float
+    typed_energy_kwh: float  # Order as typed
+    typed_time_min: float
+    battery_arrival_pct: float
+    min_battery_pct: float  # Lowest battery level at a stop
+    feasible: bool  # Battery never below battery_end_pct
+    matrix_source: str  # "ors" (road matrix) or "estimate" (straight lines x detour factor)
+    computation_ms: float
+
+class ReoptimizeRequest(BaseModel):
+    """Navigation update sent while driving a stored route"""
+    current_lat: float
+    current_lon: float
+    battery_current_pct: float  # Current state of charge (%)
+    # Optional updated settings (None = keep the values of the original request)
+    num_passengers: Optional[int] = None
+    avg_weight_kg: Optional[float] = None
+    use_climate: Optional[bool] = None
+    climate_intensity: Optional[float] = None
+
+class ReoptimizeResponse(BaseModel):
+    route_id: str
+    from_point_index: int  # Index of the route point matched to the current position
+    distance_to_route_m: float  # Distance between the current position and the matched point
+    segments: List[Segment]  # Remaining segments (re-indexed from 0)
+    remaining_distance: float  # km
+    remaining_eco_energy: float  # kWh
+    remaining_real_energy: float  # kWh
+    remaining_eco_time: float  # minutes
+    battery_arrival_pct_eco: float  # %
+    battery_arrival_pct_real: float  # %
+    computation_ms: float
+
+class DepartureRequest(BaseModel):
+    """Departure time(s) to evaluate for a stored route (naive datetimes are local time, Europe/Paris)"""
+    departure_time: Optional[datetime] = None  # Single departure (default: now)
+    # Departure window: every step_minutes from window_start to window_start + window_hours
+    window_start: Optional[datetime] = None
+    window_hours: float = Field(24.0, le=7 * 24)  # At most a week
+    step_minutes: int = 15
+    objective: str = "energy"  # Best departure: "energy" (eco driving) or "time" (with the traffic)
+    battery_current_pct: float = 100.0  # %
+
+class DepartureEstimate(BaseModel):
+    """Expected trip for one departure time, from the time-of-day traffic profiles"""
+    departure_time: datetime
+    arrival_time: datetime  # Driving with the traffic
+    expected_energy: float  # kWh, driving with the traffic
+    expected_time: float  # minutes
+    eco_energy: float  # kWh, eco speed capped by the traffic
+    eco_time: float  # minutes
+    eco_arrival_time: datetime
+    battery_arrival_pct: float  # %
+    battery_arrival_pct_eco: float  # %
+
+class DepartureResponse(BaseModel):
+    route_id: str
+    best: DepartureEstimate
+    candidates: List[DepartureEstimate]  # Single departure: [best]
+    computation_ms: float
+
+class TraceMatchResponse(BaseModel):
+    """Actual trip computed from a recorded GPS trace matched to a stored route"""
+    route_id: str
+    fixes_total: int  # Fixes read from the trace
+    fixes_matched: int  # Fixes matched to the route
+    matched_distance: float  # km of route covered by the trace
+    coverage_percent: float  # % of the route distance covered
+    segments: List[Segment]  # Covered segments (real_* = values measured from the trace)
+    actual_energy: float  # kWh
+    eco_energy: float  # kWh on the same covered segments
+    limit_energy: float  # kWh on the same covered segments
+    actual_time: float  # minutes
+    eco_time: float  # minutes
+
 class ChargingStation(BaseModel):
     name: str
     operator: str
@@ -119,6 +368,58 @@ class ChargingStation(BaseModel):
     longitude: float
     address: Optional[str] = None
 
+class StationCluster(BaseModel):
+    """Stations of one grid cell of the viewport (low zoom levels)"""
+    latitude: float  # Centroid
+    longitude: float
+    count: int
+    available_count: int  # Stations 'Dispo'
+    max_power_kw: float
+    min_lat: float  # Bounding box of the members (zoom-to-cluster)
+    min_lon: float
+    max_lat: float
+    max_lon: float
+
+class StationViewportResponse(BaseModel):
+    stations: List[ChargingStation]
+    clusters: List[StationCluster]
+    total: int  # Items (stations + clusters) in the viewport, all pages included
+    next_cursor: Optional[str] = None
+
+class ReachabilityRequest(BaseModel):
+    """Energy reachability from a point ("where can I go with 40% battery?")"""
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    start: Optional[str] = None  # Address, geocoded when no coordinates are given
+    vehicle_profile: VehicleProfile
+    user_max_speed: int = 130  # Maximum speed limit in km/h
+    num_passengers: int = 1
+    avg_weight_kg: float = 75.0
+    use_climate: bool = False
+    climate_intensity: float = 50.0
+    battery_start_pct: float = 100.0  # Rounded down to 5% buckets
+    battery_end_pct: float = 10.0  # Reserve kept on arrival
+    rho_air: float = 1.225
+    max_stations: int = 200  # Reachable stations returned, highest arrival battery first
+
+class ReachableStation(BaseModel):
+    station: ChargingStation
+    energy_kwh: float  # Energy needed to reach the station's cell
+    battery_arrival_pct: float  # %
+
+class ReachabilityResponse(BaseModel):
+    latitude: float  # Origin
+    longitude: float
+    battery_start_pct: float  # Battery bucket used
+    budget_kwh: float  # Energy available above the reserve
+    source: str  # "osm" (road graph) or "lattice" (no road graph available)
+    cell_size_deg: float
+    polygon: List[List[float]]  # Outline of the reachable area, closed [lat, lon] ring
+    cells: List[List[float]]  # Reachable cells: [lat, lon, battery_arrival_pct]
+    stations: List[ReachableStation]
+    cached: bool
+    computation_ms: float
+
 
 # ============================================================================
 # PHYSICS CALCULATIONS
@@ -142,548 +443,214 @@ def calculate_segment_distance(lat1: float, lon1: float, lat2: float, lon2: floa
     
     return R * c
 
-def calculate_energy_consumption(
-    speed_kmh: float,
-    distance_m: float,
-    elevation_change_m: float,
-    vehicle: VehicleProfile,
-    total_mass_kg: float = None,
-    aux_power_kw: float = None,
-    rho_air: float = 1.225,
-) -> float:
+# ============================================================================
+# API ENDPOINTS
+# ============================================================================
+
+@api_router.get("/")
+async def root():
+    return {"message": "Ecospeed API - Green Driving Optimizer for Electric Vehicles"}
+
+@api_router.get("/metrics")
+async def get_metrics() -> Dict[str, Any]:
     """
-    Calculate energy consumption for a SINGLE elementary segment between two GPS points.
-    
-    IMPORTANT: This function is called for each segment individually. We do NOT average
-    slopes between multiple segments. Each segment's slope is calculated as:
-    slope = elevation_change_m / distance_m
-    
-    This ensures that uphill and downhill portions are treated separately:
-    - Uphill segments (slope > 0): consume energy with motor efficiency losses
-    - Downhill segments (slope < 0): can recover energy with regen efficiency losses
-    
-    Forces considered:
-    1. Gravity force (uphill/downhill) - depends on individual segment slope
-    2. Rolling resistance
-    3. Aerodynamic drag
-    4. Inertia (simplified)
-    
-    Returns energy in kWh (positive for consumption, negative for regeneration).
+    Internal counters: request coalescing, physics executor, route store,
+    persistence queue, admission control (queue depth, waits, rejections per
+    lane) and event-loop lag.
     """
-    if speed_kmh <= 0:
-        return 0.0
-    
-    # Convert speed to m/s
-    speed_ms = speed_kmh / 3.6
-    
-    # Total vehicle mass (use provided or calculate from vehicle profile)
-    if total_mass_kg is None:
-        total_mass = vehicle.empty_mass + vehicle.extra_load
-    else:
-        total_mass = total_mass_kg
-    
-    # Use provided aux_power or vehicle default
-    if aux_power_kw is None:
-        aux_power = vehicle.aux_power_kw
-    else:
-        aux_power = aux_power_kw
-    
-    # Use provided air density or default
-    air_density = rho_air if rho_air else AIR_DENSITY
-    
-    # Time to travel this segment (seconds)
-    time_s = distance_m / speed_ms if speed_ms > 0 else 0
-    
-    # Calculate slope angle
-    if distance_m > 0:
-        slope = elevation_change_m / distance_m
-        # Limit slope to realistic values (-50% to +50%)
-        slope = max(-0.5, min(0.5, slope))
-    else:
-        slope = 0
-    
-    # 1. Gravity force (positive uphill, negative downhill)
-    F_gravity = total_mass * GRAVITY * slope
-    
-    # 2. Rolling resistance force
-    F_rolling = vehicle.rolling_resistance * total_mass * GRAVITY * math.cos(math.atan(slope))
-    
-    # 3. Aerodynamic drag force (using CdA directly from drag_coefficient)
-    # Note: In Streamlit code, drag_coefficient is actually CdA (Cd × A)
-    F_aero = 0.5 * air_density * vehicle.drag_coefficient * (speed_ms ** 2)
-    
-    # Total resistance force
-    F_total = F_gravity + F_rolling + F_aero
-    
-    # Power required at wheels (Watts)
-    power_wheels_w = F_total * speed_ms
-    
-    # Electrical power (accounting for motor efficiency or regen)
-    # IMPORTANT: This correctly separates uphill and downhill segments:
-    # - Uphill (power_wheels_w > 0): Energy consumed with motor efficiency (e.g., 95%)
-    #   → If we need 100W at wheels, we consume 100/0.95 = 105.3W electrical
-    # - Downhill (power_wheels_w < 0): Energy recovered with regen efficiency (e.g., 85%)
-    #   → If we can recover 100W at wheels, we only get 100*0.85 = 85W electrical
-    # This means even with equal uphill/downhill (net slope = 0), we still consume energy
-    # because motor efficiency < 100% and regen efficiency < 100%
-    if power_wheels_w >= 0:
-        # Consuming energy (uphill/flat) - divide by efficiency (losses)
-        power_elec_w = power_wheels_w / max(vehicle.motor_efficiency, 1e-6)
-    else:
-        # Recovering energy (downhill) - multiply by regen efficiency (losses)
-        # Note: power_wheels_w is negative here, so result is still negative (recovered energy)
-        power_elec_w = power_wheels_w * vehicle.regen_efficiency
-    
-    # Add auxiliary power (HVAC, etc.) - always positive (consumed)
-    power_aux_w = aux_power * 1000  # Convert kW to W
-    power_total_w = power_elec_w + power_aux_w
-    
-    # Energy (Watt-hours)
-    # Note: power_total_w can be negative for downhill segments (recovered energy)
-    # but will be less negative than power_wheels_w due to regen efficiency < 100%
-    energy_wh = power_total_w * (time_s / 3600.0)
-    
-    # Convert to kWh
-    # Result: positive for consumption, negative for recovery (but less than ideal due to losses)
-    energy_kwh = energy_wh / 1000.0
-    
-    return energy_kwh
+    return {
+        "coalescing": {
+            "route": route_flight.stats(),
+            "charging_stations": station_flight.stats(),
+            "reachability": reachability_flight.stats(),
+            "geocode": geocode_flight.stats(),
+            "stop_matrix": stop_matrix_flight.stats()
+        },
+        "physics_executor": physics_executor.stats(),
+        "route_store": {"routes": len(route_store)},
+        "geocode_cache": {"entries": len(_geocode_cache)},
+        "reachability_cache": reachability_cache.stats(),
+        "station_sync": station_sync.stats(),
+        "outbound": outbound.stats(),
+        "persistence": write_behind.stats(),
+        "shared_cache": shared_cache.stats(),
+        "admission": admission.stats(),
+        "profiling": profiling.profile_guard.stats(),
+        "event_loop": loop_monitor.stats()
+    }
 
-def calculate_eco_speed(
-    distance_m: float,
-    elevation_change_m: float,
-    speed_limit_kmh: float,
-    vehicle: VehicleProfile,
-    total_mass_kg: float = None,
-    min_speed_kmh: float = 30.0
-) -> float:
+def _vehicle_profile_document(profile: dict) -> dict:
+    """Profil complet (valeurs par défaut comprises), tel que servi par le catalogue."""
+    return VehicleProfile(**profile).model_dump()
+
+def _vehicle_catalog():
+    return get_vehicle_catalog(_vehicle_profile_document)
+
+@api_router.get("/vehicle-profiles", response_model=List[VehicleProfile])
+async def get_vehicle_profiles(
+    q: Optional[str] = None,  # Recherche par nom (sous-chaîne, insensible à la casse)
+    min_battery_kwh: Optional[float] = None,
+    max_battery_kwh: Optional[float] = None,
+    source: Optional[str] = None  # "builtin" ou "custom"
+) -> Response:
     """
-    Calculate optimized eco-speed for a SINGLE elementary segment between two GPS points.
-    
-    IMPORTANT: This function is called for each segment individually, using its own
-    elevation_change_m. We do NOT average slopes between segments. The slope is calculated
-    as: slope = elevation_change_m / distance_m for THIS specific segment.
-    
-    Takes into account ALL vehicle parameters:
-    - Mass (affects gravity and rolling resistance)
-    - Rolling resistance coefficient (Crr)
-    - Aerodynamic drag (CdA)
-    - Motor and regen efficiency
-    
-    Strategy (based on individual segment slope):
-    - Uphill (slope > 2%): reduce speed to minimize power demand (more reduction if heavier/higher drag)
-    - Downhill (slope < -2%): moderate speed to maximize regen benefits (but never exceed speed limit)
-    - Flat (|slope| <= 2%): slightly below speed limit for optimal efficiency
-    
-    IMPORTANT: eco_speed must NEVER exceed speed_limit_kmh (legal requirement)
-    
-    Returns speed in km/h.
+    Catalogue des profils de véhicules (intégrés + flottes personnalisées).
+    Servi depuis un snapshot immuable en mémoire avec un ETag fort (version
+    du catalogue) : le middleware de cache répond 304 sur If-None-Match.
     """
-    # Calculate slope for THIS specific segment (not averaged with others)
-    slope = elevation_change_m / distance_m if distance_m > 0 else 0
-    
-    # Calculate total mass (use provided or vehicle default)
-    if total_mass_kg is None:
-        total_mass = vehicle.empty_mass + vehicle.extra_load
-    else:
-        total_mass = total_mass_kg
-    
-    # Base vehicle mass for reference (typical empty mass)
-    base_mass = vehicle.empty_mass
-    # Mass ratio: how much heavier than base (1.0 = same, 1.5 = 50% heavier)
-    mass_ratio = total_mass / base_mass if base_mass > 0 else 1.0
-    
-    # Normalize vehicle characteristics for speed adjustment
-    # Reference values (typical EV)
-    ref_rolling_resistance = 0.008  # Typical Crr for EVs
-    ref_drag_coefficient = 0.6  # Typical CdA for EVs (m²)
-    
-    # Calculate resistance factors relative to reference
-    rolling_factor = vehicle.rolling_resistance / ref_rolling_resistance if ref_rolling_resistance > 0 else 1.0
-    drag_factor = vehicle.drag_coefficient / ref_drag_coefficient if ref_drag_coefficient > 0 else 1.0
-    
-    # Combined resistance factor (higher = more resistance = need lower speed)
-    # Rolling resistance is more important at low speeds, drag at high speeds
-    # We use a weighted average: 40% rolling, 60% drag (drag dominates at highway speeds)
-    resistance_factor = 0.4 * rolling_factor + 0.6 * drag_factor
-    
-    # Efficiency factor (lower efficiency = need more careful speed management)
-    # Average of motor and regen efficiency (both matter)
-    avg_efficiency = (vehicle.motor_efficiency + vehicle.regen_efficiency) / 2.0
-    ref_efficiency = 0.90  # Reference 90% average efficiency
-    efficiency_factor = avg_efficiency / ref_efficiency if ref_efficiency > 0 else 1.0
-    # Lower efficiency means we need to be more conservative with speed
-    efficiency_adjustment = 1.0 - (1.0 - efficiency_factor) * 0.1  # Up to 10% adjustment
-    
-    # Adjust speed based on slope, mass, resistance, and efficiency
-    if slope > 0.02:  # Significant uphill (>2% grade)
-        # Reduce speed significantly on uphill
-        # Heavier vehicles, higher drag, and lower efficiency need more speed reduction
-        base_reduction = 0.65  # Base reduction to 65% of limit
-        
-        # Mass adjustment (up to 10% more reduction for 2x mass)
-        mass_adjustment = min(0.10, (mass_ratio - 1.0) * 0.10)
-        
-        # Resistance adjustment (higher resistance = more reduction, up to 8%)
-        resistance_adjustment = min(0.08, (resistance_factor - 1.0) * 0.08)
-        
-        # Efficiency adjustment (lower efficiency = more reduction, up to 5%)
-        efficiency_adjustment_val = (1.0 - efficiency_adjustment) * 0.05
-        
-        speed_factor = base_reduction - mass_adjustment - resistance_adjustment - efficiency_adjustment_val
-        eco_speed = max(min_speed_kmh, speed_limit_kmh * speed_factor)
-        
-    elif slope < -0.02:  # Significant downhill
-        # Moderate speed to balance safety and regen, but never exceed limit
-        # Heavier vehicles and better regen efficiency can benefit from slightly higher speed
-        base_factor = 0.85
-        
-        # Mass adjustment (heavier = more regen benefit, up to 5% increase)
-        mass_adjustment = min(0.05, (mass_ratio - 1.0) * 0.05)
-        
-        # Regen efficiency adjustment (better regen = can go slightly faster, up to 3%)
-        regen_adjustment = min(0.03, (vehicle.regen_efficiency - 0.85) * 0.15)  # 0.85 = ref, scale to 3%
-        
-        # But higher drag/resistance reduces this benefit (up to 2% reduction)
-        resistance_penalty = min(0.02, (resistance_factor - 1.0) * 0.02)
-        
-        speed_factor = base_factor + mass_adjustment + regen_adjustment - resistance_penalty
-        eco_speed = min(speed_limit_kmh * speed_factor, speed_limit_kmh)
-        
-    else:  # Flat terrain
-        # Slightly below limit for efficiency
-        # Consider rolling resistance (more important at low speeds) and drag (more important at high speeds)
-        base_factor = 0.88
-        
-        # Mass adjustment (heavier = more rolling resistance, up to 3% reduction)
-        mass_adjustment = min(0.03, (mass_ratio - 1.0) * 0.03)
-        
-        # Resistance adjustment (higher resistance = more reduction, up to 5%)
-        resistance_adjustment = min(0.05, (resistance_factor - 1.0) * 0.05)
-        
-        # Efficiency adjustment (lower efficiency = more reduction, up to 3%)
-        efficiency_adjustment_val = (1.0 - efficiency_adjustment) * 0.03
-        
-        speed_factor = base_factor - mass_adjustment - resistance_adjustment - efficiency_adjustment_val
-        eco_speed = speed_limit_kmh * speed_factor
-    
-    # CRITICAL: Ensure eco_speed NEVER exceeds speed_limit_kmh (legal requirement)
-    # Also ensure it's not below minimum safe speed
-    eco_speed = max(min_speed_kmh, min(eco_speed, speed_limit_kmh))
-    
-    return round(eco_speed, 1)
-
-def _merge_segments(segment_group: List[Segment], index: int) -> Segment:
-    """
-    Merge a group of consecutive segments with the same speed limit into a single segment.
-    
-    IMPORTANT: This function ADDS energies (including negative values for regeneration),
-    it does NOT average slopes. Each elementary segment was already calculated individually
-    with its own slope, and we simply sum the results. This preserves the accurate energy
-    balance: uphill segments (positive energy) and downhill segments (negative energy)
-    are never averaged together.
-    """
-    if not segment_group:
-        raise ValueError("Cannot merge empty segment group")
-    
-    if len(segment_group) == 1:
-        # Single segment, just update index
-        seg = segment_group[0]
-        return Segment(
-            index=index,
-            distance=seg.distance,
-            elevation_start=seg.elevation_start,
-            elevation_end=seg.elevation_end,
-            speed_limit=seg.speed_limit,
-            eco_speed=seg.eco_speed,
-            real_speed=seg.real_speed,
-            limit_energy=seg.limit_energy,
-            eco_energy=seg.eco_energy,
-            real_energy=seg.real_energy,
-            limit_time=seg.limit_time,
-            eco_time=seg.eco_time,
-            real_time=seg.real_time,
-            lat_start=seg.lat_start,
-            lon_start=seg.lon_start,
-            lat_end=seg.lat_end,
-            lon_end=seg.lon_end
-        )
-    
-    # Merge multiple segments
-    first_seg = segment_group[0]
-    last_seg = segment_group[-1]
-    
-    # Sum all values (including negative energies from regeneration)
-    # Each elementary segment was calculated individually with its own slope,
-    # so we simply add the results without averaging
-    total_distance = sum(s.distance for s in segment_group)
-    total_limit_energy = sum(s.limit_energy for s in segment_group)  # Can be negative
-    total_eco_energy = sum(s.eco_energy for s in segment_group)  # Can be negative
-    total_real_energy = sum(s.real_energy for s in segment_group)  # Can be negative
-    total_limit_time = sum(s.limit_time for s in segment_group)
-    total_eco_time = sum(s.eco_time for s in segment_group)
-    total_real_time = sum(s.real_time for s in segment_group)
-    
-    # Calculate weighted average speeds (weighted by distance)
-    total_eco_speed = sum(s.eco_speed * s.distance for s in segment_group) / total_distance if total_distance > 0 else first_seg.eco_speed
-    total_real_speed = sum(s.real_speed * s.distance for s in segment_group) / total_distance if total_distance > 0 else first_seg.real_speed
-    
-    return Segment(
-        index=index,
-        distance=total_distance,
-        elevation_start=first_seg.elevation_start,
-        elevation_end=last_seg.elevation_end,
-        speed_limit=first_seg.speed_limit,  # Same for all in group
-        eco_speed=round(total_eco_speed, 1),
-        real_speed=round(total_real_speed, 1),
-        limit_energy=total_limit_energy,  # Sum of all energies (positive + negative)
-        eco_energy=total_eco_energy,  # Sum of all energies (positive + negative)
-        real_energy=total_real_energy,  # Sum of all energies (positive + negative)
-        limit_time=total_limit_time,
-        eco_time=total_eco_time,
-        real_time=total_real_time,
-        lat_start=first_seg.lat_start,
-        lon_start=first_seg.lon_start,
-        lat_end=last_seg.lat_end,
-        lon_end=last_seg.lon_end
-    )
+    snapshot = _vehicle_catalog().snapshot
+    body, etag = snapshot.search(q, min_battery_kwh, max_battery_kwh, source)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={VEHICLE_PROFILES_MAX_AGE}",
+        "X-Catalog-Version": str(snapshot.version)
+    }
+    return Response(content=body, media_type="application/json", headers=headers)
 
-def simulate_real_speed(
-    speed_limit_kmh: float,
-    eco_speed_kmh: float,
-    segment_index: int
-) -> float:
+@api_router.post("/vehicle-profiles", status_code=201)
+async def register_vehicle_profile(profile: VehicleProfile) -> VehicleProfile:
     """
-    Simulate realistic driver behavior.
-    
-    Real speed is typically:
-    - Close to speed limit on motorways
-    - More variable in urban areas
-    - Sometimes above or below limit
+    Enregistre (ou remplace) un profil de flotte personnalisé.
+    Le profil est persisté dans MongoDB puis publié dans une nouvelle version du catalogue.
     """
-    # Use segment index as seed for consistent but varied behavior
-    random.seed(segment_index)
-    
-    # Base: slightly below limit
-    base_speed = speed_limit_kmh * 0.92
-    
-    # Add random variation (-10% to +5%)
-    variation = random.uniform(-0.10, 0.05)
-    real_speed = base_speed * (1 + variation)
-    
-    # Clamp to reasonable range
-    real_speed = max(50, min(real_speed, speed_limit_kmh * 1.05))
-    
-    return round(real_speed, 1)
+    profile.name = profile.name.strip()
+    if not profile.name:
+        raise HTTPException(status_code=400, detail="Vehicle profile name is required")
+    catalog = _vehicle_catalog()
+    if catalog.is_builtin(profile.name):
+        raise HTTPException(status_code=409, detail=f"'{profile.name}' is a built-in vehicle profile")
 
-# ============================================================================
-# API ENDPOINTS
-# ============================================================================
+    profile.source = "custom"
+    document = profile.model_dump()
+    try:
+        await db.vehicle_profiles.replace_one({"name": profile.name}, document, upsert=True)
+    except Exception as e:
+        logger.error(f"Error saving vehicle profile '{profile.name}': {e}")
+        raise HTTPException(status_code=503, detail="Vehicle profile store unavailable")
+    catalog.register(document)
+    await _publish_vehicle_catalog()
+    return profile
 
-@api_router.get("/")
-async def root():
-    return {"message": "Ecospeed API - Green Driving Optimizer for Electric Vehicles"}
+# Tampon de la dernière version des profils de flotte vue par ce worker
+_vehicle_catalog_stamp: Optional[str] = None
 
-@api_router.get("/vehicle-profiles")
-async def get_vehicle_profiles() -> List[VehicleProfile]:
-    """
-    Get predefined EV vehicle profiles from Streamlit code.
-    """
-    profiles = [
-        VehicleProfile(
-            name="Tesla Model 3",
-            empty_mass=1850,
-            extra_load=150,
-            drag_coefficient=0.58,  # CdA (Cd × A)
-            frontal_area=2.2,  # Realistic frontal area in m² (for display only)
-            rolling_resistance=0.008,
-            motor_efficiency=0.95,
-            regen_efficiency=0.85,
-            aux_power_kw=2.0,
-            battery_kwh=75
-        ),
-        VehicleProfile(
-            name="Tesla Model Y",
-            empty_mass=2000,
-            extra_load=150,
-            drag_coefficient=0.62,  # CdA
-            frontal_area=2.4,  # SUV - larger frontal area
-            rolling_resistance=0.008,
-            motor_efficiency=0.95,
-            regen_efficiency=0.85,
-            aux_power_kw=2.2,
-            battery_kwh=75
-        ),
-        VehicleProfile(
-            name="Audi Q4 e-tron",
-            empty_mass=2100,
-            extra_load=150,
-            drag_coefficient=0.70,  # CdA
-            frontal_area=2.5,  # SUV - larger frontal area
-            rolling_resistance=0.009,
-            motor_efficiency=0.92,
-            regen_efficiency=0.80,
-            aux_power_kw=2.5,
-            battery_kwh=82
-        ),
-        VehicleProfile(
-            name="BMW iX3",
-            empty_mass=2180,
-            extra_load=150,
-            drag_coefficient=0.68,  # CdA
-            frontal_area=2.4,  # SUV
-            rolling_resistance=0.009,
-            motor_efficiency=0.93,
-            regen_efficiency=0.82,
-            aux_power_kw=2.3,
-            battery_kwh=80
-        ),
-        VehicleProfile(
-            name="Mercedes EQC",
-            empty_mass=2425,
-            extra_load=150,
-            drag_coefficient=0.72,  # CdA
-            frontal_area=2.5,  # Large SUV
-            rolling_resistance=0.010,
-            motor_efficiency=0.91,
-            regen_efficiency=0.78,
-            aux_power_kw=2.8,
-            battery_kwh=80
-        ),
-        VehicleProfile(
-            name="Volkswagen ID.4",
-            empty_mass=2120,
-            extra_load=150,
-            drag_coefficient=0.66,  # CdA
-            frontal_area=2.3,  # SUV
-            rolling_resistance=0.009,
-            motor_efficiency=0.90,
-            regen_efficiency=0.75,
-            aux_power_kw=2.0,
-            battery_kwh=77
-        ),
-        VehicleProfile(
-            name="Renault Zoe",
-            empty_mass=1500,
-            extra_load=150,
-            drag_coefficient=0.65,  # CdA
-            frontal_area=1.9,  # Small car
-            rolling_resistance=0.010,
-            motor_efficiency=0.90,
-            regen_efficiency=0.70,
-            aux_power_kw=1.5,
-            battery_kwh=52
-        ),
-        VehicleProfile(
-            name="BMW i3",
-            empty_mass=1200,
-            extra_load=150,
-            drag_coefficient=0.50,  # CdA
-            frontal_area=1.8,  # Very small car
-            rolling_resistance=0.008,
-            motor_efficiency=0.92,
-            regen_efficiency=0.80,
-            aux_power_kw=1.8,
-            battery_kwh=42
-        ),
-        VehicleProfile(
-            name="Nissan Leaf",
-            empty_mass=1600,
-            extra_load=150,
-            drag_coefficient=0.68,  # CdA
-            frontal_area=2.1,  # Compact car
-            rolling_resistance=0.010,
-            motor_efficiency=0.88,
-            regen_efficiency=0.75,
-            aux_power_kw=1.7,
-            battery_kwh=40
-        ),
-        VehicleProfile(
-            name="Hyundai IONIQ 5",
-            empty_mass=1950,
-            extra_load=150,
-            drag_coefficient=0.64,  # CdA
-            frontal_area=2.3,  # SUV/Crossover
-            rolling_resistance=0.008,
-            motor_efficiency=0.94,
-            regen_efficiency=0.83,
-            aux_power_kw=2.1,
-            battery_kwh=73
-        ),
-        VehicleProfile(
-            name="Kia EV6",
-            empty_mass=1980,
-            extra_load=150,
-            drag_coefficient=0.63,  # CdA
-            frontal_area=2.3,  # SUV/Crossover
-            rolling_resistance=0.008,
-            motor_efficiency=0.94,
-            regen_efficiency=0.83,
-            aux_power_kw=2.1,
-            battery_kwh=77
-        ),
-        VehicleProfile(
-            name="Custom",
-            empty_mass=1900,
-            extra_load=150,
-            drag_coefficient=0.62,  # CdA
-            frontal_area=2.2,  # Default realistic value
-            rolling_resistance=0.010,
-            motor_efficiency=0.90,
-            regen_efficiency=0.60,
-            aux_power_kw=2.0,
-            battery_kwh=60
-        )
-    ]
-    return profiles
+async def _publish_vehicle_catalog() -> None:
+    """Signale aux autres workers que les profils de flotte ont changé."""
+    global _vehicle_catalog_stamp
+    if shared_cache.enabled:
+        _vehicle_catalog_stamp = uuid.uuid4().hex
+        await shared_cache.aset("vehicle-catalog", "stamp", _vehicle_catalog_stamp, STATION_SNAPSHOT_TTL_S)
+
+async def _reload_custom_profiles():
+    """Profils de flotte enregistrés (MongoDB) dans une nouvelle version du catalogue."""
+    custom = await asyncio.wait_for(db.vehicle_profiles.find({}, {"_id": 0}).to_list(None), timeout=5)
+    snapshot = _vehicle_catalog().load_custom(custom)
+    logger.info(f"Vehicle catalog version {snapshot.version}: {len(snapshot.profiles)} profiles ({len(custom)} custom)")
+    return snapshot
 
-def get_speed_limit_by_road_type(road_type: str, user_max_speed: int = 130, is_urban: bool = False) -> int:
+async def _follow_vehicle_catalog() -> None:
+    """Recharge les profils de flotte quand un autre worker en a enregistré un."""
+    global _vehicle_catalog_stamp
+    while True:
+        await asyncio.sleep(VEHICLE_CATALOG_POLL_S)
+        try:
+            stamp = await shared_cache.aget("vehicle-catalog", "stamp")
+            if stamp is not None and stamp != _vehicle_catalog_stamp:
+                await _reload_custom_profiles()
+                _vehicle_catalog_stamp = stamp
+        except Exception as e:
+            logger.warning(f"Vehicle catalog refresh failed: {e}")
+
+# Serveurs amont configurables (benchmarks/load_test.py les remplace par des serveurs locaux)
+ORS_BASE_URL = os.environ.get('ORS_BASE_URL', 'https://api.openrouteservice.org').rstrip('/')
+ORS_DIRECTIONS_URL = f"{ORS_BASE_URL}/v2/directions/driving-car"
+ORS_ELEVATION_URL = f"{ORS_BASE_URL}/elevation/line"
+ORS_MATRIX_URL = f"{ORS_BASE_URL}/v2/matrix/driving-car"
+NOMINATIM_DOMAIN = os.environ.get('NOMINATIM_DOMAIN', 'nominatim.openstreetmap.org')
+NOMINATIM_SCHEME = os.environ.get('NOMINATIM_SCHEME', 'https')
+ORS_MATRIX_MAX_ELEMENTS = 3500  # Sources x destinations per matrix request (ORS limit)
+
+def _post_json(url: str, body: Dict[str, Any], headers: Dict[str, str], params: Optional[Dict[str, Any]] = None) -> Any:
+    """POST bloquant (exécuté dans un thread par le scheduler sortant)."""
+    response = requests.post(url, json=body, headers=headers, params=params, timeout=60)
+    response.raise_for_status()
+    return response.json()
+
+async def _geocode(location: str) -> Any:
     """
-    Retourne la limitation de vitesse typique selon le type de route.
-    Mapping des types de route ORS vers limitations de vitesse en France.
-    
-    Args:
-        road_type: Type de route depuis OpenRouteService
-        user_max_speed: Vitesse maximale configurée par l'utilisateur
-        is_urban: Si True, on est en zone urbaine (limitation 50 km/h sauf autoroute)
+    Géocodage Nominatim via le scheduler sortant (1 requête/s, retries avec
+    backoff sur les erreurs transitoires, circuit breaker). Les adresses
+    trouvées sont gardées en cache GEOCODE_CACHE_TTL_S secondes (en mémoire
+    et dans le cache partagé entre workers) et les requêtes simultanées pour
+    la même adresse partagent un seul appel.
     """
-    # En zone urbaine, toutes les routes sauf autoroute sont limitées à 50 km/h
-    if is_urban:
-        road_type_lower = road_type.lower() if road_type else ""
-        if "motorway" in road_type_lower:
-            return min(130, user_max_speed)  # Autoroute même en ville
+    key = " ".join(location.lower().split())
+    cached = _geocode_cache.get(key)
+    if cached is not None and time.time() - cached[0] < GEOCODE_CACHE_TTL_S:
+        _geocode_cache.move_to_end(key)
+        return cached[1]
+    
+    async def lookup() -> Any:
+        # Cache partagé entre workers, puis Nominatim
+        shared = await shared_cache.aget("geocode", key)
+        if shared is not None:
+            geocoded_at, result = shared
         else:
-            return 50  # Toutes les autres routes en ville = 50 km/h
-    
-    # Hors zone urbaine
-    speed_mapping = {
-        "motorway": min(130, user_max_speed),  # Autoroute
-        "trunk": min(110, user_max_speed),     # Route express
-        "primary": min(90, user_max_speed),    # Route nationale
-        "secondary": min(90, user_max_speed),  # Route départementale principale
-        "tertiary": min(90, user_max_speed),   # Route départementale secondaire
-        "unclassified": 50,                    # Route non classée
-        "residential": 50,                     # Zone résidentielle
-        "service": 30,                         # Route de service
+            geolocator = Nominatim(user_agent="ecospeed", timeout=10, domain=NOMINATIM_DOMAIN, scheme=NOMINATIM_SCHEME)
+            result = await outbound.call("nominatim", geolocator.geocode, location, timeout=10)
+            geocoded_at = time.time()
+            if result is not None:
+                await shared_cache.aset("geocode", key, (geocoded_at, result), GEOCODE_CACHE_TTL_S)
+                write_behind.put("geocodes", _geocode_document(key, result))
+        if result is not None:
+            _geocode_cache[key] = (geocoded_at, result)
+            _geocode_cache.move_to_end(key)
+            while len(_geocode_cache) > GEOCODE_CACHE_MAX_ENTRIES:
+                _geocode_cache.popitem(last=False)
+        return result
+    
+    return await geocode_flight.do(request_key("geocode", {"q": key}), lookup)
+
+def _geocode_document(key: str, result: Any) -> Dict[str, Any]:
+    updated_at = datetime.now(timezone.utc)
+    return {
+        "query": key,
+        "address": result.address,
+        "latitude": result.latitude,
+        "longitude": result.longitude,
+        "raw": result.raw,
+        "updated_at": updated_at,
+        "expires_at": updated_at + timedelta(seconds=GEOCODE_CACHE_TTL_S)
     }
-    
-    # Recherche par préfixe (car ORS peut retourner "motorway_link", etc.)
-    if road_type:
-        road_type_lower = road_type.lower()
-        for key, speed in speed_mapping.items():
-            if key in road_type_lower:
-                return speed
-    
-    # Par défaut, utiliser 50 km/h (zone urbaine)
-    return 50
 
-async def get_route_from_ors(start: str, end: str, user_max_speed: int = 130) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[List[float]]]:
+async def _geocode_all(locations: List[str]) -> List[Any]:
+    """
+    Géocodage de toutes les étapes d'un trajet en une seule étape : adresses
+    distinctes résolues en parallèle (cache d'abord, puis file Nominatim).
+    """
+    distinct = list(dict.fromkeys(locations))
+    results = await asyncio.gather(*(_geocode(location) for location in distinct))
+    resolved = dict(zip(distinct, results))
+    return [resolved[location] for location in locations]
+
+async def get_route_from_ors(
+    start: str,
+    end: str,
+    user_max_speed: int = 130,
+    waypoints: Optional[List[str]] = None
+) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[List[float]], List[int]]:
     """
     Get route from OpenRouteService API with detailed segments and speed limits.
-    Returns tuple: (points, detailed_segments, route_coordinates)
+    Returns tuple: (points, detailed_segments, route_coordinates, stop_indices)
     - points: list of points with coordinates, elevation, and speed_limit
     - detailed_segments: list of route segments with road type information
     - route_coordinates: full list of route coordinates [[lat, lon], ...] for map display
+    - stop_indices: index in points of every stop (start, waypoints..., end)
+    
+    All stops are geocoded in one step and routed with a single directions
+    call. Upstream calls go through the outbound scheduler (rate limits,
+    retries, circuit breakers); the CPU-bound route processing runs in a
+    worker thread.
     """
     ors_api_key = os.environ.get('ORS_API_KEY', '').strip()
     
@@ -694,807 +661,1494 @@ async def get_route_from_ors(start: str, end: str, user_max_speed: int = 130) ->
         )
     
     # Geocode addresses to coordinates
-    # Use a longer timeout and add retry logic for Nominatim
-    geolocator = Nominatim(user_agent="ecospeed", timeout=10)
-    
-    def geocode_with_retry(location: str, max_retries: int = 3) -> Any:
-        """Geocode a location with retry logic"""
-        for attempt in range(max_retries):
-            try:
-                result = geolocator.geocode(location, timeout=10)
-                if result:
-                    return result
-                # If no result, wait a bit before retrying
-                if attempt < max_retries - 1:
-                    time.sleep(1)
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    logger.warning(f"Geocoding attempt {attempt + 1} failed for '{location}': {str(e)}. Retrying...")
-                    time.sleep(2)  # Wait longer between retries
-                else:
-                    raise e
-        return None
-    
+    stops = [start, *(waypoints or []), end]
     try:
-        start_location = geocode_with_retry(start)
-        # Small delay between requests to respect Nominatim rate limits
-        time.sleep(1)
-        end_location = geocode_with_retry(end)
-        
-        if not start_location:
-            raise HTTPException(status_code=400, detail=f"Could not find location: {start}. Please try a more specific address.")
-        if not end_location:
-            raise HTTPException(status_code=400, detail=f"Could not find location: {end}. Please try a more specific address.")
-        
-        start_coords = [start_location.longitude, start_location.latitude]
-        end_coords = [end_location.longitude, end_location.latitude]
-        
-    except HTTPException:
+        locations = await _geocode_all(stops)
+    except UpstreamUnavailable:
         raise
     except Exception as e:
         logger.error(f"Geocoding error: {str(e)}")
         raise HTTPException(status_code=400, detail=f"Geocoding error: {str(e)}. Please check your internet connection and try again.")
     
+    for stop, location in zip(stops, locations):
+        if not location:
+            raise HTTPException(status_code=400, detail=f"Could not find location: {stop}. Please try a more specific address.")
+    
+    stop_coords = [[location.longitude, location.latitude] for location in locations]
+    
+    # Same stops and speed cap already routed by a worker of this host
+    ors_key = request_key("ors-route", {"coordinates": stop_coords, "user_max_speed": user_max_speed})
+    cached = await shared_cache.aget("ors-route", ors_key)
+    if cached is not None:
+        return cached
+    
     # Call OpenRouteService Directions API with instructions
-    url = "https://api.openrouteservice.org/v2/directions/driving-car"
     headers = {
         "Authorization": ors_api_key,
         "Content-Type": "application/json; charset=utf-8"
     }
     
     body = {
-        "coordinates": [start_coords, end_coords],
+        "coordinates": stop_coords,
         "elevation": True,
         "instructions": True,
         "geometry": True,
         "format": "geojson",  # Request GeoJSON format explicitly
-        "extra_info": ["waytype", "surface"]  # Request road type information
+        "extra_info": ["waytype", "waycategory", "surface"]  # Request road type information
     }
     
     try:
-        # Try POST with format in params
-        response = requests.post(url, json=body, headers=headers, params={"format": "geojson"}, timeout=60)
-        response.raise_for_status()
-        data = response.json()
-        
-        # Extract route data - handle both formats
-        route = None
-        if "routes" in data and data["routes"]:
-            route = data["routes"][0]
-        elif "features" in data and data["features"]:
-            # GeoJSON format
-            feature = data["features"][0]
-            route = feature.get("properties", {})
-            route["geometry"] = feature.get("geometry", {})
-            route["segments"] = feature.get("properties", {}).get("segments", [])
-        
-        if not route:
-            raise HTTPException(status_code=500, detail="No route found in API response")
-        
-        # Extract geometry and elevation
-        # OpenRouteService can return geometry in different formats
-        coords_list = []
-        geometry = route.get("geometry")
-        
-        if isinstance(geometry, dict):
-            # GeoJSON format: {"type": "LineString", "coordinates": [[lon, lat, elev], ...]}
-            if geometry.get("type") == "LineString":
-                coords_list = geometry.get("coordinates", [])
-            elif "coordinates" in geometry:
-                coords_list = geometry.get("coordinates", [])
-        elif isinstance(geometry, str):
-            # Encoded polyline5 format - decode it
-            try:
-                from polyline5_decoder import decode_polyline5
-                # Decode polyline5 - check if elevation is requested (3D encoding)
-                # If elevation=True in request, polyline includes elevation as 3rd dimension
-                decoded = decode_polyline5(geometry, has_elevation=True)
-                
-                # Extract coordinates and elevations
-                if decoded and len(decoded[0]) >= 3:
-                    # 3D coordinates: [lat, lon, elev]
-                    coords_list = [[coord[1], coord[0]] for coord in decoded]  # Convert to [lon, lat]
-                    elevations = [coord[2] for coord in decoded]
-                else:
-                    # 2D coordinates: [lat, lon]
-                    coords_list = [[coord[1], coord[0]] for coord in decoded]  # Convert to [lon, lat]
-                    elevations = []
-                
-                logger.info(f"Decoded {len(coords_list)} coordinates from polyline5 (3D: {len(decoded[0]) >= 3 if decoded else False})")
-            except ImportError:
-                logger.error("polyline5_decoder module not found. Using start/end points only.")
-                coords_list = [start_coords, end_coords]
-            except Exception as e:
-                logger.error(f"Error decoding polyline5: {e}. Using start/end points only.")
-                coords_list = [start_coords, end_coords]
-        else:
-            # Fallback: use start and end coordinates
-            coords_list = [start_coords, end_coords]
-        
-        # Ensure we have at least 2 points
-        if len(coords_list) < 2:
-            logger.warning(f"Only {len(coords_list)} coordinate(s) received. Using start/end points.")
-            coords_list = [start_coords, end_coords]
-        
-        # Log for debugging
-        logger.info(f"Extracted {len(coords_list)} coordinates from route")
-        
-        # Extract elevation if not already extracted from polyline
-        if not elevations:
-            elevations = []
-            if coords_list:
-                # Check if elevation is in coordinates (3rd element)
-                if len(coords_list[0]) >= 3:
-                    # Elevation already in coordinates
-                    elevations = [coord[2] for coord in coords_list]
-                    # Remove elevation from coordinates for consistency
-                    coords_list = [[coord[0], coord[1]] for coord in coords_list]
-                else:
-                    # Try to get elevation from elevation service
-                    try:
-                        elev_url = "https://api.openrouteservice.org/elevation/line"
-                        elev_body = {
-                            "format_in": "geojson",
-                            "format_out": "json",
-                            "geometry": {
-                                "type": "LineString",
-                                "coordinates": coords_list[:1000]  # Limit to 1000 points
-                            }
-                        }
-                        elev_response = requests.post(elev_url, json=elev_body, headers=headers, timeout=60)
-                        if elev_response.status_code == 200:
-                            elev_data = elev_response.json()
-                            elevations = [pt[2] for pt in elev_data.get("geometry", {}).get("coordinates", [])]
-                            # Interpolate if needed
-                            if len(elevations) != len(coords_list):
-                                # Simple linear interpolation
-                                if len(elevations) > 1:
-                                    # Linear interpolation without numpy
-                                    result = []
-                                    for i in range(len(coords_list)):
-                                        pos = i / (len(coords_list) - 1) if len(coords_list) > 1 else 0
-                                        idx = pos * (len(elevations) - 1)
-                                        idx_low = int(idx)
-                                        idx_high = min(idx_low + 1, len(elevations) - 1)
-                                        t = idx - idx_low
-                                        interp_val = elevations[idx_low] * (1 - t) + elevations[idx_high] * t
-                                        result.append(interp_val)
-                                    elevations = result
-                                else:
-                                    elevations = [elevations[0] if elevations else 0.0] * len(coords_list)
-                        else:
-                            elevations = [0.0] * len(coords_list)
-                    except Exception:
-                        elevations = [0.0] * len(coords_list)
-        else:
-            elevations = []
-        
-        # Extract detailed segments with road type information
-        segments = route.get("segments", [])
-        detailed_segments = []
-        
-        # Extract steps from segments
-        all_steps = []
-        for seg in segments:
-            seg_steps = seg.get("steps", [])
-            all_steps.extend(seg_steps)
-            detailed_segments.append({
-                "distance": seg.get("distance", 0),
-                "duration": seg.get("duration", 0),
-                "steps": seg_steps
-            })
-        
-        # If no segments, create a single segment for the whole route
-        if not detailed_segments:
-            summary = route.get("summary", {})
-            total_dist = summary.get("distance", 0)
-            detailed_segments = [{
-                "distance": total_dist,
-                "duration": summary.get("duration", 0),
-                "steps": []
-            }]
-        
-        # Create points with speed limits based on road type
-        points = []
-        total_distance = sum(seg.get("distance", 0) for seg in detailed_segments) or 1
-        
-        # Calculate cumulative distances for coordinate points
-        coord_distances = [0]
-        for i in range(len(coords_list) - 1):
-            lon1, lat1 = coords_list[i][0], coords_list[i][1]
-            lon2, lat2 = coords_list[i+1][0], coords_list[i+1][1]
-            d = calculate_segment_distance(lat1, lon1, lat2, lon2)
-            coord_distances.append(coord_distances[-1] + d)
-        
-        # Normalize distances
-        if coord_distances[-1] > 0:
-            coord_ratio = total_distance / coord_distances[-1]
-            coord_distances = [d * coord_ratio for d in coord_distances]
-        
-        # Use waytype extras to assign speed limits
-        # waytype values: [start_index, end_index, waytype_id]
-        # waytype_id: 1=motorway, 2=trunk, 3=primary, 4=secondary, 5=tertiary, etc.
-        waytype_mapping = {
-            1: "motorway",
-            2: "trunk", 
-            3: "primary",
-            4: "secondary",
-            5: "tertiary",
-            6: "unclassified",
-            7: "residential",
-            8: "service"
-        }
-        
-        waytype_ranges = []
-        if "extras" in route and "waytype" in route["extras"]:
-            waytype_extra = route["extras"]["waytype"]
-            if "values" in waytype_extra:
-                waytype_ranges = waytype_extra["values"]
-        
-        # Détecter si on est en zone urbaine
-        # Méthode 1: Analyser les types de routes (si >30% sont résidentielles/unclassified/service, on est probablement en ville)
-        urban_indicators = {"residential", "unclassified", "service"}
-        urban_segment_count = 0
-        total_segment_length = 0
-        
-        if waytype_ranges:
-            for waytype_range in waytype_ranges:
-                start_idx, end_idx, waytype_id = waytype_range
-                waytype_name = waytype_mapping.get(waytype_id, "unclassified")
-                segment_length = end_idx - start_idx
-                total_segment_length += segment_length
-                if waytype_name in urban_indicators:
-                    urban_segment_count += segment_length
-        
-        is_urban_by_road_type = total_segment_length > 0 and (urban_segment_count / total_segment_length) > 0.3
-        
-        # Méthode 2: Vérifier via géocodage inverse si départ/arrivée sont en zone urbaine
-        is_urban_by_geocoding = False
-        urban_points_count = 0
-        total_points_checked = 0
-        
-        try:
-            if coords_list:
-                geolocator = Nominatim(user_agent="ecospeed", timeout=5)
-                
-                # Vérifier plusieurs points le long de la route (départ, milieu, arrivée)
-                check_indices = [0]  # Toujours vérifier le départ
-                if len(coords_list) > 1:
-                    check_indices.append(len(coords_list) - 1)  # Arrivée
-                if len(coords_list) > 2:
-                    check_indices.append(len(coords_list) // 2)  # Milieu
-                
-                for idx in check_indices:
-                    coord = coords_list[idx]
-                    lon, lat = coord[0], coord[1]
-                    
-                    try:
-                        location = geolocator.reverse(f"{lat}, {lon}", language='fr', timeout=5)
-                        total_points_checked += 1
-                        
-                        if location:
-                            address = location.raw.get('address', {})
-                            # Vérifier si on est dans une ville (plusieurs indicateurs)
-                            place_types = ['city', 'town', 'village', 'suburb', 'municipality', 'hamlet']
-                            has_urban_place = any(address.get(pt) for pt in place_types)
-                            
-                            # Vérifier aussi le code postal français (commence par 2 chiffres)
-                            postal_code = address.get('postcode', '')
-                            is_french_urban = False
-                            if postal_code and len(postal_code) >= 2:
-                                # En France, les codes postaux commencent par 2 chiffres
-                                # Les grandes villes ont souvent des codes postaux spécifiques
-                                is_french_urban = postal_code[:2].isdigit()
-                            
-                            # Si on a un type de lieu urbain OU un code postal français, considérer comme urbain
-                            if has_urban_place or is_french_urban:
-                                urban_points_count += 1
-                                
-                    except Exception as e:
-                        logger.debug(f"Geocoding failed for point {idx}: {e}")
-                        continue
-                
-                # Si au moins 2 points sur 3 sont urbains, ou si départ ET arrivée sont urbains
-                if total_points_checked >= 2:
-                    if urban_points_count >= 2 or (urban_points_count >= 1 and total_points_checked == 2):
-                        is_urban_by_geocoding = True
-                        logger.info(f"Detected urban route: {urban_points_count}/{total_points_checked} points are in urban areas")
-                elif total_points_checked == 1 and urban_points_count == 1:
-                    # Si on n'a pu vérifier qu'un seul point et qu'il est urbain, considérer comme urbain
-                    is_urban_by_geocoding = True
-                    logger.info(f"Detected urban route: single checked point is urban")
-                    
-        except Exception as e:
-            logger.warning(f"Could not determine urban zone from geocoding: {e}")
-        
-        # Considérer comme zone urbaine si l'une des deux méthodes le détecte
-        is_urban_route = is_urban_by_geocoding or is_urban_by_road_type
-        
-        if is_urban_route:
-            logger.info(f"Route detected as urban - applying 50 km/h speed limit (except motorways)")
-        
-        # Assign speed limits to each point based on waytype
-        for i, coord in enumerate(coords_list):
-            lon, lat = coord[0], coord[1]
-            elev = elevations[i] if i < len(elevations) else 0
-            
-            speed_limit = 50  # Default
-            
-            # Find waytype for this point index
-            if waytype_ranges:
-                for waytype_range in waytype_ranges:
-                    start_idx, end_idx, waytype_id = waytype_range
-                    if start_idx <= i < end_idx:
-                        waytype_name = waytype_mapping.get(waytype_id, "unclassified")
-                        speed_limit = get_speed_limit_by_road_type(waytype_name, user_max_speed, is_urban_route)
-                        break
-            else:
-                # Si pas de waytype disponible, utiliser la détection urbaine
-                speed_limit = get_speed_limit_by_road_type("unclassified", user_max_speed, is_urban_route)
-            
-            points.append({
-                "lat": lat,
-                "lon": lon,
-                "elevation": elev,
-                "speed_limit": speed_limit
-            })
-        
-        # Convert coords_list from [lon, lat] to [lat, lon] for frontend
-        route_coordinates = [[coord[1], coord[0]] for coord in coords_list]
-        
-        return points, detailed_segments, route_coordinates
-        
+        data = await outbound.call("ors", _post_json, ORS_DIRECTIONS_URL, body, headers, {"format": "geojson"})
     except requests.exceptions.RequestException as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error calling OpenRouteService API: {str(e)}"
         )
+    
+    route, coords_list, elevations = _parse_ors_route(data, stop_coords)
+    
+    # Extract elevation if not already extracted from polyline
+    if not elevations:
+        if len(coords_list[0]) >= 3:
+            # Elevation already in coordinates
+            elevations = [coord[2] for coord in coords_list]
+            # Remove elevation from coordinates for consistency
+            coords_list = [[coord[0], coord[1]] for coord in coords_list]
+        else:
+            elevations = await _fetch_elevations(coords_list, headers)
+    
+    stop_indices = _stop_point_indices(route, coords_list, stop_coords)
+    points, detailed_segments, route_coordinates = await asyncio.to_thread(
+        _route_points_from_ors, route, coords_list, elevations, user_max_speed
+    )
+    result = (points, detailed_segments, route_coordinates, stop_indices)
+    await shared_cache.aset("ors-route", ors_key, result, ORS_ROUTE_CACHE_TTL_S)
+    return result
+
+def _parse_ors_route(data: Dict[str, Any], stop_coords: List[List[float]]) -> tuple[Dict[str, Any], List[List[float]], List[float]]:
+    """
+    Route, coordinates ([lon, lat] or [lon, lat, elev]) and elevations (empty
+    if the geometry has none) of an OpenRouteService directions response.
+    Without a usable geometry, the stops themselves are used as the route.
+    """
+    # Extract route data - handle both formats
+    route = None
+    if "routes" in data and data["routes"]:
+        route = data["routes"][0]
+    elif "features" in data and data["features"]:
+        # GeoJSON format
+        feature = data["features"][0]
+        route = feature.get("properties", {})
+        route["geometry"] = feature.get("geometry", {})
+        route["segments"] = feature.get("properties", {}).get("segments", [])
+    
+    if not route:
+        raise HTTPException(status_code=500, detail="No route found in API response")
+    
+    # Extract geometry and elevation
+    # OpenRouteService can return geometry in different formats
+    coords_list = []
+    elevations = []
+    geometry = route.get("geometry")
+    
+    if isinstance(geometry, dict):
+        # GeoJSON format: {"type": "LineString", "coordinates": [[lon, lat, elev], ...]}
+        if geometry.get("type") == "LineString":
+            coords_list = geometry.get("coordinates", [])
+        elif "coordinates" in geometry:
+            coords_list = geometry.get("coordinates", [])
+    elif isinstance(geometry, str):
+        # Encoded polyline5 format - decode it
+        try:
+            from polyline5_decoder import decode_polyline5
+            # Decode polyline5 - check if elevation is requested (3D encoding)
+            # If elevation=True in request, polyline includes elevation as 3rd dimension
+            decoded = decode_polyline5(geometry, has_elevation=True)
+            
+            # Extract coordinates and elevations
+            if decoded and len(decoded[0]) >= 3:
+                # 3D coordinates: [lat, lon, elev]
+                coords_list = [[coord[1], coord[0]] for coord in decoded]  # Convert to [lon, lat]
+                elevations = [coord[2] for coord in decoded]
+            else:
+                # 2D coordinates: [lat, lon]
+                coords_list = [[coord[1], coord[0]] for coord in decoded]  # Convert to [lon, lat]
+                elevations = []
+            
+            logger.info(f"Decoded {len(coords_list)} coordinates from polyline5 (3D: {len(decoded[0]) >= 3 if decoded else False})")
+        except ImportError:
+            logger.error("polyline5_decoder module not found. Using start/end points only.")
+            coords_list = list(stop_coords)
+        except Exception as e:
+            logger.error(f"Error decoding polyline5: {e}. Using start/end points only.")
+            coords_list = list(stop_coords)
+    else:
+        # Fallback: use start and end coordinates
+        coords_list = list(stop_coords)
+    
+    # Ensure we have at least 2 points
+    if len(coords_list) < 2:
+        logger.warning(f"Only {len(coords_list)} coordinate(s) received. Using start/end points.")
+        coords_list = list(stop_coords)
+    
+    # Log for debugging
+    logger.info(f"Extracted {len(coords_list)} coordinates from route")
+    
+    return route, coords_list, elevations
+
+def _stop_point_indices(route: Dict[str, Any], coords_list: List[List[float]], stop_coords: List[List[float]]) -> List[int]:
+    """
+    Index in coords_list of every stop: the ORS way_points when consistent,
+    otherwise the nearest geometry point of each stop, searching forward only.
+    """
+    last = len(coords_list) - 1
+    way_points = route.get("way_points") or []
+    if (len(way_points) == len(stop_coords) and way_points[0] == 0 and way_points[-1] == last
+            and all(a <= b for a, b in zip(way_points[:-1], way_points[1:]))):
+        return [int(i) for i in way_points]
+    
+    lat = np.radians([coord[1] for coord in coords_list])
+    lon = np.radians([coord[0] for coord in coords_list])
+    indices = [0]
+    for stop_lon, stop_lat in stop_coords[1:-1]:
+        start = indices[-1]
+        x = (lon[start:] - math.radians(stop_lon)) * np.cos(lat[start:])
+        y = lat[start:] - math.radians(stop_lat)
+        indices.append(start + int(np.argmin(x * x + y * y)))
+    return indices + [last]
+
+async def _fetch_elevations(coords_list: List[List[float]], headers: Dict[str, str]) -> List[float]:
+    """
+    Elevations from the OpenRouteService elevation service, interpolated to
+    every coordinate. Falls back to 0 m (flat route) if the service fails.
+    """
+    elev_body = {
+        "format_in": "geojson",
+        "format_out": "json",
+        "geometry": {
+            "type": "LineString",
+            "coordinates": coords_list[:1000]  # Limit to 1000 points
+        }
+    }
+    try:
+        elev_data = await outbound.call("ors", _post_json, ORS_ELEVATION_URL, elev_body, headers)
+        elevations = [pt[2] for pt in elev_data.get("geometry", {}).get("coordinates", [])]
+    except Exception as e:
+        logger.warning(f"Elevation service failed ({e}), computing the route as flat")
+        return [0.0] * len(coords_list)
+    
+    if len(elevations) == len(coords_list):
+        return elevations
+    if len(elevations) <= 1:
+        return [elevations[0] if elevations else 0.0] * len(coords_list)
+    # Linear interpolation over the relative position along the point list
+    positions = np.linspace(0, len(elevations) - 1, len(coords_list))
+    return np.interp(positions, np.arange(len(elevations)), elevations).tolist()
+
+def _route_points_from_ors(
+    route: Dict[str, Any],
+    coords_list: List[List[float]],
+    elevations: List[float],
+    user_max_speed: int
+) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[List[float]]]:
+    """Route points with speed limits, detailed segments and map coordinates (CPU-bound)."""
+    # Extract detailed segments with road type information
+    segments = route.get("segments", [])
+    detailed_segments = []
+    
+    # Extract steps from segments
+    all_steps = []
+    for seg in segments:
+        seg_steps = seg.get("steps", [])
+        all_steps.extend(seg_steps)
+        detailed_segments.append({
+            "distance": seg.get("distance", 0),
+            "duration": seg.get("duration", 0),
+            "steps": seg_steps
+        })
+    
+    # If no segments, create a single segment for the whole route
+    if not detailed_segments:
+        summary = route.get("summary", {})
+        total_dist = summary.get("distance", 0)
+        detailed_segments = [{
+            "distance": total_dist,
+            "duration": summary.get("duration", 0),
+            "steps": []
+        }]
+    
+    # Create points with speed limits based on road type
+    points = []
+    total_distance = sum(seg.get("distance", 0) for seg in detailed_segments) or 1
+    
+    # Calculate cumulative distances for coordinate points
+    coord_distances = [0]
+    for i in range(len(coords_list) - 1):
+        lon1, lat1 = coords_list[i][0], coords_list[i][1]
+        lon2, lat2 = coords_list[i+1][0], coords_list[i+1][1]
+        d = calculate_segment_distance(lat1, lon1, lat2, lon2)
+        coord_distances.append(coord_distances[-1] + d)
+    
+    # Normalize distances
+    if coord_distances[-1] > 0:
+        coord_ratio = total_distance / coord_distances[-1]
+        coord_distances = [d * coord_ratio for d in coord_distances]
+    
+    # Road class of every point from the waytype / waycategory extras
+    # (ranges [start_index, end_index, value], see speed_limits.ors_road_classes)
+    extras = route.get("extras", {})
+    waytype_ranges = extras.get("waytype", {}).get("values", [])
+    waycategory_ranges = extras.get("waycategory", {}).get("values", [])
+    if waytype_ranges:
+        road_class = ors_road_classes(len(coords_list), waytype_ranges, waycategory_ranges)
+    else:
+        # Si pas de waytype disponible, utiliser "unclassified" et la détection urbaine
+        road_class = np.full(len(coords_list), ROAD_CLASSES["unclassified"], dtype=np.int64)
+    
+    # Détecter les zones urbaines point par point à partir du jeu de données local
+    # des aires urbaines (aucun appel réseau, précision au niveau du segment)
+    lat_array = np.array([coord[1] for coord in coords_list], dtype=np.float64)
+    lon_array = np.array([coord[0] for coord in coords_list], dtype=np.float64)
+    is_urban_points = classify_urban(lat_array, lon_array)
+    
+    if is_urban_points is None:
+        # Jeu de données indisponible : repli sur l'analyse des types de routes
+        # (si >30% des points sont des rues, on est probablement en ville)
+        is_urban_route = bool(waytype_ranges) and float(np.mean(road_class == ROAD_CLASSES["residential"])) > 0.3
+        is_urban_points = np.full(len(coords_list), is_urban_route)
+    
+    urban_count = int(is_urban_points.sum())
+    if urban_count:
+        logger.info(f"{urban_count}/{len(coords_list)} route points in urban areas - applying 50 km/h speed limit there (except motorways)")
+    
+    # Assign speed limits to all points at once: OSM maxspeed when known,
+    # road-type defaults (with urban detection) otherwise
+    speed_limits = route_speed_limits(lat_array, lon_array, road_class, is_urban_points, user_max_speed)
+    
+    for i, coord in enumerate(coords_list):
+        points.append({
+            "lat": coord[1],
+            "lon": coord[0],
+            "elevation": elevations[i] if i < len(elevations) else 0,
+            "speed_limit": float(speed_limits[i]),
+            "road_class": int(road_class[i])
+        })
+    
+    # Convert coords_list from [lon, lat] to [lat, lon] for frontend
+    route_coordinates = [[coord[1], coord[0]] for coord in coords_list]
+    
+    return points, detailed_segments, route_coordinates
+
+def _total_mass_and_aux_power(
+    vehicle: VehicleProfile,
+    num_passengers: int,
+    avg_weight_kg: float,
+    use_climate: bool,
+    climate_intensity: float
+) -> tuple[float, float]:
+    """
+    Total mass (vehicle + passengers) in kg and auxiliary power in kW,
+    including the extra HVAC power when climate is used.
+    """
+    total_passenger_weight = num_passengers * avg_weight_kg
+    total_mass_kg = vehicle.empty_mass + total_passenger_weight
+    
+    # Adjust auxiliary power based on HVAC
+    climate_power_adjustment = 0
+    if use_climate:
+        # Add extra HVAC power based on intensity (roughly 1–3 kW)
+        climate_power_adjustment = (climate_intensity / 100.0) * 3.0
+    
+    return total_mass_kg, vehicle.aux_power_kw + climate_power_adjustment
+
+def _usable_battery_kwh(vehicle: VehicleProfile) -> float:
+    """Usable battery capacity in kWh (falls back to the gross capacity); raises HTTP 400 if no positive capacity."""
+    usable_kwh = vehicle.usable_battery_kwh or vehicle.battery_kwh
+    if not usable_kwh > 0:
+        raise HTTPException(status_code=400, detail="Vehicle profile needs a positive battery capacity (usable_battery_kwh or battery_kwh)")
+    return usable_kwh
+
+def _route_request_key(request: RouteRequest) -> str:
+    """Coalescing key of a route request (addresses normalized, all other parameters as-is)."""
+    # Chart options only change the view of the route, not the route itself
+    payload = request.model_dump(exclude={"chart_points", "chart_method"})
+    payload["start"] = " ".join(request.start.lower().split())
+    payload["end"] = " ".join(request.end.lower().split())
+    payload["waypoints"] = [" ".join(waypoint.lower().split()) for waypoint in request.waypoints]
+    return request_key("route", payload)
 
 @api_router.post("/route")
 async def calculate_route(request: RouteRequest) -> RouteResponse:
     """
     Calculate route with eco-speed optimization using OpenRouteService API.
     Requires ORS_API_KEY to be configured.
-    """
-    route_id = str(uuid.uuid4())
     
+    Identical requests arriving while one is being computed share its result
+    instead of geocoding and calling OpenRouteService again (each caller still
+    gets its own route_id, hence its own navigation progress).
+    Admitted in the "planning" lane with a cost estimated from the distance
+    between the geocoded stops (429 if the server is saturated).
+    """
     # Validate inputs
     if not request.start or not request.end:
         raise HTTPException(status_code=400, detail="Start and end locations are required")
+    if request.driver_profile not in DRIVER_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown driver profile: {request.driver_profile}. Available: {', '.join(DRIVER_PROFILES)}")
+    if len(request.waypoints) > MAX_WAYPOINTS:
+        raise HTTPException(status_code=400, detail=f"Too many waypoints (max {MAX_WAYPOINTS})")
+    if any(not waypoint.strip() for waypoint in request.waypoints):
+        raise HTTPException(status_code=400, detail="Waypoints must not be empty")
+    
+    if request.chart_points is not None:
+        _check_chart_options(request.chart_points, request.chart_method)
+    
+    request_hash = _route_request_key(request)
+    response, leader = await route_flight.run(request_hash, lambda: _admitted_route(request, request_hash))
+    stored = await route_store.aget(response.route_id)
+    if not leader and stored is not None:
+        # Navigation progress is per route_id: every caller gets its own
+        stored = await _fork_route(stored, request, request_hash)
+        response = stored.response
+    if request.chart_points is None:
+        return response
+    return response.model_copy(update={
+        "chart": _route_chart(response, stored, request.chart_points, request.chart_method)
+    })
+
+async def _fork_route(stored: StoredRoute, request: RouteRequest, request_hash: str) -> StoredRoute:
+    """Copy of a computed route under a new route_id (geometry and results shared, fresh progress)."""
+    route_id = str(uuid.uuid4())
+    forked = dataclasses.replace(
+        stored,
+        route_id=route_id,
+        request=request,
+        created_at=time.time(),
+        progress_index=0,
+        response=stored.response.model_copy(update={"route_id": route_id}),
+        charts={}
+    )
+    route_store.put(forked)
+    write_behind.put("routes", lambda: _route_document(forked, request_hash))
+    await route_store.publish(forked)
+    return forked
+
+async def _route_cost(request: RouteRequest) -> float:
+    """Admission cost of a route: straight-line distance between the geocoded stops (cached for the computation)."""
+    if not os.environ.get('ORS_API_KEY', '').strip():
+        return route_cost(0)  # Rejected with 400 by get_route_from_ors
+    locations = await _geocode_all([request.start, *request.waypoints, request.end])
+    if any(location is None for location in locations):
+        return route_cost(0)
+    distance_m = sum(
+        calculate_segment_distance(a.latitude, a.longitude, b.latitude, b.longitude)
+        for a, b in zip(locations, locations[1:])
+    )
+    return route_cost(distance_m / 1000)
+
+async def _admitted_route(request: RouteRequest, request_hash: str) -> RouteResponse:
+    async with admission.admit("planning", await _route_cost(request)):
+        return await _compute_route(request, request_hash)
+
+async def _compute_route(request: RouteRequest, request_hash: str) -> RouteResponse:
+    """Geocode, fetch the route from OpenRouteService and compute the segment physics."""
+    route_id = str(uuid.uuid4())
     
     # Get route from OpenRouteService API
     try:
-        route_points, detailed_segments, route_coordinates = await get_route_from_ors(request.start, request.end, request.user_max_speed)
+        route_points, detailed_segments, route_coordinates, stop_indices = await get_route_from_ors(
+            request.start, request.end, request.user_max_speed, request.waypoints
+        )
         start_location = request.start
         end_location = request.end
     except HTTPException as e:
         raise e
     
-    # Calculate total mass (vehicle + passengers)
+    # Calculate total mass (vehicle + passengers) and auxiliary power (HVAC)
     logging.info(f"Received parameters: num_passengers={request.num_passengers}, avg_weight_kg={request.avg_weight_kg}")
-    total_passenger_weight = request.num_passengers * request.avg_weight_kg
-    total_mass_kg = request.vehicle_profile.empty_mass + total_passenger_weight
-    logging.info(f"Calculated total mass: {total_mass_kg} kg (vehicle: {request.vehicle_profile.empty_mass} kg + passengers: {total_passenger_weight} kg)")
+    total_mass_kg, adjusted_aux_power_kw = _total_mass_and_aux_power(
+        request.vehicle_profile,
+        request.num_passengers,
+        request.avg_weight_kg,
+        request.use_climate,
+        request.climate_intensity
+    )
+    logging.info(f"Calculated total mass: {total_mass_kg} kg (vehicle: {request.vehicle_profile.empty_mass} kg + passengers: {total_mass_kg - request.vehicle_profile.empty_mass} kg)")
     
-    # Adjust auxiliary power based on HVAC
-    climate_power_adjustment = 0
-    if request.use_climate:
-        # Add extra HVAC power based on intensity (roughly 1–3 kW)
-        climate_power_adjustment = (request.climate_intensity / 100.0) * 3.0
+    if len(route_points) < 2:
+        raise HTTPException(status_code=500, detail="Route has less than two points")
     
-    adjusted_aux_power_kw = request.vehicle_profile.aux_power_kw + climate_power_adjustment
+    # Simulate real speeds for the whole route in one draw (per-request generator,
+    # reproducible for the same stops and driver profile, or an explicit seed)
+    seed = request.simulation_seed if request.simulation_seed is not None else route_seed(
+        request.start, *request.waypoints, request.end, request.driver_profile
+    )
+    real_speeds = simulate_real_speeds(
+        [p["speed_limit"] for p in route_points[1:]],
+        seed=seed,
+        profile=request.driver_profile
+    )
+    
+    # Keep the geometry so that navigation updates can recompute the remaining suffix
+    stored = StoredRoute(
+        route_id=route_id,
+        request=request,
+        lat=np.array([p["lat"] for p in route_points], dtype=np.float64),
+        lon=np.array([p["lon"] for p in route_points], dtype=np.float64),
+        elevation=np.array([p["elevation"] for p in route_points], dtype=np.float64),
+        speed_limit=np.array([p["speed_limit"] for p in route_points[1:]], dtype=np.float64),
+        real_speed=real_speeds,
+        start_location=start_location,
+        end_location=end_location,
+        road_class=np.array([p.get("road_class", 0) for p in route_points], dtype=np.int64),
+        stop_indices=np.array(stop_indices, dtype=np.int64)
+    )
+    route_store.put(stored)
     
-    # First, create all individual segments between consecutive GPS points
+    # Compute all elementary segments between consecutive GPS points
     # IMPORTANT: Each elementary segment is calculated individually with its own slope.
     # We do NOT average slopes between uphill and downhill portions, as this would be misleading:
     # - Uphill segments consume energy (with motor efficiency losses ~90-95%)
     # - Downhill segments can recover energy (with regen efficiency losses ~65-85%)
     # Even if net elevation change is zero, we still consume energy due to efficiency losses.
-    individual_segments = []
-    
-    for i in range(len(route_points) - 1):
-        p1 = route_points[i]
-        p2 = route_points[i + 1]
-        
-        # Calculate segment distance between two consecutive GPS points
-        distance_m = calculate_segment_distance(
-            p1["lat"], p1["lon"],
-            p2["lat"], p2["lon"]
-        )
-        
-        # Calculate elevation change for THIS specific segment (not averaged)
-        # Positive = uphill, Negative = downhill
-        elevation_change = p2["elevation"] - p1["elevation"]
-        speed_limit = p2["speed_limit"]
-        
-        # Calculate eco speed for this segment based on its individual slope
-        eco_speed = calculate_eco_speed(
-            distance_m,
-            elevation_change,  # Individual slope for this segment
-            speed_limit,
-            request.vehicle_profile,
-            total_mass_kg=total_mass_kg
-        )
-        
-        # Simulate real speed
-        real_speed = simulate_real_speed(speed_limit, eco_speed, i)
-        
-        # Calculate energy for each scenario with new parameters
-        # NOTE: Energy can be negative for downhill segments (regeneration)
-        limit_energy = calculate_energy_consumption(
-            speed_limit, distance_m, elevation_change, request.vehicle_profile,
-            total_mass_kg=total_mass_kg,
-            aux_power_kw=adjusted_aux_power_kw,
-            rho_air=request.rho_air
-        )
-        eco_energy = calculate_energy_consumption(
-            eco_speed, distance_m, elevation_change, request.vehicle_profile,
-            total_mass_kg=total_mass_kg,
-            aux_power_kw=adjusted_aux_power_kw,
-            rho_air=request.rho_air
-        )
-        real_energy = calculate_energy_consumption(
-            real_speed, distance_m, elevation_change, request.vehicle_profile,
-            total_mass_kg=total_mass_kg,
-            aux_power_kw=adjusted_aux_power_kw,
-            rho_air=request.rho_air
-        )
-        
-        # Calculate time for each scenario (in seconds)
-        limit_time = (distance_m / (speed_limit / 3.6)) if speed_limit > 0 else 0
-        eco_time = (distance_m / (eco_speed / 3.6)) if eco_speed > 0 else 0
-        real_time = (distance_m / (real_speed / 3.6)) if real_speed > 0 else 0
-        
-        # Ensure all values are valid numbers (check for NaN and None)
-        import math
-        limit_time = max(0, limit_time) if limit_time is not None and not math.isnan(limit_time) else 0
-        eco_time = max(0, eco_time) if eco_time is not None and not math.isnan(eco_time) else 0
-        real_time = max(0, real_time) if real_time is not None and not math.isnan(real_time) else 0
-        
-        # Ensure energy values are valid numbers (but allow negative values for regeneration)
-        # Negative energy means energy recovered through regeneration
-        limit_energy = limit_energy if limit_energy is not None and not math.isnan(limit_energy) else 0
-        eco_energy = eco_energy if eco_energy is not None and not math.isnan(eco_energy) else 0
-        real_energy = real_energy if real_energy is not None and not math.isnan(real_energy) else 0
-        
-        segment = Segment(
-            index=i,
-            distance=distance_m,
-            elevation_start=p1["elevation"],
-            elevation_end=p2["elevation"],
-            speed_limit=speed_limit,
-            eco_speed=eco_speed,
-            real_speed=real_speed,
-            limit_energy=limit_energy,
-            eco_energy=eco_energy,
-            real_energy=real_energy,
-            limit_time=limit_time,
-            eco_time=eco_time,
-            real_time=real_time,
-            lat_start=p1["lat"],
-            lon_start=p1["lon"],
-            lat_end=p2["lat"],
-            lon_end=p2["lon"]
-        )
-        individual_segments.append(segment)
+    # Long routes are computed in a worker process so they do not block the event loop.
+    arrays = await physics_executor.route_arrays(
+        stored.lat, stored.lon, stored.elevation, stored.speed_limit, stored.real_speed,
+        request.vehicle_profile,
+        total_mass_kg=total_mass_kg,
+        aux_power_kw=adjusted_aux_power_kw,
+        rho_air=request.rho_air
+    )
     
-    # Group consecutive segments with the same speed_limit
-    segments = []
-    if individual_segments:
-        current_group = [individual_segments[0]]
-        segment_index = 0
-        
-        for i in range(1, len(individual_segments)):
-            current_seg = individual_segments[i]
-            prev_seg = current_group[-1]
-            
-            # Check if speed_limit is the same (with small tolerance for floating point)
-            if abs(current_seg.speed_limit - prev_seg.speed_limit) < 0.1:
-                # Same speed limit, add to current group
-                current_group.append(current_seg)
-            else:
-                # Different speed limit, finalize current group and start new one
-                merged_seg = _merge_segments(current_group, segment_index)
-                segments.append(merged_seg)
-                segment_index += 1
-                current_group = [current_seg]
-        
-        # Don't forget the last group
-        if current_group:
-            merged_seg = _merge_segments(current_group, segment_index)
-            segments.append(merged_seg)
+    # Group consecutive segments with the same speed_limit (energies are summed, never averaged)
+    segments = _segments_from_arrays(stored, 0, arrays)
     
     # Calculate total distance
     total_distance_m = sum(s.distance for s in segments)
     total_distance_km = total_distance_m / 1000
     
-    return RouteResponse(
+    stored.response = RouteResponse(
         route_id=route_id,
         segments=segments,
         total_distance=round(total_distance_km, 2),
         start_location=start_location,
         end_location=end_location,
-        route_coordinates=route_coordinates
+        route_coordinates=route_coordinates,
+        legs=_leg_summaries(stored, arrays),
+        totals=_trip_totals(arrays, 0, len(arrays["distance"]))
+    )
+    # Persisted in the background: the document is built (model_dump) by the writer, not here
+    write_behind.put("routes", lambda: _route_document(stored, request_hash))
+    # Other workers may receive the navigation updates of this route
+    await route_store.publish(stored)
+    return stored.response
+
+def _route_document(stored: StoredRoute, request_hash: str) -> Dict[str, Any]:
+    created_at = datetime.fromtimestamp(stored.created_at, timezone.utc)
+    return {
+        "route_id": stored.route_id,
+        "request_hash": request_hash,
+        "request": stored.request.model_dump(),
+        "start_location": stored.start_location,
+        "end_location": stored.end_location,
+        "total_distance": stored.response.total_distance,
+        "totals": stored.response.totals.model_dump(),
+        "response": stored.response.model_dump(),
+        "created_at": created_at,
+        "expires_at": created_at + ROUTE_PERSIST_TTL
+    }
+
+def _trip_totals(arrays: Dict[str, np.ndarray], first: int, end: int) -> TripTotals:
+    """Totals of the elementary segments first..end - 1 (energies summed, times in minutes)."""
+    total = lambda name: float(arrays[name][first:end].sum())  # noqa: E731
+    return TripTotals(
+        distance=round(total("distance") / 1000, 3),
+        limit_energy=total("limit_energy"),
+        eco_energy=total("eco_energy"),
+        real_energy=total("real_energy"),
+        limit_time=total("limit_time") / 60,
+        eco_time=total("eco_time") / 60,
+        real_time=total("real_time") / 60
+    )
+
+def _leg_summaries(stored: StoredRoute, arrays: Dict[str, np.ndarray]) -> List[LegSummary]:
+    """Per-leg totals of a whole route, with the range of merged segments of each leg."""
+    stops = stored.stop_indices
+    if stops is None:
+        stops = np.array([0, stored.point_count - 1])
+    names = [stored.start_location, *stored.request.waypoints, stored.end_location]
+    if len(names) != len(stops):
+        names = [f"Stop {k}" for k in range(len(stops))]
+    group_starts = route_physics.group_starts(stored.speed_limit, stops[1:-1])
+    legs = []
+    for k in range(len(stops) - 1):
+        first, end = int(stops[k]), int(stops[k + 1])
+        legs.append(LegSummary(
+            **_trip_totals(arrays, first, end).model_dump(),
+            index=k,
+            start_location=names[k],
+            end_location=names[k + 1],
+            first_segment=int(np.searchsorted(group_starts, first)),
+            last_segment=int(np.searchsorted(group_starts, end)) - 1
+        ))
+    return legs
+
+async def _fetch_ors_matrix(coords: List[List[float]], headers: Dict[str, str]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Distance (m) and duration (s) matrices between all coordinates from the
+    ORS matrix service: one request when N x N fits ORS_MATRIX_MAX_ELEMENTS,
+    otherwise blocks of source rows fetched concurrently.
+    """
+    n = len(coords)
+    rows_per_call = max(1, ORS_MATRIX_MAX_ELEMENTS // n)
+    blocks = [list(range(first, min(first + rows_per_call, n))) for first in range(0, n, rows_per_call)]
+    distance = np.full((n, n), np.nan)
+    duration = np.full((n, n), np.nan)
+    
+    async def fetch_block(sources: List[int]) -> Dict[str, Any]:
+        body = {"locations": coords, "sources": sources, "metrics": ["distance", "duration"]}
+        return await outbound.call("ors", _post_json, ORS_MATRIX_URL, body, headers)
+    
+    async for sources, data, error in fan_out(blocks, fetch_block, concurrency=2):
+        if error is not None:
+            raise error
+        # null = no route between the two points
+        distance[sources] = np.array(data["distances"], dtype=np.float64)
+        duration[sources] = np.array(data["durations"], dtype=np.float64)
+    return distance, duration
+
+async def _stop_matrices(coords: List[List[float]]) -> tuple[np.ndarray, np.ndarray, np.ndarray, str]:
+    """
+    (distance, duration, elevation, source) for the coordinates ([lon, lat]),
+    cached by rounded coordinates. Without an ORS key, straight-line
+    estimates on flat ground.
+    """
+    key = tuple((round(lon, 5), round(lat, 5)) for lon, lat in coords)
+    cached = _stop_matrix_cache.get(key)
+    if cached is not None:
+        _stop_matrix_cache.move_to_end(key)
+        return cached
+    
+    async def compute() -> tuple[np.ndarray, np.ndarray, np.ndarray, str]:
+        lat = np.array([coord[1] for coord in coords])
+        lon = np.array([coord[0] for coord in coords])
+        estimated_distance, estimated_duration = estimate_matrices(lat, lon)
+        ors_api_key = os.environ.get('ORS_API_KEY', '').strip()
+        if not ors_api_key:
+            result = (estimated_distance, estimated_duration, np.zeros(len(coords)), "estimate")
+        else:
+            headers = {"Authorization": ors_api_key, "Content-Type": "application/json; charset=utf-8"}
+            distance, duration = await _fetch_ors_matrix(coords, headers)
+            unroutable = np.isnan(distance) | np.isnan(duration)
+            if unroutable.any():
+                logger.warning(f"{int(unroutable.sum())} stop pairs without a road route, using estimates")
+                distance = np.where(unroutable, estimated_distance, distance)
+                duration = np.where(unroutable, estimated_duration, duration)
+            elevation = np.array(await _fetch_elevations(coords, headers), dtype=np.float64)
+            result = (distance, duration, elevation, "ors")
+        _stop_matrix_cache[key] = result
+        while len(_stop_matrix_cache) > STOP_MATRIX_CACHE_MAX_ENTRIES:
+            _stop_matrix_cache.popitem(last=False)
+        return result
+    
+    return await stop_matrix_flight.do(request_key("stop-matrix", {"coords": key}), compute)
+
+@api_router.post("/stop-order")
+async def optimize_stop_order(request: StopOrderRequest) -> StopOrderResponse:
+    """
+    Order of the stops of a multi-stop round using the least energy (or time),
+    from an asymmetric energy matrix (elevation and regeneration make A -> B
+    differ from B -> A), respecting the battery reserve at every stop when
+    possible. The ordered stops can be sent as waypoints to POST /api/route.
+    """
+    t0 = time.perf_counter()
+    
+    if not request.stops:
+        raise HTTPException(status_code=400, detail="At least one stop is required")
+    if len(request.stops) > MAX_ORDERED_STOPS:
+        raise HTTPException(status_code=400, detail=f"Too many stops (max {MAX_ORDERED_STOPS})")
+    if request.objective not in ("energy", "time"):
+        raise HTTPException(status_code=400, detail="objective must be 'energy' or 'time'")
+    vehicle = request.vehicle_profile
+    usable_kwh = _usable_battery_kwh(vehicle)
+    
+    # Matrix index 0 = start, 1..N = stops, N + 1 = fixed end
+    locations = [request.start, *request.stops] + ([request.end] if request.end else [])
+    resolved = await _geocode_all(locations)
+    for location, found in zip(locations, resolved):
+        if not found:
+            raise HTTPException(status_code=400, detail=f"Could not find location: {location}. Please try a more specific address.")
+    coords = [[found.longitude, found.latitude] for found in resolved]
+    distance, duration, elevation, source = await _stop_matrices(coords)
+    
+    total_mass_kg, aux_power_kw = _total_mass_and_aux_power(
+        vehicle,
+        request.num_passengers,
+        request.avg_weight_kg,
+        request.use_climate,
+        request.climate_intensity
+    )
+    context = route_physics.VehiclePhysicsContext.from_vehicle(vehicle, total_mass_kg, aux_power_kw, request.rho_air)
+    energy = energy_matrix(context, distance, duration, elevation, request.user_max_speed)
+    
+    end = len(locations) - 1 if request.end else (0 if request.return_to_start else None)
+    optimizer = StopOrderOptimizer(
+        energy,
+        duration,
+        objective=request.objective,
+        end=end,
+        usable_kwh=usable_kwh,
+        battery_start_pct=request.battery_start_pct,
+        battery_reserve_pct=request.battery_end_pct
+    )
+    result = await asyncio.to_thread(optimizer.solve)
+    typed = optimizer.evaluate(optimizer.typed_order())
+    
+    order = [i - 1 for i in result.order if 1 <= i <= len(request.stops)]
+    ordered_stops = [request.stops[i] for i in order]
+    return StopOrderResponse(
+        order=order,
+        ordered_stops=ordered_stops,
+        end_location=request.end or (request.start if request.return_to_start else ordered_stops[-1]),
+        energy_kwh=result.energy_kwh,
+        time_min=result.time_s / 60,
+        typed_energy_kwh=typed.energy_kwh,
+        typed_time_min=typed.time_s / 60,
+        battery_arrival_pct=request.battery_start_pct - result.energy_kwh / usable_kwh * 100,
+        min_battery_pct=result.min_battery_pct,
+        feasible=result.feasible,
+        matrix_source=source,
+        computation_ms=round((time.perf_counter() - t0) * 1000, 2)
+    )
+
+def _nearest_route_point(stored: StoredRoute, lat: float, lon: float) -> tuple[int, float]:
+    """
+    Index of the route point closest to (lat, lon) and its distance in meters.
+    Only points after the last known progress are searched, so that a route
+    passing twice near the same place never sends the driver backwards.
+    """
+    start = min(stored.progress_index, stored.point_count - 1)
+    lat_rad = np.radians(stored.lat[start:])
+    lon_rad = np.radians(stored.lon[start:])
+    # Equirectangular approximation, accurate enough at GPS matching distances
+    x = (lon_rad - math.radians(lon)) * np.cos((lat_rad + math.radians(lat)) / 2)
+    y = lat_rad - math.radians(lat)
+    squared = x * x + y * y
+    offset = int(np.argmin(squared))
+    return start + offset, float(math.sqrt(squared[offset]) * 6371000)
+
+def _segments_from_arrays(
+    stored: StoredRoute,
+    first: int,
+    arrays: Dict[str, np.ndarray],
+    index_offset: int = 0
+) -> List[Segment]:
+    """
+    Build merged Segment objects for the elementary segments of stored starting
+    at `first` (as many as there are values in arrays), grouping consecutive
+    segments with the same speed limit like calculate_route.
+    """
+    speed_limit = stored.speed_limit[first:first + len(arrays["distance"])]
+    # Segments never span two legs of a multi-stop trip
+    boundaries = stored.stop_indices - first if stored.stop_indices is not None else None
+    starts, ends, merged = route_physics.merge_by_speed_limit(
+        speed_limit,
+        arrays["distance"],
+        columns={name: arrays[name] for name in (
+            "limit_energy", "eco_energy", "real_energy", "limit_time", "eco_time", "real_time"
+        )},
+        speed_columns={"eco_speed": arrays["eco_speed"], "real_speed": arrays["real_speed"]},
+        boundaries=boundaries
+    )
+    
+    segments = []
+    for k in range(len(starts)):
+        p1 = first + int(starts[k])
+        p2 = first + int(ends[k]) + 1
+        segments.append(Segment(
+            index=index_offset + k,
+            distance=float(merged["distance"][k]),
+            elevation_start=float(stored.elevation[p1]),
+            elevation_end=float(stored.elevation[p2]),
+            speed_limit=float(speed_limit[starts[k]]),
+            eco_speed=float(merged["eco_speed"][k]),
+            real_speed=float(merged["real_speed"][k]),
+            limit_energy=float(merged["limit_energy"][k]),
+            eco_energy=float(merged["eco_energy"][k]),
+            real_energy=float(merged["real_energy"][k]),
+            limit_time=float(merged["limit_time"][k]),
+            eco_time=float(merged["eco_time"][k]),
+            real_time=float(merged["real_time"][k]),
+            lat_start=float(stored.lat[p1]),
+            lon_start=float(stored.lon[p1]),
+            lat_end=float(stored.lat[p2]),
+            lon_end=float(stored.lon[p2])
+        ))
+    return segments
+
+@api_router.post("/route/{route_id}/reoptimize")
+async def reoptimize_route(route_id: str, update: ReoptimizeRequest) -> ReoptimizeResponse:
+    """
+    Recompute eco-speed advice for the remaining part of a stored route.
+    
+    The current position is matched to the cached geometry and only the suffix
+    of elementary segments after that point is recomputed (vectorized physics),
+    with the current battery level and optionally updated passengers / HVAC.
+    No geocoding or OpenRouteService call is made. Navigation updates are
+    admitted first ("navigation" lane), before new plans and exports.
+    """
+    t0 = time.perf_counter()
+    
+    stored = await route_store.aget(route_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail=f"Route {route_id} not found or expired. Please recalculate the route.")
+    _usable_battery_kwh(stored.request.vehicle_profile)
+    
+    async with admission.admit("navigation", points_cost(stored.point_count - stored.progress_index)):
+        return await _reoptimize(stored, update, t0)
+
+async def _reoptimize(stored: StoredRoute, update: ReoptimizeRequest, t0: float) -> ReoptimizeResponse:
+    request = stored.request
+    vehicle = request.vehicle_profile
+    total_mass_kg, aux_power_kw = _total_mass_and_aux_power(
+        vehicle,
+        update.num_passengers if update.num_passengers is not None else request.num_passengers,
+        update.avg_weight_kg if update.avg_weight_kg is not None else request.avg_weight_kg,
+        update.use_climate if update.use_climate is not None else request.use_climate,
+        update.climate_intensity if update.climate_intensity is not None else request.climate_intensity
+    )
+    
+    point_index, distance_to_route_m = _nearest_route_point(stored, update.current_lat, update.current_lon)
+    await route_store.set_progress(stored, point_index)
+    
+    # Remaining elementary segments: point_index -> point_index + 1, ..., n-2 -> n-1
+    arrays = route_physics.route_arrays(
+        stored.lat[point_index:],
+        stored.lon[point_index:],
+        stored.elevation[point_index:],
+        stored.speed_limit[point_index:],
+        stored.real_speed[point_index:],
+        vehicle,
+        total_mass_kg=total_mass_kg,
+        aux_power_kw=aux_power_kw,
+        rho_air=request.rho_air
+    )
+    
+    segments = _segments_from_arrays(stored, point_index, arrays)
+    
+    usable_kwh = _usable_battery_kwh(vehicle)
+    eco_energy = float(arrays["eco_energy"].sum())
+    real_energy = float(arrays["real_energy"].sum())
+    
+    return ReoptimizeResponse(
+        route_id=stored.route_id,
+        from_point_index=point_index,
+        distance_to_route_m=round(distance_to_route_m, 1),
+        segments=segments,
+        remaining_distance=round(float(arrays["distance"].sum()) / 1000, 2),
+        remaining_eco_energy=eco_energy,
+        remaining_real_energy=real_energy,
+        remaining_eco_time=float(arrays["eco_time"].sum()) / 60,
+        battery_arrival_pct_eco=update.battery_current_pct - eco_energy / usable_kwh * 100,
+        battery_arrival_pct_real=update.battery_current_pct - real_energy / usable_kwh * 100,
+        computation_ms=round((time.perf_counter() - t0) * 1000, 2)
+    )
+
+MAX_DEPARTURE_CANDIDATES = 7 * 96  # One week at 15 minutes
+
+@api_router.post("/route/{route_id}/departure")
+async def evaluate_departure(route_id: str, request: DepartureRequest) -> DepartureResponse:
+    """
+    Expected energy, duration and arrival time of a stored route for a
+    departure time, from the time-of-day traffic speed profiles.
+    
+    With window_start, every departure of the window is evaluated in one
+    batched computation (a day at 15 minutes = 97 departures, not 97 route
+    calls) and the best one for the objective is returned with all candidates.
+    """
+    t0 = time.perf_counter()
+    
+    stored = await route_store.aget(route_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail=f"Route {route_id} not found or expired. Please recalculate the route.")
+    if request.objective not in ("energy", "time"):
+        raise HTTPException(status_code=400, detail="objective must be 'energy' or 'time'")
+    
+    if request.window_start is not None:
+        if request.step_minutes < 1 or request.window_hours <= 0:
+            raise HTTPException(status_code=400, detail="window_hours and step_minutes must be positive")
+        # Nombre de départs vérifié avant de construire la liste
+        if departure_count(request.window_hours, request.step_minutes) > MAX_DEPARTURE_CANDIDATES:
+            raise HTTPException(status_code=400, detail=f"Too many departures in the window (max {MAX_DEPARTURE_CANDIDATES})")
+        departures = departure_grid(request.window_start, request.window_hours, request.step_minutes)
+    else:
+        departures = [request.departure_time or datetime.now(timezone.utc)]
+    departures = [d if d.tzinfo else d.replace(tzinfo=LOCAL_TZ) for d in departures]
+    
+    vehicle = stored.request.vehicle_profile
+    total_mass_kg, aux_power_kw = _total_mass_and_aux_power(
+        vehicle,
+        stored.request.num_passengers,
+        stored.request.avg_weight_kg,
+        stored.request.use_climate,
+        stored.request.climate_intensity
+    )
+    context = route_physics.VehiclePhysicsContext.from_vehicle(vehicle, total_mass_kg, aux_power_kw, stored.request.rho_air)
+    road_class = stored.road_class if stored.road_class is not None else np.zeros(stored.point_count, dtype=np.int64)
+    
+    # (departures x segments) evaluation, off the event loop
+    async with admission.admit("planning", points_cost(stored.point_count * len(departures))):
+        expected = await asyncio.to_thread(
+            evaluate_departures,
+            context, stored.lat, stored.lon, stored.elevation, stored.speed_limit, road_class, departures
+        )
+    
+    usable_kwh = _usable_battery_kwh(vehicle)
+    candidates = []
+    for k, departure in enumerate(departures):
+        traffic_time = float(expected["traffic_time"][k])
+        eco_time = float(expected["eco_time"][k])
+        traffic_energy = float(expected["traffic_energy"][k])
+        eco_energy = float(expected["eco_energy"][k])
+        candidates.append(DepartureEstimate(
+            departure_time=departure,
+            arrival_time=departure + timedelta(seconds=traffic_time),
+            expected_energy=traffic_energy,
+            expected_time=traffic_time / 60,
+            eco_energy=eco_energy,
+            eco_time=eco_time / 60,
+            eco_arrival_time=departure + timedelta(seconds=eco_time),
+            battery_arrival_pct=request.battery_current_pct - traffic_energy / usable_kwh * 100,
+            battery_arrival_pct_eco=request.battery_current_pct - eco_energy / usable_kwh * 100
+        ))
+    
+    score = expected["eco_energy"] if request.objective == "energy" else expected["traffic_time"]
+    return DepartureResponse(
+        route_id=route_id,
+        best=candidates[int(np.argmin(score))],
+        candidates=candidates,
+        computation_ms=round((time.perf_counter() - t0) * 1000, 2)
+    )
+
+def _match_uploaded_trace(stored: StoredRoute, fileobj, trace_format: str) -> TraceMatchResponse:
+    """
+    Map-match a GPX/CSV trace to a stored route and compute the actual energy
+    of every covered elementary segment from the measured speeds.
+    Runs in a worker thread (CPU-bound, reads the upload in chunks).
+    """
+    if trace_format == "gpx":
+        fixes = map_matching.parse_gpx(fileobj)
+    else:
+        fixes = map_matching.parse_csv(fileobj)
+    
+    chunk_size = int(os.environ.get('TRACE_CHUNK_SIZE', '5000'))
+    matcher = map_matching.match_trace(stored.lat, stored.lon, fixes, chunk_size=chunk_size)
+    actual_speed = matcher.segment_speeds()
+    covered = ~np.isnan(actual_speed)
+    
+    request = stored.request
+    vehicle = request.vehicle_profile
+    total_mass_kg, aux_power_kw = _total_mass_and_aux_power(
+        vehicle, request.num_passengers, request.avg_weight_kg, request.use_climate, request.climate_intensity
+    )
+    
+    arrays = route_physics.route_arrays(
+        stored.lat, stored.lon, stored.elevation, stored.speed_limit,
+        np.where(covered, actual_speed, 0.0),
+        vehicle,
+        total_mass_kg=total_mass_kg,
+        aux_power_kw=aux_power_kw,
+        rho_air=request.rho_air
+    )
+    # Measured times rather than distance / speed
+    arrays["real_time"] = np.nan_to_num(np.diff(matcher.point_times), nan=0.0)
+    distance_m = arrays["distance"]
+    
+    # One group of segments per contiguous run of covered segments
+    segments = []
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], covered.astype(np.int8), [0]))))
+    for run_start, run_end in zip(edges[::2], edges[1::2]):
+        run_arrays = {name: values[run_start:run_end] for name, values in arrays.items()}
+        segments.extend(_segments_from_arrays(stored, int(run_start), run_arrays, index_offset=len(segments)))
+    
+    covered_distance = float(distance_m[covered].sum())
+    total_distance = float(distance_m.sum())
+    return TraceMatchResponse(
+        route_id=stored.route_id,
+        fixes_total=matcher.fixes_total,
+        fixes_matched=matcher.fixes_matched,
+        matched_distance=round(covered_distance / 1000, 2),
+        coverage_percent=round(covered_distance / total_distance * 100, 1) if total_distance > 0 else 0.0,
+        segments=segments,
+        actual_energy=float(arrays["real_energy"][covered].sum()),
+        eco_energy=float(arrays["eco_energy"][covered].sum()),
+        limit_energy=float(arrays["limit_energy"][covered].sum()),
+        actual_time=float(arrays["real_time"][covered].sum()) / 60,
+        eco_time=float(arrays["eco_time"][covered].sum()) / 60
+    )
+
+@api_router.post("/route/{route_id}/trace")
+async def match_route_trace(route_id: str, file: UploadFile = File(...), trace_format: Optional[str] = None) -> TraceMatchResponse:
+    """
+    Ingest a recorded GPS trace (GPX or CSV with lat, lon, time columns) for a
+    stored route. The trace is map-matched to the route geometry and the actual
+    per-segment speeds are used to compute the real energy with the same physics
+    as /api/route (instead of the simulated real speeds).
+    """
+    stored = await route_store.aget(route_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail=f"Route {route_id} not found or expired. Please recalculate the route.")
+    
+    if not trace_format:
+        filename = (file.filename or "").lower()
+        trace_format = "gpx" if filename.endswith(".gpx") else "csv"
+    if trace_format not in ("gpx", "csv"):
+        raise HTTPException(status_code=400, detail="Unsupported trace format. Use 'gpx' or 'csv'.")
+    
+    try:
+        return await asyncio.to_thread(_match_uploaded_trace, stored, file.file, trace_format)
+    except (ValueError, ET.ParseError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid GPS trace: {str(e)}")
+
+MAX_CACHED_CHARTS = 8  # Résolutions gardées par route
+
+def _check_chart_options(points: int, method: str) -> None:
+    if not chart_series.MIN_CHART_POINTS <= points <= chart_series.MAX_CHART_POINTS:
+        raise HTTPException(status_code=400, detail=f"Chart points must be between {chart_series.MIN_CHART_POINTS} and {chart_series.MAX_CHART_POINTS}")
+    if method not in chart_series.CHART_METHODS:
+        raise HTTPException(status_code=400, detail=f"Unknown chart method: {method}. Available: {', '.join(chart_series.CHART_METHODS)}")
+
+def _route_chart(response: RouteResponse, stored: Optional[StoredRoute], points: int, method: str) -> ChartSeries:
+    """
+    Downsampled chart series of a route, cached per (points, method) on the
+    stored route along with the full-resolution prefix sums.
+    """
+    key = (points, method)
+    if stored is not None and key in stored.charts:
+        return stored.charts[key]
+    base = stored.chart_base if stored is not None else None
+    if base is None:
+        base = chart_series.chart_base(response.segments)
+    series = chart_series.chart_series(base, points, method)
+    chart = ChartSeries(method=method, points=len(series["segment_index"]), source_segments=len(response.segments), **series)
+    if stored is not None:
+        stored.chart_base = base
+        stored.charts[key] = chart
+        while len(stored.charts) > MAX_CACHED_CHARTS:
+            stored.charts.pop(next(iter(stored.charts)))
+    return chart
+
+async def _route_response(route_id: str) -> tuple[RouteResponse, Optional[StoredRoute]]:
+    """Computed route from the route store, or from MongoDB once expired from the store."""
+    stored = await route_store.aget(route_id)
+    if stored is None or stored.response is None:
+        try:
+            document = await asyncio.wait_for(db.routes.find_one({"route_id": route_id}, {"_id": 0, "response": 1}), timeout=2)
+        except Exception as e:
+            logger.warning(f"Persisted route {route_id} not loaded: {e}")
+            document = None
+        if document is not None:
+            return RouteResponse(**document["response"]), None
+    return _stored_route_response(stored, route_id), stored
+
+def _stored_route_response(stored: Optional[StoredRoute], route_id: str) -> RouteResponse:
+    if stored is None or stored.response is None:
+        raise HTTPException(status_code=404, detail=f"Route {route_id} not found or expired. Please recalculate the route.")
+    return stored.response
+
+@api_router.get("/route/{route_id}")
+async def get_route(route_id: str, chart_points: Optional[int] = None, chart_method: str = "lttb") -> RouteResponse:
+    """
+    Route déjà calculée (même réponse que POST /api/route), depuis le route
+    store, ou depuis MongoDB une fois expirée du store (ROUTE_PERSIST_TTL_DAYS).
+    Avec chart_points, les séries des graphiques sous-échantillonnées sont jointes.
+    Immuable pour un route_id donné : cacheable.
+    """
+    if chart_points is not None:
+        _check_chart_options(chart_points, chart_method)
+    response, stored = await _route_response(route_id)
+    if chart_points is None:
+        return response
+    return response.model_copy(update={"chart": _route_chart(response, stored, chart_points, chart_method)})
+
+@api_router.get("/route/{route_id}/chart")
+async def get_route_chart(route_id: str, points: int = 500, method: str = "lttb") -> ChartSeries:
+    """
+    Séries des graphiques (vitesses, énergies et temps cumulés selon la
+    distance) sous-échantillonnées à `points` points : "lttb" (forme de la
+    courbe de vitesse éco) ou "minmax" (extrema de chaque vitesse par tranche).
+    Les cumuls restent exacts aux points retenus. Mis en cache par résolution.
+    """
+    _check_chart_options(points, method)
+    response, stored = await _route_response(route_id)
+    return _route_chart(response, stored, points, method)
+
+@api_router.get("/export/segments")
+async def export_segments(
+    format: Optional[str] = None,  # "parquet", "arrow" ou "csv" (défaut : parquet si pyarrow est installé, sinon csv)
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,  # Exclue
+    vehicle: Optional[str] = None,  # Nom exact du profil de véhicule
+    min_distance_km: Optional[float] = None,
+    max_distance_km: Optional[float] = None,
+    chunk_rows: int = route_export.DEFAULT_CHUNK_ROWS
+) -> StreamingResponse:
+    """
+    Export en flux des segments des routes persistées (une ligne par segment :
+    route_id, date, véhicule, énergies, temps et vitesses), en Arrow IPC,
+    Parquet ou CSV. Mémoire bornée : lecture par lots du curseur MongoDB et
+    encodage par blocs de chunk_rows lignes. Chaque bloc est admis dans la file
+    "bulk", après la navigation et les calculs de trajets.
+    """
+    fmt = (format or ("parquet" if route_export.arrow_available() else "csv")).lower()
+    if fmt not in route_export.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown export format: {fmt}. Available: {', '.join(route_export.EXPORT_FORMATS)}")
+    if fmt != "csv" and not route_export.arrow_available():
+        raise HTTPException(status_code=501, detail=f"{fmt} export requires pyarrow on the server. Use format=csv.")
+    if not 1000 <= chunk_rows <= 1_000_000:
+        raise HTTPException(status_code=400, detail="chunk_rows must be between 1000 and 1000000")
+    
+    query = route_export.export_query(start_date, end_date, vehicle, min_distance_km, max_distance_km)
+    cursor = db.routes.find(query, route_export.EXPORT_PROJECTION).sort("created_at", ASCENDING).batch_size(route_export.CURSOR_BATCH_SIZE)
+    filename = f"ecospeed-segments.{route_export.EXTENSIONS[fmt]}"
+    chunks = route_export.stream_export(cursor, fmt, chunk_rows)
+    # Coût : un bloc de chunk_rows lignes en mémoire et à encoder à la fois.
+    # Admission bloc par bloc, rendue avant l'envoi : rien n'est retenu pendant
+    # que le client lit, ni si le flux n'est jamais consommé. Le premier bloc
+    # est admis avant la réponse (429 possible), les suivants attendent leur tour.
+    async with admission.admit("bulk", points_cost(chunk_rows)):
+        first = await chunks.__anext__()
+    
+    async def stream():
+        try:
+            yield first
+            while True:
+                try:
+                    ticket = await admission.acquire("bulk", points_cost(chunk_rows))
+                except AdmissionRejected as e:
+                    await asyncio.sleep(e.retry_after_s)
+                    continue
+                try:
+                    chunk = await chunks.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    ticket.release()
+                yield chunk
+        finally:
+            await chunks.aclose()
+    
+    return StreamingResponse(
+        stream(),
+        media_type=route_export.MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@api_router.get("/profiles/{key}")
+async def get_profile(key: str, format: str = "speedscope", x_profile: Optional[str] = Header(None)) -> Response:
+    """
+    Profil d'une requête exécutée avec l'en-tête X-Profile (administrateurs) :
+    par identifiant de profil (en-tête X-Profile-Id de la réponse) ou par
+    route_id. Formats : speedscope (JSON), collapsed (flamegraph) ou summary.
+    """
+    if not profiling.PROFILE_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if not profiling.is_admin(x_profile):
+        raise HTTPException(status_code=403, detail="Profiling requires the admin token (X-Profile header)")
+    if format not in profiling.PROFILE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown profile format: {format}. Available: {', '.join(profiling.PROFILE_FORMATS)}")
+    
+    profile = await asyncio.to_thread(profiling.profile_store.get, key)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"No profile for {key}")
+    if format == "collapsed":
+        return PlainTextResponse(profile["collapsed"])
+    if format == "summary":
+        return JSONResponse({k: v for k, v in profile.items() if k not in ("speedscope", "collapsed")})
+    return JSONResponse(
+        profile["speedscope"],
+        headers={"Content-Disposition": f'attachment; filename="{profile["profile_id"]}.speedscope.json"'}
     )
 
 @api_router.get("/route/{route_id}/kpis")
 async def get_route_kpis(route_id: str) -> KPIResponse:
     """
-    This is a placeholder. In a real implementation, you would:
-    1. Retrieve the route from database using route_id
-    2. Calculate KPIs based on actual segment data
-    
-    For now, we'll compute from a demo route.
+    KPIs d'une route calculée (mêmes formules que les cartes KPI du frontend) :
+    économie d'énergie éco vs limitation, temps supplémentaire, CO2 évité (0,5 kg/kWh).
+    Route store d'abord, puis MongoDB comme GET /api/route/{route_id}.
     """
-    # This endpoint would normally fetch stored route data
-    # For simplicity, we're returning placeholder KPIs
-    raise HTTPException(status_code=501, detail="KPI calculation should be done on frontend based on route segments")
+    response, _ = await _route_response(route_id)
+    segments = response.segments
+    eco_energy = sum(s.eco_energy for s in segments)
+    real_energy = sum(s.real_energy for s in segments)
+    limit_energy = sum(s.limit_energy for s in segments)
+    eco_time = sum(s.eco_time for s in segments) / 60
+    real_time = sum(s.real_time for s in segments) / 60
+    limit_time = sum(s.limit_time for s in segments) / 60
+    energy_saved = limit_energy - eco_energy
+    
+    return KPIResponse(
+        eco_energy=eco_energy,
+        real_energy=real_energy,
+        limit_energy=limit_energy,
+        energy_saved=energy_saved,
+        energy_saved_percent=energy_saved / limit_energy * 100 if limit_energy > 0 else 0.0,
+        extra_time=eco_time - limit_time,
+        co2_avoided=energy_saved * 0.5,
+        total_distance=sum(s.distance for s in segments) / 1000,
+        eco_time=eco_time,
+        real_time=real_time,
+        limit_time=limit_time
+    )
+
+def _station_document(record: Dict[str, Any], synced_at: datetime) -> Dict[str, Any]:
+    # Point GeoJSON pour l'index 2dsphere
+    location = {"type": "Point", "coordinates": [record["longitude"], record["latitude"]]}
+    return dict(record, synced_at=synced_at, location=location)
+
+async def _persist_stations(records: List[Dict[str, Any]]) -> None:
+    """
+    Upsert des bornes modifiées (id Open Charge Map + hash de contenu) via la
+    file write-behind, et nouveau snapshot pour les autres workers.
+    """
+    synced_at = datetime.now(timezone.utc)
+    for record in records:
+        write_behind.put("charging_stations", _station_document(record, synced_at))
+        _station_records[record["id"]] = {k: v for k, v in record.items() if k != "content_hash"}
+    await _publish_station_snapshot()
+
+async def _remove_stations(station_ids: List[str]) -> None:
+    """
+    Bornes supprimées d'Open Charge Map : tombstone dans MongoDB (plus rechargées
+    au démarrage) et nouveau snapshot, sans elles, pour les autres workers.
+    """
+    deleted_at = datetime.now(timezone.utc)
+    for station_id in station_ids:
+        write_behind.put("charging_stations", {"id": station_id, "deleted": True, "deleted_at": deleted_at})
+        _station_records.pop(station_id, None)
+    await _publish_station_snapshot()
+
+async def _save_station_sync_state(started: datetime) -> None:
+    """Début de la dernière synchronisation complète, point de reprise après un redémarrage."""
+    write_behind.put("sync_state", {"name": "station-sync", "last_sync": started})
+
+# Bornes normalisées connues (id -> champs), source des snapshots partagés
+_station_records: Dict[str, Dict[str, Any]] = {}
+_station_snapshot_version = 0.0
+# Bornes persistées encore présentes chez Open Charge Map (hors tombstones)
+LIVE_STATIONS = {"deleted": {"$ne": True}}
+
+def _load_station_records(records: List[Dict[str, Any]], last_sync: Optional[datetime] = None, complete: bool = False) -> None:
+    """
+    Charge des bornes persistées (MongoDB ou snapshot) dans l'index local.
+    complete : les records sont toutes les bornes (snapshot), les autres sont retirées.
+    """
+    if complete:
+        ids = {record["id"] for record in records}
+        for station_id in station_sync.drop([station_id for station_id in station_sync.hashes if station_id not in ids]):
+            _station_records.pop(station_id, None)
+    station_sync.load([{k: v for k, v in record.items() if k != "location"} for record in records], last_sync)
+    for record in records:
+        _station_records[record["id"]] = {k: v for k, v in record.items() if k not in ("content_hash", "synced_at", "location")}
+
+async def _publish_station_snapshot() -> None:
+    global _station_snapshot_version
+    if not shared_cache.enabled:
+        return
+    _station_snapshot_version = time.time()
+    snapshot = {
+        "version": _station_snapshot_version,
+        "last_sync": station_sync.last_sync,
+        "records": list(_station_records.values())
+    }
+    # Sérialisation de toutes les bornes : dans un thread
+    await asyncio.to_thread(shared_cache.set, "stations", "snapshot", snapshot, STATION_SNAPSHOT_TTL_S)
+    await shared_cache.aset("stations", "version", _station_snapshot_version, STATION_SNAPSHOT_TTL_S)
+
+async def _load_station_snapshot() -> bool:
+    """Bornes du dernier snapshot publié par le worker qui synchronise (False si aucun)."""
+    global _station_snapshot_version
+    snapshot = await shared_cache.aget("stations", "snapshot")
+    if snapshot is None or snapshot["version"] <= _station_snapshot_version:
+        return False
+    await asyncio.to_thread(_load_station_records, snapshot["records"], None, True)
+    station_sync.last_sync = snapshot["last_sync"]
+    _station_snapshot_version = snapshot["version"]
+    logger.info(f"Loaded station snapshot of another worker: {len(snapshot['records'])} stations")
+    return True
+
+async def _follow_station_snapshots() -> None:
+    """Worker non élu : relit les snapshots publiés, et reprend la synchronisation si l'élu disparaît."""
+    while True:
+        await asyncio.sleep(STATION_SHARE_POLL_S)
+        try:
+            if try_lock("station-sync"):
+                logger.info("Station sync taken over by this worker")
+                await _load_station_snapshot()
+                station_sync.start()
+                return
+            version = await shared_cache.aget("stations", "version")
+            if version is not None and version > _station_snapshot_version:
+                await _load_station_snapshot()
+        except Exception as e:
+            logger.warning(f"Station snapshot refresh failed: {e}")
+
+# Copie locale des bornes, synchronisée incrémentalement en arrière-plan
+station_sync = StationSync(
+    make_station=ChargingStation,
+    persist=_persist_stations,
+    save_state=_save_station_sync_state,
+    remove=_remove_stations,
+    interval_s=float(os.environ.get('STATION_SYNC_INTERVAL_S', '900'))
+)
 
 @api_router.get("/charging-stations")
 async def get_charging_stations(
+    response: Response,
     latitude: float = None,  # Optionnel pour filtrer par zone
     longitude: float = None,
     distance: float = None  # km - optionnel
 ) -> List[ChargingStation]:
     """
-    Récupère toutes les bornes de recharge de France depuis l'API Open Charge Map.
-    Utilise l'API Open Charge Map avec la clé API fournie.
+    Récupère les bornes de recharge de France (Open Charge Map).
+    Servies depuis la copie locale synchronisée en arrière-plan dès qu'elle est
+    disponible ; sinon appel direct à l'API, les requêtes identiques simultanées
+    (même zone) partageant un seul appel. Coût d'admission : surface interrogée
+    pour un appel direct, coût fixe pour la copie locale (lecture en mémoire).
     """
-    stations = []
-    
-    # Clé API Open Charge Map
-    API_KEY = "4141afa0-52ab-4c97-9487-f91daa6c436d"
-    
-    try:
-        # Si des coordonnées sont fournies, chercher autour de ce point
+    if station_sync.ready:
+        cost = STATION_INDEX_COST
+    else:
+        area_km2 = math.pi * (distance if distance else 50) ** 2 if latitude and longitude else FRANCE_AREA_KM2
+        cost = area_cost(area_km2)
+    async with admission.admit("planning", cost):
+        return await _charging_stations(response, latitude, longitude, distance)
+
+async def _charging_stations(
+    response: Response,
+    latitude: Optional[float],
+    longitude: Optional[float],
+    distance: Optional[float]
+) -> List[ChargingStation]:
+    if station_sync.ready:
+        index = station_sync.index
         if latitude and longitude:
-            # Recherche autour d'un point spécifique
-            url = "https://api.openchargemap.io/v3/poi/"
-            params = {
-                'output': 'json',
-                'latitude': latitude,
-                'longitude': longitude,
-                'distance': distance if distance else 50,  # 50 km par défaut
-                'distanceunit': 'KM',
-                'maxresults': 1000,  # Maximum autorisé par l'API
-                'key': API_KEY,
-                'countrycode': 'FR',  # Filtrer pour la France uniquement
-            }
-            
-            response = requests.get(url, params=params, timeout=30)
-            if response.status_code == 200:
-                data = response.json()
-                logger.info(f"Found {len(data)} charging stations near coordinates")
-                
-                for poi in data:
-                    address_info = poi.get('AddressInfo', {})
-                    connections = poi.get('Connections', [])
-                    
-                    if not connections or not address_info.get('Latitude') or not address_info.get('Longitude'):
-                        continue
-                    
-                    # Prendre la connexion avec la plus haute puissance
-                    max_power = 0
-                    for conn in connections:
-                        power_kw = conn.get('PowerKW', 0) or 0
-                        if power_kw > max_power:
-                            max_power = power_kw
-                    
-                    if max_power == 0:
-                        max_power = 22  # Valeur par défaut
-                    
-                    # Statut
-                    status_type = poi.get('StatusType', {})
-                    status_id = status_type.get('ID', 0) if status_type else 0
-                    if status_id == 50:  # En service
-                        status = 'Dispo'
-                    elif status_id == 0:  # Inconnu
-                        status = 'Dispo'
-                    else:
-                        status = 'Hors service'
-                    
-                    # Nom de l'opérateur
-                    operator_info = poi.get('OperatorInfo', {})
-                    operator = operator_info.get('Title', 'Opérateur inconnu') if operator_info else 'Opérateur inconnu'
-                    
-                    # Nom de la station
-                    name = address_info.get('Title', 'Borne de recharge')
-                    
-                    # Adresse
-                    address_line = address_info.get('AddressLine1', '')
-                    town = address_info.get('Town', '')
-                    address = f"{address_line}, {town}".strip(', ')
-                    
-                    # Prix (si disponible)
-                    usage_info = poi.get('UsageType', {})
-                    price = None
-                    if usage_info and usage_info.get('IsPayAtLocation'):
-                        price = 'Tarif variable'
-                    
-                    station = ChargingStation(
-                        name=name,
-                        operator=operator,
-                        powerKw=float(max_power),
-                        price=price,
-                        status=status,
-                        latitude=address_info.get('Latitude'),
-                        longitude=address_info.get('Longitude'),
-                        address=address if address else town
-                    )
-                    
-                    stations.append(station)
-        else:
-            # Récupérer toutes les bornes de France en faisant plusieurs requêtes
-            # La France s'étend approximativement de 42°N à 51°N et de -5°E à 8°E
-            # On divise en grille pour récupérer toutes les bornes
-            
-            # Coordonnées approximatives de la France (centres de régions)
-            france_centers = [
-                (48.8566, 2.3522),   # Paris/Île-de-France
-                (45.7640, 4.8357),   # Lyon/Auvergne-Rhône-Alpes
-                (43.2965, 5.3698),   # Marseille/Provence-Alpes-Côte d'Azur
-                (44.8378, -0.5792),  # Bordeaux/Nouvelle-Aquitaine
-                (47.2184, -1.5536),  # Nantes/Pays de la Loire
-                (50.6292, 3.0573),   # Lille/Hauts-de-France
-                (49.4431, 1.0993),   # Rouen/Normandie
-                (48.1173, -1.6778),  # Rennes/Bretagne
-                (47.2378, 6.0241),   # Besançon/Bourgogne-Franche-Comté
-                (48.5734, 7.7521),   # Strasbourg/Grand Est
-                (46.2276, 2.2137),   # Orléans/Centre-Val de Loire
-                (46.3072, -0.3376),  # Poitiers/Nouvelle-Aquitaine
-                (43.6108, 1.4442),   # Toulouse/Occitanie
-                (43.7102, 7.2620),   # Nice/Provence-Alpes-Côte d'Azur
-            ]
-            
-            all_stations_dict = {}  # Utiliser un dict pour éviter les doublons
-            
-            for lat, lon in france_centers:
-                try:
-                    url = "https://api.openchargemap.io/v3/poi/"
-                    params = {
-                        'output': 'json',
-                        'latitude': lat,
-                        'longitude': lon,
-                        'distance': 200,  # 200 km pour couvrir une grande zone
-                        'distanceunit': 'KM',
-                        'maxresults': 1000,
-                        'key': API_KEY,
-                        'countrycode': 'FR',
-                    }
-                    
-                    response = requests.get(url, params=params, timeout=30)
-                    if response.status_code == 200:
-                        data = response.json()
-                        logger.info(f"Found {len(data)} stations near ({lat}, {lon})")
-                        
-                        for poi in data:
-                            address_info = poi.get('AddressInfo', {})
-                            connections = poi.get('Connections', [])
-                            
-                            if not connections or not address_info.get('Latitude') or not address_info.get('Longitude'):
-                                continue
-                            
-                            # Utiliser latitude+longitude comme clé unique
-                            station_key = f"{address_info.get('Latitude')}_{address_info.get('Longitude')}"
-                            if station_key in all_stations_dict:
-                                continue  # Déjà ajoutée
-                            
-                            # Prendre la connexion avec la plus haute puissance
-                            max_power = 0
-                            for conn in connections:
-                                power_kw = conn.get('PowerKW', 0) or 0
-                                if power_kw > max_power:
-                                    max_power = power_kw
-                            
-                            if max_power == 0:
-                                max_power = 22  # Valeur par défaut
-                            
-                            # Statut
-                            status_type = poi.get('StatusType', {})
-                            status_id = status_type.get('ID', 0) if status_type else 0
-                            if status_id == 50:  # En service
-                                status = 'Dispo'
-                            elif status_id == 0:  # Inconnu
-                                status = 'Dispo'
-                            else:
-                                status = 'Hors service'
-                            
-                            # Nom de l'opérateur
-                            operator_info = poi.get('OperatorInfo', {})
-                            operator = operator_info.get('Title', 'Opérateur inconnu') if operator_info else 'Opérateur inconnu'
-                            
-                            # Nom de la station
-                            name = address_info.get('Title', 'Borne de recharge')
-                            
-                            # Adresse
-                            address_line = address_info.get('AddressLine1', '')
-                            town = address_info.get('Town', '')
-                            address = f"{address_line}, {town}".strip(', ')
-                            
-                            # Prix (si disponible)
-                            usage_info = poi.get('UsageType', {})
-                            price = None
-                            if usage_info and usage_info.get('IsPayAtLocation'):
-                                price = 'Tarif variable'
-                            
-                            station = ChargingStation(
-                                name=name,
-                                operator=operator,
-                                powerKw=float(max_power),
-                                price=price,
-                                status=status,
-                                latitude=address_info.get('Latitude'),
-                                longitude=address_info.get('Longitude'),
-                                address=address if address else town
-                            )
-                            
-                            all_stations_dict[station_key] = station
-                    
-                    # Petite pause entre les requêtes pour éviter de surcharger l'API
-                    time.sleep(0.5)
-                    
-                except Exception as e:
-                    logger.warning(f"Error fetching stations near ({lat}, {lon}): {e}")
-                    continue
-            
-            stations = list(all_stations_dict.values())
-            logger.info(f"Successfully loaded {len(stations)} unique charging stations from Open Charge Map")
+            return [index.stations[i] for i in index.within(latitude, longitude, distance if distance else 50)]
+        return list(index.stations)
     
-    except Exception as e:
-        logger.error(f"Error fetching charging stations from Open Charge Map: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
+    # Clé normalisée : ~10 m de précision sur les coordonnées, rayon par défaut explicite
+    if latitude and longitude:
+        query = {"latitude": round(latitude, 4), "longitude": round(longitude, 4), "distance": distance if distance else 50}
+    else:
+        query = {"country": "FR"}
     
-    # Si aucune borne n'a été trouvée, retourner des bornes de démo
-    if not stations:
-        logger.warning("No stations found, returning demo stations")
+    stations, failed_regions = await station_flight.do(
+        request_key("stations", query),
+        lambda: _fetch_charging_stations(latitude, longitude, distance)
+    )
+    if failed_regions:
+        # Résultat partiel : signalé au client et jamais mis en cache
+        response.headers["X-Failed-Regions"] = str(failed_regions)
+        response.headers["Cache-Control"] = "no-store"
+    return stations
+
+async def _get_station_index() -> StationIndex:
+    """
+    Index de toutes les bornes de France : celui de la synchronisation locale,
+    ou à défaut reconstruit depuis l'API au plus toutes les STATION_INDEX_TTL_S
+    secondes (une seule reconstruction à la fois).
+    """
+    global _station_index, _station_index_built_at
+    if station_sync.ready:
+        return station_sync.index
+    if _station_index is not None and time.time() - _station_index_built_at < STATION_INDEX_TTL_S:
+        return _station_index
+    
+    async def build() -> StationIndex:
+        global _station_index, _station_index_built_at
+        stations, failed_regions = await _fetch_charging_stations(None, None, None)
+        _station_index = StationIndex(stations)
+        # Index partiel : nouvelle tentative après une minute au lieu de STATION_INDEX_TTL_S
+        _station_index_built_at = time.time() - (STATION_INDEX_TTL_S - 60 if failed_regions else 0)
+        logger.info(f"Station index version {_station_index.version}: {len(stations)} stations")
+        return _station_index
+    
+    return await station_flight.do(request_key("stations-index", {"country": "FR"}), build)
+
+@api_router.get("/charging-stations/viewport")
+async def get_charging_stations_viewport(
+    min_lat: float,
+    min_lon: float,
+    max_lat: float,
+    max_lon: float,
+    zoom: Optional[int] = None,  # Zoom de la carte : regroupement par grille en dessous de 14
+    cursor: Optional[str] = None,  # next_cursor de la page précédente
+    limit: int = 500
+) -> StationViewportResponse:
+    """
+    Bornes visibles dans une emprise (bbox) de carte, paginées par curseur.
+    Aux zooms faibles, les zones denses sont regroupées côté serveur en clusters
+    (une cellule de 64 px par cluster), la carte ne télécharge que ce qu'elle affiche.
+    """
+    if not (-90 <= min_lat <= max_lat <= 90) or not (-180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+        raise HTTPException(status_code=400, detail="Invalid bounding box")
+    if zoom is not None and not 0 <= zoom <= 22:
+        raise HTTPException(status_code=400, detail="zoom must be between 0 and 22")
+    if not 1 <= limit <= 2000:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 2000")
+    
+    index = await _get_station_index()
+    offset = 0
+    if cursor:
+        try:
+            version, offset = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if version != index.version:
+            raise HTTPException(status_code=410, detail="Station data changed, restart from the first page")
+    
+    page = index.query(min_lat, min_lon, max_lat, max_lon, zoom=zoom, offset=offset, limit=limit)
+    return StationViewportResponse(
+        stations=page["stations"],
+        clusters=[StationCluster(**cluster) for cluster in page["clusters"]],
+        total=page["total"],
+        next_cursor=encode_cursor(index.version, page["next_offset"]) if page["next_offset"] is not None else None
+    )
+
+@api_router.post("/reachability")
+async def get_reachability(request: ReachabilityRequest) -> ReachabilityResponse:
+    """
+    Zone atteignable depuis un point avec la batterie disponible (au-dessus de
+    battery_end_pct) : une seule recherche un-vers-tous bornée par l'énergie,
+    avec le véhicule, les passagers et la climatisation de la requête, plus les
+    bornes de recharge atteignables. Résultats en cache par (cellule d'origine,
+    classe de véhicule, tranche de batterie de 5 %).
+    """
+    t0 = time.perf_counter()
+    
+    if request.latitude is None or request.longitude is None:
+        if not request.start:
+            raise HTTPException(status_code=400, detail="latitude/longitude or start is required")
+        location = await _geocode(request.start)
+        if location is None:
+            raise HTTPException(status_code=404, detail=f"Location not found: {request.start}")
+        latitude, longitude = location.latitude, location.longitude
+    else:
+        latitude, longitude = request.latitude, request.longitude
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise HTTPException(status_code=400, detail="Invalid coordinates")
+    
+    vehicle = request.vehicle_profile
+    total_mass_kg, aux_power_kw = _total_mass_and_aux_power(
+        vehicle,
+        request.num_passengers,
+        request.avg_weight_kg,
+        request.use_climate,
+        request.climate_intensity
+    )
+    context = route_physics.VehiclePhysicsContext.from_vehicle(vehicle, total_mass_kg, aux_power_kw, request.rho_air)
+    usable_kwh = _usable_battery_kwh(vehicle)
+    
+    key = ReachabilityCache.key(context, usable_kwh, latitude, longitude, request.battery_start_pct,
+                                request.battery_end_pct, request.user_max_speed)
+    area = reachability_cache.get(key)
+    cached = area is not None
+    if area is None:
+        async def search():
+            result = await asyncio.to_thread(
+                reachable_area, context, usable_kwh, latitude, longitude,
+                request.battery_start_pct, request.battery_end_pct, request.user_max_speed
+            )
+            reachability_cache.put(key, result)
+            return result
+        
+        try:
+            area = await reachability_flight.do(request_key("reachability", {"key": repr(key)}), search)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    # Bornes atteignables : cellule de la borne dans la zone
+    stations = []
+    try:
+        index = await _get_station_index()
+    except UpstreamUnavailable as e:
+        logger.warning(f"Reachability without stations: {e}")
+        index = None
+    if index is not None and len(index):
+        energy = area.locate(index.lat, index.lon)
+        reachable = np.flatnonzero(~np.isnan(energy))
+        reachable = reachable[np.argsort(energy[reachable], kind="stable")][:max(request.max_stations, 0)]
         stations = [
-            ChargingStation(
-                name='Supercharger Paris-La Défense',
-                operator='Tesla',
-                powerKw=250,
-                price='0.40€/kWh',
-                status='Dispo',
-                latitude=48.8925,
-                longitude=2.2383,
-                address='Paris-La Défense'
-            ),
-            ChargingStation(
-                name='Ionity Autoroute A6',
-                operator='Ionity',
-                powerKw=350,
-                price='0.79€/kWh',
-                status='Dispo',
-                latitude=48.8566,
-                longitude=2.3522,
-                address='Autoroute A6'
-            ),
-            ChargingStation(
-                name='Total Energies Champs-Élysées',
-                operator='Total',
-                powerKw=175,
-                price='0.45€/kWh',
-                status='Dispo',
-                latitude=48.8698,
-                longitude=2.3081,
-                address='Champs-Élysées, Paris'
-            ),
-            ChargingStation(
-                name='Electra Parking Opéra',
-                operator='Electra',
-                powerKw=150,
-                price='0.44€/kWh',
-                status='Occupée',
-                latitude=48.8706,
-                longitude=2.3317,
-                address='Opéra, Paris'
-            ),
+            ReachableStation(
+                station=index.stations[i],
+                energy_kwh=round(float(energy[i]), 3),
+                battery_arrival_pct=round(float(area.battery_at(energy[i])), 1)
+            )
+            for i in reachable.tolist()
         ]
     
-    # Retourner toutes les bornes (pas de limite)
-    # La pagination côté frontend gère l'affichage
-    logger.info(f"Returning {len(stations)} charging stations (no limit)")
-    return stations
+    battery = np.round(area.battery_at(area.energy), 1)
+    return ReachabilityResponse(
+        latitude=latitude,
+        longitude=longitude,
+        battery_start_pct=area.battery_pct,
+        budget_kwh=round(area.budget_kwh, 2),
+        source=area.source,
+        cell_size_deg=area.cell_deg,
+        polygon=area.polygon(),
+        cells=np.column_stack([np.round(area.lat, 5), np.round(area.lon, 5), battery]).tolist(),
+        stations=stations,
+        cached=cached,
+        computation_ms=round((time.perf_counter() - t0) * 1000, 2)
+    )
+
+async def _fetch_charging_stations(
+    latitude: Optional[float],
+    longitude: Optional[float],
+    distance: Optional[float]
+) -> tuple[List[ChargingStation], int]:
+    """
+    Appel direct à l'API Open Charge Map (OCM_BASE_URL) via le scheduler sortant.
+    Utilisé tant que la synchronisation locale des bornes n'a pas encore abouti.
+    Retourne (bornes, nombre de régions en échec) : résultats partiels si certaines
+    régions échouent, erreur (503) seulement si Open Charge Map est indisponible.
+    """
+    # Si des coordonnées sont fournies, chercher autour de ce point
+    if latitude and longitude:
+        pois, _ = await outbound.call("ocm", fetch_pois, latitude, longitude, distance if distance else 50)  # 50 km par défaut
+        logger.info(f"Found {len(pois)} charging stations near coordinates")
+        stations = []
+        for record in map(normalize_poi, pois):
+            if record is not None:
+                record.pop('id')
+                stations.append(ChargingStation(**record))
+        return stations, 0
+    
+    # Toutes les bornes de France : requêtes par région en parallèle (concurrence bornée),
+    # fusionnées au fil des réponses avec déduplication sur l'identifiant Open Charge Map
+    async def fetch_region(center):
+        pois, _ = await outbound.call("ocm", fetch_pois, center[0], center[1], 200)  # 200 km pour couvrir une grande zone
+        return pois
+    
+    all_stations_dict = {}
+    failed_regions = 0
+    error = None
+    async for (lat, lon), pois, region_error in fan_out(REGION_CENTERS, fetch_region, FETCH_CONCURRENCY, OCM_REGION_TIMEOUT_S):
+        if region_error is not None:
+            logger.warning(f"Error fetching stations near ({lat}, {lon}): {region_error!r}")
+            failed_regions += 1
+            error = region_error
+            continue
+        logger.info(f"Found {len(pois)} stations near ({lat}, {lon})")
+        for record in map(normalize_poi, pois):
+            if record is not None and record['id'] not in all_stations_dict:
+                all_stations_dict[record.pop('id')] = ChargingStation(**record)
+    
+    if not all_stations_dict and error is not None:
+        raise error if isinstance(error, UpstreamUnavailable) else UpstreamUnavailable("ocm", str(error))
+    
+    stations = list(all_stations_dict.values())
+    logger.info(f"Loaded {len(stations)} unique charging stations from Open Charge Map ({failed_regions} regions failed)")
+    return stations, failed_regions
 
 # Root endpoint
 @app.get("/")
@@ -1506,9 +2160,34 @@ async def root():
         "api": "/api"
     }
 
+@app.exception_handler(UpstreamUnavailable)
+async def upstream_unavailable_handler(request, exc: UpstreamUnavailable):
+    # Fournisseur externe indisponible (circuit ouvert, quota, erreurs répétées) : échec explicite
+    headers = {"Retry-After": str(max(1, math.ceil(exc.retry_after_s)))} if exc.retry_after_s else None
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers=headers)
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request, exc: AdmissionRejected):
+    # Serveur saturé : rejet immédiat plutôt qu'une file d'attente sans fin
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(min(max(1, math.ceil(exc.retry_after_s)), 300))}
+    )
+
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(
+    HttpCachingMiddleware,
+    policies=[
+        (r"/api/vehicle-profiles", f"public, max-age={VEHICLE_PROFILES_MAX_AGE}"),
+        (r"/api/charging-stations(/viewport)?", f"public, max-age={CHARGING_STATIONS_MAX_AGE}, stale-while-revalidate={CHARGING_STATIONS_MAX_AGE * 6}"),
+        # Une route calculée ne change plus pour un route_id donné
+        (r"/api/route/[^/]+(/kpis|/chart)?", f"public, max-age={STORED_ROUTE_MAX_AGE}"),
+    ]
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1517,6 +2196,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Profilage à la demande (en-tête X-Profile) : aucun coût si PROFILE_TOKEN n'est pas défini.
+# Ajouté en dernier : englobe les autres middlewares et la sérialisation des réponses
+if profiling.PROFILE_TOKEN:
+    app.add_middleware(ProfilingMiddleware, store=profiling.profile_store, guard=profiling.profile_guard)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -1524,6 +2208,103 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def start_physics_executor():
+    # Pre-warm the physics worker processes before the first long route arrives
+    await asyncio.to_thread(physics_executor.start)
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    loop_monitor.start()
+
+@app.on_event("startup")
+async def load_vehicle_catalog():
+    # Profils intégrés (fichier) + profils de flotte enregistrés (MongoDB)
+    global _vehicle_catalog_stamp
+    _vehicle_catalog()
+    if shared_cache.enabled:
+        _vehicle_catalog_stamp = await shared_cache.aget("vehicle-catalog", "stamp")
+        _follower_tasks.append(asyncio.create_task(_follow_vehicle_catalog()))
+    try:
+        await _reload_custom_profiles()
+    except Exception as e:
+        logger.warning(f"Custom vehicle profiles not loaded: {e}")
+        # Le suivi réessaie dès qu'un tampon est publié
+        _vehicle_catalog_stamp = None
+
+def preload_shared_state() -> None:
+    """
+    Appelé par gunicorn (gunicorn.conf.py) dans le processus maître avant de
+    créer les workers : l'index des bornes, construit une seule fois, est
+    hérité par tous les workers (copy-on-write) au lieu d'être rechargé par chacun.
+    """
+    from pymongo import MongoClient
+    
+    sync_client = MongoClient(mongo_url, serverSelectionTimeoutMS=5000)
+    try:
+        sync_db = sync_client[os.environ['DB_NAME']]
+        records = list(sync_db.charging_stations.find(LIVE_STATIONS, {"_id": 0}))
+        sync_state = sync_db.sync_state.find_one({"name": "station-sync"}) or {}
+    except Exception as e:
+        logger.warning(f"Charging stations not preloaded: {e}")
+        return
+    finally:
+        # Aucun client MongoDB ouvert ne doit traverser le fork
+        sync_client.close()
+    _load_station_records(records, sync_state.get("last_sync"))
+    logger.info(f"Preloaded {len(records)} charging stations before forking workers")
+
+@app.on_event("startup")
+async def start_station_sync():
+    # Bornes déjà chargées (préchargement gunicorn), sinon snapshot d'un autre worker ou MongoDB
+    if not station_sync.ready and not await _load_station_snapshot():
+        try:
+            records = await asyncio.wait_for(db.charging_stations.find(LIVE_STATIONS, {"_id": 0}).to_list(None), timeout=10)
+            sync_state = await asyncio.wait_for(db.sync_state.find_one({"name": "station-sync"}), timeout=5) or {}
+            _load_station_records(records, sync_state.get("last_sync"))
+            logger.info(f"Loaded {len(records)} synchronized charging stations")
+            # Bornes enregistrées avant l'index 2dsphere : ajout du point GeoJSON
+            for record in records:
+                if "location" not in record and "synced_at" in record:
+                    write_behind.put("charging_stations", _station_document(record, record["synced_at"]))
+        except Exception as e:
+            logger.warning(f"Synchronized charging stations not loaded: {e}")
+    # Un seul worker synchronise avec Open Charge Map, les autres suivent ses snapshots
+    if try_lock("station-sync"):
+        if station_sync.ready:
+            await _publish_station_snapshot()
+        station_sync.start()
+    else:
+        _follower_tasks.append(asyncio.create_task(_follow_station_snapshots()))
+
+@app.on_event("startup")
+async def start_write_behind():
+    # Index (TTL, 2dsphere) créés par le writer, puis cache des géocodages réchauffé depuis MongoDB
+    write_behind.start()
+    try:
+        documents = await asyncio.wait_for(
+            db.geocodes.find({"expires_at": {"$gt": datetime.now(timezone.utc)}}, {"_id": 0})
+            .sort("updated_at", DESCENDING).limit(GEOCODE_CACHE_MAX_ENTRIES).to_list(None),
+            timeout=5
+        )
+    except Exception as e:
+        logger.warning(f"Persisted geocodes not loaded: {e}")
+        return
+    for document in reversed(documents):
+        updated_at = document["updated_at"]
+        updated_at = updated_at if updated_at.tzinfo else updated_at.replace(tzinfo=timezone.utc)
+        location = Location(document["address"], (document["latitude"], document["longitude"]), document.get("raw") or {})
+        _geocode_cache[document["query"]] = (updated_at.timestamp(), location)
+    logger.info(f"Loaded {len(documents)} persisted geocodes")
+
+_follower_tasks: List[asyncio.Task] = []
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    for task in _follower_tasks:
+        task.cancel()
+    await station_sync.stop()
+    await write_behind.stop()
+    await loop_monitor.stop()
+    client.close()
+    physics_executor.shutdown()
\ No newline at end of file
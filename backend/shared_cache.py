@@ -0,0 +1,204 @@
+"""
+Cross-process shared cache for ECOSPEED
+In the multi-worker production mode (gunicorn.conf.py) every worker is a
+separate process: in-process caches would be duplicated and cold in each
+of them. This tier is one SQLite database in WAL mode, on shared memory
+(/dev/shm) when available, seen by all the workers of the host:
+
+- values are pickled, grouped by namespace ("geocode", "ors-route",
+  "route", "stations"...) with a TTL each
+- reads are a primary-key lookup (tens of microseconds); writes go through
+  a worker thread so the event loop never waits on the database lock
+- the size is bounded (SHARED_CACHE_MAX_MB): oldest entries are evicted
+- any database error counts as a miss: the cache never fails a request
+
+Connections are opened per process and per thread (SQLite handles must not
+cross a fork). SHARED_CACHE_DIR sets the directory (empty: disabled,
+default: ecospeed-<uid> in /dev/shm); it also holds the lock files electing
+the worker that runs a singleton job. Since its values are unpickled, the
+directory must be private: created 0700, and refused (cache disabled) if it
+is not owned by the current user or is writable by others.
+"""
+import asyncio
+import fcntl
+import logging
+import os
+import pickle
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_default_dir = Path("/dev/shm") if Path("/dev/shm").is_dir() else Path(tempfile.gettempdir())
+SHARED_CACHE_DIR = os.environ.get('SHARED_CACHE_DIR', str(_default_dir / f"ecospeed-{os.getuid()}"))
+SHARED_CACHE_MAX_MB = float(os.environ.get('SHARED_CACHE_MAX_MB', '48'))
+EVICTION_EVERY = 64  # Writes between two size checks
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_stored_at ON entries (stored_at);
+"""
+
+
+class SharedCache:
+    """Pickled key-value entries with TTL in a SQLite file shared by processes (disabled without a path)."""
+
+    def __init__(self, path: Optional[str], max_bytes: int = 48 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writes = 0
+        self.counters = {"hits": 0, "misses": 0, "writes": 0, "errors": 0, "evicted": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per (process, thread): a forked worker opens its own
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            Path(self.path).parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=2.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # A cache: losing the last writes on a crash is fine
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.executescript(_SCHEMA)
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def get(self, namespace: str, key: str) -> Any:
+        """Cached value, or None if missing, expired or unreadable."""
+        if not self.enabled:
+            return None
+        try:
+            row = self._connection().execute(
+                "SELECT value FROM entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, key, time.time())
+            ).fetchone()
+            value = pickle.loads(row[0]) if row is not None else None
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.debug(f"Shared cache read failed ({namespace}): {e!r}")
+            return None
+        self.counters["hits" if value is not None else "misses"] += 1
+        return value
+
+    def set_pickled(self, namespace: str, key: str, data: bytes, ttl_s: float) -> None:
+        if not self.enabled:
+            return
+        now = time.time()
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, data, len(data), now, now + ttl_s)
+            )
+            self.counters["writes"] += 1
+            self._writes += 1
+            if self._writes % EVICTION_EVERY == 0:
+                self._evict()
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.debug(f"Shared cache write failed ({namespace}): {e!r}")
+
+    def set(self, namespace: str, key: str, value: Any, ttl_s: float) -> None:
+        if self.enabled:
+            self.set_pickled(namespace, key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ttl_s)
+
+    def _evict(self) -> None:
+        """Remove expired entries, then the oldest ones while over max_bytes."""
+        connection = self._connection()
+        removed = connection.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),)).rowcount
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total > self.max_bytes:
+            # Oldest entries first, down to 90 % of the budget
+            excess = total - 0.9 * self.max_bytes
+            cutoff = None
+            for stored_at, size in connection.execute("SELECT stored_at, size FROM entries ORDER BY stored_at"):
+                excess -= size
+                cutoff = stored_at
+                if excess <= 0:
+                    break
+            removed += connection.execute("DELETE FROM entries WHERE stored_at <= ?", (cutoff,)).rowcount
+        self.counters["evicted"] += removed
+
+    async def aget(self, namespace: str, key: str) -> Any:
+        if not self.enabled:
+            return None
+        return await asyncio.to_thread(self.get, namespace, key)
+
+    async def aset(self, namespace: str, key: str, value: Any, ttl_s: float) -> None:
+        """
+        Store a value: pickled right away (a consistent snapshot even if the
+        caller mutates it afterwards), written from a worker thread.
+        """
+        if not self.enabled:
+            return
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        await asyncio.to_thread(self.set_pickled, namespace, key, data, ttl_s)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "pid": os.getpid(), **self.counters}
+
+
+def try_lock(name: str) -> bool:
+    """
+    Non-blocking exclusive lock held until the process exits, to elect one
+    worker for a singleton job. Always True when the shared directory is disabled.
+    """
+    if not SHARED_CACHE_DIR:
+        return True
+    locks = _held_locks.setdefault(os.getpid(), {})
+    if name in locks:
+        return True
+    fd = os.open(os.path.join(SHARED_CACHE_DIR, f"{name}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    locks[name] = fd
+    return True
+
+
+_held_locks: Dict[int, Dict[str, int]] = {}
+
+
+def secure_directory(path: str) -> bool:
+    """
+    Create `path` private to this user (0700), or check that an existing one
+    is a real directory owned by this user and not writable by others.
+    """
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        info = os.lstat(path)
+    except OSError as e:
+        logger.warning(f"Shared cache directory {path} unusable: {e}")
+        return False
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o022:
+        logger.warning(f"Shared cache disabled: {path} is not a private directory of this user")
+        return False
+    return True
+
+
+# Nothing is unpickled from (nor any lock taken in) a directory others can write to
+if SHARED_CACHE_DIR and not secure_directory(SHARED_CACHE_DIR):
+    SHARED_CACHE_DIR = ''
+
+shared_cache = SharedCache(
+    os.path.join(SHARED_CACHE_DIR, "cache.sqlite3") if SHARED_CACHE_DIR else None,
+    max_bytes=int(SHARED_CACHE_MAX_MB * 1024 * 1024),
+)
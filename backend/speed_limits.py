@@ -0,0 +1,297 @@
+"""
+Speed limits for ECOSPEED
+Per-point speed limits from real OSM `maxspeed` tags, with a vectorized
+fallback on French defaults by road type.
+
+The OSM limits are stored as a compact sorted table built offline from a
+local OSM extract: every way with a maxspeed tag is rasterized into grid
+cells of GRID_DEG degrees (~50 m), and each (cell, road group) key maps to
+a limit in km/h. Road groups are the OSM highway classes that an
+OpenRouteService route can tell apart (see ors_road_classes): the table is
+built from OSM classes but queried with classes derived from the ORS
+extras, so both sides are reduced to the same groups. Keys (int64) and limits (uint8) are saved as two .npy files
+and memory-mapped at runtime, so the table costs 9 bytes per entry and is
+shared by the page cache between processes. A route is labeled with one
+np.searchsorted call.
+
+Build the table (OSM XML, optionally .gz / .bz2):
+    python speed_limits.py build france-latest.osm.bz2 data/speed_limits
+and point SPEED_LIMITS_PATH to the output directory (default: data/speed_limits).
+Tables built before road groups existed (no "format" file) must be rebuilt.
+"""
+import bz2
+import gzip
+import logging
+import os
+import sys
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SPEED_LIMITS_PATH = Path(__file__).parent / "data" / "speed_limits"
+GRID_DEG = 0.0005  # Cell size (~55 m in latitude)
+
+TABLE_FORMAT = "2"  # Keys on road groups
+
+# Road classes (OSM highway values), also used for the points of OpenRouteService routes
+ROAD_CLASSES = {
+    "motorway": 1, "motorway_link": 1,
+    "trunk": 2, "trunk_link": 2,
+    "primary": 3, "primary_link": 3,
+    "secondary": 4, "secondary_link": 4,
+    "tertiary": 5, "tertiary_link": 5,
+    "unclassified": 6,
+    "residential": 7, "living_street": 7,
+    "service": 8,
+}
+
+# OpenRouteService does not return the OSM highway value of a route, only
+# coarse groups of it (WayType in openrouteservice): waytype 1 "State Road" =
+# motorway, trunk, primary; 2 "Road" = secondary, tertiary, unclassified;
+# 3 "Street" = residential, living_street, service; 4 and above = paths,
+# tracks, cycleways, footways, steps, ferries, construction. The waycategory
+# extra flags motorways (bit 1, "Highways"). Each waytype maps to the class
+# whose defaults fit the group best.
+ORS_WAYTYPE_CLASSES = {
+    0: 0,
+    1: ROAD_CLASSES["primary"],
+    2: ROAD_CLASSES["tertiary"],
+    3: ROAD_CLASSES["residential"],
+}
+ORS_WAYCATEGORY_HIGHWAY = 1
+
+# Road group of each road class id (index): unknown, motorway, trunk and
+# primary, secondary to unclassified, streets
+ROAD_GROUPS = np.array([0, 1, 2, 2, 3, 3, 3, 4, 4], dtype=np.int64)
+
+# Implicit French limits (maxspeed=FR:xxx)
+IMPLICIT_LIMITS = {
+    "fr:urban": 50, "fr:rural": 80, "fr:trunk": 110, "fr:motorway": 130,
+    "fr:zone30": 30, "fr:zone:30": 30, "fr:walk": 6, "fr:living_street": 20,
+}
+
+
+# ============================================================================
+# VECTORIZED ROAD-TYPE DEFAULTS
+# ============================================================================
+
+def ors_road_classes(point_count: int, waytypes, waycategories=()) -> np.ndarray:
+    """
+    Road class id of every point of an OpenRouteService route from its
+    waytype and waycategory extras ([first point, last point, value] ranges).
+    """
+    road_class = np.zeros(point_count, dtype=np.int64)
+    # Reversed so that the first range containing a point wins
+    for first, last, waytype in reversed(waytypes):
+        road_class[first:last + 1] = ORS_WAYTYPE_CLASSES.get(waytype, ROAD_CLASSES["unclassified"])
+    for first, last, category in waycategories:
+        if category & ORS_WAYCATEGORY_HIGHWAY:
+            road_class[first:last + 1] = ROAD_CLASSES["motorway"]
+    return road_class
+
+
+def default_limits(road_class: np.ndarray, is_urban: np.ndarray, user_max_speed: int = 130) -> np.ndarray:
+    """
+    French default speed limits for arrays of road class ids (0 = unknown)
+    and urban flags: 50 km/h in town except on motorways.
+    """
+    capped = lambda speed: min(speed, user_max_speed)  # noqa: E731
+    # Index = road class id: unknown, motorway, trunk, primary, secondary, tertiary, unclassified, residential, service
+    rural = np.array([50, capped(130), capped(110), capped(90), capped(90), capped(90), 50, 50, 30], dtype=np.float64)
+    urban = np.array([50, capped(130), 50, 50, 50, 50, 50, 50, 50], dtype=np.float64)
+    road_class = np.clip(np.asarray(road_class, dtype=np.int64), 0, len(rural) - 1)
+    return np.where(np.asarray(is_urban, dtype=bool), urban[road_class], rural[road_class])
+
+
+# ============================================================================
+# OSM MAXSPEED TABLE
+# ============================================================================
+
+def cell_keys(lat: np.ndarray, lon: np.ndarray, road_class: np.ndarray) -> np.ndarray:
+    """int64 (grid cell, road class) keys of points, sortable and searchable with np.searchsorted."""
+    lat_q = np.floor((np.asarray(lat) + 90.0) / GRID_DEG).astype(np.int64)
+    lon_q = np.floor((np.asarray(lon) + 180.0) / GRID_DEG).astype(np.int64)
+    return (((lat_q << 21) | lon_q) << 4) | np.asarray(road_class, dtype=np.int64)
+
+
+def group_keys(lat: np.ndarray, lon: np.ndarray, road_class: np.ndarray) -> np.ndarray:
+    """(grid cell, road group) keys of points of the given road classes."""
+    groups = ROAD_GROUPS[np.clip(np.asarray(road_class, dtype=np.int64), 0, len(ROAD_GROUPS) - 1)]
+    return cell_keys(lat, lon, groups)
+
+
+class SpeedLimitTable:
+    """Sorted (cell, road group) -> maxspeed table, usually memory-mapped."""
+
+    def __init__(self, keys: np.ndarray, limits: np.ndarray):
+        self.keys = keys
+        self.limits = limits
+
+    @classmethod
+    def load(cls, path) -> "SpeedLimitTable":
+        path = Path(path)
+        table_format = (path / "format").read_text().strip() if (path / "format").exists() else "1"
+        if table_format != TABLE_FORMAT:
+            raise ValueError(f"table format {table_format}, expected {TABLE_FORMAT}: rebuild it")
+        return cls(
+            np.load(path / "keys.npy", mmap_mode="r"),
+            np.load(path / "limits.npy", mmap_mode="r"),
+        )
+
+    def save(self, path) -> None:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "keys.npy", np.ascontiguousarray(self.keys))
+        np.save(path / "limits.npy", np.ascontiguousarray(self.limits))
+        (path / "format").write_text(TABLE_FORMAT)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def lookup(self, lat, lon, road_class) -> np.ndarray:
+        """OSM speed limits (km/h) of the points, NaN where no maxspeed is known."""
+        keys = group_keys(lat, lon, road_class)
+        result = np.full(len(keys), np.nan)
+        if not len(self.keys):
+            return result
+        slot = np.searchsorted(self.keys, keys).clip(max=len(self.keys) - 1)
+        found = self.keys[slot] == keys
+        result[found] = self.limits[slot[found]]
+        return result
+
+
+def parse_maxspeed(value: str) -> Optional[int]:
+    """km/h value of an OSM maxspeed tag (None for none/signals/variable...)."""
+    limits = []
+    for part in value.lower().replace(",", ";").split(";"):
+        part = part.strip()
+        if part in IMPLICIT_LIMITS:
+            limits.append(IMPLICIT_LIMITS[part])
+            continue
+        number, _, unit = part.partition(" ")
+        try:
+            speed = float(number)
+        except ValueError:
+            continue
+        if unit.strip() == "mph":
+            speed *= 1.609344
+        limits.append(int(round(speed)))
+    limits = [limit for limit in limits if 0 < limit <= 250]
+    return min(limits) if limits else None
+
+
+def open_osm(path):
+    """Binary file object of an OSM XML extract, decompressing .bz2 / .gz."""
+    path = str(path)
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def build_table(osm_path) -> SpeedLimitTable:
+    """
+    Build the table from an OSM XML extract in two streaming passes:
+    1. ways with a highway and a maxspeed tag (node ids, class, limit)
+    2. coordinates of the nodes used by those ways
+    """
+    ways: List[Tuple[List[int], int, int]] = []
+    needed = set()
+    with open_osm(osm_path) as f:
+        for _, elem in ET.iterparse(f, events=("end",)):
+            if elem.tag == "way":
+                tags = {tag.get("k"): tag.get("v") for tag in elem.iter("tag")}
+                road_class = ROAD_CLASSES.get(tags.get("highway", ""))
+                limit = parse_maxspeed(tags["maxspeed"]) if road_class and "maxspeed" in tags else None
+                if limit:
+                    refs = [int(nd.get("ref")) for nd in elem.iter("nd")]
+                    ways.append((refs, road_class, limit))
+                    needed.update(refs)
+            if elem.tag in ("node", "way", "relation"):
+                elem.clear()
+    logger.info(f"{len(ways)} ways with maxspeed, {len(needed)} nodes")
+
+    coords: Dict[int, Tuple[float, float]] = {}
+    with open_osm(osm_path) as f:
+        for _, elem in ET.iterparse(f, events=("end",)):
+            if elem.tag == "node":
+                node_id = int(elem.get("id"))
+                if node_id in needed:
+                    coords[node_id] = (float(elem.get("lat")), float(elem.get("lon")))
+            if elem.tag in ("node", "way", "relation"):
+                elem.clear()
+
+    # Way segments as arrays (start, end, class, limit)
+    lat1, lon1, lat2, lon2, classes, limits = [], [], [], [], [], []
+    for refs, road_class, limit in ways:
+        points = [coords[ref] for ref in refs if ref in coords]
+        for (a_lat, a_lon), (b_lat, b_lon) in zip(points[:-1], points[1:]):
+            lat1.append(a_lat)
+            lon1.append(a_lon)
+            lat2.append(b_lat)
+            lon2.append(b_lon)
+            classes.append(road_class)
+            limits.append(limit)
+    lat1, lon1, lat2, lon2 = map(np.asarray, (lat1, lon1, lat2, lon2))
+    classes = np.asarray(classes, dtype=np.int64)
+    limits = np.asarray(limits, dtype=np.uint8)
+
+    # Rasterize: sample every segment at half a cell so every crossed cell is hit
+    steps = np.ceil(np.hypot(lat2 - lat1, lon2 - lon1) / (GRID_DEG / 2)).astype(np.int64) + 1
+    seg = np.repeat(np.arange(len(steps)), steps)
+    t = (np.arange(len(seg)) - np.repeat(np.cumsum(steps) - steps, steps)) / np.maximum(steps[seg] - 1, 1)
+    keys = group_keys(lat1[seg] + t * (lat2[seg] - lat1[seg]), lon1[seg] + t * (lon2[seg] - lon1[seg]), classes[seg])
+    sample_limits = limits[seg]
+
+    # One limit per key: keep the lowest when several ways of the same group share a cell
+    order = np.lexsort((sample_limits, keys))
+    keys, sample_limits = keys[order], sample_limits[order]
+    first = np.concatenate(([True], keys[1:] != keys[:-1]))
+    return SpeedLimitTable(keys[first], sample_limits[first])
+
+
+_table: Optional[SpeedLimitTable] = None
+_table_loaded = False
+
+
+def get_speed_limit_table() -> Optional[SpeedLimitTable]:
+    """Memory-map the OSM speed-limit table once (None if it has not been built)."""
+    global _table, _table_loaded
+    if not _table_loaded:
+        _table_loaded = True
+        path = os.environ.get('SPEED_LIMITS_PATH') or DEFAULT_SPEED_LIMITS_PATH
+        try:
+            _table = SpeedLimitTable.load(path)
+            logger.info(f"Loaded {len(_table)} OSM speed-limit cells from {path}")
+        except (OSError, ValueError) as e:
+            logger.info(f"No OSM speed-limit table at {path} ({e}), using road-type defaults")
+    return _table
+
+
+def route_speed_limits(lat, lon, road_class, is_urban, user_max_speed: int = 130) -> np.ndarray:
+    """
+    Speed limit (km/h) of every route point: OSM maxspeed when known (capped
+    by the user's maximum speed), road-type defaults otherwise.
+    """
+    limits = default_limits(road_class, is_urban, user_max_speed)
+    table = get_speed_limit_table()
+    if table is not None:
+        osm = table.lookup(lat, lon, road_class)
+        known = ~np.isnan(osm)
+        limits[known] = np.minimum(osm[known], user_max_speed)
+    return limits
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "build":
+        print("Usage: python speed_limits.py build <extract.osm[.gz|.bz2]> <output_dir>")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO)
+    table = build_table(sys.argv[2])
+    table.save(sys.argv[3])
+    print(f"Saved {len(table)} entries to {sys.argv[3]}")
@@ -0,0 +1,78 @@
+"""
+Real-speed model for ECOSPEED
+Simulates how a driver actually drives a route (the "real" scenario compared
+with the speed-limit and eco-speed scenarios).
+
+The whole real-speed vector of a route is drawn at once from a per-request
+numpy.random.Generator, so results are reproducible for a given seed and no
+global random state is touched (safe with concurrent requests).
+"""
+import zlib
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class DriverProfile:
+    """
+    Driving style used to simulate real speeds.
+    real speed = speed limit × base_factor × (1 + variation),
+    variation drawn uniformly in [variation_low, variation_high],
+    then clamped to [min_speed_kmh, speed limit × max_over_limit].
+    """
+    name: str
+    base_factor: float
+    variation_low: float
+    variation_high: float
+    min_speed_kmh: float = 50.0
+    max_over_limit: float = 1.05
+
+
+DRIVER_PROFILES: Dict[str, DriverProfile] = {}
+
+
+def register_driver_profile(profile: DriverProfile) -> None:
+    """Add (or replace) a driver profile available to simulate_real_speeds."""
+    DRIVER_PROFILES[profile.name] = profile
+
+
+register_driver_profile(DriverProfile("calm", base_factor=0.88, variation_low=-0.08, variation_high=0.02, max_over_limit=1.0))
+# Same behavior as the original simulation: slightly below the limit, -10% to +5%
+register_driver_profile(DriverProfile("average", base_factor=0.92, variation_low=-0.10, variation_high=0.05))
+register_driver_profile(DriverProfile("aggressive", base_factor=0.98, variation_low=-0.05, variation_high=0.10, max_over_limit=1.12))
+
+
+def route_seed(*parts: str) -> int:
+    """Deterministic seed derived from route identifiers (e.g. stop addresses and driver profile)."""
+    key = "|".join(part.strip().lower() for part in parts)
+    return zlib.crc32(key.encode("utf-8"))
+
+
+def simulate_real_speeds(
+    speed_limits,
+    seed: Optional[int] = None,
+    profile: str = "average",
+) -> np.ndarray:
+    """
+    Simulate realistic driver behavior for every segment of a route in one draw.
+
+    Real speed is typically:
+    - Close to speed limit on motorways
+    - More variable in urban areas
+    - Sometimes above or below limit
+
+    Returns speeds in km/h rounded to 0.1, one per segment.
+    """
+    driver = DRIVER_PROFILES.get(profile)
+    if driver is None:
+        raise ValueError(f"Unknown driver profile: {profile}. Available: {', '.join(DRIVER_PROFILES)}")
+
+    speed_limits = np.asarray(speed_limits, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    variation = rng.uniform(driver.variation_low, driver.variation_high, size=len(speed_limits))
+
+    real_speeds = speed_limits * driver.base_factor * (1 + variation)
+    real_speeds = np.maximum(driver.min_speed_kmh, np.minimum(real_speeds, speed_limits * driver.max_over_limit))
+    return np.round(real_speeds, 1)
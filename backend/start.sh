@@ -31,10 +31,17 @@ EOF
     echo ""
 fi
 
+# Mode production (./start.sh prod, ou WEB_CONCURRENCY défini) : plusieurs workers gunicorn
+if [ "$1" = "prod" ] || [ -n "$WEB_CONCURRENCY" ]; then
+    echo "🌐 Démarrage du serveur FastAPI (${WEB_CONCURRENCY:-auto} workers) sur http://localhost:${PORT:-8001}"
+    echo ""
+    exec gunicorn -c gunicorn.conf.py server:app
+fi
+
 echo "🌐 Démarrage du serveur FastAPI sur http://localhost:8001"
 echo "Appuyez sur Ctrl+C pour arrêter le serveur"
 echo ""
 
-# Démarrer le serveur
+# Démarrer le serveur (développement, rechargement automatique)
 uvicorn server:app --reload --host 0.0.0.0 --port 8001
 
@@ -0,0 +1,195 @@
+"""
+Charging station index for ECOSPEED
+Viewport queries over the charging stations: bounding box filtering, grid
+clustering per zoom level and cursor pagination, so that a map only
+downloads what it can display instead of every station of France.
+
+Stations are kept in arrays (lat, lon, power, availability) next to the
+station objects. A query is a vectorized bounding-box mask; at low zoom the
+stations in the box are aggregated on a Web Mercator grid of CELL_PX pixels
+(the same projection as the map tiles), one cluster per non-empty cell.
+Items (clusters and single stations) are ordered by cell, then by station
+id, so a cursor is simply an offset in the result of a given index version.
+The version is a digest of the indexed content, not a counter: every worker
+holding the same stations (whatever their row order) computes the same
+version and the same pages, and accepts the cursors of the others.
+"""
+import base64
+import hashlib
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+CELL_PX = 64  # Cluster cell size in screen pixels
+TILE_PX = 256
+MAX_CLUSTER_ZOOM = 14  # From this zoom on, stations are never clustered
+MAX_LATITUDE = 85.05112878  # Web Mercator limit
+
+
+def mercator_cells(lat: np.ndarray, lon: np.ndarray, zoom: int, cell_px: int = CELL_PX) -> Tuple[np.ndarray, np.ndarray]:
+    """Integer (x, y) grid cells of the points at a zoom level (Web Mercator, cell_px pixels)."""
+    cells_per_axis = (TILE_PX << zoom) / cell_px
+    lat_rad = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(lon) + 180.0) / 360.0 * cells_per_axis
+    y = (1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / math.pi) / 2.0 * cells_per_axis
+    return np.floor(x).astype(np.int64), np.floor(y).astype(np.int64)
+
+
+def encode_cursor(version: str, offset: int) -> str:
+    return base64.urlsafe_b64encode(f"{version}:{offset}".encode("ascii")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """(index version, offset) of a cursor; ValueError if it is malformed."""
+    try:
+        version, offset = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("ascii").split(":")
+        return version, int(offset)
+    except (UnicodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+class StationIndex:
+    """Immutable snapshot of the stations, queried by viewport."""
+
+    def __init__(self, stations: Sequence[Any], ids: Optional[Sequence[str]] = None):
+        self.stations = list(stations)
+        # Station ids (e.g. Open Charge Map ids) for incremental updates, default: positions
+        self.ids = list(ids) if ids is not None else [str(i) for i in range(len(self.stations))]
+        self.positions = {station_id: i for i, station_id in enumerate(self.ids)}
+        self.lat = np.array([s.latitude for s in self.stations], dtype=np.float64)
+        self.lon = np.array([s.longitude for s in self.stations], dtype=np.float64)
+        self.power_kw = np.array([s.powerKw for s in self.stations], dtype=np.float64)
+        self.available = np.array([s.status == 'Dispo' for s in self.stations], dtype=bool)
+        self._seal()
+
+    def _seal(self) -> None:
+        """Id rank of each row (tie-break of the item order) and content digest (version)."""
+        order = np.argsort(np.array(self.ids, dtype=str), kind="stable")
+        self.rank = np.empty(len(order), dtype=np.int64)
+        self.rank[order] = np.arange(len(order))
+        digest = hashlib.blake2b(digest_size=8)
+        digest.update("\0".join(self.ids[i] for i in order.tolist()).encode("utf-8"))
+        for column in (self.lat, self.lon, self.power_kw, self.available):
+            digest.update(np.ascontiguousarray(column[order]).tobytes())
+        self.version = digest.hexdigest()
+
+    def updated(self, changes: Dict[str, Any], removed: Sequence[str] = ()) -> "StationIndex":
+        """
+        New index version with some stations replaced or added (by id), and
+        the `removed` ids dropped. Only the changed rows are rewritten, the
+        other stations are shared.
+        """
+        index = StationIndex.__new__(StationIndex)
+        gone = [self.positions[station_id] for station_id in removed if station_id in self.positions]
+        if gone:
+            keep = np.ones(len(self.ids), dtype=bool)
+            keep[gone] = False
+            rows = np.flatnonzero(keep).tolist()
+            index.stations = [self.stations[i] for i in rows]
+            index.ids = [self.ids[i] for i in rows]
+            index.positions = {station_id: i for i, station_id in enumerate(index.ids)}
+            index.lat, index.lon = self.lat[keep], self.lon[keep]
+            index.power_kw, index.available = self.power_kw[keep], self.available[keep]
+        else:
+            index.stations = list(self.stations)
+            index.ids = list(self.ids)
+            index.positions = dict(self.positions)
+            index.lat, index.lon = self.lat.copy(), self.lon.copy()
+            index.power_kw, index.available = self.power_kw.copy(), self.available.copy()
+
+        added = [station_id for station_id in changes if station_id not in index.positions]
+        for station_id in added:
+            index.positions[station_id] = len(index.ids)
+            index.ids.append(station_id)
+            index.stations.append(changes[station_id])
+        extra = len(added)
+        if extra:
+            index.lat = np.concatenate([index.lat, np.empty(extra)])
+            index.lon = np.concatenate([index.lon, np.empty(extra)])
+            index.power_kw = np.concatenate([index.power_kw, np.empty(extra)])
+            index.available = np.concatenate([index.available, np.empty(extra, dtype=bool)])
+        for station_id, station in changes.items():
+            i = index.positions[station_id]
+            index.stations[i] = station
+            index.lat[i], index.lon[i] = station.latitude, station.longitude
+            index.power_kw[i] = station.powerKw
+            index.available[i] = station.status == 'Dispo'
+        index._seal()
+        return index
+
+    def __len__(self) -> int:
+        return len(self.stations)
+
+    def in_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> np.ndarray:
+        """Indices of the stations inside the box (a box crossing the antimeridian has min_lon > max_lon)."""
+        mask = (self.lat >= min_lat) & (self.lat <= max_lat)
+        if min_lon <= max_lon:
+            mask &= (self.lon >= min_lon) & (self.lon <= max_lon)
+        else:
+            mask &= (self.lon >= min_lon) | (self.lon <= max_lon)
+        return np.flatnonzero(mask)
+
+    def within(self, latitude: float, longitude: float, distance_km: float) -> np.ndarray:
+        """Indices of the stations less than distance_km away from a point (haversine)."""
+        lat1, lat2 = math.radians(latitude), np.radians(self.lat)
+        dlat = lat2 - lat1
+        dlon = np.radians(self.lon) - math.radians(longitude)
+        a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+        distance = 2 * 6371.0 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+        return np.flatnonzero(distance <= distance_km)
+
+    def query(
+        self,
+        min_lat: float,
+        min_lon: float,
+        max_lat: float,
+        max_lon: float,
+        zoom: Optional[int] = None,
+        offset: int = 0,
+        limit: int = 500,
+    ) -> Dict[str, Any]:
+        """
+        One page of the viewport items, ordered by grid cell.
+
+        Returns {"stations": [...], "clusters": [...], "total": items in the
+        viewport, "next_offset": offset of the next page or None}. Without a
+        zoom, or at MAX_CLUSTER_ZOOM and above, every item is a station.
+        """
+        ids = self.in_bbox(min_lat, min_lon, max_lat, max_lon)
+        cluster_zoom = min(zoom if zoom is not None else MAX_CLUSTER_ZOOM, MAX_CLUSTER_ZOOM)
+        cx, cy = mercator_cells(self.lat[ids], self.lon[ids], cluster_zoom)
+        keys = (cx << 32) | cy
+        order = np.lexsort((self.rank[ids], keys))
+        ids, keys = ids[order], keys[order]
+
+        if zoom is None or zoom >= MAX_CLUSTER_ZOOM:
+            # One item per station
+            starts = np.arange(len(ids))
+            counts = np.ones(len(ids), dtype=np.int64)
+        else:
+            # One item per non-empty cell
+            _, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+
+        total = len(starts)
+        page = slice(offset, offset + limit)
+        stations: List[Any] = []
+        clusters: List[Dict[str, Any]] = []
+        for start, count in zip(starts[page].tolist(), counts[page].tolist()):
+            members = ids[start:start + count]
+            if count == 1:
+                stations.append(self.stations[int(members[0])])
+                continue
+            clusters.append({
+                "latitude": float(self.lat[members].mean()),
+                "longitude": float(self.lon[members].mean()),
+                "count": count,
+                "available_count": int(self.available[members].sum()),
+                "max_power_kw": float(self.power_kw[members].max()),
+                "min_lat": float(self.lat[members].min()),
+                "min_lon": float(self.lon[members].min()),
+                "max_lat": float(self.lat[members].max()),
+                "max_lon": float(self.lon[members].max()),
+            })
+        next_offset = offset + limit if offset + limit < total else None
+        return {"stations": stations, "clusters": clusters, "total": total, "next_offset": next_offset}
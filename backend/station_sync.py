@@ -0,0 +1,361 @@
+"""
+Incremental Open Charge Map synchronization for ECOSPEED
+A background job keeps a local copy of the French charging stations so that
+station reads are served from memory and never wait on Open Charge Map.
+
+- First run: full pull of every region (REGION_CENTERS, 200 km radius),
+  areas whose response hits the maxresults cap being split until complete.
+- Next runs: the same regions with `modifiedsince` = start of the last
+  fully successful run minus SYNC_OVERLAP, so only changed POIs are
+  transferred. That start time is handed to `save_state` (persisted as a
+  sync-state document) and given back to load() after a restart.
+- Every station is normalized and hashed; only entries whose content hash
+  changed update the in-memory index (StationIndex.updated) and are
+  persisted (MongoDB upserts), unchanged ones are skipped. The overlap
+  window therefore costs bandwidth only, never duplicates.
+- Deletions: `modifiedsince` never returns a POI removed upstream, so every
+  FULL_SYNC_RUNS runs the window is the whole history again. A complete
+  full pass (no failed region, no area still capped at maxresults) drops
+  the known stations it did not return from the index and hands their ids
+  to `remove` (tombstones in MongoDB, new snapshot). A pass that would
+  drop more than MAX_DELETED_FRACTION of the stations is distrusted.
+
+The upstream is configured with OCM_BASE_URL (e.g. the local mock server of
+benchmarks/mock_ocm.py) and OCM_API_KEY; STATION_SYNC_INTERVAL_S sets the
+period (0 disables the job).
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+import outbound
+from station_index import StationIndex
+
+logger = logging.getLogger(__name__)
+
+OCM_BASE_URL = os.environ.get('OCM_BASE_URL', 'https://api.openchargemap.io/v3').rstrip('/')
+OCM_API_KEY = os.environ.get('OCM_API_KEY', '4141afa0-52ab-4c97-9487-f91daa6c436d')
+SYNC_OVERLAP = timedelta(minutes=10)
+MAX_RESULTS = 1000  # Maximum autorisé par l'API
+REGION_RADIUS_KM = 200
+MIN_AREA_RADIUS_KM = 5
+# Every N runs, a full pass (no modifiedsince) finds the stations deleted upstream
+FULL_SYNC_RUNS = int(os.environ.get('STATION_FULL_SYNC_RUNS', '24'))
+MAX_DELETED_FRACTION = 0.2
+# Regions fetched concurrently (the "ocm" token bucket still paces the requests)
+FETCH_CONCURRENCY = int(os.environ.get('OCM_FETCH_CONCURRENCY', '4'))
+
+# Coordonnées approximatives de la France (centres de régions), rayon de 200 km
+REGION_CENTERS = [
+    (48.8566, 2.3522),   # Paris/Île-de-France
+    (45.7640, 4.8357),   # Lyon/Auvergne-Rhône-Alpes
+    (43.2965, 5.3698),   # Marseille/Provence-Alpes-Côte d'Azur
+    (44.8378, -0.5792),  # Bordeaux/Nouvelle-Aquitaine
+    (47.2184, -1.5536),  # Nantes/Pays de la Loire
+    (50.6292, 3.0573),   # Lille/Hauts-de-France
+    (49.4431, 1.0993),   # Rouen/Normandie
+    (48.1173, -1.6778),  # Rennes/Bretagne
+    (47.2378, 6.0241),   # Besançon/Bourgogne-Franche-Comté
+    (48.5734, 7.7521),   # Strasbourg/Grand Est
+    (46.2276, 2.2137),   # Orléans/Centre-Val de Loire
+    (46.3072, -0.3376),  # Poitiers/Nouvelle-Aquitaine
+    (43.6108, 1.4442),   # Toulouse/Occitanie
+    (43.7102, 7.2620),   # Nice/Provence-Alpes-Côte d'Azur
+]
+
+
+def normalize_poi(poi: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    ChargingStation fields of an Open Charge Map POI (plus its OCM id), or
+    None for POIs without connections or coordinates.
+    """
+    address_info = poi.get('AddressInfo') or {}
+    connections = poi.get('Connections') or []
+    if not connections or not address_info.get('Latitude') or not address_info.get('Longitude'):
+        return None
+
+    # Connexion avec la plus haute puissance, 22 kW par défaut
+    max_power = max((conn.get('PowerKW', 0) or 0 for conn in connections), default=0) or 22
+
+    # Statut : 50 = en service, 0 = inconnu
+    status_type = poi.get('StatusType') or {}
+    status = 'Dispo' if status_type.get('ID', 0) in (0, 50) else 'Hors service'
+
+    operator_info = poi.get('OperatorInfo') or {}
+    town = address_info.get('Town', '') or ''
+    address = f"{address_info.get('AddressLine1', '') or ''}, {town}".strip(', ')
+    usage_info = poi.get('UsageType') or {}
+
+    return {
+        'id': str(poi.get('ID') or f"{address_info.get('Latitude')}_{address_info.get('Longitude')}"),
+        'name': address_info.get('Title', 'Borne de recharge'),
+        'operator': operator_info.get('Title', 'Opérateur inconnu'),
+        'powerKw': float(max_power),
+        'price': 'Tarif variable' if usage_info.get('IsPayAtLocation') else None,
+        'status': status,
+        'latitude': address_info.get('Latitude'),
+        'longitude': address_info.get('Longitude'),
+        'address': address if address else town,
+    }
+
+
+async def fan_out(
+    items: List[Any],
+    fn: Callable[[Any], Awaitable[Any]],
+    concurrency: int,
+    timeout_s: Optional[float] = None,
+) -> AsyncIterator[Tuple[Any, Any, Optional[BaseException]]]:
+    """
+    Run fn(item) for every item with at most `concurrency` calls in flight
+    and yield (item, result, error) in completion order, so results can be
+    merged as they arrive. A call failing or exceeding timeout_s yields its
+    error instead of aborting the others.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(item):
+        async with semaphore:
+            try:
+                return item, await asyncio.wait_for(fn(item), timeout_s), None
+            except Exception as e:
+                return item, None, e
+
+    tasks = [asyncio.ensure_future(run(item)) for item in items]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def content_hash(record: Dict[str, Any]) -> str:
+    encoded = json.dumps(record, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+def fetch_pois(
+    latitude: float,
+    longitude: float,
+    distance_km: float,
+    modified_since: Optional[datetime] = None,
+    timeout: float = 30,
+) -> Tuple[List[Dict[str, Any]], int]:
+    """One Open Charge Map query (blocking). Returns (POIs, response size in bytes)."""
+    params = {
+        'output': 'json',
+        'latitude': latitude,
+        'longitude': longitude,
+        'distance': distance_km,
+        'distanceunit': 'KM',
+        'maxresults': MAX_RESULTS,
+        'key': OCM_API_KEY,
+        'countrycode': 'FR',
+    }
+    if modified_since is not None:
+        params['modifiedsince'] = modified_since.strftime('%Y-%m-%dT%H:%M:%S')
+    response = requests.get(f"{OCM_BASE_URL}/poi/", params=params, timeout=timeout)
+    response.raise_for_status()
+    return response.json(), len(response.content)
+
+
+class StationSync:
+    """Local copy of the stations, refreshed incrementally from Open Charge Map."""
+
+    def __init__(
+        self,
+        make_station: Callable[..., Any],
+        persist: Optional[Callable[[List[Dict[str, Any]]], Awaitable[None]]] = None,
+        save_state: Optional[Callable[[datetime], Awaitable[None]]] = None,
+        interval_s: float = 900,
+        fetch: Callable[..., Tuple[List[Dict[str, Any]], int]] = fetch_pois,
+        remove: Optional[Callable[[List[str]], Awaitable[None]]] = None,
+    ):
+        self.make_station = make_station  # Normalized fields -> station object (ChargingStation)
+        self.persist = persist
+        self.save_state = save_state  # Start time of a fully successful run -> durable sync state
+        self.remove = remove  # Ids of the stations deleted upstream
+        self.interval_s = interval_s
+        self.fetch = fetch
+        self.hashes: Dict[str, str] = {}
+        self.index: Optional[StationIndex] = None
+        self.last_sync: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self.incremental_runs = 0  # Runs since the last full pass
+        self._pending_removals: List[str] = []
+        self.counters = {"runs": 0, "requests": 0, "failed_regions": 0, "truncated_areas": 0,
+                         "added": 0, "updated": 0, "unchanged": 0, "deleted": 0, "bytes": 0}
+
+    @property
+    def ready(self) -> bool:
+        return self.index is not None and len(self.index) > 0
+
+    def apply(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Update the index with the records whose content changed; returns them."""
+        changed: Dict[str, Dict[str, Any]] = {}
+        for record in records:
+            digest = content_hash(record)
+            previous = self.hashes.get(record['id'])
+            if previous == digest:
+                self.counters["unchanged"] += 1
+                continue
+            self.counters["added" if previous is None else "updated"] += 1
+            self.hashes[record['id']] = digest
+            changed[record['id']] = dict(record, content_hash=digest)
+        if changed:
+            stations = {
+                station_id: self.make_station(**{k: v for k, v in record.items() if k not in ('id', 'content_hash')})
+                for station_id, record in changed.items()
+            }
+            self.index = self.index.updated(stations) if self.index is not None else StationIndex(
+                list(stations.values()), ids=list(stations)
+            )
+        return list(changed.values())
+
+    def drop(self, station_ids) -> List[str]:
+        """Remove stations from the index (deleted upstream); returns the ids that were known."""
+        removed = [station_id for station_id in station_ids if self.hashes.pop(station_id, None) is not None]
+        if removed and self.index is not None:
+            self.index = self.index.updated({}, removed=removed)
+        self.counters["deleted"] += len(removed)
+        return removed
+
+    def load(self, records: List[Dict[str, Any]], last_sync: Optional[datetime] = None) -> None:
+        """
+        Seed the local copy with previously persisted records. `last_sync` is
+        the persisted start time of the last fully successful run: the next
+        run pulls what changed since then instead of everything. Without it
+        (no sync state yet) the next run is a full pull; the records' own
+        synced_at dates are no substitute, a run that failed half-way
+        persists stations from after the regions it missed.
+        """
+        self.apply([{k: v for k, v in record.items() if k not in ('content_hash', 'synced_at')} for record in records])
+        if last_sync is not None:
+            self.last_sync = last_sync if last_sync.tzinfo else last_sync.replace(tzinfo=timezone.utc)
+
+    async def _pull_area(self, lat: float, lon: float, radius_km: float, since: Optional[datetime]) -> List[Dict[str, Any]]:
+        """
+        Normalized stations of a circle. A response capped at maxresults is
+        incomplete, so the circle is split into 4 covering circles (centers
+        at ±r/2, radius r/√2) down to MIN_AREA_RADIUS_KM.
+        """
+        # Rate limit, retries and circuit breaker of the "ocm" provider
+        pois, size = await outbound.call("ocm", self.fetch, lat, lon, radius_km, since)
+        self.counters["requests"] += 1
+        self.counters["bytes"] += size
+        records = [record for record in map(normalize_poi, pois) if record is not None]
+        if len(pois) < MAX_RESULTS:
+            return records
+        if radius_km / 2 < MIN_AREA_RADIUS_KM:
+            # Still capped at the smallest area: this pass cannot tell deletions
+            self.counters["truncated_areas"] += 1
+            return records
+        offset_lat = radius_km / 2 / 111.32
+        offset_lon = offset_lat / max(math.cos(math.radians(lat)), 0.1)
+        for d_lat in (-offset_lat, offset_lat):
+            for d_lon in (-offset_lon, offset_lon):
+                records.extend(await self._pull_area(lat + d_lat, lon + d_lon, radius_km / math.sqrt(2), since))
+        return records
+
+    async def sync_once(self) -> int:
+        """
+        Pull every region (incrementally, except the first run and every
+        FULL_SYNC_RUNS runs). Returns the number of changed and deleted stations.
+        """
+        started = datetime.now(timezone.utc)
+        full = self.last_sync is None or self.incremental_runs >= FULL_SYNC_RUNS
+        since = None if full else self.last_sync - SYNC_OVERLAP
+        truncated = self.counters["truncated_areas"]
+        records: List[Dict[str, Any]] = []
+        failed = 0
+        regions = fan_out(
+            REGION_CENTERS,
+            lambda center: self._pull_area(center[0], center[1], REGION_RADIUS_KM, since),
+            FETCH_CONCURRENCY
+        )
+        async for (lat, lon), region_records, error in regions:
+            if error is not None:
+                failed += 1
+                logger.warning(f"Station sync: region ({lat}, {lon}) failed: {error!r}")
+            else:
+                records.extend(region_records)
+
+        changed = self.apply(records)
+        deleted: List[str] = []
+        if full and not failed and self.counters["truncated_areas"] == truncated:
+            seen = {record['id'] for record in records}
+            missing = [station_id for station_id in self.hashes if station_id not in seen]
+            if len(missing) > MAX_DELETED_FRACTION * len(self.hashes):
+                logger.warning(f"Station sync: full pass lacks {len(missing)} of {len(self.hashes)} stations, deletions ignored")
+            else:
+                deleted = self.drop(missing)
+        persisted = True
+        if changed and self.persist is not None:
+            try:
+                await self.persist(changed)
+            except Exception as e:
+                persisted = False
+                # Forgotten hashes: the next run (same start date) persists them again
+                for record in changed:
+                    self.hashes.pop(record['id'], None)
+                logger.warning(f"Station sync: persisting {len(changed)} stations failed: {e}")
+        removals = self._pending_removals + deleted
+        if removals and self.remove is not None:
+            try:
+                await self.remove(removals)
+                self._pending_removals = []
+            except Exception as e:
+                # Already out of the index: retried on the next run
+                self._pending_removals = removals
+                persisted = False
+                logger.warning(f"Station sync: removing {len(removals)} deleted stations failed: {e}")
+        self.counters["runs"] += 1
+        self.counters["failed_regions"] += failed
+        # A failed region is pulled again from the same date on the next run
+        if not failed and persisted:
+            self.last_sync = started
+            self.incremental_runs = 0 if full else self.incremental_runs + 1
+            if self.save_state is not None:
+                try:
+                    await self.save_state(started)
+                except Exception as e:
+                    logger.warning(f"Station sync: saving the sync state failed: {e}")
+        logger.info(f"Station sync: {len(records)} POIs received, {len(changed)} changed, "
+                    f"{len(deleted)} deleted, {failed} regions failed")
+        return len(changed) + len(deleted)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.sync_once()
+            except Exception as e:
+                logger.error(f"Station sync failed: {e}")
+            await asyncio.sleep(self.interval_s)
+
+    def start(self) -> None:
+        if self.interval_s > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "stations": len(self.index) if self.index is not None else 0,
+            "index_version": self.index.version if self.index is not None else None,
+            "last_sync": self.last_sync.isoformat() if self.last_sync else None,
+        }
@@ -0,0 +1,257 @@
+"""
+Stop-order optimization for ECOSPEED multi-stop rounds
+Finds the order of N stops that uses the least energy (or time) between a
+fixed start and an optional fixed end, so that fleet users do not simply
+drive the stops in the order they typed them.
+
+1. Cost matrices: road distances and durations between every pair of stops
+   (one many-to-many matrix query) and stop elevations give, for each
+   ordered pair, the energy at the eco speed of the average speed on the
+   net slope (route_physics). Energy is asymmetric: A -> B uphill costs
+   more than B -> A, which recovers part of it by regeneration.
+2. Order: nearest insertion, then 2-opt (segment reversal, re-costed in
+   both directions since costs are asymmetric) and Or-opt (moving chains of
+   1 to 3 stops, either direction) until no move improves the tour or the
+   time budget is spent.
+   Tours that drop the battery below the reserve at any stop are penalized,
+   so a feasible order is preferred whenever one is found.
+"""
+import math
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+from route_physics import VehiclePhysicsContext, segment_slopes
+
+DETOUR_FACTOR = 1.3  # Road distance / straight-line distance when no road matrix is available
+ESTIMATE_SPEED_KMH = 70.0
+BATTERY_PENALTY = 1000.0  # Objective units per kWh below the reserve
+MAX_OPTIMIZATION_S = 2.0
+
+
+def estimate_matrices(lat: np.ndarray, lon: np.ndarray):
+    """Distance (m) and duration (s) matrices from straight-line distances (no road data)."""
+    lat_rad, lon_rad = np.radians(lat), np.radians(lon)
+    d_lat = lat_rad[None, :] - lat_rad[:, None]
+    d_lon = lon_rad[None, :] - lon_rad[:, None]
+    a = np.sin(d_lat / 2) ** 2 + np.cos(lat_rad[:, None]) * np.cos(lat_rad[None, :]) * np.sin(d_lon / 2) ** 2
+    distance = 2 * 6371000 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0))) * DETOUR_FACTOR
+    return distance, distance / (ESTIMATE_SPEED_KMH / 3.6)
+
+
+def energy_matrix(
+    context: VehiclePhysicsContext,
+    distance_m: np.ndarray,
+    duration_s: np.ndarray,
+    elevation_m: np.ndarray,
+    user_max_speed: float = 130,
+) -> np.ndarray:
+    """
+    Energy (kWh) of every ordered pair, driving at the eco speed for the
+    pair's average speed on its net slope. One vectorized evaluation.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        average_kmh = np.where(duration_s > 0, distance_m / duration_s * 3.6, 0.0)
+    average_kmh = np.minimum(average_kmh, user_max_speed)
+    slope = segment_slopes(distance_m, elevation_m[None, :] - elevation_m[:, None])
+    energy = context.energy(context.eco_speeds(average_kmh, slope), distance_m, slope)
+    np.fill_diagonal(energy, 0.0)
+    return energy
+
+
+@dataclass
+class StopOrder:
+    order: List[int]  # Matrix indices, start first (and end last when fixed)
+    energy_kwh: float
+    time_s: float
+    min_battery_pct: float  # Lowest battery level reached at a stop
+    feasible: bool  # Battery never below the reserve
+    iterations: int
+
+
+class StopOrderOptimizer:
+    """
+    Heuristic asymmetric path optimizer. Matrix index 0 is the start; `end`
+    is a fixed last stop (None: the tour ends at whichever stop is best;
+    equal to 0 for a round trip back to the start).
+    """
+
+    def __init__(
+        self,
+        energy: np.ndarray,
+        time_s: np.ndarray,
+        objective: str = "energy",
+        end: Optional[int] = None,
+        usable_kwh: float = 0.0,
+        battery_start_pct: float = 100.0,
+        battery_reserve_pct: float = 0.0,
+    ):
+        self.energy = energy.tolist()
+        self.time = time_s.tolist()
+        self.cost = self.energy if objective == "energy" else self.time
+        self.end = end
+        self.usable_kwh = usable_kwh
+        self.battery_start_pct = battery_start_pct
+        self.battery_reserve_pct = battery_reserve_pct
+        self.size = len(self.energy)
+
+    def _battery(self, tour: List[int]):
+        """(lowest battery % along the tour, kWh missing below the reserve)."""
+        if self.usable_kwh <= 0:
+            return 100.0, 0.0
+        used = lowest_used = 0.0
+        for a, b in zip(tour[:-1], tour[1:]):
+            used += self.energy[a][b]
+            lowest_used = max(lowest_used, used)
+        lowest = self.battery_start_pct - lowest_used / self.usable_kwh * 100
+        missing = max(self.battery_reserve_pct - lowest, 0.0) / 100 * self.usable_kwh
+        return lowest, missing
+
+    def tour_cost(self, tour: List[int]) -> float:
+        cost = self.cost
+        total = 0.0
+        for a, b in zip(tour[:-1], tour[1:]):
+            total += cost[a][b]
+        missing = self._battery(tour)[1]
+        return total + BATTERY_PENALTY * missing
+
+    def _fixed_tail(self) -> List[int]:
+        return [self.end] if self.end is not None else []
+
+    def nearest_insertion(self) -> List[int]:
+        """Insert, one by one, the stop closest to the tour at its cheapest position."""
+        cost = self.cost
+        tail = self._fixed_tail()
+        tour = [0] + tail
+        remaining = set(range(1, self.size)) - set(tail)
+        while remaining:
+            stop = min(remaining, key=lambda s: min(min(cost[t][s], cost[s][t]) for t in tour))
+            best_position, best_delta = len(tour), math.inf
+            # Positions between consecutive stops, or at the end of an open tour
+            last = len(tour) if self.end is None else len(tour) - 1
+            for position in range(1, last + 1):
+                before = tour[position - 1]
+                if position < len(tour):
+                    after = tour[position]
+                    delta = cost[before][stop] + cost[stop][after] - cost[before][after]
+                else:
+                    delta = cost[before][stop]
+                if delta < best_delta:
+                    best_position, best_delta = position, delta
+            tour.insert(best_position, stop)
+            remaining.remove(stop)
+        return tour
+
+    def _accept(self, candidate: List[int], best: float, delta: float, screen: bool):
+        """Full cost of candidate if it may improve on best (delta: objective change without battery)."""
+        if screen and delta >= -1e-9:
+            return None
+        cost = self.tour_cost(candidate)
+        return cost if cost < best - 1e-9 else None
+
+    def improve(self, tour: List[int], deadline: float) -> tuple[List[int], int]:
+        """
+        2-opt and Or-opt moves (first improvement) until a local optimum or
+        the deadline. Moves are screened with O(1) objective deltas; the
+        battery constraint is checked on the full tour only for candidates.
+        """
+        c = self.cost
+        best = self.tour_cost(tour)
+        fixed_tail = 1 if self.end is not None else 0
+        iterations = 0
+        improved = True
+        while improved and time.monotonic() < deadline:
+            improved = False
+            iterations += 1
+            # Full evaluation of every move only when reordering alone may fix the battery:
+            # a feasible tour is only beaten by a lower objective, and when even the
+            # arrival is below the reserve only a lower total energy helps
+            used = sum(self.energy[a][b] for a, b in zip(tour[:-1], tour[1:]))
+            exhausted = self.usable_kwh > 0 and (
+                self.battery_start_pct - used / self.usable_kwh * 100 < self.battery_reserve_pct)
+            screen = self._battery(tour)[1] <= 1e-9 or exhausted
+            movable_end = len(tour) - fixed_tail  # tour[1:movable_end] can move
+
+            # 2-opt: reverse tour[i:j + 1]; the reversed part is re-costed backwards
+            for i in range(1, movable_end - 1):
+                before = tour[i - 1]
+                forward = backward = 0.0
+                for j in range(i + 1, movable_end):
+                    forward += c[tour[j - 1]][tour[j]]
+                    backward += c[tour[j]][tour[j - 1]]
+                    delta = c[before][tour[j]] - c[before][tour[i]] + backward - forward
+                    if j + 1 < len(tour):
+                        after = tour[j + 1]
+                        delta += c[tour[i]][after] - c[tour[j]][after]
+                    candidate = None
+                    if delta < -1e-9 or not screen:
+                        candidate = tour[:i] + tour[i:j + 1][::-1] + tour[j + 1:]
+                        cost = self._accept(candidate, best, delta, screen)
+                        if cost is not None:
+                            tour, best, improved = candidate, cost, True
+                            break
+                if improved:
+                    break
+            if improved:
+                continue
+
+            # Or-opt: move a chain of 1-3 stops elsewhere, in either direction
+            for length in (1, 2, 3):
+                for i in range(1, movable_end - length + 1):
+                    chain = tour[i:i + length]
+                    before = tour[i - 1]
+                    after = tour[i + length] if i + length < len(tour) else None
+                    removal = c[before][chain[0]] - (c[before][after] if after is not None else 0.0)
+                    if after is not None:
+                        removal += c[chain[-1]][after]
+                    internal = sum(c[a][b] for a, b in zip(chain[:-1], chain[1:]))
+                    reverse_internal = sum(c[b][a] for a, b in zip(chain[:-1], chain[1:]))
+                    rest = tour[:i] + tour[i + length:]
+                    for position in range(1, len(rest) - fixed_tail + 1):
+                        if position == i:
+                            continue
+                        a = rest[position - 1]
+                        b = rest[position] if position < len(rest) else None
+                        for moved, extra in ((chain, 0.0), (chain[::-1], reverse_internal - internal)):
+                            delta = c[a][moved[0]] + extra - removal
+                            if b is not None:
+                                delta += c[moved[-1]][b] - c[a][b]
+                            if delta < -1e-9 or not screen:
+                                candidate = rest[:position] + moved + rest[position:]
+                                cost = self._accept(candidate, best, delta, screen)
+                                if cost is not None:
+                                    tour, best, improved = candidate, cost, True
+                                    break
+                            if length == 1:
+                                break
+                        if improved:
+                            break
+                    if improved:
+                        break
+                if improved:
+                    break
+        return tour, iterations
+
+    def evaluate(self, tour: List[int], iterations: int = 0) -> StopOrder:
+        energy = sum(self.energy[a][b] for a, b in zip(tour[:-1], tour[1:]))
+        time_s = sum(self.time[a][b] for a, b in zip(tour[:-1], tour[1:]))
+        lowest, missing = self._battery(tour)
+        return StopOrder(tour, energy, time_s, lowest, missing <= 1e-9, iterations)
+
+    def typed_order(self) -> List[int]:
+        middle = [i for i in range(1, self.size) if i != self.end]
+        return [0] + middle + self._fixed_tail()
+
+    def solve(self, max_seconds: float = MAX_OPTIMIZATION_S) -> StopOrder:
+        """Best local optimum from nearest insertion and from the typed order (never worse than typed)."""
+        deadline = time.monotonic() + max_seconds
+        best_tour, best_cost, total_iterations = None, math.inf, 0
+        for initial in (self.nearest_insertion(), self.typed_order()):
+            tour, iterations = self.improve(initial, deadline)
+            total_iterations += iterations
+            cost = self.tour_cost(tour)
+            if cost < best_cost:
+                best_tour, best_cost = tour, cost
+        return self.evaluate(best_tour, total_iterations)
@@ -0,0 +1,216 @@
+"""
+Time-of-day traffic speed profiles for ECOSPEED
+Historical speed distributions, expressed as ratios of the speed limit
+(mean and standard deviation), per road class, day type (weekday / weekend)
+and quarter-hour slot of the day:
+
+    mean[road_class, day_type, slot], std[road_class, day_type, slot]
+
+(9 x 2 x 96 float32 values each). Optional per-segment profiles override the
+road-class ones: sorted (grid cell, road group) keys, the same keys as the
+OSM speed-limit table, with one (2, 96) profile each. Profiles are stored as
+.npy files in a directory (TRAFFIC_PROFILES_PATH) and memory-mapped; without
+one, built-in profiles with typical French weekday rush hours are used.
+
+The engine evaluates a route for a batch of departure times at once: the
+time each segment is entered depends on the time spent on the previous ones,
+which is solved by a few vectorized fixed-point iterations over a
+(departures x segments) matrix. Expected energy and time integrate the
+speed distribution with a 3-point Gauss-Hermite rule, since consumption is
+not linear in speed.
+"""
+import logging
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from route_physics import VehiclePhysicsContext, haversine_distances, segment_slopes, travel_times
+from speed_limits import group_keys
+
+logger = logging.getLogger(__name__)
+
+SLOTS_PER_DAY = 96  # Quarter-hours
+SLOT_S = 86400 // SLOTS_PER_DAY
+ROAD_CLASS_COUNT = 9  # 0 = unknown, 1..8 = speed_limits.ROAD_CLASSES ids (motorway ... service)
+LOCAL_TZ = ZoneInfo(os.environ.get('TRAFFIC_TIMEZONE', 'Europe/Paris'))
+MIN_SPEED_KMH = 5.0
+FIXED_POINT_ITERATIONS = 3
+# Departures evaluated together: (block x segments) matrices stay cache-sized on long routes
+DEPARTURE_BLOCK = 8
+
+# 3-point Gauss-Hermite rule for E[f(v)], v ~ N(mean, std)
+QUADRATURE_NODES = np.array([-np.sqrt(3.0), 0.0, np.sqrt(3.0)])
+QUADRATURE_WEIGHTS = np.array([1 / 6, 2 / 3, 1 / 6])
+
+
+def default_profiles():
+    """
+    Built-in (mean, std) ratio profiles: free-flow ratio per road class, minus
+    morning (8h) and evening (18h) weekday peaks and a milder weekend midday dip.
+    """
+    # Index = road class id: unknown, motorway, trunk, primary, secondary, tertiary, unclassified, residential, service
+    free_flow = np.array([0.85, 0.95, 0.93, 0.90, 0.90, 0.88, 0.85, 0.80, 0.75])
+    peak_depth = np.array([0.20, 0.25, 0.25, 0.30, 0.25, 0.20, 0.20, 0.15, 0.10])
+    hours = (np.arange(SLOTS_PER_DAY) + 0.5) / 4
+
+    def bump(center, width):
+        return np.exp(-0.5 * ((hours - center) / width) ** 2)
+
+    weekday = np.maximum(bump(8.0, 1.0), bump(18.0, 1.2))
+    weekend = 0.5 * np.maximum(bump(11.5, 1.5), bump(17.5, 1.5))
+    dip = np.stack([weekday, weekend])  # (day type, slot)
+    mean = free_flow[:, None, None] - peak_depth[:, None, None] * dip[None]
+    std = 0.05 + 0.5 * peak_depth[:, None, None] * dip[None]
+    return mean.astype(np.float32), std.astype(np.float32)
+
+
+class TrafficProfiles:
+    """Speed ratio profiles per road class, with optional per-segment overrides."""
+
+    def __init__(self, mean, std, keys=None, segment_mean=None, segment_std=None):
+        self.mean = mean  # (ROAD_CLASS_COUNT, 2, SLOTS_PER_DAY)
+        self.std = std
+        self.keys = keys  # (K,) sorted segment keys
+        self.segment_mean = segment_mean  # (K, 2, SLOTS_PER_DAY)
+        self.segment_std = segment_std
+
+    @classmethod
+    def load(cls, path) -> "TrafficProfiles":
+        path = Path(path)
+        optional = {}
+        if (path / "keys.npy").exists():
+            optional = {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in ("keys", "segment_mean", "segment_std")}
+        return cls(np.load(path / "mean.npy", mmap_mode="r"), np.load(path / "std.npy", mmap_mode="r"), **optional)
+
+    def save(self, path) -> None:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        arrays = {"mean": self.mean, "std": self.std}
+        if self.keys is not None:
+            arrays.update(keys=self.keys, segment_mean=self.segment_mean, segment_std=self.segment_std)
+        for name, values in arrays.items():
+            np.save(path / f"{name}.npy", np.ascontiguousarray(values))
+
+    def segment_rows(self, lat, lon, road_class) -> np.ndarray:
+        """Row of the per-segment profile of each segment start point, -1 if none."""
+        rows = np.full(len(road_class), -1, dtype=np.int64)
+        if self.keys is None or not len(self.keys):
+            return rows
+        keys = group_keys(lat, lon, road_class)
+        slot = np.searchsorted(self.keys, keys).clip(max=len(self.keys) - 1)
+        found = self.keys[slot] == keys
+        rows[found] = slot[found]
+        return rows
+
+    def ratios(self, road_class: np.ndarray, rows: np.ndarray, day_type: np.ndarray, slot: np.ndarray):
+        """(mean, std) speed ratios; road_class / rows are (n,), day_type / slot broadcast to (D, n)."""
+        # Flat (road class, day type, slot) index: one take per array instead of 3-D fancy indexing
+        flat = (np.clip(road_class, 0, ROAD_CLASS_COUNT - 1) * 2 + day_type) * SLOTS_PER_DAY + slot
+        mean = np.take(np.asarray(self.mean).reshape(-1), flat)
+        std = np.take(np.asarray(self.std).reshape(-1), flat)
+        has_row = rows >= 0
+        if has_row.any():
+            flat = (np.where(has_row, rows, 0) * 2 + day_type) * SLOTS_PER_DAY + slot
+            mean = np.where(has_row, np.take(np.asarray(self.segment_mean).reshape(-1), flat), mean)
+            std = np.where(has_row, np.take(np.asarray(self.segment_std).reshape(-1), flat), std)
+        return mean, std
+
+
+_profiles: Optional[TrafficProfiles] = None
+
+
+def get_traffic_profiles() -> TrafficProfiles:
+    """Load the profiles of TRAFFIC_PROFILES_PATH once, built-in profiles otherwise."""
+    global _profiles
+    if _profiles is None:
+        path = os.environ.get('TRAFFIC_PROFILES_PATH')
+        if path:
+            try:
+                _profiles = TrafficProfiles.load(path)
+                logger.info(f"Loaded traffic profiles from {path}")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Traffic profiles unavailable ({path}): {e}, using built-in profiles")
+        if _profiles is None:
+            _profiles = TrafficProfiles(*default_profiles())
+    return _profiles
+
+
+def _local_clock(departures: List[datetime]):
+    """Seconds since local midnight and weekday (0 = Monday) of each departure."""
+    local = [(d if d.tzinfo else d.replace(tzinfo=LOCAL_TZ)).astimezone(LOCAL_TZ) for d in departures]
+    seconds = np.array([t.hour * 3600 + t.minute * 60 + t.second for t in local], dtype=np.float64)
+    weekday = np.array([t.weekday() for t in local], dtype=np.int64)
+    return seconds, weekday
+
+
+def evaluate_departures(
+    context: VehiclePhysicsContext,
+    lat: np.ndarray,
+    lon: np.ndarray,
+    elevation: np.ndarray,
+    speed_limit: np.ndarray,
+    road_class: np.ndarray,
+    departures: List[datetime],
+    profiles: Optional[TrafficProfiles] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Expected energy (kWh) and duration (s) of a route for every departure
+    time, in one batched evaluation over (departures x segments) matrices.
+
+    lat / lon / elevation hold one value per point, speed_limit one per
+    elementary segment and road_class one per point (the class of a segment
+    is the class of its start point). Returns (D,) arrays: "traffic_*" when
+    driving with the traffic, "eco_*" at the eco speed capped by the traffic.
+    """
+    profiles = profiles or get_traffic_profiles()
+    lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+    # Geometry and eco speeds do not depend on the departure: computed once
+    distance_m = haversine_distances(lat, lon)
+    slope = segment_slopes(distance_m, np.diff(np.asarray(elevation, dtype=np.float64)))
+    speed_limit = np.asarray(speed_limit, dtype=np.float64)
+    eco_speed = context.eco_speeds(speed_limit, slope)
+    road_class = np.asarray(road_class, dtype=np.int64)[:-1]
+    rows = profiles.segment_rows(lat[:-1], lon[:-1], road_class)
+    start_s, weekday = _local_clock(departures)
+
+    def speed_ratios(block, offset):
+        slots = ((start_s[block, None] + offset) // SLOT_S).astype(np.int64)  # Quarter-hours since the departure day
+        day_type = (weekday[block, None] + slots // SLOTS_PER_DAY) % 7 >= 5
+        return profiles.ratios(road_class, rows, day_type.astype(np.int64), slots % SLOTS_PER_DAY)
+
+    def quadrature_speeds(mean, std):
+        return [(weight, np.maximum(speed_limit * (mean + node * std), MIN_SPEED_KMH))
+                for node, weight in zip(QUADRATURE_NODES, QUADRATURE_WEIGHTS)]
+
+    results = {name: np.zeros(len(departures)) for name in ("traffic_energy", "traffic_time", "eco_energy", "eco_time")}
+    for first in range(0, len(departures), DEPARTURE_BLOCK):
+        block = slice(first, first + DEPARTURE_BLOCK)
+        # Entry time of each segment = expected time spent on the previous ones;
+        # only times are needed to converge, energies are evaluated once at the end
+        offset = np.zeros((len(start_s[block]), len(distance_m)))  # Seconds from departure to segment entry
+        for _ in range(FIXED_POINT_ITERATIONS):
+            traffic_time = sum(weight * distance_m * 3.6 / speed
+                               for weight, speed in quadrature_speeds(*speed_ratios(block, offset)))
+            offset = np.cumsum(traffic_time, axis=1) - traffic_time
+
+        for weight, speed in quadrature_speeds(*speed_ratios(block, offset)):
+            capped_eco = np.minimum(eco_speed, speed)
+            results["traffic_energy"][block] += weight * context.energy(speed, distance_m, slope).sum(axis=1)
+            results["traffic_time"][block] += weight * (distance_m * 3.6 / speed).sum(axis=1)
+            results["eco_energy"][block] += weight * context.energy(capped_eco, distance_m, slope).sum(axis=1)
+            results["eco_time"][block] += weight * travel_times(distance_m, capped_eco).sum(axis=1)
+    return results
+
+
+def departure_count(hours: float, step_minutes: int) -> int:
+    """Number of departures of departure_grid, to bound a window before building it."""
+    return int(hours * 60 // step_minutes) + 1
+
+
+def departure_grid(start: datetime, hours: float, step_minutes: int) -> List[datetime]:
+    """Departure times from start to start + hours (included), every step_minutes."""
+    return [start + timedelta(minutes=step_minutes * k) for k in range(departure_count(hours, step_minutes))]
@@ -0,0 +1,159 @@
+"""
+Urban-zone classification for ECOSPEED
+Classifies route points as urban / non-urban from an offline boundary dataset
+(GeoJSON polygons of urban areas) instead of reverse geocoding, with zero
+network calls.
+
+Polygons are indexed in a regular lat/lon grid (cell -> candidate polygons)
+and points are tested with a vectorized ray-casting point-in-polygon test,
+so a whole route is classified in one call.
+
+The dataset is set with URBAN_AREAS_PATH (e.g. an export of OSM built-up
+areas or of the INSEE urban units); without it the classification is off and
+the caller falls back to its road-type heuristic. data/urban_areas_sample.geojson
+is only a placeholder for demos and tests (circles around city centres), not
+a boundary dataset.
+"""
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_URBAN_AREAS_PATH = Path(__file__).parent / "data" / "urban_areas_sample.geojson"
+GRID_CELL_DEG = 0.05  # ~5 km cells
+EDGE_BLOCK_SIZE = 1 << 20  # Point x edge pairs tested at once (bounded memory)
+
+
+def _points_in_ring(lon: np.ndarray, lat: np.ndarray, ring: np.ndarray) -> np.ndarray:
+    """Vectorized even-odd ray casting of points against one polygon ring ((k, 2) lon/lat)."""
+    inside = np.zeros(len(lon), dtype=bool)
+    # Only the points in the bounding box of the ring can be inside
+    (x_min, y_min), (x_max, y_max) = ring.min(axis=0), ring.max(axis=0)
+    candidates = np.flatnonzero((lon >= x_min) & (lon <= x_max) & (lat >= y_min) & (lat <= y_max))
+    if not len(candidates):
+        return inside
+    px = lon[candidates, None]
+    py = lat[candidates, None]
+    x1, y1 = ring[:-1, 0], ring[:-1, 1]
+    x2, y2 = ring[1:, 0], ring[1:, 1]
+    dy = np.where(y2 != y1, y2 - y1, 1e-12)
+    parity = np.zeros(len(candidates), dtype=bool)
+    # (points x edges) blocks of edges
+    step = max(1, EDGE_BLOCK_SIZE // len(candidates))
+    for first in range(0, len(x1), step):
+        edges = slice(first, first + step)
+        crosses = (y1[edges] > py) != (y2[edges] > py)
+        x_at = x1[edges] + (py - y1[edges]) * (x2[edges] - x1[edges]) / dy[edges]
+        parity ^= np.logical_xor.reduce(crosses & (px < x_at), axis=1)
+    inside[candidates] = parity
+    return inside
+
+
+class UrbanAreaIndex:
+    """Grid-indexed set of urban polygons (each polygon: outer ring + optional holes)."""
+
+    def __init__(self, polygons: List[List[np.ndarray]], names: Optional[List[str]] = None, cell_deg: float = GRID_CELL_DEG):
+        self.polygons = polygons
+        self.names = names or [""] * len(polygons)
+        self.cell_deg = cell_deg
+        self.cells: Dict[Tuple[int, int], List[int]] = {}
+        for pid, rings in enumerate(polygons):
+            outer = rings[0]
+            x0, y0 = np.floor(outer.min(axis=0) / cell_deg).astype(int)
+            x1, y1 = np.floor(outer.max(axis=0) / cell_deg).astype(int)
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    self.cells.setdefault((cx, cy), []).append(pid)
+
+    @classmethod
+    def from_geojson(cls, path) -> "UrbanAreaIndex":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        polygons, names = [], []
+        for feature in data.get("features", []):
+            geometry = feature.get("geometry") or {}
+            name = (feature.get("properties") or {}).get("name", "")
+            if geometry.get("type") == "Polygon":
+                parts = [geometry["coordinates"]]
+            elif geometry.get("type") == "MultiPolygon":
+                parts = geometry["coordinates"]
+            else:
+                continue
+            for rings in parts:
+                polygons.append([np.asarray(ring, dtype=np.float64)[:, :2] for ring in rings])
+                names.append(name)
+        return cls(polygons, names)
+
+    def __len__(self) -> int:
+        return len(self.polygons)
+
+    def classify(self, lat, lon) -> np.ndarray:
+        """Boolean array: True where the point lies in an urban polygon."""
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        urban = np.zeros(len(lat), dtype=bool)
+        if not len(lat) or not self.polygons:
+            return urban
+
+        cx = np.floor(lon / self.cell_deg).astype(np.int64)
+        cy = np.floor(lat / self.cell_deg).astype(np.int64)
+        # Cell key with a non-negative latitude part so that divmod gives (cx, cy) back
+        keys = cx * 100_000 + (cy + 50_000)
+        order = np.argsort(keys, kind="stable")
+        cell_keys, starts = np.unique(keys[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+
+        # Points of each candidate polygon, gathered through the grid cells they fall in
+        candidates: Dict[int, List[np.ndarray]] = {}
+        for key, start, end in zip(cell_keys.tolist(), starts.tolist(), ends.tolist()):
+            cell_x, cell_y = divmod(key, 100_000)
+            pids = self.cells.get((cell_x, cell_y - 50_000))
+            if pids:
+                for pid in pids:
+                    candidates.setdefault(pid, []).append(order[start:end])
+
+        for pid, chunks in candidates.items():
+            points = np.concatenate(chunks)
+            points = points[~urban[points]]
+            if not len(points):
+                continue
+            rings = self.polygons[pid]
+            inside = _points_in_ring(lon[points], lat[points], rings[0])
+            for hole in rings[1:]:
+                inside &= ~_points_in_ring(lon[points], lat[points], hole)
+            urban[points[inside]] = True
+        return urban
+
+
+_index: Optional[UrbanAreaIndex] = None
+_loaded = False
+
+
+def get_urban_index() -> Optional[UrbanAreaIndex]:
+    """Load the urban area dataset once (None if URBAN_AREAS_PATH is not set, missing or invalid)."""
+    global _index, _loaded
+    if not _loaded:
+        _loaded = True
+        path = os.environ.get('URBAN_AREAS_PATH', '').strip()
+        if not path:
+            logger.info("No urban area dataset (URBAN_AREAS_PATH): urban zones from road types")
+            return None
+        try:
+            _index = UrbanAreaIndex.from_geojson(path)
+            logger.info(f"Loaded {len(_index)} urban area polygons from {path}")
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Urban area dataset unavailable ({path}): {e}")
+    return _index
+
+
+def classify_urban(lat, lon) -> Optional[np.ndarray]:
+    """Per-point urban classification, or None when no dataset is available."""
+    index = get_urban_index()
+    if index is None:
+        return None
+    return index.classify(lat, lon)
@@ -0,0 +1,126 @@
+"""
+Vehicle profile catalog for ECOSPEED
+Built-in EV profiles are read from data/vehicle_profiles.json, custom fleet
+profiles are registered through the API and persisted in MongoDB.
+
+The catalog is served from an immutable in-memory snapshot: profiles, the
+pre-serialized JSON body and its strong ETag are computed once per version.
+Registering a profile builds a new snapshot (copy-on-write) and swaps it in,
+so readers never lock and never see a partially updated catalog.
+
+Every profile goes through a normalizer (the API passes the VehicleProfile
+model) so the served JSON carries the full field set with its defaults, the
+same for built-in and custom profiles.
+
+Note: in the data file, drag_coefficient holds CdA (Cd × frontal area, m²);
+frontal_area is for display only.
+"""
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VEHICLE_PROFILES_PATH = Path(__file__).parent / "data" / "vehicle_profiles.json"
+
+
+def _serialize(profiles) -> bytes:
+    return json.dumps(list(profiles), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+class CatalogSnapshot:
+    """One immutable version of the catalog."""
+
+    def __init__(self, profiles: Tuple[Dict[str, Any], ...], version: int):
+        self.profiles = profiles
+        self.version = version
+        self.body = _serialize(profiles)
+        self.etag = _etag(self.body)
+        self._by_name = {profile["name"].casefold(): profile for profile in profiles}
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        return self._by_name.get(name.casefold())
+
+    def search(
+        self,
+        query: Optional[str] = None,
+        min_battery_kwh: Optional[float] = None,
+        max_battery_kwh: Optional[float] = None,
+        source: Optional[str] = None,
+    ) -> Tuple[bytes, str]:
+        """Filtered catalog: (JSON body, ETag). Unfiltered requests reuse the snapshot body."""
+        if query is None and min_battery_kwh is None and max_battery_kwh is None and source is None:
+            return self.body, self.etag
+        needle = query.casefold() if query else None
+        matches = [
+            profile for profile in self.profiles
+            if (needle is None or needle in profile["name"].casefold())
+            and (min_battery_kwh is None or profile.get("battery_kwh", 0) >= min_battery_kwh)
+            and (max_battery_kwh is None or profile.get("battery_kwh", 0) <= max_battery_kwh)
+            and (source is None or profile.get("source") == source)
+        ]
+        body = _serialize(matches)
+        return body, _etag(body)
+
+
+class VehicleCatalog:
+    """Built-in + custom profiles, published as immutable snapshots."""
+
+    def __init__(self, builtin: List[Dict[str, Any]], normalize: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None):
+        self._normalize = normalize or dict
+        self._builtin = tuple(dict(self._normalize(profile), source="builtin") for profile in builtin)
+        self._custom: Dict[str, Dict[str, Any]] = {}
+        self.snapshot = CatalogSnapshot(self._builtin, version=1)
+
+    @classmethod
+    def from_file(cls, path, normalize=None) -> "VehicleCatalog":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), normalize)
+
+    def _publish(self) -> CatalogSnapshot:
+        custom = tuple(sorted(self._custom.values(), key=lambda profile: profile["name"].casefold()))
+        self.snapshot = CatalogSnapshot(self._builtin + custom, self.snapshot.version + 1)
+        return self.snapshot
+
+    def is_builtin(self, name: str) -> bool:
+        return any(profile["name"].casefold() == name.casefold() for profile in self._builtin)
+
+    def load_custom(self, profiles: List[Dict[str, Any]]) -> CatalogSnapshot:
+        """Replace the custom profiles (e.g. with the ones stored in MongoDB)."""
+        custom = {}
+        for profile in profiles:
+            if self.is_builtin(profile["name"]):
+                continue
+            try:
+                custom[profile["name"].casefold()] = dict(self._normalize(profile), source="custom")
+            except Exception as e:
+                logger.warning(f"Skipping invalid vehicle profile '{profile['name']}': {e}")
+        self._custom = custom
+        return self._publish()
+
+    def register(self, profile: Dict[str, Any]) -> CatalogSnapshot:
+        """Add or replace a custom profile. Built-in names cannot be overridden."""
+        if self.is_builtin(profile["name"]):
+            raise ValueError(f"'{profile['name']}' is a built-in vehicle profile")
+        self._custom[profile["name"].casefold()] = dict(self._normalize(profile), source="custom")
+        return self._publish()
+
+
+_catalog: Optional[VehicleCatalog] = None
+
+
+def get_vehicle_catalog(normalize=None) -> VehicleCatalog:
+    """Load the built-in profiles once (VEHICLE_PROFILES_PATH, default data/vehicle_profiles.json)."""
+    global _catalog
+    if _catalog is None:
+        path = os.environ.get('VEHICLE_PROFILES_PATH') or DEFAULT_VEHICLE_PROFILES_PATH
+        _catalog = VehicleCatalog.from_file(path, normalize)
+        logger.info(f"Loaded {len(_catalog.snapshot.profiles)} vehicle profiles from {path}")
+    return _catalog
@@ -1,17 +1,28 @@
 import React from 'react';
 import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer } from 'recharts';
 
-const SpeedChart = ({ segments }) => {
-  // Transform segments data for chart
-  const data = segments.map((segment, index) => {
-    const distanceKm = segments.slice(0, index + 1).reduce((sum, s) => sum + s.distance, 0) / 1000;
-    return {
-      distance: distanceKm.toFixed(1),
-      limit: segment.speed_limit,
-      eco: segment.eco_speed,
-      segment: index + 1
-    };
-  });
+const SpeedChart = ({ segments, chart }) => {
+  // Séries sous-échantillonnées par le backend si disponibles, sinon tous les segments
+  let data;
+  if (chart && chart.segment_index && chart.segment_index.length > 0) {
+    data = chart.segment_index.map((segmentIndex, i) => ({
+      distance: chart.distance_km[i].toFixed(1),
+      limit: chart.speed_limit[i],
+      eco: chart.eco_speed[i],
+      segment: segmentIndex + 1
+    }));
+  } else {
+    let distanceM = 0;
+    data = segments.map((segment, index) => {
+      distanceM += segment.distance;
+      return {
+        distance: (distanceM / 1000).toFixed(1),
+        limit: segment.speed_limit,
+        eco: segment.eco_speed,
+        segment: index + 1
+      };
+    });
+  }
 
   const CustomTooltip = ({ active, payload }) => {
     if (active && payload && payload.length) {
@@ -495,7 +495,8 @@ const AnalysisPage = () => {
         climate_intensity: climateIntensity,
         battery_start_pct: batteryStartPct,
         battery_end_pct: targetArrivalPct,
-        rho_air: rhoAir
+        rho_air: rhoAir,
+        chart_points: 600 // Séries du graphique de vitesse sous-échantillonnées côté serveur
       };
       
       console.log('Sending request to:', `${API}/route`);
@@ -1798,7 +1799,7 @@ const AnalysisPage = () => {
                           </CardDescription>
                         </CardHeader>
                         <CardContent>
-                          <SpeedChart segments={routeData.segments} />
+                          <SpeedChart segments={routeData.segments} chart={routeData.chart} />
                         </CardContent>
                       </Card>
                     </TabsContent>
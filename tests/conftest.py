@@ -0,0 +1,12 @@
+import os
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), "..", "backend")
+sys.path.insert(0, os.path.abspath(BACKEND_DIR))
+
+# server.py reads these at import time; the tests never reach MongoDB and keep
+# every cache in-process
+os.environ.setdefault("MONGO_URL", "mongodb://127.0.0.1:27017")
+os.environ.setdefault("DB_NAME", "ecospeed_test")
+os.environ["SHARED_CACHE_DIR"] = ""
+os.environ.setdefault("PHYSICS_EXECUTOR", "inline")
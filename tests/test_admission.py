@@ -0,0 +1,159 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from admission import AdmissionController, AdmissionRejected, Lane
+
+
+def controller(capacity=2.0, navigation_slo=1.0, planning_slo=1.0, bulk_slo=1.0):
+    return AdmissionController(capacity, [
+        Lane("navigation", 0, slo_s=navigation_slo),
+        Lane("planning", 1, slo_s=planning_slo),
+        Lane("bulk", 2, slo_s=bulk_slo),
+    ])
+
+
+def test_waiting_requests_are_granted_by_lane_priority():
+    admission = controller()
+    order = []
+
+    async def request(lane):
+        async with admission.admit(lane, 1):
+            order.append(lane)
+
+    async def main():
+        running = [await admission.acquire("planning", 1) for _ in range(2)]
+        bulk = asyncio.ensure_future(request("bulk"))
+        await asyncio.sleep(0)
+        navigation = asyncio.ensure_future(request("navigation"))
+        await asyncio.sleep(0)
+        assert admission.stats()["lanes"]["bulk"]["queued"] == 1
+        running[0].release()
+        await asyncio.gather(bulk, navigation)
+        running[1].release()
+
+    asyncio.run(main())
+
+    assert order == ["navigation", "bulk"]
+    assert admission.in_use == 0
+
+
+def test_lane_head_is_not_overtaken_by_a_smaller_request():
+    admission = controller(capacity=4.0, planning_slo=5.0, bulk_slo=5.0)
+
+    async def main():
+        running = await admission.acquire("planning", 2)
+        large = asyncio.ensure_future(admission.acquire("planning", 4))
+        small = asyncio.ensure_future(admission.acquire("bulk", 1))
+        await asyncio.sleep(0.01)
+        # One unit is free, but the large planning request is first in line
+        assert not large.done() and not small.done()
+        running.release()
+        large_ticket = await large
+        assert not small.done()
+        large_ticket.release()
+        (await small).release()
+
+    asyncio.run(main())
+
+
+def test_cost_above_capacity_runs_alone():
+    admission = controller()
+
+    async def main():
+        return await admission.acquire("bulk", 50)
+
+    ticket = asyncio.run(main())
+
+    assert ticket.cost == 2.0
+    assert admission.in_use == 2.0
+
+
+def test_projected_wait_above_the_slo_is_rejected_right_away():
+    admission = controller(navigation_slo=0.5)
+    admission.lanes["navigation"].unit_s = 10.0
+
+    async def main():
+        running = await admission.acquire("navigation", 2)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire("navigation", 1)
+        running.release()
+        return rejected.value
+
+    rejected = asyncio.run(main())
+
+    assert rejected.lane == "navigation" and rejected.retry_after_s > 0.5
+    assert admission.counters["navigation"] == {"admitted": 1, "rejected": 1, "timed_out": 0}
+
+
+def test_request_queued_beyond_its_slo_is_rejected():
+    admission = controller(planning_slo=0.05)
+    admission.lanes["planning"].unit_s = 0.0
+
+    async def main():
+        running = await admission.acquire("planning", 2)
+        with pytest.raises(AdmissionRejected, match="queued longer"):
+            await admission.acquire("planning", 1)
+        running.release()
+
+    asyncio.run(main())
+
+    assert admission.counters["planning"]["timed_out"] == 1
+    assert admission.stats()["lanes"]["planning"]["queued"] == 0
+    assert admission.in_use == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    admission = controller(bulk_slo=5.0)
+
+    async def main():
+        running = await admission.acquire("bulk", 2)
+        waiter = asyncio.ensure_future(admission.acquire("bulk", 1))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert admission.stats()["lanes"]["bulk"]["queued"] == 0
+        running.release()
+
+    asyncio.run(main())
+
+    assert admission.in_use == 0
+
+
+def test_shed_requests_get_429_with_retry_after(monkeypatch):
+    async def acquire(lane_name, cost):
+        raise AdmissionRejected(lane_name, "projected queue latency 12.3s above 10s", 12.3)
+
+    monkeypatch.setattr(server.admission, "acquire", acquire)
+
+    response = TestClient(server.app).get("/api/export/segments", params={"format": "csv"})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "13"
+
+
+def test_station_query_costs_its_area_only_upstream(monkeypatch):
+    costs = []
+    acquire = server.admission.acquire
+
+    async def recording(lane_name, cost):
+        costs.append(cost)
+        return await acquire(lane_name, cost)
+
+    async def fetch(latitude, longitude, distance):
+        return [], 0
+
+    monkeypatch.setattr(server.admission, "acquire", recording)
+    monkeypatch.setattr(server, "_fetch_charging_stations", fetch)
+    monkeypatch.setattr(server.station_sync, "index", None)
+    client = TestClient(server.app)
+
+    assert client.get("/api/charging-stations").status_code == 200
+    monkeypatch.setattr(server.station_sync, "index", server.StationIndex([server.ChargingStation(
+        name="Borne", operator="Test", powerKw=22.0, status="Dispo", latitude=48.8, longitude=2.3)]))
+    assert client.get("/api/charging-stations").status_code == 200
+
+    assert costs == [server.area_cost(server.FRANCE_AREA_KM2), server.STATION_INDEX_COST]
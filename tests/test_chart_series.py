@@ -0,0 +1,146 @@
+import asyncio
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from chart_series import CUMULATIVE_SERIES, SPEED_SERIES, chart_series, lttb_indices, minmax_indices
+
+
+def speed_profile(n=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    speed = np.clip(90 + np.cumsum(rng.normal(0, 0.5, n)), 30, 130)
+    speed[1234] = 5.0  # Short stop
+    speed[3210] = 160.0  # Spike
+    return speed
+
+
+def base(n=5000):
+    speed = speed_profile(n)
+    rng = np.random.default_rng(1)
+    columns = {"distance_km": np.cumsum(rng.uniform(5, 20, n)) / 1000}
+    for name in SPEED_SERIES:
+        columns[name] = speed + {"speed_limit": 10, "eco_speed": 0, "real_speed": -5}[name]
+    for name in CUMULATIVE_SERIES:
+        columns[name] = np.cumsum(rng.uniform(-0.001, 0.01, n))
+    return columns
+
+
+def test_lttb_keeps_both_ends_and_the_extremes():
+    speed = speed_profile()
+    x = np.arange(len(speed), dtype=np.float64)
+
+    indices = lttb_indices(x, speed, 200)
+
+    assert len(indices) == 200
+    assert indices[0] == 0 and indices[-1] == len(speed) - 1
+    assert (np.diff(indices) > 0).all()
+    assert {1234, 3210} <= set(indices.tolist())
+
+
+def test_minmax_keeps_every_series_extremes_within_budget():
+    columns = base()
+    series = [columns[name] for name in SPEED_SERIES]
+
+    indices = minmax_indices(series, 100)
+
+    assert len(indices) <= 100
+    assert indices[0] == 0 and indices[-1] == len(columns["eco_speed"]) - 1
+    for values in series:
+        assert values[indices].min() == values.min()
+        assert values[indices].max() == values.max()
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+def test_cumulative_series_stay_exact_at_the_retained_points(method):
+    columns = base()
+
+    series = chart_series(columns, 300, method)
+
+    indices = np.array(series["segment_index"])
+    assert indices[-1] == len(columns["eco_energy"]) - 1
+    for name in CUMULATIVE_SERIES + ("distance_km",):
+        np.testing.assert_array_equal(series[name], columns[name][indices])
+        assert series[name][-1] == columns[name][-1]
+
+
+def test_short_routes_are_not_downsampled():
+    columns = {name: values[:50] for name, values in base().items()}
+
+    for method in ("lttb", "minmax"):
+        assert chart_series(columns, 100, method)["segment_index"] == list(range(50))
+
+
+def varied_route(n=3000):
+    """Route points whose speed limit changes every 10 points (one merged segment each)."""
+    limits = np.array([50.0, 90.0, 130.0, 70.0])
+    points = [
+        {"lat": lat, "lon": 2.35, "elevation": 100 + 30 * np.sin(k / 200), "speed_limit": limits[(k // 10) % 4], "road_class": 0}
+        for k, lat in enumerate(np.linspace(48.8, 48.2, n))
+    ]
+    return points, [], [[p["lat"], p["lon"]] for p in points], [0, n - 1]
+
+
+@pytest.fixture
+def route(monkeypatch):
+    async def get_route_from_ors(start, end, user_max_speed, waypoints):
+        return varied_route()
+
+    async def route_cost(request):
+        return 1.0
+
+    monkeypatch.setattr(server, "get_route_from_ors", get_route_from_ors)
+    monkeypatch.setattr(server, "_route_cost", route_cost)
+    request = server.RouteRequest(
+        start="Paris", end="Etampes",
+        vehicle_profile=server.VehicleProfile(
+            name="Chart EV", empty_mass=1850, extra_load=150, drag_coefficient=0.58, frontal_area=2.2,
+            rolling_resistance=0.008, motor_efficiency=0.95, regen_efficiency=0.85
+        )
+    )
+    return asyncio.run(server.calculate_route(request))
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+def test_route_chart_endpoint(route, method):
+    client = TestClient(server.app)
+
+    response = client.get(f"/api/route/{route.route_id}/chart", params={"points": 20, "method": method})
+
+    assert response.status_code == 200
+    chart = response.json()
+    assert chart["source_segments"] == len(route.segments) > 100
+    assert chart["points"] == len(chart["segment_index"]) <= 20
+    assert chart["segment_index"][0] == 0 and chart["segment_index"][-1] == len(route.segments) - 1
+    assert chart["eco_energy"][-1] == pytest.approx(sum(s.eco_energy for s in route.segments))
+    assert chart["real_time"][-1] == pytest.approx(sum(s.real_time for s in route.segments))
+    # Cached per resolution on the stored route
+    assert (20, method) in server.route_store.get(route.route_id).charts
+
+
+def test_route_chart_options_are_checked(route):
+    client = TestClient(server.app)
+
+    assert client.get(f"/api/route/{route.route_id}/chart", params={"points": 5}).status_code == 400
+    assert client.get(f"/api/route/{route.route_id}/chart", params={"method": "mean"}).status_code == 400
+
+
+def test_route_kpis_of_a_route_expired_from_the_store(route, monkeypatch):
+    client = TestClient(server.app)
+    live = client.get(f"/api/route/{route.route_id}/kpis").json()
+    document = {"response": route.model_dump()}
+
+    class Routes:
+        async def find_one(self, query, projection):
+            return document if query == {"route_id": route.route_id} else None
+
+    monkeypatch.setattr(server, "db", type("Db", (), {"routes": Routes()})())
+    monkeypatch.setattr(server.route_store, "_routes", type(server.route_store._routes)())
+
+    persisted = client.get(f"/api/route/{route.route_id}/kpis")
+
+    assert persisted.status_code == 200
+    assert persisted.json() == pytest.approx(live)
+    assert live["energy_saved"] == pytest.approx(live["limit_energy"] - live["eco_energy"])
+    assert client.get("/api/route/unknown/kpis").status_code == 404
@@ -0,0 +1,126 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import server
+from coalescing import SingleFlight, request_key
+
+
+def test_request_key_ignores_dict_order():
+    assert request_key("route", {"a": 1, "b": [1, 2]}) == request_key("route", {"b": [1, 2], "a": 1})
+    assert request_key("route", {"a": 1}) != request_key("stations", {"a": 1})
+
+
+def test_concurrent_identical_calls_share_one_execution():
+    flight = SingleFlight("test")
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    async def main():
+        return await asyncio.gather(*(flight.run("key", work) for _ in range(5)))
+
+    results = asyncio.run(main())
+
+    assert calls == 1
+    assert [result for result, _ in results] == [1] * 5
+    assert [leader for _, leader in results] == [True, False, False, False, False]
+    assert flight.stats() == {"leaders": 1, "followers": 4, "in_flight": 0}
+
+
+def test_key_is_forgotten_once_finished():
+    flight = SingleFlight("test")
+
+    async def work():
+        return object()
+
+    async def main():
+        return await flight.do("key", work), await flight.do("key", work)
+
+    first, second = asyncio.run(main())
+
+    assert first is not second
+
+
+def test_errors_reach_every_caller():
+    flight = SingleFlight("test")
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream down")
+
+    async def main():
+        return await asyncio.gather(flight.do("key", work), flight.do("key", work), return_exceptions=True)
+
+    results = asyncio.run(main())
+
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_work():
+    flight = SingleFlight("test")
+
+    async def work():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do("key", work))
+        follower = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(main()) == "done"
+
+
+def fake_route(n=300):
+    points = [
+        {"lat": lat, "lon": 2.35, "elevation": 100.0, "speed_limit": 90.0, "road_class": 0}
+        for lat in np.linspace(48.8, 48.6, n)
+    ]
+    return points, [], [[p["lat"], p["lon"]] for p in points], [0, n - 1]
+
+
+def test_coalesced_route_callers_get_independent_routes(monkeypatch):
+    calls = 0
+
+    async def get_route_from_ors(start, end, user_max_speed, waypoints):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.02)
+        return fake_route()
+
+    async def route_cost(request):
+        return 1.0
+
+    monkeypatch.setattr(server, "get_route_from_ors", get_route_from_ors)
+    monkeypatch.setattr(server, "_route_cost", route_cost)
+    request = server.RouteRequest(
+        start="Paris", end="Etampes",
+        vehicle_profile=server.VehicleProfile(
+            name="Test EV", empty_mass=1850, extra_load=150, drag_coefficient=0.58, frontal_area=2.2,
+            rolling_resistance=0.008, motor_efficiency=0.95, regen_efficiency=0.85
+        )
+    )
+
+    async def main():
+        return await asyncio.gather(server.calculate_route(request), server.calculate_route(request))
+
+    first, second = asyncio.run(main())
+
+    assert calls == 1
+    assert first.route_id != second.route_id
+    assert first.segments == second.segments
+    first_stored = server.route_store.get(first.route_id)
+    second_stored = server.route_store.get(second.route_id)
+    assert second_stored.response.route_id == second.route_id
+    # One driver's navigation updates do not move the other's matching window
+    asyncio.run(server.route_store.set_progress(first_stored, 200))
+    assert second_stored.progress_index == 0
+    assert server._nearest_route_point(second_stored, 48.79, 2.35)[0] < 200
@@ -0,0 +1,39 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from tests.test_reoptimize import store_route
+
+
+@pytest.fixture
+def client():
+    return TestClient(server.app)
+
+
+def test_departure_window_is_evaluated_in_one_batch(client):
+    stored = store_route()
+
+    response = client.post(f"/api/route/{stored.route_id}/departure",
+                           json={"window_start": "2026-03-02T06:00:00", "window_hours": 24, "step_minutes": 15})
+
+    assert response.status_code == 200
+    assert len(response.json()["candidates"]) == 97
+
+
+def test_too_many_departures_are_refused_before_building_them(client, monkeypatch):
+    stored = store_route()
+    monkeypatch.setattr(server, "departure_grid", lambda *args: pytest.fail("departure grid built"))
+
+    response = client.post(f"/api/route/{stored.route_id}/departure",
+                           json={"window_start": "2026-03-02T06:00:00", "window_hours": 48, "step_minutes": 1})
+
+    assert response.status_code == 400
+
+
+def test_window_hours_is_bounded(client):
+    stored = store_route()
+
+    response = client.post(f"/api/route/{stored.route_id}/departure",
+                           json={"window_start": "2026-03-02T06:00:00", "window_hours": 1e12, "step_minutes": 15})
+
+    assert response.status_code == 422
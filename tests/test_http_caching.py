@@ -0,0 +1,128 @@
+import pytest
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.testclient import TestClient
+
+import server
+import vehicle_catalog
+from http_caching import HttpCachingMiddleware, etag_for, etag_matches
+from vehicle_catalog import DEFAULT_VEHICLE_PROFILES_PATH, VehicleCatalog
+
+
+@pytest.mark.parametrize("if_none_match, expected", [
+    (None, False), ('"a"', True), ('W/"a"', True), ('"b", "a"', True), ("*", True), ('"b"', False),
+])
+def test_etag_matches(if_none_match, expected):
+    assert etag_matches(if_none_match, '"a"') is expected
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+
+    @app.get("/data")
+    def data():
+        return {"value": 1}
+
+    @app.get("/versioned")
+    def versioned():
+        return Response(b"{}", media_type="application/json", headers={"ETag": '"v7"', "Cache-Control": "no-cache"})
+
+    @app.get("/missing")
+    def missing():
+        raise HTTPException(status_code=404)
+
+    @app.post("/data")
+    def post_data():
+        return {"value": 2}
+
+    @app.get("/uncached")
+    def uncached():
+        return {"value": 3}
+
+    app.add_middleware(HttpCachingMiddleware, policies=[(r"/data|/versioned|/missing", "public, max-age=60")])
+    return TestClient(app)
+
+
+def test_body_hash_etag_and_304(client):
+    response = client.get("/data")
+
+    assert response.headers["etag"] == etag_for(response.content)
+    assert response.headers["cache-control"] == "public, max-age=60"
+    revalidated = client.get("/data", headers={"If-None-Match": response.headers["etag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert "content-length" not in revalidated.headers or revalidated.headers["content-length"] == "0"
+    assert revalidated.headers["etag"] == response.headers["etag"]
+
+
+def test_endpoint_validators_are_kept(client):
+    response = client.get("/versioned", headers={"If-None-Match": '"v6"'})
+
+    assert response.status_code == 200
+    assert response.headers["etag"] == '"v7"' and response.headers["cache-control"] == "no-cache"
+    assert client.get("/versioned", headers={"If-None-Match": '"v7"'}).status_code == 304
+
+
+def test_errors_posts_and_other_paths_go_through(client):
+    assert "etag" not in client.get("/missing", headers={"If-None-Match": "*"}).headers
+    assert "etag" not in client.post("/data").headers
+    assert "etag" not in client.get("/uncached").headers
+
+
+FLEET_VAN = {
+    "name": "Fleet Van", "empty_mass": 2500, "extra_load": 300, "drag_coefficient": 0.9, "frontal_area": 3.2,
+    "rolling_resistance": 0.009, "motor_efficiency": 0.92, "regen_efficiency": 0.8, "battery_kwh": 90,
+}
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    catalog = VehicleCatalog.from_file(DEFAULT_VEHICLE_PROFILES_PATH, server._vehicle_profile_document)
+    monkeypatch.setattr(vehicle_catalog, "_catalog", catalog)
+    return catalog
+
+
+def test_vehicle_profiles_revalidate_until_the_catalog_changes(catalog):
+    client = TestClient(server.app)
+
+    first = client.get("/api/vehicle-profiles")
+    etag = first.headers["etag"]
+
+    assert first.status_code == 200
+    assert etag == catalog.snapshot.etag
+    assert first.headers["cache-control"] == f"public, max-age={server.VEHICLE_PROFILES_MAX_AGE}"
+    assert client.get("/api/vehicle-profiles", headers={"If-None-Match": etag}).status_code == 304
+
+    catalog.register(FLEET_VAN)
+
+    changed = client.get("/api/vehicle-profiles", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert int(changed.headers["x-catalog-version"]) == int(first.headers["x-catalog-version"]) + 1
+    assert any(profile["name"] == "Fleet Van" for profile in changed.json())
+
+
+def test_filtered_vehicle_profiles_have_their_own_etag(catalog):
+    client = TestClient(server.app)
+
+    full = client.get("/api/vehicle-profiles")
+    filtered = client.get("/api/vehicle-profiles", params={"source": "custom"})
+
+    assert filtered.json() == []
+    assert filtered.headers["etag"] != full.headers["etag"]
+    assert client.get("/api/vehicle-profiles", params={"source": "custom"},
+                      headers={"If-None-Match": filtered.headers["etag"]}).status_code == 304
+
+
+def test_builtin_and_custom_profiles_carry_every_field(catalog):
+    client = TestClient(server.app)
+    catalog.register(FLEET_VAN)
+
+    profiles = client.get("/api/vehicle-profiles").json()
+
+    assert {profile["source"] for profile in profiles} == {"builtin", "custom"}
+    for profile in profiles:
+        assert set(profile) == set(server.VehicleProfile.model_fields)
+        assert server.VehicleProfile(**profile).model_dump() == profile
+    van = next(profile for profile in profiles if profile["name"] == "Fleet Van")
+    assert van["usable_battery_kwh"] == 55.0 and van["max_charge_kw"] == 150.0
@@ -0,0 +1,102 @@
+import io
+import math
+
+import numpy as np
+
+from map_matching import match_trace, parse_csv, parse_gpx
+
+LAT0 = 48.0
+METERS_PER_DEGREE = 111195.0
+
+
+def to_lat_lon(x, y):
+    return LAT0 + np.asarray(y) / METERS_PER_DEGREE, 2.0 + np.asarray(x) / (METERS_PER_DEGREE * math.cos(math.radians(LAT0)))
+
+
+def hairpin_route(leg_m=1000.0, gap_m=12.0, step_m=10.0):
+    """East along y = 0, then back west along y = gap_m: both legs are within the search radius."""
+    out_x = np.arange(0.0, leg_m + step_m, step_m)
+    back_x = out_x[::-1]
+    x = np.concatenate([out_x, back_x])
+    y = np.concatenate([np.zeros(len(out_x)), np.full(len(back_x), gap_m)])
+    return x, y
+
+
+def drive(x, y, speed_ms, noise_m=4.0, seed=0, t0=1_700_000_000.0):
+    """Fixes every second of a drive along the polyline (x, y) with Gaussian GPS noise."""
+    cumulative = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))))
+    travelled = np.arange(0.0, cumulative[-1], speed_ms)
+    fx, fy = np.interp(travelled, cumulative, x), np.interp(travelled, cumulative, y)
+    rng = np.random.default_rng(seed)
+    lat, lon = to_lat_lon(fx + rng.normal(0, noise_m, len(fx)), fy + rng.normal(0, noise_m, len(fy)))
+    return [(float(a), float(b), t0 + k) for k, (a, b) in enumerate(zip(lat, lon))]
+
+
+def test_constant_speed_is_recovered_on_a_straight_route():
+    x = np.arange(0.0, 2010.0, 10.0)
+    lat, lon = to_lat_lon(x, np.zeros(len(x)))
+
+    matcher = match_trace(lat, lon, drive(x, np.zeros(len(x)), speed_ms=20.0))
+
+    speeds = matcher.segment_speeds()
+    covered = ~np.isnan(speeds)
+    assert covered.mean() > 0.95
+    assert abs(np.median(speeds[covered]) - 72.0) < 2.0
+    assert matcher.fixes_matched == matcher.fixes_total
+
+
+def test_viterbi_keeps_the_leg_being_driven():
+    x, y = hairpin_route()
+    lat, lon = to_lat_lon(x, y)
+
+    matcher = match_trace(lat, lon, drive(x, y, speed_ms=15.0))
+
+    times = matcher.point_times
+    covered = ~np.isnan(times)
+    assert covered.mean() > 0.95
+    # Some outbound fixes are closer to the return leg, yet the return leg is passed later
+    assert (np.diff(times[covered]) >= 0).all()
+    half = len(x) // 2
+    assert np.nanmax(times[:half]) <= np.nanmin(times[half:])
+    speeds = matcher.segment_speeds()
+    assert abs(np.nanmedian(speeds) - 54.0) < 3.0
+
+
+def test_small_chunks_give_the_same_passing_times():
+    x, y = hairpin_route()
+    lat, lon = to_lat_lon(x, y)
+    fixes = drive(x, y, speed_ms=15.0)
+
+    whole = match_trace(lat, lon, fixes)
+    chunked = match_trace(lat, lon, fixes, chunk_size=17)
+
+    np.testing.assert_allclose(chunked.point_times, whole.point_times, atol=2.0)
+
+
+def test_fixes_far_from_the_route_are_not_matched():
+    x = np.arange(0.0, 1010.0, 10.0)
+    lat, lon = to_lat_lon(x, np.zeros(len(x)))
+    fixes = drive(x, np.zeros(len(x)), speed_ms=20.0)
+    far_lat, far_lon = to_lat_lon(500.0, 400.0)
+    fixes.append((float(far_lat), float(far_lon), fixes[-1][2] + 1))
+
+    matcher = match_trace(lat, lon, fixes)
+
+    assert matcher.fixes_total == len(fixes)
+    assert matcher.fixes_matched == len(fixes) - 1
+
+
+def test_gpx_and_csv_traces_give_the_same_fixes():
+    gpx = (
+        '<?xml version="1.0"?><gpx xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg>'
+        '<trkpt lat="48.1" lon="2.1"><time>2026-03-02T08:00:00Z</time></trkpt>'
+        '<trkpt lat="48.2" lon="2.2"><time>2026-03-02T08:00:05Z</time></trkpt>'
+        '<trkpt lat="48.3" lon="2.3"></trkpt>'
+        '</trkseg></trk></gpx>'
+    )
+    csv = "Latitude,Longitude,Time\n48.1,2.1,2026-03-02T08:00:00Z\n48.2,2.2,1772438405\nbad,2.3,0\n"
+
+    from_gpx = list(parse_gpx(io.BytesIO(gpx.encode())))
+    from_csv = list(parse_csv(io.BytesIO(csv.encode())))
+
+    assert from_gpx == from_csv == [(48.1, 2.1, 1772438400.0), (48.2, 2.2, 1772438405.0)]
@@ -0,0 +1,114 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import server
+from tests.test_chart_series import varied_route
+
+VEHICLE = server.VehicleProfile(
+    name="Leg EV", empty_mass=1850, extra_load=150, drag_coefficient=0.58, frontal_area=2.2,
+    rolling_resistance=0.008, motor_efficiency=0.95, regen_efficiency=0.85
+)
+
+
+@pytest.fixture
+def routing(monkeypatch):
+    """calculate_route on a 3000-point route with a stop every 1000 points; records the simulation seeds."""
+    seeds = []
+    simulate = server.simulate_real_speeds
+
+    async def get_route_from_ors(start, end, user_max_speed, waypoints):
+        points, segments, coordinates, _ = varied_route()
+        stops = np.linspace(0, len(points) - 1, len(waypoints) + 2).astype(int).tolist()
+        return points, segments, coordinates, stops
+
+    async def route_cost(request):
+        return 1.0
+
+    def simulate_real_speeds(speed_limits, seed=None, profile="average"):
+        seeds.append(seed)
+        return simulate(speed_limits, seed=seed, profile=profile)
+
+    monkeypatch.setattr(server, "get_route_from_ors", get_route_from_ors)
+    monkeypatch.setattr(server, "_route_cost", route_cost)
+    monkeypatch.setattr(server, "simulate_real_speeds", simulate_real_speeds)
+
+    def route(**fields):
+        request = server.RouteRequest(**dict(dict(start="Paris", end="Orléans", vehicle_profile=VEHICLE), **fields))
+        return asyncio.run(server.calculate_route(request))
+
+    return route, seeds
+
+
+def test_legs_add_up_to_the_whole_trip(routing):
+    route, _ = routing
+
+    response = route(waypoints=["Étampes", "Angerville"])
+
+    legs, totals = response.legs, response.totals
+    assert [(leg.start_location, leg.end_location) for leg in legs] == [
+        ("Paris", "Étampes"), ("Étampes", "Angerville"), ("Angerville", "Orléans")]
+    # Distances are rounded to the meter per leg
+    assert sum(leg.distance for leg in legs) == pytest.approx(totals.distance, abs=len(legs) * 0.0005)
+    for name in ("limit_energy", "eco_energy", "real_energy", "limit_time", "eco_time", "real_time"):
+        assert sum(getattr(leg, name) for leg in legs) == pytest.approx(getattr(totals, name), rel=1e-9)
+    assert legs[0].first_segment == 0 and legs[-1].last_segment == len(response.segments) - 1
+    assert all(a.last_segment + 1 == b.first_segment for a, b in zip(legs, legs[1:]))
+    assert totals.distance == pytest.approx(response.total_distance, abs=0.01)
+
+
+def test_simulation_seed_depends_on_waypoints_and_driver(routing):
+    route, seeds = routing
+
+    route()
+    route()
+    route(waypoints=["Étampes"])
+    route(driver_profile="calm")
+    route(simulation_seed=7)
+
+    assert seeds[0] == seeds[1]
+    assert len(set(seeds[1:4])) == 3
+    assert seeds[4] == 7
+
+
+def test_stops_are_geocoded_once_each_in_parallel(monkeypatch):
+    calls, in_flight = [], []
+
+    async def geocode(location):
+        calls.append(location)
+        in_flight.append(location)
+        await asyncio.sleep(0.01)
+        # Every distinct stop was started before the first one finished
+        assert len(in_flight) == 3
+        return None if location == "Nowhere" else SimpleNamespace(address=location)
+
+    monkeypatch.setattr(server, "_geocode", geocode)
+
+    resolved = asyncio.run(server._geocode_all(["Paris", "Lyon", "Paris", "Nowhere", "Lyon"]))
+
+    assert sorted(calls) == ["Lyon", "Nowhere", "Paris"]
+    assert [found.address if found else None for found in resolved] == ["Paris", "Lyon", "Paris", None, "Lyon"]
+
+
+def test_stop_point_indices():
+    coords = [[2.0 + k * 0.01, 48.0] for k in range(101)]  # [lon, lat] going east
+    stops = [coords[0], [2.3, 48.001], [2.7, 47.999], coords[-1]]
+
+    # Consistent ORS way points are used as they are
+    assert server._stop_point_indices({"way_points": [0, 30, 70, 100]}, coords, stops) == [0, 30, 70, 100]
+    # Missing or inconsistent: nearest point of each stop
+    assert server._stop_point_indices({}, coords, stops) == [0, 30, 70, 100]
+    assert server._stop_point_indices({"way_points": [0, 70, 30, 100]}, coords, stops) == [0, 30, 70, 100]
+
+
+def test_stop_point_indices_search_forward_only():
+    # Out along the equator and back: the second stop is on the way back
+    coords = [[k * 0.01, 0.0] for k in range(51)] + [[(50 - k) * 0.01, 0.0001] for k in range(1, 51)]
+    stops = [coords[0], [0.2, 0.0], [0.1, 0.0001], coords[-1]]
+
+    indices = server._stop_point_indices({"way_points": [0, 1]}, coords, stops)
+
+    assert indices[1] == 20 and indices[2] == 90
+    assert indices == sorted(indices)
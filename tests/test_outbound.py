@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+
+import pytest
+import requests
+
+import outbound
+from outbound import Provider, UpstreamUnavailable
+
+
+def failing():
+    raise requests.ConnectionError("connection refused")
+
+
+def make_provider(**kwargs):
+    options = dict(rate_per_s=1000, burst=1000, max_retries=0, failure_threshold=2, reset_timeout_s=0.05)
+    options.update(kwargs)
+    return Provider("test", **options)
+
+
+async def open_circuit(provider):
+    for _ in range(2):
+        with pytest.raises(UpstreamUnavailable):
+            await provider.call(failing)
+    assert provider.breaker.state == "open"
+    with pytest.raises(UpstreamUnavailable, match="circuit open"):
+        await provider.call(lambda: "ok")
+    await asyncio.sleep(0.06)
+    assert provider.breaker.state == "half-open"
+
+
+def test_half_open_allows_a_single_trial_that_closes_the_circuit():
+    provider = make_provider()
+    release = threading.Event()
+
+    async def main():
+        await open_circuit(provider)
+        trial = asyncio.ensure_future(provider.call(lambda: release.wait(5) and "ok"))
+        await asyncio.sleep(0.01)
+        # Every other call fails fast while the trial runs
+        with pytest.raises(UpstreamUnavailable, match="circuit open"):
+            await provider.call(lambda: "ok")
+        release.set()
+        return await trial
+
+    assert asyncio.run(main()) == "ok"
+    assert provider.breaker.state == "closed"
+    assert provider.counters["short_circuited"] == 2
+
+
+def test_failed_trial_reopens_the_circuit():
+    provider = make_provider()
+
+    async def main():
+        await open_circuit(provider)
+        with pytest.raises(UpstreamUnavailable):
+            await provider.call(failing)
+
+    asyncio.run(main())
+
+    assert provider.breaker.state == "open"
+    assert not provider.breaker.trial_in_flight
+
+
+def test_trial_cancelled_during_the_upstream_call_is_released():
+    provider = make_provider()
+    release = threading.Event()
+
+    async def main():
+        await open_circuit(provider)
+        trial = asyncio.ensure_future(provider.call(release.wait, 5))
+        await asyncio.sleep(0.01)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        assert not provider.breaker.trial_in_flight
+        # The next caller runs the trial instead of being short-circuited forever
+        result = await provider.call(lambda: "ok")
+        release.set()
+        return result
+
+    assert asyncio.run(main()) == "ok"
+    assert provider.breaker.state == "closed"
+
+
+def test_trial_cancelled_while_rate_limited_is_released():
+    provider = make_provider(rate_per_s=1000, burst=1)
+
+    async def main():
+        await open_circuit(provider)
+        provider.bucket.rate = 2.0
+        provider.bucket.tokens = 0.0
+        provider.bucket.updated = time.monotonic()
+        trial = asyncio.ensure_future(provider.call(lambda: "ok"))
+        await asyncio.sleep(0.01)
+        assert provider.bucket.waiting == 1
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        assert not provider.breaker.trial_in_flight
+        assert provider.bucket.waiting == 0
+        # The reserved token was given back
+        assert provider.bucket.tokens > -0.5
+
+    asyncio.run(main())
+
+
+def test_cancelled_call_of_a_closed_circuit_leaves_another_trial_alone():
+    provider = make_provider()
+    release = threading.Event()
+
+    async def main():
+        # Started while the circuit is closed, still running when it opens
+        slow = asyncio.ensure_future(provider.call(release.wait, 5))
+        await asyncio.sleep(0.01)
+        await open_circuit(provider)
+        trial = asyncio.ensure_future(provider.call(release.wait, 5))
+        await asyncio.sleep(0.01)
+        slow.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await slow
+        assert provider.breaker.trial_in_flight
+        release.set()
+        await trial
+
+    asyncio.run(main())
+
+    assert provider.breaker.state == "closed"
+
+
+def test_rate_limits_are_split_between_workers(monkeypatch):
+    monkeypatch.setattr(outbound, "WORKER_COUNT", 4)
+
+    assert outbound._worker_share(2.0, 2) == {"rate_per_s": 0.5, "burst": 1.0}
+    assert outbound._worker_share(40 / 60, 8) == {"rate_per_s": 40 / 60 / 4, "burst": 2.0}
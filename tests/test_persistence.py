@@ -0,0 +1,179 @@
+import asyncio
+
+from pymongo.errors import BulkWriteError
+
+from persistence import DUPLICATE_KEY, CollectionSpec, WriteBehind
+
+
+class FakeCollection:
+    def __init__(self):
+        self.batches = []
+        self.fail = None  # Exception raised by the next writes
+        self.during_write = None  # Called inside the next write
+        self.delay_s = 0.0
+
+    async def _write(self, documents):
+        if self.during_write is not None:
+            self.during_write()
+            self.during_write = None
+        if self.delay_s:
+            await asyncio.sleep(self.delay_s)
+        if self.fail is not None:
+            raise self.fail
+        self.batches.append(documents)
+
+    async def insert_many(self, documents, ordered=True):
+        await self._write(list(documents))
+
+    async def bulk_write(self, operations, ordered=True):
+        await self._write([operation._doc for operation in operations])
+
+    @property
+    def written(self):
+        return [document for batch in self.batches for document in batch]
+
+
+class FakeDb(dict):
+    def __missing__(self, name):
+        self[name] = FakeCollection()
+        return self[name]
+
+
+def write_behind(**kwargs):
+    specs = [
+        CollectionSpec("stations", key="id", priority=2),
+        CollectionSpec("routes", priority=1),
+        CollectionSpec("geocodes", key="query"),
+    ]
+    return WriteBehind(FakeDb(), specs, **kwargs)
+
+
+def test_updates_of_a_pending_document_are_coalesced():
+    wb = write_behind()
+    wb.put("stations", {"id": "a", "power": 22})
+    wb.put("stations", {"id": "b", "power": 50})
+    wb.put("stations", {"id": "a", "power": 150})
+
+    assert asyncio.run(wb.flush())
+
+    assert wb.db["stations"].written == [{"id": "b", "power": 50}, {"id": "a", "power": 150}]
+    assert wb.counters["stations"] == {"queued": 3, "coalesced": 1, "written": 2, "dropped": 0}
+
+
+def test_documents_are_written_in_batches_highest_priority_first():
+    wb = write_behind(batch_size=3)
+    for i in range(7):
+        wb.put("routes", {"route_id": i})
+    wb.put("geocodes", {"query": "Paris"})
+    wb.put("stations", {"id": "a"})
+    order = []
+    for name in ("stations", "routes", "geocodes"):
+        wb.db[name].during_write = lambda name=name: order.append(name)
+
+    assert asyncio.run(wb.flush())
+
+    assert [len(batch) for batch in wb.db["routes"].batches] == [3, 3, 1]
+    assert order == ["stations", "routes", "geocodes"]
+    assert wb.pending == 0
+
+
+def test_failed_batch_is_requeued_in_order():
+    wb = write_behind()
+    for i in range(3):
+        wb.put("routes", {"route_id": i})
+    wb.db["routes"].fail = ConnectionError("MongoDB down")
+
+    assert not asyncio.run(wb.flush())
+
+    assert wb.consecutive_failures == 1 and wb.failed_batches == 1
+    wb.db["routes"].fail = None
+    assert asyncio.run(wb.flush())
+    assert wb.db["routes"].written == [{"route_id": 0}, {"route_id": 1}, {"route_id": 2}]
+    assert wb.consecutive_failures == 0
+
+
+def test_requeue_keeps_a_version_queued_during_the_failed_write():
+    wb = write_behind()
+    wb.put("stations", {"id": "a", "power": 22})
+    wb.put("stations", {"id": "b", "power": 50})
+    stations = wb.db["stations"]
+    stations.fail = ConnectionError("MongoDB down")
+    stations.during_write = lambda: wb.put("stations", {"id": "a", "power": 150})
+
+    asyncio.run(wb.flush())
+    stations.fail = None
+    asyncio.run(wb.flush())
+
+    assert sorted(stations.written, key=lambda d: d["id"]) == [{"id": "a", "power": 150}, {"id": "b", "power": 50}]
+
+
+def test_slow_write_is_abandoned_and_retried():
+    wb = write_behind(write_timeout_s=0.01)
+    wb.put("geocodes", {"query": "Lyon"})
+    wb.db["geocodes"].delay_s = 0.1
+
+    assert not asyncio.run(wb.flush())
+
+    assert wb.pending == 1
+    wb.db["geocodes"].delay_s = 0.0
+    assert asyncio.run(wb.flush())
+
+
+def test_full_queue_sheds_the_oldest_low_priority_documents():
+    wb = write_behind(max_pending=4)
+    wb.put("stations", {"id": "a"})
+    wb.put("routes", {"route_id": 1})
+    for query in ("Paris", "Lyon", "Lille"):
+        wb.put("geocodes", {"query": query})
+    # Each new station pushes out the oldest geocode
+    accepted = wb.put("stations", {"id": "b"})
+    wb.put("stations", {"id": "c"})
+
+    assert accepted
+    assert wb.pending == 4
+    assert wb.stats()["pending"] == {"stations": 3, "routes": 1, "geocodes": 0}
+    assert wb.counters["geocodes"]["dropped"] == 3
+    assert not wb.put("geocodes", {"query": "Nice"})
+
+    asyncio.run(wb.flush())
+    assert wb.db["routes"].written == [{"route_id": 1}]
+
+
+def test_requeued_batch_is_shed_when_the_queue_filled_up_meanwhile():
+    wb = write_behind(max_pending=3)
+    wb.put("geocodes", {"query": "Paris"})
+    wb.put("geocodes", {"query": "Lyon"})
+    geocodes = wb.db["geocodes"]
+    geocodes.fail = ConnectionError("MongoDB down")
+    geocodes.during_write = lambda: [wb.put("routes", {"route_id": i}) for i in range(3)]
+
+    asyncio.run(wb.flush())
+
+    assert wb.stats()["pending"] == {"stations": 0, "routes": 3, "geocodes": 0}
+    assert wb.counters["geocodes"]["dropped"] == 2
+
+
+def test_rejected_documents_are_dropped_and_duplicates_ignored():
+    wb = write_behind()
+    for i in range(3):
+        wb.put("routes", {"route_id": i})
+    wb.db["routes"].fail = BulkWriteError({"writeErrors": [
+        {"index": 0, "code": DUPLICATE_KEY, "errmsg": "duplicate key"},
+        {"index": 2, "code": 121, "errmsg": "document failed validation"},
+    ]})
+
+    assert asyncio.run(wb.flush())
+
+    assert wb.pending == 0
+    assert wb.counters["routes"]["written"] == 2
+    assert wb.counters["routes"]["dropped"] == 1
+
+
+def test_callable_documents_are_built_at_flush_time():
+    wb = write_behind()
+    built = []
+    wb.put("routes", lambda: built.append(1) or {"route_id": "r"}, key="r")
+
+    assert built == []
+    asyncio.run(wb.flush())
+    assert wb.db["routes"].written == [{"route_id": "r"}]
@@ -0,0 +1,62 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import route_physics
+from physics_executor import PhysicsExecutor
+
+VEHICLE = SimpleNamespace(
+    empty_mass=1850.0, extra_load=150.0, drag_coefficient=0.58, rolling_resistance=0.008,
+    motor_efficiency=0.95, regen_efficiency=0.85, aux_power_kw=2.0,
+)
+
+
+def route(n=3000):
+    lat = np.linspace(48.0, 48.5, n)
+    lon = np.linspace(2.0, 2.3, n)
+    elevation = 100 + 40 * np.sin(np.linspace(0, 30, n))
+    speed_limit = np.where(np.arange(n - 1) % 500 < 250, 90.0, 130.0)
+    return lat, lon, elevation, speed_limit, speed_limit - 5
+
+
+@pytest.fixture(scope="module")
+def executor():
+    executor = PhysicsExecutor(mode="process", workers=1, offload_min_points=1000)
+    executor.start()
+    yield executor
+    executor.shutdown()
+
+
+def run(executor, *args):
+    return asyncio.run(executor.route_arrays(*args, VEHICLE, total_mass_kg=2000.0, aux_power_kw=2.0))
+
+
+def test_offloaded_physics_matches_inline(executor):
+    args = route()
+    expected = route_physics.route_arrays(*args, VEHICLE, total_mass_kg=2000.0, aux_power_kw=2.0)
+
+    arrays = run(executor, *args)
+
+    assert executor.offloaded_count >= 1
+    for name in ("distance", "eco_energy", "real_energy", "eco_time"):
+        np.testing.assert_allclose(arrays[name], expected[name])
+
+
+def test_broken_pool_falls_back_inline_and_restarts(executor):
+    args = route()
+    expected = route_physics.route_arrays(*args, VEHICLE, total_mass_kg=2000.0, aux_power_kw=2.0)
+    # A worker dying (e.g. killed out of memory) breaks the whole pool
+    with pytest.raises(Exception):
+        executor._pool.submit(os._exit, 1).result()
+
+    arrays = run(executor, *args)
+
+    np.testing.assert_allclose(arrays["eco_energy"], expected["eco_energy"])
+    assert executor.restart_count == 1
+    offloaded = executor.offloaded_count
+    arrays = run(executor, *args)
+    assert executor.offloaded_count == offloaded + 1
+    np.testing.assert_allclose(arrays["eco_energy"], expected["eco_energy"])
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import profiling
+from profiling import ProfileGuard, ProfileStore, ProfilingMiddleware
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+@pytest.fixture
+def profiled(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", "secret")
+    app = FastAPI()
+
+    @app.get("/work")
+    async def work():
+        busy(0.03)  # On the event loop
+        await asyncio.to_thread(busy, 0.03)  # In a worker thread
+        await asyncio.sleep(0.03)  # Awaiting
+        return {"route_id": "route-42"}
+
+    store, guard = ProfileStore(), ProfileGuard(max_per_minute=2)
+    client = TestClient(ProfilingMiddleware(app, store, guard))
+    return client, store, guard
+
+
+def test_requests_without_a_valid_token_are_not_profiled(profiled):
+    client, store, guard = profiled
+
+    for headers in ({}, {"X-Profile": "wrong"}, {"X-Profile": ""}):
+        response = client.get("/work", headers=headers)
+        assert response.status_code == 200
+        assert "x-profile-id" not in response.headers
+
+    assert guard.counters == {"profiled": 0, "rate_limited": 0}
+    assert store.get("route-42") is None
+
+
+def test_profiled_request_outputs_can_be_parsed(profiled):
+    client, store, _ = profiled
+
+    response = client.get("/work", headers={"X-Profile": "secret"})
+
+    profile_id = response.headers["x-profile-id"]
+    assert response.json() == {"route_id": "route-42"}
+    stored = store.get(profile_id)
+    assert stored is store.get("route-42")  # Also stored under the route_id of the response
+    assert stored["status"] == 200 and stored["samples"] > 0
+
+    speedscope = json.loads(json.dumps(stored["speedscope"]))
+    frames = speedscope["shared"]["frames"]
+    for profile in speedscope["profiles"]:
+        assert profile["name"].endswith(("(event loop)", "(worker thread)", "(awaiting)"))
+        assert profile["type"] == "sampled" and profile["unit"] == "milliseconds"
+        assert len(profile["samples"]) == len(profile["weights"])
+        assert all(0 <= index < len(frames) for sample in profile["samples"] for index in sample)
+    names = {frame["name"] for frame in frames}
+    assert "busy" in names
+
+    lines = stored["collapsed"].splitlines()
+    assert lines
+    total = 0
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert stack.split(";")[0] in ("event loop", "worker thread", "awaiting")
+        total += int(count)
+    assert total == stored["samples"]
+    assert any("busy (test_profiling.py" in line for line in lines)
+
+
+def test_guard_rate_limits_profiled_requests(profiled):
+    client, store, guard = profiled
+    headers = {"X-Profile": "secret"}
+
+    ids = [client.get("/work", headers=headers).headers["x-profile-id"] for _ in range(3)]
+
+    assert ids[2] == "rate-limited" and "rate-limited" not in ids[:2]
+    assert guard.counters == {"profiled": 2, "rate_limited": 1}
+    assert not guard.running
+
+
+def test_one_profiled_request_at_a_time():
+    guard = ProfileGuard(max_per_minute=10)
+
+    assert guard.try_start()
+    assert not guard.try_start()
+    guard.done()
+    assert guard.try_start()
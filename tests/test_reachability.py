@@ -0,0 +1,129 @@
+import math
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import reachability
+from reachability import LATTICE_CELL_DEG, ReachabilityCache, RoadGraph, energy_search, reachable_area, soc_bucket
+from route_physics import VehiclePhysicsContext
+
+VEHICLE = SimpleNamespace(
+    empty_mass=1850.0, extra_load=150.0, drag_coefficient=0.58, rolling_resistance=0.008,
+    motor_efficiency=0.95, regen_efficiency=0.85, aux_power_kw=2.0,
+)
+PARIS = (48.8566, 2.3522)
+
+
+def max_range_km(context, budget_kwh):
+    """Straight-line range on flat ground at the lattice speed (plus a cell)."""
+    slope = np.zeros(1)
+    per_km = float(context.energy(context.eco_speeds(np.array([reachability.LATTICE_SPEED_KMH]), slope),
+                                  np.array([1000.0]), slope)[0])
+    return budget_kwh / per_km + LATTICE_CELL_DEG * 111.32
+
+
+@pytest.fixture(autouse=True)
+def no_road_graph(monkeypatch):
+    # Lattice fallback, whatever is installed in data/road_graph
+    monkeypatch.setattr(reachability, "_graph", None)
+    monkeypatch.setattr(reachability, "_graph_loaded", True)
+
+
+@pytest.fixture
+def context():
+    return VehiclePhysicsContext.from_vehicle(VEHICLE, 2000, 2.0)
+
+
+def test_reachable_cells_grow_with_the_battery(context):
+    areas = [reachable_area(context, 20.0, *PARIS, battery_pct) for battery_pct in (10, 25, 50)]
+
+    sizes = [len(area.keys) for area in areas]
+    assert sizes[0] < sizes[1] < sizes[2]
+    for smaller, larger in zip(areas, areas[1:]):
+        assert set(smaller.keys.tolist()) <= set(larger.keys.tolist())
+
+
+def test_no_returned_cell_exceeds_the_budget(context):
+    area = reachable_area(context, 20.0, *PARIS, 40, reserve_pct=10)
+    graph = RoadGraph.lattice(*PARIS, 200.0)
+    costs = graph.edge_costs(context, 130)
+
+    assert area.budget_kwh == pytest.approx(0.30 * 20.0)
+    assert (area.energy <= area.budget_kwh + 1e-9).all()
+    assert (area.battery_at(area.energy) >= 10 - 1e-9).all()
+    # Every cell but the origin is reached through a returned neighbour, at the returned energy
+    energy = dict(zip(area.keys.tolist(), area.energy.tolist()))
+    indptr, targets = graph.adjacency()
+    keys = graph.keys.tolist()
+    arrivals = {}
+    for node, key in enumerate(keys):
+        if key in energy:
+            for edge in range(indptr[node], indptr[node + 1]):
+                target = keys[targets[edge]]
+                arrivals[target] = min(arrivals.get(target, math.inf), energy[key] + costs[edge])
+    for key, used in energy.items():
+        if used > 0:
+            assert arrivals[key] == pytest.approx(used, rel=1e-6)
+
+
+def test_regeneration_never_makes_an_edge_negative():
+    graph = RoadGraph.lattice(*PARIS, 20.0)
+    # A vehicle recovering energy on every edge (e.g. a downhill road)
+    downhill = SimpleNamespace(
+        gravity_force=-1.0, rolling_force=1.0, aero_coefficient=1.0, inv_motor_efficiency=1.0, aux_power_w=0.0,
+        eco_speeds=lambda limit, slope: limit,
+        energy=lambda speed, distance, slope: -distance / 1000 * 0.05,
+    )
+
+    costs = graph.edge_costs(downhill, 130)
+
+    assert min(costs) == 0.0
+    best = energy_search(graph, costs, graph.nearest_node(*PARIS), budget_kwh=0.0)
+    assert set(best.values()) == {0.0} and len(best) == len(graph)
+
+
+def test_cached_area_is_the_area_of_the_request(context):
+    cache = ReachabilityCache()
+    first = reachable_area(context, 20.0, *PARIS, 42)
+    key = cache.key(context, 20.0, *PARIS, 42, 0.0, 130)
+    cache.put(key, first)
+    # Same origin cell and battery bucket
+    nearby = (PARIS[0] + LATTICE_CELL_DEG / 10, PARIS[1])
+    other_key = cache.key(context, 20.0, *nearby, 44.9, 0.0, 130)
+
+    assert other_key == key
+    cached = cache.get(other_key)
+    fresh = reachable_area(context, 20.0, *nearby, 44.9)
+    assert cached is first
+    np.testing.assert_array_equal(cached.keys, fresh.keys)
+    np.testing.assert_allclose(cached.energy, fresh.energy)
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 0}
+    assert cache.key(context, 20.0, *PARIS, 45, 0.0, 130) != key
+
+
+def test_lattice_fallback_and_battery_buckets(context):
+    area = reachable_area(context, 20.0, *PARIS, 44.9)
+
+    assert area.source == "lattice" and area.cell_deg == LATTICE_CELL_DEG
+    assert soc_bucket(44.9) == 40 and soc_bucket(45) == 45 and soc_bucket(4.9) == 0
+    assert area.battery_pct == 40
+    assert area.budget_kwh == pytest.approx(0.40 * 20.0)
+    # The farthest cell is about as far as the budget allows at the lattice speed
+    distance_km = np.hypot((area.lat - PARIS[0]) * 111.32,
+                           (area.lon - PARIS[1]) * 111.32 * math.cos(math.radians(PARIS[0])))
+    assert 0 < distance_km.max() < max_range_km(context, area.budget_kwh)
+
+
+def test_road_graph_is_used_when_available(context):
+    keys = reachability.grid_keys([48.85, 48.85, 48.87], [2.35, 2.37, 2.37], 0.02)
+    graph = RoadGraph.from_edges(
+        np.array([keys[0], keys[1], keys[1], keys[2]]), np.array([keys[1], keys[0], keys[2], keys[1]]),
+        np.array([2000.0, 2000.0, 2500.0, 2500.0]), np.array([50.0, 50.0, 90.0, 90.0]), 0.02,
+    )
+
+    area = reachable_area(context, 20.0, 48.85, 2.35, 50, graph=graph)
+
+    assert area.source == "osm"
+    assert sorted(area.keys.tolist()) == sorted(set(keys.tolist()))
+    assert np.isnan(area.locate([45.0], [4.0])[0])
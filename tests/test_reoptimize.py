@@ -0,0 +1,78 @@
+import uuid
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from route_store import StoredRoute
+
+VEHICLE = {
+    "name": "Test EV", "empty_mass": 1850, "extra_load": 150, "drag_coefficient": 0.58,
+    "frontal_area": 2.2, "rolling_resistance": 0.008, "motor_efficiency": 0.95,
+    "regen_efficiency": 0.85, "aux_power_kw": 2.0, "battery_kwh": 75, "usable_battery_kwh": 72,
+}
+
+
+def store_route(vehicle=VEHICLE, n=400):
+    """Put a straight Paris -> south route of n points in the route store."""
+    request = server.RouteRequest(start="Paris", end="Sud", vehicle_profile=server.VehicleProfile(**vehicle))
+    stored = StoredRoute(
+        route_id=str(uuid.uuid4()),
+        request=request,
+        lat=np.linspace(48.80, 48.50, n),
+        lon=np.full(n, 2.35),
+        elevation=100 + 20 * np.sin(np.linspace(0, 6, n)),
+        speed_limit=np.where(np.arange(n - 1) < n // 2, 90.0, 130.0),
+        real_speed=np.where(np.arange(n - 1) < n // 2, 85.0, 120.0),
+    )
+    server.route_store.put(stored)
+    return stored
+
+
+@pytest.fixture
+def client():
+    return TestClient(server.app)
+
+
+def test_reoptimize_recomputes_the_remaining_suffix(client):
+    stored = store_route()
+    update = {"current_lat": float(stored.lat[100]), "current_lon": 2.35, "battery_current_pct": 80}
+
+    response = client.post(f"/api/route/{stored.route_id}/reoptimize", json=update)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["from_point_index"] == 100
+    assert body["distance_to_route_m"] < 1
+    assert sum(segment["distance"] for segment in body["segments"]) == pytest.approx(body["remaining_distance"] * 1000, rel=1e-3)
+    assert body["battery_arrival_pct_eco"] < 80
+    assert stored.progress_index == 100
+
+
+def test_reoptimize_never_moves_backwards(client):
+    stored = store_route()
+    client.post(f"/api/route/{stored.route_id}/reoptimize",
+                json={"current_lat": float(stored.lat[200]), "current_lon": 2.35, "battery_current_pct": 80})
+
+    response = client.post(f"/api/route/{stored.route_id}/reoptimize",
+                           json={"current_lat": float(stored.lat[50]), "current_lon": 2.35, "battery_current_pct": 79})
+
+    assert response.json()["from_point_index"] == 200
+
+
+def test_reoptimize_rejects_a_vehicle_without_battery_capacity(client):
+    stored = store_route(vehicle={**VEHICLE, "battery_kwh": 0, "usable_battery_kwh": 0})
+
+    response = client.post(f"/api/route/{stored.route_id}/reoptimize",
+                           json={"current_lat": 48.7, "current_lon": 2.35, "battery_current_pct": 80})
+
+    assert response.status_code == 400
+    assert stored.progress_index == 0
+
+
+def test_reoptimize_unknown_route(client):
+    response = client.post(f"/api/route/{uuid.uuid4()}/reoptimize",
+                           json={"current_lat": 48.7, "current_lon": 2.35, "battery_current_pct": 80})
+
+    assert response.status_code == 404
@@ -0,0 +1,153 @@
+import asyncio
+import csv
+import io
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+import route_export
+from route_export import COLUMNS, SEGMENT_FIELDS, _csv_field, column_chunks, export_query, stream_export
+
+
+class Cursor:
+    """Async iteration over documents, like a motor cursor."""
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+
+def route(route_id, n, vehicle="Tesla Model 3", day=1):
+    segments = [dict({name: float(k + i) for i, name in enumerate(SEGMENT_FIELDS)}, index=k) for k in range(n)]
+    return {
+        "route_id": route_id,
+        "created_at": datetime(2026, 3, day, 8, 30, tzinfo=timezone.utc),
+        "request": {"vehicle_profile": {"name": vehicle}},
+        "response": {"segments": segments},
+    }
+
+
+async def collect(iterator):
+    return [item async for item in iterator]
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("plain", "plain"), ("a,b", '"a,b"'), ('say "hi"', '"say ""hi"""'), ("two\nlines", '"two\nlines"'), ("", ""),
+])
+def test_csv_field_quoting(value, expected):
+    assert _csv_field(value) == expected
+
+
+def test_chunks_are_cut_on_route_boundaries():
+    documents = [route("a", 3), route("empty", 0), route("b", 4), route("c", 2), route("d", 5)]
+
+    chunks = asyncio.run(collect(column_chunks(Cursor(documents), chunk_rows=6)))
+
+    assert [len(chunk["route_id"]) for chunk in chunks] == [7, 7]
+    assert [list(dict.fromkeys(chunk["route_id"])) for chunk in chunks] == [["a", "b"], ["c", "d"]]
+    assert all(set(chunk) == set(COLUMNS) for chunk in chunks)
+    np.testing.assert_array_equal(chunks[0]["segment_index"], [0, 1, 2, 0, 1, 2, 3])
+
+
+def test_export_query_filters():
+    start, end = datetime(2026, 1, 1), datetime(2026, 2, 1)
+
+    assert export_query() == {}
+    assert export_query(start, end, "Renault Zoe", 10, 200) == {
+        "created_at": {"$gte": start, "$lt": end},
+        "request.vehicle_profile.name": "Renault Zoe",
+        "total_distance": {"$gte": 10, "$lte": 200},
+    }
+    assert export_query(end_date=end, max_distance_km=5) == {"created_at": {"$lt": end}, "total_distance": {"$lte": 5}}
+
+
+def test_csv_round_trip():
+    documents = [route("a", 3, vehicle='Van, "XL"'), route("b", 2, day=2)]
+
+    body = b"".join(asyncio.run(collect(stream_export(Cursor(documents), "csv", chunk_rows=2))))
+    rows = list(csv.DictReader(io.StringIO(body.decode("utf-8"))))
+
+    assert body.count(b"route_id") == 1
+    assert [row["route_id"] for row in rows] == ["a", "a", "a", "b", "b"]
+    assert rows[0]["vehicle"] == 'Van, "XL"' and rows[3]["vehicle"] == "Tesla Model 3"
+    assert rows[0]["created_at"] == "2026-03-01T08:30:00.000Z"
+    assert [int(row["segment_index"]) for row in rows] == [0, 1, 2, 0, 1]
+    assert [float(rows[2][name]) for name in SEGMENT_FIELDS] == [float(2 + i) for i in range(len(SEGMENT_FIELDS))]
+
+
+def test_empty_csv_export_has_a_header():
+    body = b"".join(asyncio.run(collect(stream_export(Cursor([]), "csv"))))
+
+    assert body.decode("utf-8") == ",".join(COLUMNS) + "\n"
+
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+def test_arrow_round_trip(fmt):
+    pa = pytest.importorskip("pyarrow")
+    documents = [route("a", 3), route("b", 4, day=2), route("c", 2, day=3)]
+
+    parts = asyncio.run(collect(stream_export(Cursor(documents), fmt, chunk_rows=3)))
+    body = pa.py_buffer(b"".join(parts))
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(pa.BufferReader(body))
+        assert parquet.metadata.num_row_groups == 3
+        table = parquet.read()
+    else:
+        table = pa.ipc.open_stream(body).read_all()
+
+    assert table.column_names == list(COLUMNS)
+    assert table.column("route_id").to_pylist() == ["a"] * 3 + ["b"] * 4 + ["c"] * 2
+    assert table.column("segment_index").to_pylist() == [0, 1, 2, 0, 1, 2, 3, 0, 1]
+    assert table.column("created_at").to_pylist()[3] == datetime(2026, 3, 2, 8, 30, tzinfo=timezone.utc)
+    assert table.column("eco_energy").to_pylist()[:3] == [7.0, 8.0, 9.0]
+    assert route_export.arrow_available()
+
+
+class Routes:
+    """db.routes.find(...).sort(...).batch_size(...) over documents."""
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find(self, query, projection):
+        return self
+
+    def sort(self, *args):
+        return self
+
+    def batch_size(self, size):
+        return Cursor(self.documents)
+
+
+def test_export_admission_is_held_per_chunk_only(monkeypatch):
+    import server
+    from admission import AdmissionController, Lane
+
+    admission = AdmissionController(400, [Lane("navigation", 0, slo_s=1), Lane("planning", 1, slo_s=1), Lane("bulk", 2, slo_s=1)])
+    monkeypatch.setattr(server, "admission", admission)
+    monkeypatch.setattr(server, "db", type("Db", (), {"routes": Routes([route(str(i), 600) for i in range(5)])})())
+
+    async def main():
+        response = await server.export_segments(format="csv", chunk_rows=1000)
+        # Not streamed yet (or never): nothing held
+        assert admission.in_use == 0
+        parts = []
+        async for part in response.body_iterator:
+            assert admission.in_use == 0
+            parts.append(part)
+        return parts
+
+    parts = asyncio.run(main())
+
+    assert len(parts) == 4  # 3 chunks and the end of the export
+    # One admission per read of the cursor, the last one finds its end
+    assert admission.counters["bulk"]["admitted"] == len(parts) + 1
+    assert b"".join(parts).count(b"\n") == 1 + 5 * 600
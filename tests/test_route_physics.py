@@ -0,0 +1,147 @@
+import math
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import route_physics
+from route_physics import VehiclePhysicsContext, energy_table, merge_by_speed_limit, route_arrays
+
+VEHICLE = SimpleNamespace(
+    empty_mass=1850.0, extra_load=150.0, drag_coefficient=0.58, rolling_resistance=0.008,
+    motor_efficiency=0.95, regen_efficiency=0.85, aux_power_kw=2.0,
+)
+
+
+# Scalar reference: the per-segment formulas the API used before the physics was vectorized
+
+def reference_energy(speed_kmh, distance_m, elevation_change_m, vehicle, total_mass, aux_power_kw, rho_air=1.225):
+    if speed_kmh <= 0:
+        return 0.0
+    speed_ms = speed_kmh / 3.6
+    time_s = distance_m / speed_ms
+    slope = max(-0.5, min(0.5, elevation_change_m / distance_m)) if distance_m > 0 else 0
+    force = (total_mass * 9.81 * slope
+             + vehicle.rolling_resistance * total_mass * 9.81 * math.cos(math.atan(slope))
+             + 0.5 * rho_air * vehicle.drag_coefficient * speed_ms ** 2)
+    power_w = force * speed_ms
+    power_w = power_w / vehicle.motor_efficiency if power_w >= 0 else power_w * vehicle.regen_efficiency
+    return (power_w + aux_power_kw * 1000) * time_s / 3600 / 1000
+
+
+def reference_eco_speed(distance_m, elevation_change_m, limit, vehicle, total_mass, min_speed=30.0):
+    slope = elevation_change_m / distance_m if distance_m > 0 else 0
+    mass_ratio = total_mass / vehicle.empty_mass
+    resistance = 0.4 * vehicle.rolling_resistance / 0.008 + 0.6 * vehicle.drag_coefficient / 0.6
+    efficiency = 1.0 - (1.0 - (vehicle.motor_efficiency + vehicle.regen_efficiency) / 2 / 0.9) * 0.1
+    if slope > 0.02:
+        factor = 0.65 - min(0.10, (mass_ratio - 1) * 0.10) - min(0.08, (resistance - 1) * 0.08) - (1 - efficiency) * 0.05
+        eco = max(min_speed, limit * factor)
+    elif slope < -0.02:
+        factor = (0.85 + min(0.05, (mass_ratio - 1) * 0.05) + min(0.03, (vehicle.regen_efficiency - 0.85) * 0.15)
+                  - min(0.02, (resistance - 1) * 0.02))
+        eco = min(limit * factor, limit)
+    else:
+        factor = 0.88 - min(0.03, (mass_ratio - 1) * 0.03) - min(0.05, (resistance - 1) * 0.05) - (1 - efficiency) * 0.03
+        eco = limit * factor
+    return round(max(min_speed, min(eco, limit)), 1)
+
+
+def reference_distance(lat1, lon1, lat2, lon2):
+    a = (math.sin(math.radians(lat2 - lat1) / 2) ** 2
+         + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 6371000 * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+@pytest.fixture
+def segments():
+    rng = np.random.default_rng(1)
+    n = 500
+    distance = rng.uniform(0, 200, n)
+    distance[:3] = 0  # Duplicate points
+    elevation_change = rng.normal(0, 6, n)
+    elevation_change[3] = 500  # Clamped slope
+    speed = rng.choice([0.0, 30.0, 50.0, 90.0, 130.0], n)
+    return distance, elevation_change, speed
+
+
+def test_energy_matches_the_scalar_reference(segments):
+    distance, elevation_change, speed = segments
+
+    energy = route_physics.energy_consumption(speed, distance, elevation_change, VEHICLE, total_mass_kg=2100, aux_power_kw=3.5)
+
+    expected = [reference_energy(*args, VEHICLE, 2100, 3.5) for args in zip(speed, distance, elevation_change)]
+    np.testing.assert_allclose(energy, expected, rtol=1e-9, atol=1e-12)
+    assert (energy < 0).any() and (energy > 0).any()
+
+
+def test_eco_speeds_match_the_scalar_reference(segments):
+    distance, elevation_change, speed = segments
+    limits = np.where(speed > 0, speed, 50.0)
+
+    eco = route_physics.eco_speeds(distance, elevation_change, limits, VEHICLE, total_mass_kg=2300)
+
+    expected = [reference_eco_speed(d, dz, limit, VEHICLE, 2300) for d, dz, limit in zip(distance, elevation_change, limits)]
+    np.testing.assert_allclose(eco, expected)
+    assert (eco <= limits).all()
+
+
+def test_haversine_matches_the_scalar_reference():
+    lat = np.array([48.8566, 48.86, 45.764, 45.764])
+    lon = np.array([2.3522, 2.36, 4.8357, 4.8357])
+
+    distances = route_physics.haversine_distances(lat, lon)
+
+    expected = [reference_distance(lat[i], lon[i], lat[i + 1], lon[i + 1]) for i in range(3)]
+    np.testing.assert_allclose(distances, expected, rtol=1e-12)
+
+
+def test_energy_table_interpolation_is_close_to_direct_evaluation(segments):
+    distance, elevation_change, speed = segments
+    context = VehiclePhysicsContext.from_vehicle(VEHICLE, 2000, 2.0)
+    slope = route_physics.segment_slopes(distance, elevation_change)
+
+    direct = context.energy(speed, distance, slope)
+    interpolated = context.energy(speed, distance, slope, energy_table(context))
+
+    # Only the segments straddling the motor/regen kink are off by more than the grid error
+    np.testing.assert_allclose(interpolated, direct, atol=1e-3 * np.abs(direct).max())
+    assert interpolated.sum() == pytest.approx(direct.sum(), rel=1e-3)
+
+
+def test_energy_tables_are_shared_by_identical_vehicles():
+    first = VehiclePhysicsContext.from_vehicle(VEHICLE, 2000, 2.0)
+    # Aux power is not part of the traction table
+    second = VehiclePhysicsContext.from_vehicle(VEHICLE, 2000, 4.0)
+
+    assert energy_table(first) is energy_table(second)
+
+
+def test_route_arrays_are_consistent():
+    n = 200
+    lat = np.linspace(48.0, 48.2, n)
+    lon = np.full(n, 2.0)
+    elevation = 100 + 30 * np.sin(np.linspace(0, 8, n))
+    limits = np.full(n - 1, 90.0)
+
+    arrays = route_arrays(lat, lon, elevation, limits, limits - 5, VEHICLE, total_mass_kg=2000, aux_power_kw=2.0)
+
+    assert len(arrays["distance"]) == n - 1
+    np.testing.assert_allclose(arrays["limit_time"], arrays["distance"] / (limits / 3.6))
+    assert arrays["eco_energy"].sum() < arrays["limit_energy"].sum()
+    assert (arrays["eco_speed"] <= limits).all()
+
+
+def test_merging_sums_energies_and_respects_leg_boundaries():
+    limits = np.array([50, 50, 90, 90, 90, 50.0])
+    distance = np.array([100, 100, 200, 200, 200, 100.0])
+    energy = np.array([0.1, -0.05, 0.2, 0.2, -0.1, 0.1])
+    speed = np.array([40, 50, 80, 90, 85, 50.0])
+
+    starts, ends, merged = merge_by_speed_limit(limits, distance, {"energy": energy}, {"speed": speed}, boundaries=[4])
+
+    assert starts.tolist() == [0, 2, 4, 5]
+    assert ends.tolist() == [1, 3, 4, 5]
+    np.testing.assert_allclose(merged["energy"], [0.05, 0.4, -0.1, 0.1])
+    np.testing.assert_allclose(merged["distance"], [200, 400, 200, 100])
+    np.testing.assert_allclose(merged["speed"], [45, 85, 85, 50])
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+
+import numpy as np
+
+from route_store import RouteStore, StoredRoute
+from shared_cache import SharedCache, secure_directory
+
+
+def stored_route(route_id="r1", n=10):
+    return StoredRoute(
+        route_id=route_id, request=None, lat=np.linspace(48.8, 48.7, n), lon=np.full(n, 2.35),
+        elevation=np.zeros(n), speed_limit=np.full(n - 1, 90.0), real_speed=np.full(n - 1, 85.0),
+    )
+
+
+def shared(tmp_path):
+    secure_directory(str(tmp_path / "cache"))
+    cache = SharedCache(str(tmp_path / "cache" / "cache.sqlite3"))
+    reads = []
+    get = cache.get
+
+    def recording_get(namespace, key):
+        reads.append(threading.current_thread() is threading.main_thread())
+        return get(namespace, key)
+
+    cache.get = recording_get
+    return cache, reads
+
+
+def test_route_of_another_worker_is_read_off_the_event_loop(tmp_path):
+    cache, reads = shared(tmp_path)
+    computing, serving = RouteStore(shared=cache), RouteStore(shared=cache)
+    route = stored_route()
+
+    async def main():
+        computing.put(route)
+        await computing.publish(route)
+        await computing.set_progress(route, 4)
+        return await serving.aget("r1"), await serving.aget("missing")
+
+    found, missing = asyncio.run(main())
+
+    assert found.route_id == "r1" and found.progress_index == 4
+    assert missing is None
+    assert reads and not any(reads)
+    assert len(serving) == 1
+
+
+def test_local_routes_get_the_shared_progress(tmp_path):
+    cache, _ = shared(tmp_path)
+    first, second = RouteStore(shared=cache), RouteStore(shared=cache)
+    route = stored_route()
+    first.put(route)
+    second.put(stored_route())
+
+    asyncio.run(first.set_progress(route, 6))
+
+    assert asyncio.run(second.aget("r1")).progress_index == 6
+    assert second.get("r1").progress_index == 6
+
+
+def test_expired_routes_are_not_served():
+    store = RouteStore(ttl_s=60)
+    route = stored_route()
+    route.created_at -= 120
+    store.put(route)
+
+    assert asyncio.run(store.aget("r1")) is None
+    assert len(store) == 0
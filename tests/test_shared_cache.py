@@ -0,0 +1,55 @@
+import os
+import stat
+
+import pytest
+
+import shared_cache
+from shared_cache import SharedCache, secure_directory
+
+
+def test_directory_is_created_private(tmp_path):
+    path = tmp_path / "ecospeed"
+
+    assert secure_directory(str(path))
+    assert stat.S_IMODE(path.stat().st_mode) == 0o700
+
+
+def test_directory_writable_by_others_is_refused(tmp_path):
+    path = tmp_path / "ecospeed"
+    path.mkdir()
+    path.chmod(0o777)
+
+    assert not secure_directory(str(path))
+
+
+def test_symlinked_directory_is_refused(tmp_path):
+    (tmp_path / "elsewhere").mkdir(mode=0o700)
+    (tmp_path / "ecospeed").symlink_to(tmp_path / "elsewhere")
+
+    assert not secure_directory(str(tmp_path / "ecospeed"))
+
+
+@pytest.mark.skipif(os.getuid() != 0, reason="needs to create a directory owned by another user")
+def test_directory_of_another_user_is_refused(tmp_path):
+    path = tmp_path / "ecospeed"
+    path.mkdir(mode=0o700)
+    os.chown(path, 65534, 65534)
+
+    assert not secure_directory(str(path))
+
+
+def test_values_and_locks_in_the_private_directory(tmp_path, monkeypatch):
+    directory = tmp_path / "ecospeed"
+    assert secure_directory(str(directory))
+    cache = SharedCache(str(directory / "cache.sqlite3"))
+    monkeypatch.setattr(shared_cache, "SHARED_CACHE_DIR", str(directory))
+    monkeypatch.setattr(shared_cache, "_held_locks", {})
+
+    cache.set("route", "a", {"value": 1}, ttl_s=60)
+
+    assert cache.get("route", "a") == {"value": 1}
+    assert cache.get("route", "b") is None
+    assert shared_cache.try_lock("job")
+    assert stat.S_IMODE((directory / "job.lock").stat().st_mode) == 0o600
+    os.close(shared_cache._held_locks[os.getpid()]["job"])
+
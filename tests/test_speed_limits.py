@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+import speed_limits
+from speed_limits import ROAD_CLASSES, SpeedLimitTable, build_table, ors_road_classes, parse_maxspeed, route_speed_limits
+
+OSM = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lat="48.8000" lon="2.3000"/>
+  <node id="2" lat="48.8000" lon="2.3100"/>
+  <node id="3" lat="48.9000" lon="2.3000"/>
+  <node id="4" lat="48.9000" lon="2.3100"/>
+  <node id="5" lat="49.0000" lon="2.3000"/>
+  <node id="6" lat="49.0000" lon="2.3100"/>
+  <node id="7" lat="49.1000" lon="2.3000"/>
+  <node id="8" lat="49.1000" lon="2.3100"/>
+  <way id="10"><nd ref="1"/><nd ref="2"/><tag k="highway" v="motorway"/><tag k="maxspeed" v="110"/></way>
+  <way id="11"><nd ref="3"/><nd ref="4"/><tag k="highway" v="trunk"/><tag k="maxspeed" v="FR:rural"/></way>
+  <way id="12"><nd ref="5"/><nd ref="6"/><tag k="highway" v="secondary"/><tag k="maxspeed" v="70"/></way>
+  <way id="13"><nd ref="7"/><nd ref="8"/><tag k="highway" v="living_street"/><tag k="maxspeed" v="FR:zone30"/></way>
+</osm>
+"""
+
+
+def ors_extras(waytype, motorway=False, n=5):
+    return [[0, n - 1, waytype]], [[0, n - 1, 1 if motorway else 0]]
+
+
+@pytest.mark.parametrize("waytype, motorway, expected", [
+    (1, True, "motorway"),  # State Road flagged as highway
+    (1, False, "primary"),  # Trunk or primary
+    (2, False, "tertiary"),  # Secondary, tertiary, unclassified
+    (3, False, "residential"),  # Residential, living street, service
+    (4, False, "unclassified"),  # Path
+    (9, False, "unclassified"),  # Ferry
+])
+def test_ors_waytypes_map_to_road_classes(waytype, motorway, expected):
+    road_class = ors_road_classes(5, *ors_extras(waytype, motorway))
+
+    assert road_class.tolist() == [ROAD_CLASSES[expected]] * 5
+
+
+def test_first_waytype_range_wins_at_shared_boundaries():
+    road_class = ors_road_classes(7, [[0, 3, 1], [3, 6, 3]], [[0, 3, 1], [3, 6, 0]])
+
+    assert road_class.tolist() == [1, 1, 1, 1, 7, 7, 7]
+
+
+def test_unknown_waytype_and_uncovered_points():
+    assert ors_road_classes(4, [[0, 1, 0]]).tolist() == [0, 0, 0, 0]
+
+
+def test_default_limits_by_class_and_zone():
+    classes = np.array([ROAD_CLASSES[name] for name in ("motorway", "primary", "tertiary", "residential")])
+
+    assert speed_limits.default_limits(classes, np.zeros(4, bool)).tolist() == [130, 90, 90, 50]
+    assert speed_limits.default_limits(classes, np.ones(4, bool)).tolist() == [130, 50, 50, 50]
+    assert speed_limits.default_limits(classes, np.zeros(4, bool), user_max_speed=110).tolist() == [110, 90, 90, 50]
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("50", 50), ("FR:urban", 50), ("fr:zone30", 30), ("30 mph", 48), ("90;70", 70), ("none", None), ("signals", None),
+])
+def test_parse_maxspeed(value, expected):
+    assert parse_maxspeed(value) == expected
+
+
+@pytest.fixture
+def table(tmp_path):
+    osm = tmp_path / "extract.osm"
+    osm.write_text(OSM)
+    table = build_table(osm)
+    table.save(tmp_path / "table")
+    return SpeedLimitTable.load(tmp_path / "table")
+
+
+def test_table_built_from_osm_classes_answers_ors_classes(table):
+    """Points classified from ORS extras find the limits of the OSM ways under them."""
+    lat = np.array([48.8, 48.9, 49.0, 49.1])
+    lon = np.full(4, 2.305)
+    waytypes = [[0, 0, 1], [1, 1, 1], [2, 2, 2], [3, 3, 3]]
+    waycategories = [[0, 0, 1], [1, 3, 0]]
+    road_class = ors_road_classes(4, waytypes, waycategories)
+
+    assert table.lookup(lat, lon, road_class).tolist() == [110, 80, 70, 30]
+
+
+def test_table_lookup_misses_other_groups_and_cells(table):
+    lat = np.array([48.8, 48.8, 48.85])
+    lon = np.array([2.305, 2.305, 2.305])
+    road_class = np.array([ROAD_CLASSES["residential"], 0, ROAD_CLASSES["motorway"]])
+
+    assert np.isnan(table.lookup(lat, lon, road_class)).all()
+
+
+def test_route_limits_prefer_osm_and_cap_them(table, monkeypatch):
+    monkeypatch.setattr(speed_limits, "get_speed_limit_table", lambda: table)
+    lat = np.array([48.8, 48.95])
+    lon = np.full(2, 2.305)
+    road_class = np.array([ROAD_CLASSES["motorway"], ROAD_CLASSES["motorway"]])
+
+    limits = route_speed_limits(lat, lon, road_class, np.zeros(2, bool), user_max_speed=100)
+
+    assert limits.tolist() == [100, 100]
+    assert route_speed_limits(lat, lon, road_class, np.zeros(2, bool)).tolist() == [110, 130]
+
+
+def test_tables_of_the_previous_format_are_refused(table, tmp_path):
+    (tmp_path / "table" / "format").unlink()
+
+    with pytest.raises(ValueError):
+        SpeedLimitTable.load(tmp_path / "table")
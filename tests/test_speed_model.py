@@ -0,0 +1,63 @@
+import random
+
+import numpy as np
+import pytest
+
+from speed_model import DRIVER_PROFILES, DriverProfile, register_driver_profile, route_seed, simulate_real_speeds
+
+LIMITS = np.tile([30.0, 50.0, 70.0, 90.0, 110.0, 130.0], 500)
+
+
+def test_same_seed_same_speeds_other_seed_other_speeds():
+    first = simulate_real_speeds(LIMITS, seed=42)
+
+    np.testing.assert_array_equal(simulate_real_speeds(LIMITS, seed=42), first)
+    assert not np.array_equal(simulate_real_speeds(LIMITS, seed=43), first)
+
+
+def test_route_seed_is_stable_and_normalized():
+    assert route_seed("Paris", "Lyon", "average") == route_seed(" paris ", "LYON", "average")
+    assert route_seed("Paris", "Lyon", "average") != route_seed("Paris", "Dijon", "Lyon", "average")
+    assert route_seed("Paris", "Lyon", "average") != route_seed("Paris", "Lyon", "calm")
+
+
+def test_driver_profiles_are_ordered():
+    means = {name: simulate_real_speeds(LIMITS, seed=1, profile=name).mean() for name in ("calm", "average", "aggressive")}
+
+    assert means["calm"] < means["average"] < means["aggressive"]
+
+
+def test_average_driver_keeps_the_original_distribution():
+    speeds = simulate_real_speeds(LIMITS, seed=3)
+    # Original simulation: limit × 0.92 × (1 + U(-10%, +5%)), at least 50 km/h, at most 5% over the limit
+    low = np.maximum(50.0, LIMITS * 0.92 * 0.90)
+    high = np.maximum(50.0, np.minimum(LIMITS * 0.92 * 1.05, LIMITS * 1.05))
+
+    assert (speeds >= np.round(low, 1)).all() and (speeds <= np.round(high, 1)).all()
+    motorway = speeds[LIMITS == 130.0]
+    assert motorway.mean() == pytest.approx(130 * 0.92 * (1 - 0.025), rel=0.01)
+    assert motorway.min() < 130 * 0.92 * 0.91 and motorway.max() > 130 * 0.92 * 1.04
+    assert len(speeds) == len(LIMITS) and (speeds == np.round(speeds, 1)).all()
+
+
+def test_global_random_state_is_untouched():
+    random.seed(5)
+    np.random.seed(5)
+    expected = (random.random(), np.random.random())
+    random.seed(5)
+    np.random.seed(5)
+
+    simulate_real_speeds(LIMITS, seed=9, profile="aggressive")
+    simulate_real_speeds(LIMITS)
+
+    assert (random.random(), np.random.random()) == expected
+
+
+def test_unknown_and_registered_profiles(monkeypatch):
+    monkeypatch.setattr("speed_model.DRIVER_PROFILES", dict(DRIVER_PROFILES))
+    with pytest.raises(ValueError, match="Unknown driver profile"):
+        simulate_real_speeds(LIMITS, profile="reckless")
+
+    register_driver_profile(DriverProfile("reckless", base_factor=1.1, variation_low=0.0, variation_high=0.0, max_over_limit=1.1))
+
+    np.testing.assert_allclose(simulate_real_speeds([130.0], profile="reckless"), [143.0])
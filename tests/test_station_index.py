@@ -0,0 +1,147 @@
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from station_index import StationIndex, decode_cursor, encode_cursor
+
+BBOX = {"min_lat": 48.0, "min_lon": 1.5, "max_lat": 49.5, "max_lon": 3.5}
+
+
+def station(i, lat, lon, power=22.0, status="Dispo"):
+    return server.ChargingStation(name=f"Borne {i}", operator="Test", powerKw=power, status=status,
+                                  latitude=lat, longitude=lon)
+
+
+def make_index(n=1200, seed=0):
+    rng = np.random.default_rng(seed)
+    stations = [station(i, lat, lon, power=float(rng.choice([22, 50, 150])), status=str(rng.choice(["Dispo", "Hors service"])))
+                for i, (lat, lon) in enumerate(zip(rng.uniform(47.5, 50.0, n), rng.uniform(1.0, 4.0, n)))]
+    return StationIndex(stations, ids=[f"ocm-{i}" for i in range(n)])
+
+
+def inside(index):
+    return {s.name for s in index.stations
+            if BBOX["min_lat"] <= s.latitude <= BBOX["max_lat"] and BBOX["min_lon"] <= s.longitude <= BBOX["max_lon"]}
+
+
+def test_pages_cover_the_viewport_once():
+    index = make_index()
+    names, offset = [], 0
+    while offset is not None:
+        page = index.query(*BBOX.values(), offset=offset, limit=100)
+        names += [s.name for s in page["stations"]]
+        offset = page["next_offset"]
+
+    assert len(names) == len(set(names)) == page["total"]
+    assert set(names) == inside(index)
+
+
+def test_clusters_account_for_every_station():
+    index = make_index()
+
+    page = index.query(*BBOX.values(), zoom=6, limit=2000)
+
+    assert page["clusters"]
+    counted = len(page["stations"]) + sum(cluster["count"] for cluster in page["clusters"])
+    assert counted == len(inside(index))
+    for cluster in page["clusters"]:
+        assert cluster["min_lat"] <= cluster["latitude"] <= cluster["max_lat"]
+        assert 0 <= cluster["available_count"] <= cluster["count"]
+
+
+def test_box_across_the_antimeridian():
+    index = StationIndex([station(0, 0.0, 179.5), station(1, 0.0, -179.5), station(2, 0.0, 0.0)])
+
+    assert index.in_bbox(-1, 179, 1, -179).tolist() == [0, 1]
+
+
+def test_updates_make_a_new_version_and_keep_the_old_one():
+    index = make_index(10)
+
+    updated = index.updated({"ocm-3": station(3, 48.5, 2.0, power=350), "ocm-new": station(99, 48.6, 2.1)})
+
+    assert updated.version != index.version
+    assert len(updated) == 11 and len(index) == 10
+    assert updated.power_kw[3] == 350 and index.power_kw[3] != 350
+    assert updated.stations[updated.positions["ocm-new"]].name == "Borne 99"
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor("5f3a9c", 1500)) == ("5f3a9c", 1500)
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
+
+
+def test_indexes_of_the_same_stations_share_versions_and_pages():
+    index = make_index()
+    # Another worker: same stations loaded in another order, or rebuilt incrementally
+    order = np.random.default_rng(1).permutation(len(index))
+    shuffled = StationIndex([index.stations[i] for i in order], ids=[index.ids[i] for i in order])
+    half = len(index) // 2
+    incremental = StationIndex(index.stations[:half], ids=index.ids[:half]).updated(
+        dict(zip(index.ids[half:], index.stations[half:])))
+
+    assert shuffled.version == incremental.version == index.version
+    for zoom in (None, 8):
+        pages = [other.query(*BBOX.values(), zoom=zoom, offset=100, limit=100) for other in (index, shuffled, incremental)]
+        assert pages[0] == pages[1] == pages[2]
+
+
+@pytest.fixture
+def viewport(monkeypatch):
+    state = {"index": make_index()}
+
+    async def get_station_index():
+        return state["index"]
+
+    monkeypatch.setattr(server, "_get_station_index", get_station_index)
+    client = TestClient(server.app)
+    return client, state
+
+
+def test_viewport_pages_follow_the_cursor(viewport):
+    client, state = viewport
+    names, cursor = [], None
+    while True:
+        params = dict(BBOX, limit=150, **({"cursor": cursor} if cursor else {}))
+        page = client.get("/api/charging-stations/viewport", params=params).json()
+        names += [s["name"] for s in page["stations"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert len(names) == page["total"]
+    assert set(names) == inside(state["index"])
+
+
+def test_cursor_of_a_previous_version_is_gone(viewport):
+    client, state = viewport
+    first = client.get("/api/charging-stations/viewport", params=dict(BBOX, limit=100)).json()
+    state["index"] = state["index"].updated({"ocm-0": station(0, 48.5, 2.0, power=350)})
+
+    response = client.get("/api/charging-stations/viewport", params=dict(BBOX, limit=100, cursor=first["next_cursor"]))
+
+    assert response.status_code == 410
+
+
+def test_cursor_is_accepted_by_another_worker(viewport):
+    client, state = viewport
+    first = client.get("/api/charging-stations/viewport", params=dict(BBOX, limit=100)).json()
+    index = state["index"]
+    state["index"] = StationIndex(index.stations[::-1], ids=index.ids[::-1])
+
+    response = client.get("/api/charging-stations/viewport", params=dict(BBOX, limit=100, cursor=first["next_cursor"]))
+    expected = index.query(*BBOX.values(), offset=100, limit=100)
+
+    assert response.status_code == 200
+    assert [s["name"] for s in response.json()["stations"]] == [s.name for s in expected["stations"]]
+
+
+def test_viewport_parameters_are_checked(viewport):
+    client, _ = viewport
+
+    assert client.get("/api/charging-stations/viewport", params=dict(BBOX, cursor="garbage")).status_code == 400
+    assert client.get("/api/charging-stations/viewport", params=dict(BBOX, min_lat=50.0)).status_code == 400
+    assert client.get("/api/charging-stations/viewport", params=dict(BBOX, zoom=30)).status_code == 400
+    assert client.get("/api/charging-stations/viewport", params=dict(BBOX, limit=0)).status_code == 400
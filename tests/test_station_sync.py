@@ -0,0 +1,286 @@
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import outbound
+import server
+import station_sync
+from station_sync import REGION_CENTERS, SYNC_OVERLAP, StationSync
+
+sys.path.insert(0, os.path.join(os.path.dirname(station_sync.__file__), "benchmarks"))
+from mock_ocm import MockOcm  # noqa: E402
+
+
+class Upstream:
+    """fetch_pois against the mock without HTTP, recording the modifiedsince of each call."""
+
+    def __init__(self, mock):
+        self.mock = mock
+        self.since = []
+        self.failing = set()
+
+    def __call__(self, latitude, longitude, distance_km, modified_since=None):
+        if (latitude, longitude) in self.failing:
+            raise ValueError("region failed")
+        self.since.append(modified_since)
+        params = {"latitude": latitude, "longitude": longitude, "distance": distance_km,
+                  "maxresults": station_sync.MAX_RESULTS}
+        if modified_since is not None:
+            params["modifiedsince"] = modified_since.strftime('%Y-%m-%dT%H:%M:%S')
+        pois = self.mock.query(params)
+        return pois, len(pois)
+
+
+@pytest.fixture(autouse=True)
+def fast_ocm(monkeypatch):
+    monkeypatch.setitem(outbound.providers, "ocm", outbound.Provider("ocm", rate_per_s=1000, burst=1000, max_retries=0))
+
+
+@pytest.fixture
+def upstream():
+    return Upstream(MockOcm(3000))
+
+
+def make_sync(upstream, persisted, states):
+    async def persist(records):
+        persisted.update((record["id"], record) for record in records)
+
+    async def save_state(started):
+        states.append(started)
+
+    return StationSync(make_station=SimpleNamespace, persist=persist, save_state=save_state, fetch=upstream)
+
+
+def test_full_then_incremental_then_partial_failure(upstream):
+    persisted, states = {}, []
+    sync = make_sync(upstream, persisted, states)
+
+    # First run: everything
+    changed = asyncio.run(sync.sync_once())
+
+    assert set(upstream.since) == {None}
+    assert changed == len(sync.index) == len(persisted) > 1000
+    assert states == [sync.last_sync]
+
+    # Next run: only what changed since the start of the previous one
+    upstream.since.clear()
+    mutated = upstream.mock.mutate(0.05)
+    changed = asyncio.run(sync.sync_once())
+
+    assert set(upstream.since) == {states[0] - SYNC_OVERLAP}
+    assert 0 < changed <= mutated
+    assert len(states) == 2
+
+    # A failed region keeps the previous start date for the next run
+    upstream.since.clear()
+    upstream.failing.add(REGION_CENTERS[0])
+    upstream.mock.mutate(0.05)
+    asyncio.run(sync.sync_once())
+
+    assert sync.last_sync == states[1]
+    assert len(states) == 2
+    upstream.since.clear()
+    upstream.failing.clear()
+    asyncio.run(sync.sync_once())
+    assert set(upstream.since) == {states[1] - SYNC_OVERLAP}
+    assert len(states) == 3
+
+
+def test_restart_resumes_from_the_saved_sync_state(upstream):
+    persisted, states = {}, []
+    asyncio.run(make_sync(upstream, persisted, states).sync_once())
+    upstream.mock.mutate(0.05)
+    records = [dict(record, synced_at=states[0]) for record in persisted.values()]
+
+    restarted = make_sync(upstream, {}, [])
+    restarted.load(records, states[0])
+    upstream.since.clear()
+    asyncio.run(restarted.sync_once())
+
+    assert set(upstream.since) == {states[0] - SYNC_OVERLAP}
+    assert len(restarted.index) == len(persisted)
+
+
+def test_records_without_sync_state_get_a_full_pull(upstream):
+    persisted, states = {}, []
+    asyncio.run(make_sync(upstream, persisted, states).sync_once())
+    # Stations persisted by a run that never completed
+    records = [dict(record, synced_at=states[0]) for record in persisted.values()]
+
+    restarted = make_sync(upstream, {}, [])
+    restarted.load(records)
+    upstream.since.clear()
+    changed = asyncio.run(restarted.sync_once())
+
+    assert set(upstream.since) == {None}
+    assert changed == 0
+
+
+def test_failed_persist_is_retried(upstream):
+    states = []
+
+    async def persist(records):
+        raise ConnectionError("MongoDB down")
+
+    async def save_state(started):
+        states.append(started)
+
+    sync = StationSync(make_station=SimpleNamespace, persist=persist, save_state=save_state, fetch=upstream)
+    first = asyncio.run(sync.sync_once())
+    persisted = {}
+    sync.persist = make_sync(upstream, persisted, states).persist
+
+    assert sync.last_sync is None and states == []
+    assert asyncio.run(sync.sync_once()) == first == len(persisted)
+    assert states == [sync.last_sync]
+
+
+def test_full_pass_drops_stations_deleted_upstream(upstream, monkeypatch):
+    persisted, states, removed = {}, [], []
+
+    async def remove(station_ids):
+        removed.extend(station_ids)
+
+    sync = make_sync(upstream, persisted, states)
+    sync.remove = remove
+    asyncio.run(sync.sync_once())
+    known = len(sync.index)
+    deleted = [poi for poi in upstream.mock.pois if str(poi["ID"]) in sync.hashes][:30]
+    gone = [str(poi["ID"]) for poi in deleted]
+    upstream.mock.pois = [poi for poi in upstream.mock.pois if poi not in deleted]
+
+    # An incremental pass cannot see deletions
+    assert asyncio.run(sync.sync_once()) == 0
+    assert len(sync.index) == known and removed == []
+
+    sync.incremental_runs = station_sync.FULL_SYNC_RUNS
+    upstream.since.clear()
+    assert asyncio.run(sync.sync_once()) == len(gone)
+
+    assert set(upstream.since) == {None}
+    assert sorted(removed) == sorted(gone)
+    assert len(sync.index) == known - len(gone)
+    assert not set(gone) & set(sync.index.ids) and not set(gone) & set(sync.hashes)
+    assert sync.incremental_runs == 0
+
+
+def test_suspicious_full_pass_deletes_nothing(upstream):
+    sync = make_sync(upstream, {}, [])
+    asyncio.run(sync.sync_once())
+    known = len(sync.index)
+    del upstream.mock.pois[:len(upstream.mock.pois) // 2]
+
+    sync.incremental_runs = station_sync.FULL_SYNC_RUNS
+    assert asyncio.run(sync.sync_once()) == 0
+
+    assert len(sync.index) == known
+    assert sync.counters["deleted"] == 0
+
+
+def test_failed_removal_is_retried(upstream):
+    sync = make_sync(upstream, {}, [])
+    asyncio.run(sync.sync_once())
+    poi = next(poi for poi in upstream.mock.pois if str(poi["ID"]) in sync.hashes)
+    upstream.mock.pois.remove(poi)
+    gone = str(poi["ID"])
+    removed = []
+
+    async def remove(station_ids):
+        raise ConnectionError("MongoDB down")
+
+    sync.remove = remove
+    sync.incremental_runs = station_sync.FULL_SYNC_RUNS
+    last_sync = sync.last_sync
+    asyncio.run(sync.sync_once())
+
+    assert gone not in sync.index.positions
+    assert sync.last_sync == last_sync
+
+    async def remove(station_ids):
+        removed.extend(station_ids)
+
+    sync.remove = remove
+    asyncio.run(sync.sync_once())
+    assert removed == [gone]
+    assert sync.last_sync != last_sync
+
+
+def test_follower_snapshot_drops_deleted_stations(monkeypatch):
+    sync = StationSync(make_station=SimpleNamespace)
+    monkeypatch.setattr(server, "station_sync", sync)
+    monkeypatch.setattr(server, "_station_records", {})
+    records = [{"id": str(i), "name": f"Borne {i}", "powerKw": 22.0, "status": "Dispo",
+                "latitude": 48.0 + i / 100, "longitude": 2.0} for i in range(5)]
+    server._load_station_records(records, None, True)
+    server._station_records.update((record["id"], record) for record in records)
+
+    server._load_station_records(records[1:], None, True)
+
+    assert "0" not in sync.index.positions and len(sync.index) == 4
+    assert set(server._station_records) == {"1", "2", "3", "4"}
+
+
+@pytest.fixture
+def direct_fetch(upstream, monkeypatch):
+    """Stations served by direct Open Charge Map calls (the local copy is not ready)."""
+    monkeypatch.setattr(server.station_sync, "index", None)
+    monkeypatch.setattr(server, "fetch_pois", upstream)
+    monkeypatch.setattr(server, "_station_index", None)
+    monkeypatch.setattr(server, "_station_index_built_at", 0.0)
+
+
+def test_partial_station_fetch_is_flagged_and_not_cached(upstream, direct_fetch):
+    client = TestClient(server.app)
+    complete = client.get("/api/charging-stations").json()
+    upstream.failing.add(REGION_CENTERS[0])
+    upstream.since.clear()
+
+    partial = client.get("/api/charging-stations")
+
+    assert partial.status_code == 200
+    assert partial.headers["x-failed-regions"] == "1"
+    assert partial.headers["cache-control"] == "no-store"
+    assert 0 < len(partial.json()) < len(complete)
+    assert len(upstream.since) == len(REGION_CENTERS) - 1
+
+    # Not kept: the next request asks Open Charge Map again and gets everything
+    upstream.failing.clear()
+    upstream.since.clear()
+    again = client.get("/api/charging-stations")
+    assert "x-failed-regions" not in again.headers
+    assert len(again.json()) == len(complete)
+    assert len(upstream.since) == len(REGION_CENTERS)
+
+
+def test_partial_station_index_is_rebuilt_early(upstream, direct_fetch):
+    upstream.failing.add(REGION_CENTERS[0])
+
+    partial = asyncio.run(server._get_station_index())
+
+    # Rebuilt after a minute instead of STATION_INDEX_TTL_S
+    age = server.time.time() - server._station_index_built_at
+    assert server.STATION_INDEX_TTL_S - 60 <= age < server.STATION_INDEX_TTL_S
+    upstream.failing.clear()
+    server._station_index_built_at -= 61
+    complete = asyncio.run(server._get_station_index())
+    assert len(partial) < len(complete)
+    assert complete.version != partial.version
+
+
+def test_removed_stations_are_tombstoned_and_republished(monkeypatch):
+    written, published = [], []
+    monkeypatch.setattr(server, "_station_records", {"1": {"id": "1"}, "2": {"id": "2"}})
+    monkeypatch.setattr(server.write_behind, "put", lambda collection, doc: written.append((collection, doc)))
+
+    async def publish():
+        published.append(dict(server._station_records))
+
+    monkeypatch.setattr(server, "_publish_station_snapshot", publish)
+    asyncio.run(server._remove_stations(["1"]))
+
+    assert [(collection, doc["id"], doc["deleted"]) for collection, doc in written] == [("charging_stations", "1", True)]
+    assert published == [{"2": {"id": "2"}}]
@@ -0,0 +1,92 @@
+import itertools
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from stop_order import StopOrderOptimizer
+
+
+def asymmetric(n, seed):
+    """Random points with elevations: A -> B uphill costs more than B -> A."""
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(0, 50, (n, 2))
+    distance = np.hypot(*(xy[:, None, :] - xy[None, :, :]).transpose(2, 0, 1))
+    climb = rng.uniform(-0.3, 0.3, n)
+    energy = 0.15 * distance + (climb[None, :] - climb[:, None]) * 10
+    np.fill_diagonal(energy, 0.0)
+    return energy, distance / 70 * 3600
+
+
+def brute_force(optimizer, end):
+    middle = [i for i in range(1, optimizer.size) if i != end]
+    tail = [end] if end is not None else []
+    return min(optimizer.tour_cost([0, *order, *tail]) for order in itertools.permutations(middle))
+
+
+@pytest.mark.parametrize("end", [None, 5, 0])
+@pytest.mark.parametrize("seed", range(8))
+def test_small_rounds_match_brute_force(seed, end):
+    energy, time_s = asymmetric(6, seed)
+    optimizer = StopOrderOptimizer(energy, time_s, end=end)
+
+    result = optimizer.solve()
+
+    assert optimizer.tour_cost(result.order) == pytest.approx(brute_force(optimizer, end))
+
+
+def test_fixed_end_and_round_trip():
+    energy, time_s = asymmetric(8, 1)
+
+    fixed = StopOrderOptimizer(energy, time_s, end=7).solve()
+    round_trip = StopOrderOptimizer(energy, time_s, end=0).solve()
+    open_round = StopOrderOptimizer(energy, time_s).solve()
+
+    assert fixed.order[0] == 0 and fixed.order[-1] == 7 and sorted(fixed.order) == list(range(8))
+    assert round_trip.order[0] == round_trip.order[-1] == 0 and sorted(round_trip.order[:-1]) == list(range(8))
+    assert open_round.order[0] == 0 and sorted(open_round.order) == list(range(8))
+
+
+def test_order_below_the_reserve_is_penalized():
+    # 0 -> 1 climbs to a hilltop, 1 -> 2 regenerates on the way down
+    energy = np.array([
+        [0.0, 10.0, 2.0],
+        [9.0, 0.0, -6.0],
+        [3.0, 5.0, 0.0],
+    ])
+    time_s = np.ones((3, 3))
+    # 10 kWh usable, 100% -> 20% reserve: at most 8 kWh used at any stop
+    optimizer = StopOrderOptimizer(energy, time_s, usable_kwh=10.0, battery_start_pct=100, battery_reserve_pct=20)
+
+    result = optimizer.solve()
+    typed = optimizer.evaluate(optimizer.typed_order())
+
+    assert not typed.feasible and typed.energy_kwh == 4.0 and typed.min_battery_pct == 0.0
+    assert result.order == [0, 2, 1] and result.feasible
+    assert result.energy_kwh == 7.0 and result.min_battery_pct == pytest.approx(30.0)
+
+    tight = StopOrderOptimizer(energy, time_s, usable_kwh=5.0, battery_reserve_pct=20).solve()
+    assert not tight.feasible
+
+
+@pytest.mark.parametrize("objective", ["energy", "time"])
+@pytest.mark.parametrize("seed", range(5))
+def test_never_worse_than_the_typed_order(seed, objective):
+    energy, time_s = asymmetric(14, seed)
+    optimizer = StopOrderOptimizer(energy, time_s, objective=objective, usable_kwh=20.0, battery_reserve_pct=20)
+
+    result = optimizer.solve()
+
+    assert optimizer.tour_cost(result.order) <= optimizer.tour_cost(optimizer.typed_order()) + 1e-9
+
+
+def test_vehicle_without_battery_capacity_is_rejected():
+    vehicle = {"name": "No battery", "empty_mass": 1500, "extra_load": 0, "drag_coefficient": 0.6, "frontal_area": 2.2,
+               "rolling_resistance": 0.008, "motor_efficiency": 0.9, "regen_efficiency": 0.8,
+               "battery_kwh": 0, "usable_battery_kwh": 0}
+
+    response = TestClient(server.app).post("/api/stop-order", json={"start": "Paris", "stops": ["Lyon"], "vehicle_profile": vehicle})
+
+    assert response.status_code == 400
+    assert "battery capacity" in response.json()["detail"]
@@ -0,0 +1,84 @@
+import numpy as np
+
+import urban_zones
+from urban_zones import SAMPLE_URBAN_AREAS_PATH, UrbanAreaIndex, _points_in_ring
+
+
+def reference_in_ring(x, y, ring):
+    """Plain even-odd ray casting of one point."""
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring[:-1], ring[1:]):
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+
+def star(center, radius, spikes=9):
+    angles = np.linspace(0, 2 * np.pi, 2 * spikes + 1)
+    radii = np.where(np.arange(2 * spikes + 1) % 2 == 0, radius, radius / 2.5)
+    return np.column_stack([center[0] + radii * np.cos(angles), center[1] + radii * np.sin(angles)])
+
+
+def test_ring_test_matches_reference_on_a_concave_polygon():
+    ring = star((2.35, 48.85), 0.2)
+    rng = np.random.default_rng(0)
+    lon = rng.uniform(2.0, 2.7, 2000)
+    lat = rng.uniform(48.5, 49.2, 2000)
+
+    inside = _points_in_ring(lon, lat, ring)
+
+    expected = [reference_in_ring(x, y, ring) for x, y in zip(lon, lat)]
+    assert inside.tolist() == expected
+    assert 0 < inside.sum() < len(inside)
+
+
+def test_ring_test_in_small_edge_blocks(monkeypatch):
+    monkeypatch.setattr(urban_zones, "EDGE_BLOCK_SIZE", 7)
+    ring = star((2.35, 48.85), 0.2)
+    lon = np.linspace(2.1, 2.6, 300)
+    lat = np.full(300, 48.86)
+
+    inside = _points_in_ring(lon, lat, ring)
+
+    assert inside.tolist() == [reference_in_ring(x, y, ring) for x, y in zip(lon, lat)]
+
+
+def test_holes_are_not_urban():
+    outer = np.array([[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]], dtype=float)
+    hole = np.array([[0.4, 0.4], [0.6, 0.4], [0.6, 0.6], [0.4, 0.6], [0.4, 0.4]])
+    index = UrbanAreaIndex([[outer, hole]])
+
+    urban = index.classify([0.2, 0.5, 0.9, 1.5], [0.2, 0.5, 0.9, 0.5])
+
+    assert urban.tolist() == [True, False, True, False]
+
+
+def test_classification_is_off_without_a_dataset(monkeypatch):
+    monkeypatch.delenv("URBAN_AREAS_PATH", raising=False)
+    monkeypatch.setattr(urban_zones, "_index", None)
+    monkeypatch.setattr(urban_zones, "_loaded", False)
+
+    assert urban_zones.classify_urban([48.8566], [2.3522]) is None
+
+
+def test_sample_dataset_through_the_environment(monkeypatch):
+    monkeypatch.setenv("URBAN_AREAS_PATH", str(SAMPLE_URBAN_AREAS_PATH))
+    monkeypatch.setattr(urban_zones, "_index", None)
+    monkeypatch.setattr(urban_zones, "_loaded", False)
+
+    urban = urban_zones.classify_urban([48.8566, 47.0], [2.3522, 2.0])
+
+    assert urban.tolist() == [True, False]
+
+
+def test_unreadable_dataset_is_loaded_once(monkeypatch):
+    path = "/nonexistent/urban.geojson"
+    monkeypatch.setenv("URBAN_AREAS_PATH", path)
+    monkeypatch.setattr(urban_zones, "_index", None)
+    monkeypatch.setattr(urban_zones, "_loaded", False)
+    loads = []
+    monkeypatch.setattr(UrbanAreaIndex, "from_geojson", classmethod(lambda cls, p: loads.append(p) or open(p)))
+
+    assert urban_zones.classify_urban([48.0], [2.0]) is None
+    assert urban_zones.classify_urban([48.0], [2.0]) is None
+    assert loads == [path]
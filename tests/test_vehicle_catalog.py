@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+import server
+from shared_cache import SharedCache, secure_directory
+
+
+@pytest.fixture
+def shared(tmp_path, monkeypatch):
+    secure_directory(str(tmp_path / "cache"))
+    cache = SharedCache(str(tmp_path / "cache" / "cache.sqlite3"))
+    monkeypatch.setattr(server, "shared_cache", cache)
+    monkeypatch.setattr(server, "VEHICLE_CATALOG_POLL_S", 0.01)
+    monkeypatch.setattr(server, "_vehicle_catalog_stamp", None)
+    return cache
+
+
+def test_other_workers_reload_registered_profiles(shared, monkeypatch):
+    reloads = []
+
+    async def reload_custom_profiles():
+        reloads.append(server._vehicle_catalog_stamp)
+
+    monkeypatch.setattr(server, "_reload_custom_profiles", reload_custom_profiles)
+
+    async def main():
+        follower = asyncio.ensure_future(server._follow_vehicle_catalog())
+        await asyncio.sleep(0.05)
+        # Another worker registers a profile
+        shared.set("vehicle-catalog", "stamp", "v2", 60)
+        await asyncio.sleep(0.05)
+        # This worker registers one: no reload of its own change
+        await server._publish_vehicle_catalog()
+        await asyncio.sleep(0.05)
+        follower.cancel()
+
+    asyncio.run(main())
+
+    assert reloads == [None]
+    assert server._vehicle_catalog_stamp not in (None, "v2")
+
+
+def test_failed_reload_is_retried(shared, monkeypatch):
+    attempts = []
+
+    async def reload_custom_profiles():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("MongoDB down")
+
+    monkeypatch.setattr(server, "_reload_custom_profiles", reload_custom_profiles)
+    shared.set("vehicle-catalog", "stamp", "v2", 60)
+
+    async def main():
+        follower = asyncio.ensure_future(server._follow_vehicle_catalog())
+        await asyncio.sleep(0.1)
+        follower.cancel()
+
+    asyncio.run(main())
+
+    assert len(attempts) == 2
+    assert server._vehicle_catalog_stamp == "v2"